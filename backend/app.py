@@ -4,39 +4,61 @@ from flask_restful import Api
 from models.db import db
 import redis
 import os
-import logging
-import sys
 from config import Config, DevelopmentConfig, ProductionConfig
-
-# Setup enhanced logging
-def setup_logging(app):
-    handler = logging.StreamHandler(sys.stdout)
-    handler.setFormatter(logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-    ))
-    app.logger.addHandler(handler)
-    app.logger.setLevel(logging.DEBUG)
-    
-    # Also log SQLAlchemy queries
-    logging.getLogger('sqlalchemy.engine').setLevel(logging.INFO)
-    
-    return app
+from services.cache import ResponseCache
+from services.compression import configure_codec
+from services.semantic_cache import SemanticCache, load_embedder
+from services.fallback import configure_fallback
+from services.llm import create_provider
+from services.governor import UpstreamGovernor
+from services.rate_limit import RateLimiter
+from services.singleflight import SingleFlight
+from services.context import ContextBuilder
+from services.auth_cache import AuthCache, register_invalidation
+from services.write_behind import WriteBehind
+from services.versions import ChangeVersions
+from services.metrics import Metrics
+from services.profiler import Profiler
+from services.log import configure_logging
+from services.json_provider import configure_json
+from services.response_compression import ResponseCompressor
+from models.user import User
+from cli import register_commands
+import migrations
 
 # Import routes
 from routes.auth import auth_bp
 from routes.chat import chat_bp
 from routes.history import history_bp
 from routes.main import main_bp  # Import the main blueprint
+from routes.admin import admin_bp
 
 def create_app(config_class=DevelopmentConfig):  # Use DevelopmentConfig by default for better error messages
     app = Flask(__name__)
-    app = setup_logging(app)
     app.config.from_object(config_class)
     
+    # Queued, structured logging, configured before anything logs
+    app.log_pipeline = configure_logging(app)
+    
+    # orjson for every jsonify, falling back to the stdlib when it is not installed
+    configure_json(app)
+    
+    # gzip/brotli for large responses; registered first so it runs after every other response hook
+    app.response_compressor = ResponseCompressor.from_config(app.config)
+    app.response_compressor.init_app(app)
+    
     # Initialize extensions
     CORS(app, resources={r"/*": {"origins": "*"}})
     db.init_app(app)
     
+    # Request, stage, cache and upstream timings for /metrics
+    app.metrics = Metrics.from_config(app.config, logger=app.logger)
+    app.metrics.init_app(app)
+    
+    # Sampling profiler for live workers, off by default
+    app.profiler = Profiler.from_config(app.config, logger=app.logger)
+    app.profiler.init_app(app)
+    
     # Initialize Redis for caching
     if not app.config.get('TESTING', False):
         try:
@@ -54,15 +76,87 @@ def create_app(config_class=DevelopmentConfig):  # Use DevelopmentConfig by defa
             app.logger.warning(f"Redis connection failed: {str(e)}. Caching will be disabled.")
             app.redis = None
     
+    # One OpenAI client and connection pool per worker process
+    app.llm = create_provider(app.config)
+    
+    # Paces OpenAI calls across workers and trips to the fallback responder on 429 storms
+    app.governor = UpstreamGovernor.from_config(app.config, getattr(app, 'redis', None), logger=app.logger)
+    
+    # Per-user and per-IP request limits on the chat endpoints
+    app.rate_limiter = RateLimiter.from_config(app.config, getattr(app, 'redis', None), logger=app.logger)
+    
+    app.auth_cache = AuthCache(
+        getattr(app, 'redis', None),
+        local_ttl=app.config['AUTH_CACHE_LOCAL_TTL'],
+        redis_ttl=app.config['AUTH_CACHE_REDIS_TTL'],
+        max_entries=app.config['AUTH_CACHE_MAX_ENTRIES'],
+        enabled=app.config['AUTH_CACHE_ENABLED'],
+        logger=app.logger
+    )
+    register_invalidation(User)
+    
+    app.context_builder = ContextBuilder.from_config(app.config)
+    
+    # Compression of long message bodies and cached responses
+    app.codec = configure_codec(app.config)
+    
+    app.response_cache = ResponseCache(
+        getattr(app, 'redis', None),
+        version=app.config['RESPONSE_CACHE_VERSION'],
+        default_ttl=app.config['RESPONSE_CACHE_TTL'],
+        model_ttls=app.config['RESPONSE_CACHE_MODEL_TTLS'],
+        codec=app.codec,
+        logger=app.logger
+    )
+    
+    app.singleflight = SingleFlight(
+        getattr(app, 'redis', None),
+        lock_ttl=app.config['SINGLEFLIGHT_LOCK_TTL'],
+        wait_timeout=app.config['SINGLEFLIGHT_WAIT_TIMEOUT'],
+        enabled=app.config['SINGLEFLIGHT_ENABLED'],
+        logger=app.logger
+    )
+    
+    # Per-user change versions behind the ETags and cached bodies of the session and history lists
+    app.versions = ChangeVersions.from_config(app.config, getattr(app, 'redis', None), logger=app.logger)
+    
+    # Optional queue that writes chat turns after the response is sent
+    app.write_behind = None
+    if app.config.get('WRITE_BEHIND_ENABLED'):
+        app.write_behind = WriteBehind.from_config(app, getattr(app, 'redis', None))
+    
+    # Optional near-duplicate cache tier for first-turn questions
+    app.semantic_cache = None
+    if app.config.get('SEMANTIC_CACHE_ENABLED'):
+        try:
+            app.semantic_cache = SemanticCache(
+                app.config['SEMANTIC_CACHE_PATH'],
+                load_embedder(app.config['SEMANTIC_CACHE_EMBEDDER'], app.config['SEMANTIC_CACHE_DIM'],
+                              model=app.config['SEMANTIC_CACHE_MODEL']),
+                capacity=app.config['SEMANTIC_CACHE_SIZE'],
+                threshold=app.config['SEMANTIC_CACHE_THRESHOLD'],
+                logger=app.logger
+            )
+        except Exception as e:
+            app.logger.warning(f"Semantic cache initialization failed: {str(e)}. Semantic caching will be disabled.")
+    
+    # Keyword responder used when the LLM is rate limited
+    app.fallback = configure_fallback(app.config)
+    
     # Register blueprints
     app.register_blueprint(main_bp, url_prefix='/')  # Register the main blueprint at root
     app.register_blueprint(auth_bp, url_prefix='/api/auth')
     app.register_blueprint(chat_bp, url_prefix='/api/chat')
     app.register_blueprint(history_bp, url_prefix='/api/history')
+    app.register_blueprint(admin_bp, url_prefix='/api/admin')
+    
+    register_commands(app)
     
-    # Create database tables if they don't exist
+    # Create database tables if they don't exist, then bring existing ones up to date
     with app.app_context():
         db.create_all()
+        if app.config.get('DB_AUTO_MIGRATE', True):
+            migrations.upgrade(db.engine, logger=app.logger)
     
     # Add error handler for 500 errors
     @app.errorhandler(500)
@@ -0,0 +1,131 @@
+"""
+ASGI entry point for the Medical Chatbot API.
+
+The chat endpoints are served by the asyncio-native handlers in
+routes/chat_async.py; every other route falls through to the regular Flask
+app built by create_app. Run with:
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+"""
+
+import contextlib
+
+import redis.asyncio as aioredis
+from a2wsgi import WSGIMiddleware
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.routing import Mount
+
+from app import create_app
+from config import ProductionConfig
+from models.db import db
+from routes.chat_async import chat_routes
+from services.cache import AsyncResponseCache
+from services.singleflight import AsyncSingleFlight
+from services.governor import AsyncUpstreamGovernor
+from services.rate_limit import AsyncRateLimiter
+from services.response_compression import CompressionMiddleware
+
+# Async drivers for the synchronous database URLs used by Flask-SQLAlchemy
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg',
+    'postgres': 'postgresql+asyncpg',
+}
+
+def async_database_url(url):
+    """
+    Translate the Flask-SQLAlchemy engine URL to its asyncio driver.
+    """
+    backend = url.drivername.split('+')[0]
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for database backend '{backend}'")
+    return url.set(drivername=ASYNC_DRIVERS[backend])
+
+def create_asgi_app(config_class=ProductionConfig):
+    flask_app = create_app(config_class)
+    config = flask_app.config
+
+    with flask_app.app_context():
+        # Resolved engine URL, so relative SQLite paths match the Flask app
+        database_url = async_database_url(db.engine.url)
+
+    @contextlib.asynccontextmanager
+    async def lifespan(app):
+        state = app.state
+        engine_options = {}
+        if database_url.get_backend_name() != 'sqlite':
+            engine_options = {'pool_size': config['ASYNC_DB_POOL_SIZE'], 'max_overflow': config['ASYNC_DB_MAX_OVERFLOW']}
+        engine = create_async_engine(database_url, pool_pre_ping=True, **engine_options)
+        # Objects stay usable after commit without lazy-loading from the event loop
+        state.db_sessionmaker = async_sessionmaker(engine, expire_on_commit=False)
+        flask_app.metrics.instrument_engine(engine.sync_engine)
+
+        redis_client = None
+        if not config.get('TESTING', False):
+            try:
+                redis_client = aioredis.Redis(
+                    host=config.get('REDIS_HOST', 'localhost'),
+                    port=config.get('REDIS_PORT', 6379),
+                    db=config.get('REDIS_DB', 0),
+                    socket_timeout=5,
+                    decode_responses=True
+                )
+                await redis_client.ping()
+            except Exception as e:
+                flask_app.logger.warning(f"Async Redis connection failed: {str(e)}. Caching will be disabled.")
+                redis_client = None
+        state.response_cache = AsyncResponseCache(
+            redis_client,
+            version=config['RESPONSE_CACHE_VERSION'],
+            default_ttl=config['RESPONSE_CACHE_TTL'],
+            model_ttls=config['RESPONSE_CACHE_MODEL_TTLS'],
+            codec=flask_app.codec,
+            logger=flask_app.logger
+        )
+        state.singleflight = AsyncSingleFlight(
+            redis_client,
+            lock_ttl=config['SINGLEFLIGHT_LOCK_TTL'],
+            wait_timeout=config['SINGLEFLIGHT_WAIT_TIMEOUT'],
+            enabled=config['SINGLEFLIGHT_ENABLED'],
+            logger=flask_app.logger
+        )
+
+        # Without Redis, share the in-process state of the Flask app's instances
+        state.governor = AsyncUpstreamGovernor.from_config(
+            config, redis_client, local=flask_app.governor.local, logger=flask_app.logger
+        )
+        state.rate_limiter = AsyncRateLimiter.from_config(
+            config, redis_client, local=flask_app.rate_limiter.local, logger=flask_app.logger
+        )
+
+        # send_message reports a missing API key before the client is used
+        state.openai_client = None
+        if flask_app.llm.configured:
+            state.openai_client = flask_app.llm.create_async_client()
+
+        yield
+
+        if state.openai_client is not None:
+            await state.openai_client.close()
+        if redis_client is not None:
+            await redis_client.aclose()
+        await engine.dispose()
+
+    wsgi_app = WSGIMiddleware(flask_app)
+    app = Starlette(
+        routes=chat_routes + [Mount('/', app=wsgi_app)],
+        middleware=[
+            Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*']),
+            # Flask's responses arrive already compressed and pass through
+            Middleware(CompressionMiddleware, compressor=flask_app.response_compressor),
+        ],
+        lifespan=lifespan
+    )
+    app.state.flask_app = flask_app
+    app.state.wsgi_app = wsgi_app
+    return app
+
+app = create_asgi_app()
@@ -0,0 +1,145 @@
+"""
+Compare chat throughput of the WSGI app (gunicorn sync workers) against the
+ASGI app (uvicorn) with a local stub LLM standing in for OpenAI.
+
+Each server gets a fresh SQLite database. The driver registers a user, then
+fires --requests POST /api/chat/send calls with --concurrency in flight and
+reports throughput and latency percentiles as JSON.
+
+    cd backend
+    python benchmarks/async_vs_sync.py --requests 400 --concurrency 200 --latency 0.5
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from stub_llm import StubLLMServer
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with socket.socket() as s:
+            if s.connect_ex(('127.0.0.1', port)) == 0:
+                return
+        time.sleep(0.1)
+    raise RuntimeError(f"Server on port {port} did not start within {timeout}s")
+
+def start_server(kind, port, workers, env):
+    if kind == 'sync':
+        # --preload runs create_app (and db.create_all) once before forking
+        cmd = [sys.executable, '-m', 'gunicorn', '--preload', '-w', str(workers),
+               '-b', f'127.0.0.1:{port}', '--timeout', '120', 'wsgi:app']
+    else:
+        cmd = [sys.executable, '-m', 'uvicorn', 'asgi:app', '--host', '127.0.0.1', '--port', str(port),
+               '--workers', str(workers), '--log-level', 'warning']
+    proc = subprocess.Popen(cmd, cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_for_port(port)
+    return proc
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+async def drive(base_url, requests, concurrency):
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=300, limits=limits) as client:
+        credentials = {'username': 'bench', 'email': 'bench@example.com', 'password': 'bench-password'}
+        await client.post('/api/auth/register', json=credentials)
+        login = await client.post('/api/auth/login', json=credentials)
+        headers = {'Authorization': f"Bearer {login.json()['access_token']}"}
+
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = []
+        errors = 0
+
+        async def one(i):
+            nonlocal errors
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    # Distinct questions so the response cache never answers
+                    response = await client.post('/api/chat/send', json={'message': f'Question {i}'}, headers=headers)
+                    ok = response.status_code == 200
+                except httpx.HTTPError:
+                    ok = False
+                latencies.append(time.perf_counter() - started)
+                if not ok:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(requests)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        'requests': requests,
+        'concurrency': concurrency,
+        'errors': errors,
+        'elapsed_s': round(elapsed, 3),
+        'throughput_rps': round(requests / elapsed, 2),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 1),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.5, help='Stub LLM response delay in seconds')
+    parser.add_argument('--sync-workers', type=int, default=4, help='gunicorn sync workers')
+    parser.add_argument('--async-workers', type=int, default=1, help='uvicorn worker processes')
+    parser.add_argument('--only', choices=['sync', 'async'], help='Benchmark a single server')
+    parser.add_argument('--output', help='Also write the results to this JSON file')
+    args = parser.parse_args()
+
+    stub = StubLLMServer(('127.0.0.1', free_port()), latency=args.latency).start()
+    results = {'stub_latency_s': args.latency}
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for kind in ('sync', 'async'):
+            if args.only and args.only != kind:
+                continue
+            port = free_port()
+            env = dict(
+                os.environ,
+                DATABASE_URL=f"sqlite:///{os.path.join(tmpdir, kind + '.db')}",
+                OPENAI_API_KEY='stub',
+                OPENAI_BASE_URL=stub.base_url,
+                REDIS_PORT=str(free_port()),  # nothing listens there, so caching is disabled
+            )
+            workers = args.sync_workers if kind == 'sync' else args.async_workers
+            proc = start_server(kind, port, workers, env)
+            try:
+                result = asyncio.run(drive(f'http://127.0.0.1:{port}', args.requests, args.concurrency))
+            finally:
+                proc.terminate()
+                proc.wait(timeout=30)
+            result['workers'] = workers
+            results[kind] = result
+
+    stub.shutdown()
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
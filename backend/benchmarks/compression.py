@@ -0,0 +1,134 @@
+"""
+Size saved and CPU spent by services.compression on assistant answers.
+
+Half of the answers train a dictionary, the other half are encoded and
+decoded without a dictionary and with the trained one. Answers come from
+an existing database (--database-url) or, by default, from a synthetic
+corpus of answers in the style the chatbot produces.
+
+    cd backend
+    python benchmarks/compression.py
+    python benchmarks/compression.py --database-url sqlite:///instance/database.db
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine, select
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.chat import ChatMessage
+from services.compression import TextCodec, train_dictionary
+
+TOPICS = ['headaches', 'high blood pressure', 'seasonal allergies', 'lower back pain', 'insomnia',
+          'type 2 diabetes', 'acid reflux', 'a sprained ankle', 'the common cold', 'iron deficiency']
+OPENINGS = [
+    "I'm not a doctor, but I can share some general information about {topic}.",
+    "Here is some general information about {topic} that may help.",
+    "{Topic} is a common concern, and there are several things worth knowing.",
+]
+POINTS = [
+    "**Common causes**: {topic} can be related to lifestyle factors such as stress, diet, sleep and physical activity.",
+    "**Symptoms to watch for**: keep track of when symptoms start, how long they last and what makes them better or worse.",
+    "**Self-care**: staying hydrated, getting regular sleep and avoiding known triggers often helps with mild {topic}.",
+    "**Over-the-counter options**: a pharmacist can advise on over-the-counter products suitable for {topic}.",
+    "**Lifestyle changes**: regular exercise, a balanced diet and limiting alcohol and caffeine can reduce symptoms.",
+    "**When to seek care**: if symptoms are severe, sudden, or do not improve after a few days, contact a healthcare provider.",
+    "**Emergency signs**: seek emergency care immediately for chest pain, difficulty breathing, confusion or loss of consciousness.",
+]
+CLOSINGS = [
+    "Please consult a qualified healthcare professional for advice about your specific situation.",
+    "This information is not a substitute for professional medical advice, diagnosis, or treatment.",
+    "If you're concerned, it's always best to speak with your doctor or another healthcare provider.",
+]
+
+def synthetic_answers(count, seed=42):
+    rng = random.Random(seed)
+    answers = []
+    for _ in range(count):
+        topic = rng.choice(TOPICS)
+        points = rng.sample(POINTS, rng.randint(3, len(POINTS)))
+        lines = [rng.choice(OPENINGS).format(topic=topic, Topic=topic.capitalize()), '']
+        lines += [f"{i}. {point.format(topic=topic)}" for i, point in enumerate(points, 1)]
+        lines += ['', rng.choice(CLOSINGS)]
+        answers.append("\n".join(lines))
+    return answers
+
+def database_answers(url, count):
+    engine = create_engine(url)
+    with engine.connect() as connection:
+        answers = connection.execute(
+            select(ChatMessage.content).filter_by(role='assistant').order_by(ChatMessage.created_at.desc()).limit(count)
+        ).scalars().all()
+    engine.dispose()
+    return answers
+
+def measure(codec, answers, repeat):
+    encoded = [codec.encode(answer) for answer in answers]
+    encode_times, decode_times = [], []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for answer in answers:
+            codec.encode(answer)
+        encode_times.append((time.perf_counter() - started) / len(answers) * 1e6)
+        started = time.perf_counter()
+        for value in encoded:
+            codec.decode(value)
+        decode_times.append((time.perf_counter() - started) / len(answers) * 1e6)
+    assert [codec.decode(value) for value in encoded] == answers
+
+    raw_bytes = sum(len(answer.encode()) for answer in answers)
+    stored_bytes = sum(len(value.encode()) for value in encoded)
+    # The response cache stores the JSON encoding of each answer
+    raw_cache = sum(len(json.dumps(answer)) for answer in answers)
+    stored_cache = sum(len(codec.encode(json.dumps(answer))) for answer in answers)
+    return {
+        'values': len(answers),
+        'compressed_values': sum(1 for value, answer in zip(encoded, answers) if value != answer),
+        'raw_bytes': raw_bytes,
+        'stored_bytes': stored_bytes,
+        'db_ratio': round(raw_bytes / stored_bytes, 2),
+        'cache_ratio': round(raw_cache / stored_cache, 2),
+        'encode_us': round(statistics.median(encode_times), 1),
+        'decode_us': round(statistics.median(decode_times), 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', help='Read assistant messages from this database')
+    parser.add_argument('--count', type=int, default=2000, help='Answers to use (half train, half measure)')
+    parser.add_argument('--min-size', type=int, default=512)
+    parser.add_argument('--level', type=int, default=6)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='Also write the results to this JSON file')
+    args = parser.parse_args()
+
+    answers = database_answers(args.database_url, args.count) if args.database_url else synthetic_answers(args.count)
+    training, answers = answers[::2], answers[1::2]
+
+    results = {'answer_chars_median': statistics.median(len(answer) for answer in answers)}
+    results['no_dictionary'] = measure(TextCodec(min_size=args.min_size, level=args.level), answers, args.repeat)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        codec = TextCodec(min_size=args.min_size, level=args.level, dictionary_dir=tmpdir)
+        started = time.perf_counter()
+        dictionary = train_dictionary(training)
+        results['training_seconds'] = round(time.perf_counter() - started, 2)
+        results['dictionary_bytes'] = len(dictionary)
+        codec.save_dictionary(dictionary)
+        results['trained_dictionary'] = measure(codec, answers, args.repeat)
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
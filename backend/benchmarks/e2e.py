@@ -0,0 +1,275 @@
+"""
+End-to-end load test of the API against a stub LLM.
+
+Seeds a fresh database with users, sessions and messages, starts the
+server (gunicorn sync workers or uvicorn) with LLM_PROVIDER=stub, then
+drives each endpoint in turn and reports throughput and p50/p95/p99
+latency per endpoint as JSON:
+
+    login      POST /api/auth/login
+    sessions   GET  /api/chat/sessions
+    history    GET  /api/history/
+    send       POST /api/chat/send (continuing a seeded session)
+
+Save a run with --output and gate the next one on it with --baseline:
+the exit status is 1 when an endpoint's p95 latency rose, or its
+throughput fell, by more than --tolerance.
+
+    cd backend
+    python benchmarks/e2e.py --users 200 --sessions 5 --turns 10 --requests 500 --concurrency 50 --output base.json
+    python benchmarks/e2e.py --baseline base.json --tolerance 0.1
+    python benchmarks/e2e.py --server async --latency lognormal:0.4,0.5 --token-rate 60
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import httpx
+from sqlalchemy import insert
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from async_vs_sync import free_port, percentile, start_server
+from config import TestingConfig
+from models import User, ChatSession, ChatMessage, ChatHistory, db
+from models.db import generate_password_hash
+from services.llm_stub import REPLIES, StubBehavior, StubLLMServer
+
+PASSWORD = 'bench-password'
+PHASES = ('login', 'sessions', 'history', 'send')
+BATCH_SIZE = 5000
+
+def seed(database_url, users, sessions_per_user, turns_per_session):
+    """
+    Create the schema through create_app and bulk insert users, sessions,
+    messages and their history entries. Returns {username: [session ids]}.
+    """
+    from app import create_app
+
+    class SeedConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = database_url
+
+    # Keep stdout for the results
+    with contextlib.redirect_stdout(sys.stderr):
+        app = create_app(SeedConfig)
+    # Hashing is deliberately slow, and every user gets the same password
+    password_hash = generate_password_hash(PASSWORD)
+    start = datetime.utcnow() - timedelta(days=30)
+    rows = {User: [], ChatSession: [], ChatMessage: [], ChatHistory: []}
+    sessions = {}
+
+    def flush(force=False):
+        for model, pending in rows.items():
+            if pending and (force or len(pending) >= BATCH_SIZE):
+                db.session.execute(insert(model), pending)
+                pending.clear()
+
+    with app.app_context():
+        for u in range(users):
+            user_id, username = str(uuid.uuid4()), f'bench{u}'
+            rows[User].append({'id': user_id, 'username': username, 'email': f'{username}@example.com',
+                               'password_hash': password_hash, 'created_at': start, 'updated_at': start})
+            sessions[username] = []
+            for s in range(sessions_per_user):
+                session_id = str(uuid.uuid4())
+                t = start + timedelta(minutes=s * users + u)
+                sessions[username].append(session_id)
+                rows[ChatSession].append({'id': session_id, 'user_id': user_id, 'title': f'Question 0 of session {s}',
+                                          'created_at': t, 'updated_at': t + timedelta(seconds=turns_per_session)})
+                for turn in range(turns_per_session):
+                    created_at = t + timedelta(seconds=turn)
+                    question, answer = str(uuid.uuid4()), str(uuid.uuid4())
+                    rows[ChatMessage] += [
+                        {'id': question, 'session_id': session_id, 'role': 'user',
+                         'content': f'Question {turn} of session {s}: what should I do about this?',
+                         'created_at': created_at},
+                        {'id': answer, 'session_id': session_id, 'role': 'assistant',
+                         'content': REPLIES[turn % len(REPLIES)], 'created_at': created_at + timedelta(microseconds=1)},
+                    ]
+                    rows[ChatHistory].append({'id': str(uuid.uuid4()), 'user_id': user_id, 'query': '', 'response': '',
+                                              'user_message_id': question, 'assistant_message_id': answer,
+                                              'created_at': created_at})
+            flush()
+        flush(force=True)
+        db.session.commit()
+        db.engine.dispose()
+    return sessions
+
+def summarize(latencies, statuses, elapsed):
+    errors = sum(1 for status in statuses if status is None or status >= 400)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'elapsed_s': round(elapsed, 3),
+        'throughput_rps': round(len(latencies) / elapsed, 2) if elapsed else None,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 1),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 1),
+        'max_ms': round(max(latencies) * 1000, 1),
+    }
+
+async def run_phase(client, make_request, requests, concurrency, warmup):
+    """
+    Send `warmup` untimed requests, then `requests` timed ones with
+    `concurrency` in flight. make_request(i) returns a coroutine giving
+    the response.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, statuses = [], []
+
+    async def one(i, timed):
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                status = (await make_request(i)).status_code
+            except httpx.HTTPError:
+                status = None
+            if timed:
+                latencies.append(time.perf_counter() - started)
+                statuses.append(status)
+
+    await asyncio.gather(*(one(i, False) for i in range(warmup)))
+    started = time.perf_counter()
+    await asyncio.gather(*(one(warmup + i, True) for i in range(requests)))
+    return summarize(latencies, statuses, time.perf_counter() - started)
+
+async def drive(base_url, sessions, phases, requests, concurrency, warmup, seed_value):
+    rng = random.Random(seed_value)
+    usernames = list(sessions)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    results = {}
+    async with httpx.AsyncClient(base_url=base_url, timeout=300, limits=limits) as client:
+        tokens = {}
+
+        async def login(i):
+            username = usernames[i % len(usernames)]
+            response = await client.post('/api/auth/login', json={'username': username, 'password': PASSWORD})
+            if response.status_code == 200:
+                tokens[username] = {'Authorization': f"Bearer {response.json()['access_token']}"}
+            return response
+
+        if 'login' in phases:
+            results['login'] = await run_phase(client, login, requests, concurrency, warmup)
+        # The other phases need a token for every user they pick
+        await asyncio.gather(*(login(i) for i, username in enumerate(usernames) if username not in tokens))
+        picks = [rng.choice(usernames) for _ in range(warmup + requests)]
+
+        async def list_sessions(i):
+            return await client.get('/api/chat/sessions', headers=tokens[picks[i]])
+
+        async def history(i):
+            return await client.get('/api/history/', params={'per_page': 10}, headers=tokens[picks[i]])
+
+        async def send(i):
+            username = picks[i]
+            session_id = rng.choice(sessions[username]) if sessions[username] else None
+            # Distinct questions so the response cache never answers
+            return await client.post('/api/chat/send', headers=tokens[username], json={
+                'message': f'Benchmark question {i}: is it normal to feel tired after lunch?',
+                'session_id': session_id
+            })
+
+        for name, make_request in (('sessions', list_sessions), ('history', history), ('send', send)):
+            if name in phases:
+                results[name] = await run_phase(client, make_request, requests, concurrency, warmup)
+    return results
+
+def compare(results, baseline, tolerance):
+    """
+    Per endpoint changes against a baseline run, and whether any of them
+    is a regression beyond `tolerance` (a fraction).
+    """
+    report, regressed = {}, False
+    for name, current in results['endpoints'].items():
+        previous = baseline.get('endpoints', {}).get(name)
+        if not previous:
+            continue
+        p95 = current['p95_ms'] / previous['p95_ms'] - 1 if previous['p95_ms'] else 0
+        throughput = current['throughput_rps'] / previous['throughput_rps'] - 1 if previous['throughput_rps'] else 0
+        failed = p95 > tolerance or throughput < -tolerance or current['errors'] > previous['errors']
+        regressed = regressed or failed
+        report[name] = {'p95_change': round(p95, 3), 'throughput_change': round(throughput, 3), 'regressed': failed}
+    return report, regressed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--server', choices=['sync', 'async'], default='sync',
+                        help='gunicorn sync workers (wsgi:app) or uvicorn (asgi:app)')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--database-url', help='Empty database to use (default: a temporary SQLite file)')
+    parser.add_argument('--redis', action='store_true', help='Use the Redis from the environment (default: none)')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--sessions', type=int, default=5, help='Sessions per user')
+    parser.add_argument('--turns', type=int, default=10, help='Question/answer pairs per session')
+    parser.add_argument('--phases', default=','.join(PHASES), help='Endpoints to drive, in this order')
+    parser.add_argument('--requests', type=int, default=500, help='Timed requests per endpoint')
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--warmup', type=int, default=20, help='Untimed requests per endpoint')
+    parser.add_argument('--latency', default='0.5', help='Stub LLM latency distribution (see stub_llm.py)')
+    parser.add_argument('--token-rate', type=float, default=0, help='Stub LLM tokens per second')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Also write the results to this JSON file')
+    parser.add_argument('--baseline', help='Results of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='Allowed p95/throughput change vs the baseline')
+    args = parser.parse_args()
+    phases = [phase for phase in args.phases.split(',') if phase in PHASES]
+
+    behavior = StubBehavior(latency=args.latency, token_rate=args.token_rate, seed=args.seed)
+    stub = StubLLMServer(('127.0.0.1', free_port()), behavior).start()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        database_url = args.database_url or f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"
+        started = time.perf_counter()
+        sessions = seed(database_url, args.users, args.sessions, args.turns)
+        seed_seconds = time.perf_counter() - started
+
+        env = dict(
+            os.environ,
+            DATABASE_URL=database_url,
+            LLM_PROVIDER='stub',
+            LLM_STUB_URL=stub.base_url,
+            RATE_LIMIT_ENABLED='False',  # measure the endpoints, not the 429s
+        )
+        if not args.redis:
+            env['REDIS_PORT'] = str(free_port())  # nothing listens there, so Redis features are off
+        port = free_port()
+        proc = start_server(args.server, port, args.workers, env)
+        try:
+            endpoints = asyncio.run(drive(f'http://127.0.0.1:{port}', sessions, phases, args.requests,
+                                          args.concurrency, args.warmup, args.seed))
+        finally:
+            proc.terminate()
+            proc.wait(timeout=30)
+    stub.shutdown()
+
+    results = {
+        'server': args.server,
+        'workers': args.workers,
+        'concurrency': args.concurrency,
+        'data': {'users': args.users, 'sessions_per_user': args.sessions, 'turns_per_session': args.turns,
+                 'seed_s': round(seed_seconds, 1)},
+        'stub': behavior.describe(),
+        'endpoints': endpoints,
+    }
+    regressed = False
+    if args.baseline:
+        with open(args.baseline) as f:
+            results['comparison'], regressed = compare(results, json.load(f), args.tolerance)
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    sys.exit(1 if regressed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Cost of choosing a fallback answer: the old generate_fallback_response
+(patterns dict rebuilt per call, one re.search per topic) against
+services.fallback.FallbackEngine (one combined pattern compiled at import).
+
+Messages are synthetic patient questions of realistic lengths, some of
+them matching no topic, which is the old code's worst case.
+
+    cd backend
+    python benchmarks/fallback.py
+    python benchmarks/fallback.py --count 5000 --repeat 7
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.fallback import FallbackEngine
+
+LEGACY_PATTERNS = {
+    r"(?i)headache|migraine": ["headache answer"],
+    r"(?i)fever|temperature": ["fever answer"],
+    r"(?i)cold|flu|cough": ["cold answer"],
+    r"(?i)diet|nutrition|eat": ["diet answer"],
+    r"(?i)exercise|workout|fitness": ["exercise answer"],
+    r"(?i)sleep|insomnia|tired": ["sleep answer"],
+    r"(?i)stress|anxiety|depression": ["stress answer"],
+}
+
+def legacy_fallback(user_message):
+    # The lookup before services.fallback, including the per-call dict build
+    patterns = dict(LEGACY_PATTERNS)
+    for pattern, responses in patterns.items():
+        if re.search(pattern, user_message):
+            return random.choice(responses)
+    return random.choice(["default answer"])
+
+OPENERS = ["Hi,", "Hello doctor,", "Quick question:", "I'm a 34 year old woman and", "My son is 8 and"]
+COMPLAINTS = [
+    "I have had a pounding headache for three days", "my temperature was 38.5 this morning",
+    "I can't stop coughing at night", "I keep waking up at 3am and can't get back to sleep",
+    "I feel anxious before every meeting", "I want to start a new workout routine",
+    "my knee clicks when I walk downstairs", "I noticed a small rash on my forearm",
+    "my blood pressure reading was 145 over 90", "I get heartburn after dinner",
+]
+DETAILS = [
+    "It started after a long trip.", "Nothing I have tried so far seems to help much.",
+    "I am not taking any medication at the moment apart from vitamins.",
+    "It gets worse in the evening and a bit better in the morning.",
+    "I have no other medical conditions that I know of.", "My partner says I should see someone about it.",
+    "I also noticed it happens more when I am busy at work.",
+]
+QUESTIONS = ["What could be causing this?", "Should I be worried?", "When should I see a doctor?",
+             "Is there anything I can do at home?"]
+
+def synthetic_messages(count, seed=42):
+    rng = random.Random(seed)
+    messages = []
+    for _ in range(count):
+        parts = [rng.choice(OPENERS), rng.choice(COMPLAINTS) + '.']
+        parts += rng.sample(DETAILS, rng.randint(0, 4))
+        parts.append(rng.choice(QUESTIONS))
+        messages.append(' '.join(parts))
+    return messages
+
+def time_per_call(function, messages, repeat):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for message in messages:
+            function(message)
+        times.append((time.perf_counter() - started) / len(messages) * 1e6)
+    return round(statistics.median(times), 2)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--count', type=int, default=2000, help='Messages per run')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='Also write the results to this JSON file')
+    args = parser.parse_args()
+
+    messages = synthetic_messages(args.count)
+    engine = FallbackEngine.load(rng=random.Random(0))
+    matched = [engine.match(message)[1] for message in messages]
+
+    results = {
+        'messages': len(messages),
+        'message_chars_median': statistics.median(len(message) for message in messages),
+        'legacy_us': time_per_call(legacy_fallback, messages, args.repeat),
+        'engine_us': time_per_call(engine.match, messages, args.repeat),
+        'engine_default_share': round(sum(1 for topics in matched if not topics) / len(messages), 2),
+        'engine_multi_topic_share': round(sum(1 for topics in matched if len(topics) > 1) / len(messages), 2),
+    }
+    results['speedup'] = round(results['legacy_us'] / results['engine_us'], 2)
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+"""
+Query plans and latency of the hot chat queries before and after the
+composite indexes from migration 0002.
+
+Seeds a database with the chat tables minus their indexes, times each
+query for one user, applies the pending migrations and times them again.
+
+    cd backend
+    python benchmarks/query_indexes.py --users 1000 --sessions 20 --messages 50
+    python benchmarks/query_indexes.py --database-url postgresql://localhost/chatbench
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, select, func, text
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import migrations
+from models import User, ChatSession, ChatMessage, ChatHistory, db
+
+BATCH_SIZE = 20000
+
+def seed(engine, users, sessions_per_user, messages_per_session):
+    """
+    Insert users, sessions, messages (and one history row per message pair)
+    with Core bulk inserts. Returns the id of the first user and one of their sessions.
+    """
+    start = datetime(2024, 1, 1)
+    user_rows, session_rows, message_rows, history_rows = [], [], [], []
+    target_user = target_session = None
+
+    def flush(connection, force=False):
+        for table, rows in ((User.__table__, user_rows), (ChatSession.__table__, session_rows),
+                            (ChatMessage.__table__, message_rows), (ChatHistory.__table__, history_rows)):
+            if rows and (force or len(rows) >= BATCH_SIZE):
+                connection.execute(table.insert(), rows)
+                rows.clear()
+
+    with engine.begin() as connection:
+        for u in range(users):
+            user_id = str(uuid.uuid4())
+            user_rows.append({'id': user_id, 'username': f'user{u}', 'email': f'user{u}@example.com',
+                              'password_hash': 'x', 'created_at': start, 'updated_at': start})
+            for s in range(sessions_per_user):
+                session_id = str(uuid.uuid4())
+                # Interleave users in time, like real traffic
+                t = start + timedelta(seconds=(s * users + u) * messages_per_session)
+                session_rows.append({'id': session_id, 'user_id': user_id, 'title': f'Session {s}',
+                                     'created_at': t, 'updated_at': t + timedelta(seconds=messages_per_session)})
+                for m in range(messages_per_session):
+                    created_at = t + timedelta(seconds=m)
+                    role = 'user' if m % 2 == 0 else 'assistant'
+                    message_rows.append({'id': str(uuid.uuid4()), 'session_id': session_id, 'role': role,
+                                         'content': f'Message {m} of session {s}', 'created_at': created_at})
+                    if role == 'assistant':
+                        history_rows.append({'id': str(uuid.uuid4()), 'user_id': user_id, 'query': f'Question {m}',
+                                             'response': f'Answer {m}', 'created_at': created_at})
+                if target_session is None:
+                    target_user, target_session = user_id, session_id
+                flush(connection)
+        flush(connection, force=True)
+    return target_user, target_session
+
+def hot_queries(user_id, session_id):
+    # The statements issued by the chat, session list and history endpoints
+    return {
+        'session_messages': select(ChatMessage).filter_by(session_id=session_id).order_by(ChatMessage.created_at),
+        'context_tail': select(ChatMessage).filter_by(session_id=session_id)
+                        .order_by(ChatMessage.created_at.desc()).limit(20),
+        'session_list': select(ChatSession).filter_by(user_id=user_id).order_by(ChatSession.updated_at.desc()),
+        'history_page': select(ChatHistory).filter_by(user_id=user_id)
+                        .order_by(ChatHistory.created_at.desc()).limit(10).offset(0),
+        'history_count': select(func.count()).select_from(ChatHistory).filter_by(user_id=user_id),
+    }
+
+def explain(connection, statement):
+    compiled = statement.compile(dialect=connection.dialect, compile_kwargs={'literal_binds': True})
+    prefix = 'EXPLAIN QUERY PLAN' if connection.dialect.name == 'sqlite' else 'EXPLAIN'
+    rows = connection.execute(text(f'{prefix} {compiled}')).fetchall()
+    return [str(row[-1]) for row in rows]
+
+def measure(engine, queries, repeat):
+    results = {}
+    with engine.connect() as connection:
+        for name, statement in queries.items():
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                connection.execute(statement).fetchall()
+                timings.append((time.perf_counter() - started) * 1000)
+            results[name] = {
+                'median_ms': round(statistics.median(timings), 3),
+                'max_ms': round(max(timings), 3),
+                'plan': explain(connection, statement),
+            }
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', help='Empty database to use (default: a temporary SQLite file)')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--sessions', type=int, default=20, help='Sessions per user')
+    parser.add_argument('--messages', type=int, default=50, help='Messages per session')
+    parser.add_argument('--repeat', type=int, default=20, help='Timed runs per query')
+    parser.add_argument('--output', help='Also write the results to this JSON file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        url = args.database_url or f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"
+        engine = create_engine(url)
+
+        # Start from the schema an existing deployment has: tables without the new indexes
+        db.metadata.create_all(engine)
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                index.drop(engine)
+
+        started = time.perf_counter()
+        user_id, session_id = seed(engine, args.users, args.sessions, args.messages)
+        seed_seconds = time.perf_counter() - started
+        queries = hot_queries(user_id, session_id)
+
+        results = {
+            'rows': {
+                'users': args.users,
+                'sessions': args.users * args.sessions,
+                'messages': args.users * args.sessions * args.messages,
+                'history': args.users * args.sessions * (args.messages // 2),
+            },
+            'seed_seconds': round(seed_seconds, 1),
+            'before': measure(engine, queries, args.repeat),
+        }
+        results['migrations_applied'] = migrations.upgrade(engine)
+        with engine.connect() as connection:
+            if connection.dialect.name == 'sqlite':
+                connection.execute(text('ANALYZE'))
+        results['after'] = measure(engine, queries, args.repeat)
+        engine.dispose()
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+"""
+Cost of returning a large session transcript and history page: building
+the payload from ORM objects (to_dict) or from column projections, JSON
+serialization with the stdlib and orjson providers, and bytes on the wire
+with gzip and brotli at several levels.
+
+Seeds a temporary SQLite database with one session of --turns question
+and answer pairs, then reports medians in milliseconds and sizes in bytes
+as JSON, including whole GET requests through the test client.
+
+    cd backend
+    python benchmarks/serialization.py
+    python benchmarks/serialization.py --turns 500 --history-page 50 --repeat 20
+"""
+
+import argparse
+import contextlib
+import gzip
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert, select
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from compression import synthetic_answers
+from config import TestingConfig
+from models import User, ChatSession, ChatMessage, ChatHistory, db
+from models.chat import MESSAGE_COLUMNS, select_history_rows
+from services.json_provider import PROVIDERS, orjson
+from services.response_compression import brotli
+
+PASSWORD = 'bench-password'
+
+def timed(fn, repeat):
+    """
+    Median milliseconds of `repeat` calls of fn, and its last result.
+    """
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        times.append((time.perf_counter() - started) * 1000)
+    return round(statistics.median(times), 3), result
+
+def seed(app, turns):
+    """
+    A user with one session of `turns` question/answer pairs and their
+    history entries. Returns the session id.
+    """
+    answers = synthetic_answers(turns)
+    start = datetime.utcnow() - timedelta(days=1)
+    with app.app_context():
+        user = User('bench', 'bench@example.com', PASSWORD)
+        db.session.add(user)
+        db.session.flush()
+        session_id = str(uuid.uuid4())
+        db.session.execute(insert(ChatSession), [{'id': session_id, 'user_id': user.id, 'title': 'Benchmark session',
+                                                  'created_at': start, 'updated_at': start}])
+        messages, history = [], []
+        for turn, answer in enumerate(answers):
+            created_at = start + timedelta(seconds=turn)
+            question, reply = str(uuid.uuid4()), str(uuid.uuid4())
+            messages += [
+                {'id': question, 'session_id': session_id, 'role': 'user',
+                 'content': f'Question {turn}: what should I know about this symptom?', 'created_at': created_at},
+                {'id': reply, 'session_id': session_id, 'role': 'assistant', 'content': answer,
+                 'created_at': created_at + timedelta(microseconds=1)},
+            ]
+            history.append({'id': str(uuid.uuid4()), 'user_id': user.id, 'query': '', 'response': '',
+                            'user_message_id': question, 'assistant_message_id': reply, 'created_at': created_at})
+        db.session.execute(insert(ChatMessage), messages)
+        db.session.execute(insert(ChatHistory), history)
+        db.session.commit()
+    return session_id
+
+def fetch(app, build, repeat):
+    def run():
+        with app.app_context():
+            try:
+                return build()
+            finally:
+                # Nothing may come from the identity map of an earlier run
+                db.session.remove()
+    return timed(run, repeat)
+
+def measure_payload(app, orm_build, projection_build, repeat):
+    """
+    Fetch and serialization timings and wire sizes for one endpoint's payload.
+    """
+    orm_ms, orm_payload = fetch(app, orm_build, repeat)
+    projection_ms, payload = fetch(app, projection_build, repeat)
+    result = {'fetch_ms': {'orm_to_dict': orm_ms, 'projection': projection_ms}, 'serialize_ms': {}}
+
+    for name, provider_class in PROVIDERS.items():
+        if name == 'orjson' and orjson is None:
+            continue
+        provider = provider_class(app)
+        # to_dict output has dates as strings already; projections leave them to the provider
+        result['serialize_ms'][name] = {
+            'to_dict': timed(lambda: provider.dumps_bytes(orm_payload), repeat)[0],
+            'projection': timed(lambda: provider.dumps_bytes(payload), repeat)[0],
+        }
+    body = app.json.dumps_bytes(payload)
+    assert json.loads(body) == json.loads(app.json.dumps_bytes(orm_payload))
+
+    wire = {'identity': {'bytes': len(body), 'compress_ms': 0}}
+    for level in (1, 6, 9):
+        ms, data = timed(lambda: gzip.compress(body, compresslevel=level, mtime=0), repeat)
+        wire[f'gzip-{level}'] = {'bytes': len(data), 'compress_ms': ms}
+    if brotli is not None:
+        for quality in (1, 4, 11):
+            ms, data = timed(lambda: brotli.compress(body, quality=quality), max(1, repeat // 5 if quality == 11 else repeat))
+            wire[f'br-{quality}'] = {'bytes': len(data), 'compress_ms': ms}
+    result['wire'] = wire
+    return result
+
+def measure_requests(app, paths, repeat):
+    """
+    Median time of whole GET requests per JSON provider and encoding.
+    """
+    client = app.test_client()
+    token = client.post('/api/auth/login', json={'username': 'bench', 'password': PASSWORD}).get_json()['access_token']
+    encodings = ['identity', 'gzip'] + (['br'] if brotli is not None else [])
+    results = {}
+    for name, provider_class in PROVIDERS.items():
+        if name == 'orjson' and orjson is None:
+            continue
+        app.json = provider_class(app)
+        for encoding in encodings:
+            headers = {'Authorization': f'Bearer {token}', 'Accept-Encoding': encoding}
+            for label, path in paths.items():
+                ms, response = timed(lambda: client.get(path, headers=headers), repeat)
+                assert response.status_code == 200, response.status_code
+                results[f'{label} {name} {encoding}'] = {'ms': ms, 'bytes': len(response.data)}
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--turns', type=int, default=300, help='Question/answer pairs in the session')
+    parser.add_argument('--history-page', type=int, default=50, help='History entries per page')
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--output', help='Also write the results to this JSON file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        class BenchConfig(TestingConfig):
+            SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"
+            RESPONSE_COMPRESSION_MIN_SIZE = 0
+            # Measure every request against the database, not the projection cache
+            CHANGE_VERSION_ENABLED = False
+            LOG_LEVEL = 'WARNING'
+
+        from app import create_app
+        # Keep stdout for the results
+        with contextlib.redirect_stdout(sys.stderr):
+            app = create_app(BenchConfig)
+        session_id = seed(app, args.turns)
+        with app.app_context():
+            user_id = db.session.execute(select(User.id)).scalar()
+
+        messages = lambda query: db.session.execute(
+            query.where(ChatMessage.session_id == session_id).order_by(ChatMessage.created_at)
+        )
+        history = lambda query: db.session.execute(
+            query.where(ChatHistory.user_id == user_id).order_by(ChatHistory.created_at.desc()).limit(args.history_page)
+        )
+        results = {
+            'turns': args.turns,
+            'history_page': args.history_page,
+            'orjson': orjson is not None,
+            'brotli': brotli is not None,
+            'session': measure_payload(
+                app,
+                lambda: {'messages': [m.to_dict() for m in messages(select(ChatMessage)).scalars()]},
+                lambda: {'messages': [m._asdict() for m in messages(select(*MESSAGE_COLUMNS))]},
+                args.repeat
+            ),
+            'history': measure_payload(
+                app,
+                lambda: {'history': [h.to_dict() for h in history(select(ChatHistory)).unique().scalars()]},
+                lambda: {'history': [h._asdict() for h in history(select_history_rows())]},
+                args.repeat
+            ),
+            'requests': measure_requests(app, {
+                'session': f'/api/chat/sessions/{session_id}',
+                'history': f'/api/history/?per_page={args.history_page}',
+            }, args.repeat),
+        }
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
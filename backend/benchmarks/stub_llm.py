@@ -0,0 +1,55 @@
+"""
+OpenAI-compatible chat completions server for local load testing.
+
+Answers POST /v1/chat/completions with canned replies, streamed or not,
+after a delay drawn from a latency distribution, and can inject 500s and
+429s or enforce OpenAI-style per-minute limits, so the API can be
+benchmarked without calling OpenAI. See services.llm_stub.
+
+    python benchmarks/stub_llm.py --port 8001 --latency lognormal:0.6,0.4 --token-rate 50
+    LLM_PROVIDER=stub LLM_STUB_URL=http://127.0.0.1:8001/v1 flask run
+
+Without LLM_STUB_URL, LLM_PROVIDER=stub starts the same server inside each
+worker process, configured by the LLM_STUB_* settings.
+"""
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.llm_stub import StubBehavior, StubLLMServer
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--latency', default='0.5',
+                        help="Seconds to the first token: a number, or uniform:LOW,HIGH, normal:MEAN,STDEV, "
+                             "lognormal:MEDIAN,SIGMA or exponential:MEAN")
+    parser.add_argument('--token-rate', type=float, default=0, help='Reply tokens per second (0: all at once)')
+    parser.add_argument('--reply-tokens', type=int, default=0, help='Reply length in tokens (0: canned length)')
+    parser.add_argument('--error-rate', type=float, default=0, help='Share of requests answered with a 500')
+    parser.add_argument('--rate-limit-rate', type=float, default=0, help='Share of requests answered with a 429')
+    parser.add_argument('--rpm', type=int, default=0, help='Requests per minute before 429s (0: unlimited)')
+    parser.add_argument('--tpm', type=int, default=0, help='Tokens per minute before 429s (0: unlimited)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    behavior = StubBehavior(
+        latency=args.latency,
+        token_rate=args.token_rate,
+        reply_tokens=args.reply_tokens,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        rpm=args.rpm,
+        tpm=args.tpm,
+        seed=args.seed
+    )
+    server = StubLLMServer((args.host, args.port), behavior)
+    print(f"Stub LLM listening on {server.base_url}")
+    server.serve_forever()
+
+if __name__ == '__main__':
+    main()
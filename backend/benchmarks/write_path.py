@@ -0,0 +1,117 @@
+"""
+Commits and latency of persisting a chat turn: the old write path (a commit
+for a new session, one for the messages and title, one for the history row)
+against services.persistence.save_turn (one transaction, bulk inserts,
+history rows referencing the messages instead of copying their text).
+
+Each run writes `--sessions` conversations of `--turns` turns, the first
+turn of each starting a new session, to a file-backed SQLite database so
+every commit pays its fsync.
+
+    cd backend
+    python benchmarks/write_path.py --sessions 50 --turns 10
+    python benchmarks/write_path.py --database-url postgresql://localhost/chatbench
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime
+
+from sqlalchemy import create_engine, event, insert
+from sqlalchemy.orm import sessionmaker
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import User, ChatSession, ChatMessage, ChatHistory, db
+from services.persistence import new_session, save_turn, session_title
+
+ANSWER = "Adults generally need 7 to 9 hours of sleep per night. " * 8
+
+def legacy_turn(db_session, session, user_id, user_message, assistant_response, set_title):
+    # The write path before the persistence service
+    if session is None:
+        session = ChatSession(user_id=user_id)
+        db_session.add(session)
+        db_session.commit()
+    db_session.add(ChatMessage(session_id=session.id, role="user", content=user_message))
+    db_session.add(ChatMessage(session_id=session.id, role="assistant", content=assistant_response))
+    if set_title:
+        session.title = session_title(user_message)
+    db_session.commit()
+    db_session.add(ChatHistory(user_id=user_id, query=user_message, response=assistant_response))
+    db_session.commit()
+    return session
+
+def single_transaction_turn(db_session, session, user_id, user_message, assistant_response, set_title):
+    if session is None:
+        session = new_session(user_id)
+    save_turn(db_session, session, user_id, user_message, assistant_response, set_title)
+    return session
+
+def run(engine, write_turn, user_id, sessions, turns):
+    # Commits that reach the database, whichever code path issued them
+    commits = []
+    event.listen(engine, 'commit', lambda connection: commits.append(1))
+    Session = sessionmaker(engine)
+    timings = []
+    with Session() as db_session:
+        for s in range(sessions):
+            session = None
+            for t in range(turns):
+                started = time.perf_counter()
+                session = write_turn(db_session, session, user_id, f"Question {t} of conversation {s}",
+                                     ANSWER, set_title=t == 0)
+                timings.append((time.perf_counter() - started) * 1000)
+    total_turns = sessions * turns
+    timings.sort()
+    return {
+        'turns': total_turns,
+        'commits': len(commits),
+        'commits_per_turn': round(len(commits) / total_turns, 2),
+        'median_ms': round(statistics.median(timings), 3),
+        'p95_ms': round(timings[int(len(timings) * 0.95) - 1], 3),
+        'total_s': round(sum(timings) / 1000, 2),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', help='Empty database to use (default: a temporary SQLite file)')
+    parser.add_argument('--sessions', type=int, default=50, help='Conversations per run')
+    parser.add_argument('--turns', type=int, default=10, help='Turns per conversation')
+    parser.add_argument('--output', help='Also write the results to this JSON file')
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for name, write_turn in (('legacy', legacy_turn), ('single_transaction', single_transaction_turn)):
+            url = args.database_url or f"sqlite:///{os.path.join(tmpdir, name + '.db')}"
+            engine = create_engine(url)
+            db.metadata.drop_all(engine)
+            db.metadata.create_all(engine)
+
+            user_id = str(uuid.uuid4())
+            now = datetime.utcnow()
+            with engine.begin() as connection:
+                connection.execute(insert(User.__table__), [{
+                    'id': user_id, 'username': 'bench', 'email': 'bench@example.com',
+                    'password_hash': 'x', 'created_at': now, 'updated_at': now
+                }])
+
+            results[name] = run(engine, write_turn, user_id, args.sessions, args.turns)
+            if engine.dialect.name == 'sqlite':
+                results[name]['db_size_kb'] = os.path.getsize(engine.url.database) // 1024
+            engine.dispose()
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+"""
+Flask CLI commands for operating the Medical Chatbot backend.
+"""
+
+import sys
+import json
+import time
+
+import click
+from sqlalchemy import select
+
+import migrations
+from models.db import db
+from models.chat import ChatMessage
+from models.user import User
+from routes.chat import chat_turn
+from services.auth_cache import Principal
+from services.batch import BatchRunner
+from services.compression import train_dictionary
+
+def register_commands(app):
+    @app.cli.group('cache')
+    def cache_group():
+        """Manage the chat response cache."""
+
+    @cache_group.command('invalidate')
+    @click.option('--model', default=None, help='Only drop responses cached for this model.')
+    def cache_invalidate(model):
+        """Drop cached responses for the current cache version."""
+        if not app.response_cache.enabled:
+            raise click.ClickException('Redis is not available, nothing to invalidate.')
+        if model:
+            deleted = app.response_cache.invalidate_model(model)
+        else:
+            deleted = app.response_cache.invalidate_all()
+        click.echo(f'{deleted} cached responses deleted')
+
+    @app.cli.group('db')
+    def db_group():
+        """Manage database schema migrations."""
+
+    @db_group.command('upgrade')
+    def db_upgrade():
+        """Apply pending schema migrations."""
+        applied = migrations.upgrade(db.engine)
+        click.echo(f'Applied {len(applied)} migrations' + (f': {", ".join(applied)}' if applied else ''))
+
+    @db_group.command('status')
+    def db_status():
+        """List schema migrations and whether they are applied."""
+        applied = migrations.applied_versions(db.engine)
+        for version, module in migrations.discover():
+            state = 'applied' if version in applied else 'pending'
+            click.echo(f'{version}  {state:8}  {module.description}')
+
+    @app.cli.group('writes')
+    def writes_group():
+        """Inspect and drain the write-behind queue."""
+
+    def require_write_behind():
+        if app.write_behind is None:
+            raise click.ClickException('Write-behind is disabled (set WRITE_BEHIND_ENABLED=True).')
+        return app.write_behind
+
+    @writes_group.command('status')
+    def writes_status():
+        """Show the queue depth and lag."""
+        stats = require_write_behind().stats()
+        if 'error' in stats:
+            raise click.ClickException(f"Queue unavailable: {stats['error']}")
+        click.echo(f"backend: {stats['backend']}")
+        click.echo(f"depth: {stats['depth']} turns")
+        click.echo(f"lag: {stats['lag_seconds']:.1f}s")
+
+    @writes_group.command('drain')
+    def writes_drain():
+        """Write every queued turn now and exit."""
+        written = require_write_behind().drain()
+        click.echo(f'{written} turns written')
+
+    @writes_group.command('worker')
+    def writes_worker():
+        """Drain the queue continuously in the foreground."""
+        write_behind = require_write_behind()
+        click.echo(f'Draining the {write_behind.queue.name} write-behind queue (Ctrl+C to stop)')
+        try:
+            write_behind.run()
+        except KeyboardInterrupt:
+            write_behind.stop()
+
+    @app.cli.group('compression')
+    def compression_group():
+        """Manage the dictionaries used to compress stored text."""
+
+    @compression_group.command('train')
+    @click.option('--samples', default=2000, help='Number of recent assistant messages to learn from.')
+    def compression_train(samples):
+        """Train a dictionary on recent answers and use it for new writes."""
+        messages = db.session.execute(
+            select(ChatMessage.content).filter_by(role='assistant').order_by(ChatMessage.created_at.desc()).limit(samples)
+        ).scalars().all()
+        if len(messages) < 10:
+            raise click.ClickException('Not enough messages to train a dictionary.')
+        dictionary_id = app.codec.save_dictionary(train_dictionary(messages))
+        click.echo(f'Trained dictionary {dictionary_id} from {len(messages)} messages')
+        click.echo('Restart the workers to use it for new writes; keep the file, older values need it.')
+
+    @app.cli.group('chat')
+    def chat_group():
+        """Run prompts through the chatbot."""
+
+    @chat_group.command('batch')
+    @click.argument('input_file', type=click.File('r', encoding='utf-8'))
+    @click.option('--user', 'username', required=True, help='Username the turns are saved for.')
+    @click.option('--output', type=click.File('w', encoding='utf-8'), default='-', help='Results JSONL (default: stdout).')
+    @click.option('--checkpoint', default=None,
+                  help='Checkpoint file, to resume an interrupted run (default: INPUT_FILE.checkpoint.jsonl).')
+    @click.option('--no-checkpoint', is_flag=True, help='Do not checkpoint or resume.')
+    @click.option('--concurrency', default=None, type=int, help='Prompts in flight (default: BATCH_CONCURRENCY).')
+    def chat_batch(input_file, username, output, checkpoint, no_checkpoint, concurrency):
+        """Answer a JSONL file of prompts and write one JSONL result per prompt.
+
+        Each line is {"message": ..., "id": optional, "session_id": optional}.
+        Running the same file again skips the prompts the checkpoint has
+        answers for and re-emits their results, so the output is complete.
+        """
+        user = db.session.execute(select(User).filter_by(username=username)).scalars().first()
+        if user is None:
+            raise click.ClickException(f'No user named {username}.')
+        # The same detached view of the user the routes get from token_required
+        user = Principal.from_user(user)
+
+        lines = input_file.read().splitlines()
+        if no_checkpoint:
+            checkpoint = None
+        elif checkpoint is None:
+            checkpoint = f'{input_file.name}.checkpoint.jsonl' if input_file.name != '<stdin>' else None
+        runner = BatchRunner(app, chat_turn, concurrency=concurrency or app.config['BATCH_CONCURRENCY'],
+                             checkpoint_path=checkpoint, total=sum(1 for line in lines if line.strip()))
+
+        last_report = 0
+        try:
+            for result in runner.run(user, lines):
+                output.write(json.dumps(result) + '\n')
+                if time.monotonic() - last_report >= 2:
+                    last_report = time.monotonic()
+                    report_progress(runner.summary())
+        except KeyboardInterrupt:
+            click.echo('Interrupted; run the same command again to resume.', err=True)
+            sys.exit(130)
+        finally:
+            output.flush()
+            report_progress(runner.summary())
+
+    def report_progress(summary):
+        eta = ''
+        remaining = summary['total'] - summary['done']
+        if summary['per_second'] and remaining > 0:
+            eta = f", ~{remaining / summary['per_second']:.0f}s left"
+        click.echo(
+            f"{summary['done']}/{summary['total']} done ({summary['resumed']} resumed, {summary['failed']} failed, "
+            f"{summary['fallbacks']} fallbacks), {summary['per_second'] or 0}/s{eta}",
+            err=True
+        )
@@ -16,38 +16,224 @@ class Config:
     SQLALCHEMY_ENGINE_OPTIONS = {
         'pool_pre_ping': True,  # Enable connection pool pre-ping
     }
+    # Apply pending schema migrations in create_app (otherwise run `flask db upgrade`)
+    DB_AUTO_MIGRATE = os.environ.get('DB_AUTO_MIGRATE', 'True') == 'True'
+    # Connection pool for the async engine used by asgi.py (ignored for SQLite)
+    ASYNC_DB_POOL_SIZE = int(os.environ.get('ASYNC_DB_POOL_SIZE', 20))
+    ASYNC_DB_MAX_OVERFLOW = int(os.environ.get('ASYNC_DB_MAX_OVERFLOW', 20))
     
     # JWT settings
     JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY', SECRET_KEY)
     JWT_ACCESS_TOKEN_EXPIRES = timedelta(hours=1)
     JWT_REFRESH_TOKEN_EXPIRES = timedelta(days=30)
     
+    # Cache verified tokens and user lookups for token_required
+    AUTH_CACHE_ENABLED = os.environ.get('AUTH_CACHE_ENABLED', 'True') == 'True'
+    AUTH_CACHE_LOCAL_TTL = int(os.environ.get('AUTH_CACHE_LOCAL_TTL', 30))  # bounds staleness on other workers
+    AUTH_CACHE_REDIS_TTL = int(os.environ.get('AUTH_CACHE_REDIS_TTL', 300))
+    AUTH_CACHE_MAX_ENTRIES = int(os.environ.get('AUTH_CACHE_MAX_ENTRIES', 10000))
+    
     # OpenAI settings
     OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY')
     OPENAI_MODEL = os.environ.get('OPENAI_MODEL', 'gpt-3.5-turbo')
+    # Override to point at an OpenAI-compatible server
+    OPENAI_BASE_URL = os.environ.get('OPENAI_BASE_URL')
+    # Shared HTTP connection pool for OpenAI calls (per worker process)
+    OPENAI_MAX_CONNECTIONS = int(os.environ.get('OPENAI_MAX_CONNECTIONS', 20))
+    OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get('OPENAI_MAX_KEEPALIVE_CONNECTIONS', 10))
+    OPENAI_KEEPALIVE_EXPIRY = float(os.environ.get('OPENAI_KEEPALIVE_EXPIRY', 60))
+    OPENAI_TIMEOUT = float(os.environ.get('OPENAI_TIMEOUT', 60))
+    OPENAI_CONNECT_TIMEOUT = float(os.environ.get('OPENAI_CONNECT_TIMEOUT', 5))
+    OPENAI_MAX_RETRIES = int(os.environ.get('OPENAI_MAX_RETRIES', 2))
+    
+    # Where completions come from: "openai", or "stub" for load tests (a
+    # local OpenAI-compatible server, see services/llm_stub.py)
+    LLM_PROVIDER = os.environ.get('LLM_PROVIDER', 'openai')
+    # A stub server to share between workers (benchmarks/stub_llm.py);
+    # without it each worker runs its own, configured below
+    LLM_STUB_URL = os.environ.get('LLM_STUB_URL')
+    # Seconds to the first token: "0.5", "uniform:0.2,0.8", "normal:0.5,0.1", "lognormal:0.5,0.6" or "exponential:0.5"
+    LLM_STUB_LATENCY = os.environ.get('LLM_STUB_LATENCY', '0.5')
+    LLM_STUB_TOKEN_RATE = float(os.environ.get('LLM_STUB_TOKEN_RATE', 0))  # tokens/s, 0 for all at once
+    LLM_STUB_REPLY_TOKENS = int(os.environ.get('LLM_STUB_REPLY_TOKENS', 0))  # 0 for the canned replies' length
+    LLM_STUB_ERROR_RATE = float(os.environ.get('LLM_STUB_ERROR_RATE', 0))  # share answered with a 500
+    LLM_STUB_RATE_LIMIT_RATE = float(os.environ.get('LLM_STUB_RATE_LIMIT_RATE', 0))  # share answered with a 429
+    LLM_STUB_RPM = int(os.environ.get('LLM_STUB_RPM', 0))  # enforced like OpenAI's limits, 0 for none
+    LLM_STUB_TPM = int(os.environ.get('LLM_STUB_TPM', 0))
+    LLM_STUB_SEED = int(os.environ.get('LLM_STUB_SEED', 0))
+    
+    # Per-user and per-client-IP request limits for each endpoint group, as
+    # "<count>/<second|minute|hour|day>"; an empty value disables that scope
+    RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'True') == 'True'
+    RATE_LIMITS = {
+        'chat.send': {
+            'user': os.environ.get('RATE_LIMIT_CHAT_SEND_USER', '20/minute'),
+            'ip': os.environ.get('RATE_LIMIT_CHAT_SEND_IP', '60/minute'),
+        },
+        'chat.sessions': {
+            'user': os.environ.get('RATE_LIMIT_CHAT_SESSIONS_USER', '120/minute'),
+            'ip': os.environ.get('RATE_LIMIT_CHAT_SESSIONS_IP', '300/minute'),
+        },
+        'chat.batch': {
+            'user': os.environ.get('RATE_LIMIT_CHAT_BATCH_USER', '10/hour'),
+            'ip': os.environ.get('RATE_LIMIT_CHAT_BATCH_IP', ''),
+        },
+    }
+    # Trusted proxies in front of the app that append to X-Forwarded-For (0: use the peer address)
+    RATE_LIMIT_PROXY_COUNT = int(os.environ.get('RATE_LIMIT_PROXY_COUNT', 0))
+    
+    # Bulk evaluation runs (POST /api/chat/batch, `flask chat batch`). The HTTP
+    # endpoint is for callers also sending BATCH_API_TOKEN as X-Batch-Token; off unless it is set
+    BATCH_API_TOKEN = os.environ.get('BATCH_API_TOKEN')
+    BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', 8))
+    BATCH_MAX_CONCURRENCY = int(os.environ.get('BATCH_MAX_CONCURRENCY', 32))
+    BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', 500))  # prompts per HTTP request
+    BATCH_CHECKPOINT_DIR = os.environ.get('BATCH_CHECKPOINT_DIR', os.path.join(os.path.dirname(__file__), 'instance', 'batches'))
+    # Checkpoints of batches that finished with every prompt answered are deleted at once;
+    # the others are kept this many seconds for a resume
+    BATCH_CHECKPOINT_TTL = int(os.environ.get('BATCH_CHECKPOINT_TTL', 7 * 24 * 3600))
+    
+    # Upstream governor: paces OpenAI calls to the account's limits (corrected from
+    # x-ratelimit-* response headers) and opens a circuit breaker on repeated 429s/5xx.
+    # Shared across workers through Redis when it is available.
+    UPSTREAM_GOVERNOR_ENABLED = os.environ.get('UPSTREAM_GOVERNOR_ENABLED', 'True') == 'True'
+    UPSTREAM_RPM = int(os.environ.get('UPSTREAM_RPM', 3500))
+    UPSTREAM_TPM = int(os.environ.get('UPSTREAM_TPM', 90000))
+    UPSTREAM_HEADROOM = float(os.environ.get('UPSTREAM_HEADROOM', 0.9))  # share of the limits we use
+    UPSTREAM_MAX_CONCURRENCY = int(os.environ.get('UPSTREAM_MAX_CONCURRENCY', 32))  # 0 for no cap
+    UPSTREAM_QUEUE_TIMEOUT = float(os.environ.get('UPSTREAM_QUEUE_TIMEOUT', 5))  # longest wait before falling back
+    UPSTREAM_MAX_QUEUED = int(os.environ.get('UPSTREAM_MAX_QUEUED', 64))  # waiting calls per process
+    UPSTREAM_BREAKER_THRESHOLD = int(os.environ.get('UPSTREAM_BREAKER_THRESHOLD', 5))
+    UPSTREAM_BREAKER_WINDOW = float(os.environ.get('UPSTREAM_BREAKER_WINDOW', 30))
+    UPSTREAM_BREAKER_COOLDOWN = float(os.environ.get('UPSTREAM_BREAKER_COOLDOWN', 30))
+    
+    # Conversation context sent with each turn
+    CONTEXT_TOKEN_BUDGET = int(os.environ.get('CONTEXT_TOKEN_BUDGET', 3000))  # whole prompt, system prompt included
+    CONTEXT_MAX_MESSAGES = int(os.environ.get('CONTEXT_MAX_MESSAGES', 20))  # rows read per turn
+    CONTEXT_SUMMARY_MAX_TOKENS = int(os.environ.get('CONTEXT_SUMMARY_MAX_TOKENS', 300))
     
     # Redis settings
     REDIS_HOST = os.environ.get('REDIS_HOST', 'localhost')
     REDIS_PORT = int(os.environ.get('REDIS_PORT', 6379))
     REDIS_DB = int(os.environ.get('REDIS_DB', 0))
     
+    # Response cache settings. Bump RESPONSE_CACHE_VERSION to orphan every cached answer.
+    RESPONSE_CACHE_VERSION = int(os.environ.get('RESPONSE_CACHE_VERSION', 1))
+    RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 3600))
+    # Per-model TTL overrides, e.g. "gpt-4=7200,gpt-3.5-turbo=3600"
+    RESPONSE_CACHE_MODEL_TTLS = {
+        model.strip(): int(ttl) for model, ttl in (
+            item.split('=') for item in os.environ.get('RESPONSE_CACHE_MODEL_TTLS', '').split(',') if item
+        )
+    }
+    
+    # Coalesce identical concurrent cache misses into one OpenAI call
+    SINGLEFLIGHT_ENABLED = os.environ.get('SINGLEFLIGHT_ENABLED', 'True') == 'True'
+    SINGLEFLIGHT_LOCK_TTL = int(os.environ.get('SINGLEFLIGHT_LOCK_TTL', 90))
+    SINGLEFLIGHT_WAIT_TIMEOUT = int(os.environ.get('SINGLEFLIGHT_WAIT_TIMEOUT', 60))
+    
+    # Semantic cache for reworded first-turn questions (requires numpy). The default hashing
+    # embedder needs no model; for paraphrases install requirements-semantic.txt and set
+    # SEMANTIC_CACHE_EMBEDDER=services.semantic_cache.SentenceTransformerEmbedder
+    SEMANTIC_CACHE_ENABLED = os.environ.get('SEMANTIC_CACHE_ENABLED', 'False') == 'True'
+    SEMANTIC_CACHE_PATH = os.environ.get('SEMANTIC_CACHE_PATH', os.path.join(os.path.dirname(__file__), 'instance', 'semantic_cache'))
+    SEMANTIC_CACHE_EMBEDDER = os.environ.get('SEMANTIC_CACHE_EMBEDDER', 'services.semantic_cache.HashingEmbedder')
+    SEMANTIC_CACHE_MODEL = os.environ.get('SEMANTIC_CACHE_MODEL', 'sentence-transformers/all-MiniLM-L6-v2')
+    # Vector size: 1024 for the hashing embedder when unset; a sentence model has its own and
+    # refuses to start if this is set to anything else
+    SEMANTIC_CACHE_DIM = int(os.environ['SEMANTIC_CACHE_DIM']) if os.environ.get('SEMANTIC_CACHE_DIM') else None
+    SEMANTIC_CACHE_SIZE = int(os.environ.get('SEMANTIC_CACHE_SIZE', 10000))
+    # Minimum cosine similarity for reusing an answer: 0.85 suits the hashing embedder, about
+    # 0.75 a sentence model. Candidates that differ in negation, population, drug or dose are
+    # rejected whatever their similarity
+    SEMANTIC_CACHE_THRESHOLD = float(os.environ.get('SEMANTIC_CACHE_THRESHOLD', 0.85))
+    
+    # Compress message bodies and cached responses longer than COMPRESSION_MIN_SIZE characters.
+    # Reads decode either form, so this can be switched off at any time.
+    COMPRESSION_ENABLED = os.environ.get('COMPRESSION_ENABLED', 'True') == 'True'
+    COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', 512))
+    COMPRESSION_LEVEL = int(os.environ.get('COMPRESSION_LEVEL', 6))
+    # Trained dictionaries (`flask compression train`); keep every one ever used
+    COMPRESSION_DICT_DIR = os.environ.get('COMPRESSION_DICT_DIR', os.path.join(os.path.dirname(__file__), 'instance', 'compression'))
+    
+    # Keyword corpus for answers given while the LLM is rate limited (default: data/fallback_responses.json)
+    FALLBACK_CORPUS_PATH = os.environ.get('FALLBACK_CORPUS_PATH')
+    
+    # Write-behind persistence: respond before the chat turn is written, a worker drains the queue
+    WRITE_BEHIND_ENABLED = os.environ.get('WRITE_BEHIND_ENABLED', 'False') == 'True'
+    WRITE_BEHIND_BACKEND = os.environ.get('WRITE_BEHIND_BACKEND', 'redis')  # 'redis' stream or local 'file' log
+    WRITE_BEHIND_STREAM = os.environ.get('WRITE_BEHIND_STREAM', 'chat:writes')
+    WRITE_BEHIND_LOG_PATH = os.environ.get('WRITE_BEHIND_LOG_PATH', os.path.join(os.path.dirname(__file__), 'instance', 'write_behind.log'))
+    WRITE_BEHIND_FSYNC = os.environ.get('WRITE_BEHIND_FSYNC', 'True') == 'True'
+    WRITE_BEHIND_BATCH_SIZE = int(os.environ.get('WRITE_BEHIND_BATCH_SIZE', 100))
+    WRITE_BEHIND_INTERVAL = float(os.environ.get('WRITE_BEHIND_INTERVAL', 0.5))
+    # How long a follow-up turn waits for its session's queued writes before draining them itself
+    WRITE_BEHIND_READ_TIMEOUT = float(os.environ.get('WRITE_BEHIND_READ_TIMEOUT', 5))
+    WRITE_BEHIND_CLAIM_IDLE = int(os.environ.get('WRITE_BEHIND_CLAIM_IDLE', 60))  # reclaim entries of crashed workers
+    # Run a worker thread in every web process; set to False when running `flask writes worker` instead
+    WRITE_BEHIND_WORKER = os.environ.get('WRITE_BEHIND_WORKER', 'True') == 'True'
+    
+    # Change version per user in Redis, replaced on every write to their sessions, messages or history.
+    # GETs of the session and history lists answer If-None-Match with 304 and serve bodies cached at
+    # the current version for PROJECTION_CACHE_TTL seconds (0 keeps the ETags, caches no bodies)
+    CHANGE_VERSION_ENABLED = os.environ.get('CHANGE_VERSION_ENABLED', 'True') == 'True'
+    CHANGE_VERSION_TTL = int(os.environ.get('CHANGE_VERSION_TTL', 7 * 86400))
+    PROJECTION_CACHE_TTL = int(os.environ.get('PROJECTION_CACHE_TTL', 300))
+    
+    # JSON serialization of responses: 'orjson' (used only when installed) or the stdlib 'default'
+    JSON_PROVIDER = os.environ.get('JSON_PROVIDER', 'orjson')
+    
+    # Response compression, negotiated from Accept-Encoding (brotli needs the Brotli package)
+    RESPONSE_COMPRESSION_ENABLED = os.environ.get('RESPONSE_COMPRESSION_ENABLED', 'True') == 'True'
+    RESPONSE_COMPRESSION_MIN_SIZE = int(os.environ.get('RESPONSE_COMPRESSION_MIN_SIZE', 1024))  # bytes
+    RESPONSE_COMPRESSION_GZIP_LEVEL = int(os.environ.get('RESPONSE_COMPRESSION_GZIP_LEVEL', 6))
+    RESPONSE_COMPRESSION_BROTLI_QUALITY = int(os.environ.get('RESPONSE_COMPRESSION_BROTLI_QUALITY', 4))
+    
     # CORS settings
     CORS_HEADERS = 'Content-Type'
     
-    # Logging
+    # Logging: records go through an in-memory queue to a listener thread that writes them to stdout
     LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+    LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')  # one JSON object per line, or 'text'
+    LOG_QUEUE = os.environ.get('LOG_QUEUE', 'True') == 'True'  # False writes from the logging thread
+    LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))  # records beyond this are dropped, not waited for
+    LOG_SQL = os.environ.get('LOG_SQL', 'False') == 'True'  # every SQL statement at INFO
+    # At most LOG_REPEAT_BURST similar warnings/errors per LOG_REPEAT_WINDOW seconds (0 disables)
+    LOG_REPEAT_WINDOW = float(os.environ.get('LOG_REPEAT_WINDOW', 60))
+    LOG_REPEAT_BURST = int(os.environ.get('LOG_REPEAT_BURST', 5))
+    
+    # Prometheus metrics on /metrics (requires prometheus_client). Under gunicorn
+    # also set PROMETHEUS_MULTIPROC_DIR to aggregate every worker, see gunicorn.conf.py
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'True') == 'True'
+    
+    # Service counters on /api/admin/stats (caches, upstream governor, rate limits,
+    # single-flight, write-behind, LLM pool) for callers sending ADMIN_TOKEN as
+    # X-Admin-Token. Off unless both are set.
+    ADMIN_STATS_ENABLED = os.environ.get('ADMIN_STATS_ENABLED', 'False') == 'True'
+    ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+    
+    # On-demand sampling profiler (/api/admin/profile, or X-Profile: 1 on any request),
+    # for callers sending PROFILING_TOKEN as X-Profiler-Token. Off unless both are set.
+    PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', 'False') == 'True'
+    PROFILING_TOKEN = os.environ.get('PROFILING_TOKEN')
+    PROFILING_DIR = os.environ.get('PROFILING_DIR', os.path.join(os.path.dirname(__file__), 'instance', 'profiles'))
+    PROFILING_INTERVAL = float(os.environ.get('PROFILING_INTERVAL', 0.005))  # seconds between samples
+    PROFILING_MAX_SECONDS = int(os.environ.get('PROFILING_MAX_SECONDS', 300))
 
 class DevelopmentConfig(Config):
     DEBUG = True
     ENV = 'development'
-    # More verbose SQL logs in development
-    SQLALCHEMY_ECHO = True
+    # More verbose, human-readable logs with SQL in development
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'DEBUG')
+    LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')
+    LOG_SQL = os.environ.get('LOG_SQL', 'True') == 'True'
 
 class ProductionConfig(Config):
     DEBUG = False
     ENV = 'production'
     # Use more secure settings in production
     SQLALCHEMY_ECHO = False
+    LOG_SQL = False
     
 class TestingConfig(Config):
     TESTING = True
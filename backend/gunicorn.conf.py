@@ -0,0 +1,24 @@
+"""
+gunicorn settings read automatically from the backend directory.
+
+With PROMETHEUS_MULTIPROC_DIR set (it must be set before the app is
+imported, so in the environment), every worker writes its metrics to
+that directory and GET /metrics on any worker reports all of them.
+
+    PROMETHEUS_MULTIPROC_DIR=/tmp/chatbot-metrics gunicorn -w 4 wsgi:app
+"""
+
+import os
+import shutil
+
+def on_starting(server):
+    # Samples left over from an earlier run would be added to this one's
+    multiproc_dir = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if multiproc_dir:
+        shutil.rmtree(multiproc_dir, ignore_errors=True)
+        os.makedirs(multiproc_dir, exist_ok=True)
+
+def child_exit(server, worker):
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,9 @@
+from sqlalchemy import Column, Text, DateTime
+
+from migrations import add_column
+
+description = "Add the rolling context summary columns to chat_session"
+
+def upgrade(connection):
+    add_column(connection, 'chat_session', Column('summary', Text))
+    add_column(connection, 'chat_session', Column('summary_until', DateTime))
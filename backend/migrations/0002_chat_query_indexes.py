@@ -0,0 +1,10 @@
+from migrations import create_index
+
+description = "Composite indexes for the chat message, session list and history queries"
+
+# On a large PostgreSQL table, create these by hand with CREATE INDEX CONCURRENTLY
+# before deploying to avoid blocking writes while the index builds.
+def upgrade(connection):
+    create_index(connection, 'ix_chat_message_session_created', 'chat_message', 'session_id', 'created_at')
+    create_index(connection, 'ix_chat_session_user_updated', 'chat_session', 'user_id', 'updated_at')
+    create_index(connection, 'ix_chat_history_user_created', 'chat_history', 'user_id', 'created_at')
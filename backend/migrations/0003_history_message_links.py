@@ -0,0 +1,76 @@
+"""
+History rows used to store a second copy of each turn's text. This links
+them to the ChatMessage pair holding the same text and empties their own
+copy. Rows that can't be matched to a pair (their session was deleted)
+keep their text.
+
+The freed space is reused by new rows; to shrink the file, run VACUUM
+(SQLite) or VACUUM FULL / pg_repack (PostgreSQL) afterwards.
+"""
+
+import hashlib
+from collections import defaultdict
+
+from sqlalchemy import Column, String, DateTime, table, column, select, update, bindparam
+
+from migrations import add_column, create_index
+
+description = "Link chat_history rows to their chat_message pair instead of copying the text"
+
+BATCH_SIZE = 1000
+
+history = table('chat_history', column('id'), column('user_id'), column('query'), column('response'),
+                column('user_message_id'), column('assistant_message_id'), column('created_at', DateTime))
+messages = table('chat_message', column('id'), column('session_id'), column('role'), column('content'),
+                 column('created_at', DateTime))
+sessions = table('chat_session', column('id'), column('user_id'))
+
+def upgrade(connection):
+    add_column(connection, 'chat_history', Column('user_message_id', String(36)))
+    add_column(connection, 'chat_history', Column('assistant_message_id', String(36)))
+    create_index(connection, 'ix_chat_history_user_message', 'chat_history', 'user_message_id')
+
+    user_ids = connection.execute(
+        select(history.c.user_id).where(history.c.user_message_id.is_(None)).distinct()
+    ).scalars().all()
+    for user_id in user_ids:
+        compact_user(connection, user_id)
+
+def digest(user_text, assistant_text):
+    return hashlib.sha256(f"{user_text}\0{assistant_text}".encode()).digest()
+
+def compact_user(connection, user_id):
+    # Every (user, assistant) message pair of the user's sessions, by the text they hold
+    pairs = defaultdict(list)
+    rows = connection.execute(
+        select(messages.c.id, messages.c.session_id, messages.c.role, messages.c.content, messages.c.created_at)
+        .select_from(messages.join(sessions, sessions.c.id == messages.c.session_id))
+        .where(sessions.c.user_id == user_id)
+        .order_by(messages.c.session_id, messages.c.created_at, messages.c.id)
+    ).all()
+    for previous, current in zip(rows, rows[1:]):
+        if (previous.session_id == current.session_id
+                and previous.role == 'user' and current.role == 'assistant'):
+            pairs[digest(previous.content, current.content)].append((previous.id, current.id, previous.created_at))
+
+    links = []
+    for entry in connection.execute(
+        select(history.c.id, history.c.query, history.c.response, history.c.created_at)
+        .where(history.c.user_id == user_id, history.c.user_message_id.is_(None))
+    ):
+        candidates = pairs.get(digest(entry.query, entry.response))
+        if not candidates:
+            continue
+        # Identical questions and answers are paired with the closest turn in time
+        best = min(candidates, key=lambda pair: abs((pair[2] - entry.created_at).total_seconds())
+                   if pair[2] and entry.created_at else 0)
+        candidates.remove(best)
+        links.append({'history_id': entry.id, 'user_message_id': best[0], 'assistant_message_id': best[1]})
+
+    statement = (update(history)
+                 .where(history.c.id == bindparam('history_id'))
+                 .values(user_message_id=bindparam('user_message_id'),
+                         assistant_message_id=bindparam('assistant_message_id'),
+                         query='', response=''))
+    for start in range(0, len(links), BATCH_SIZE):
+        connection.execute(statement, links[start:start + BATCH_SIZE])
@@ -0,0 +1,91 @@
+"""
+Schema migrations for existing databases.
+
+db.create_all() only creates missing tables; it never changes tables that
+already exist. Each module in this package named `NNNN_description.py`
+brings an existing database up to the current models and defines:
+
+    description = "What the migration does"
+
+    def upgrade(connection):
+        ...
+
+Migrations run in version order, each in its own transaction, and are
+recorded in the `schema_migrations` table. Fresh databases already get the
+current schema from create_all, so every migration must be idempotent.
+"""
+
+import os
+import re
+import importlib
+import pkgutil
+from datetime import datetime
+
+from sqlalchemy import Table, Column, String, DateTime, MetaData, select, inspect, text
+from sqlalchemy.exc import SQLAlchemyError
+
+MIGRATION_RE = re.compile(r'^(\d{4})_\w+$')
+
+metadata = MetaData()
+
+schema_migrations = Table(
+    'schema_migrations', metadata,
+    Column('version', String(64), primary_key=True),
+    Column('applied_at', DateTime, nullable=False)
+)
+
+def discover():
+    """
+    All migration modules as (version, module) pairs, in order.
+    """
+    migrations = []
+    for info in pkgutil.iter_modules([os.path.dirname(__file__)]):
+        match = MIGRATION_RE.match(info.name)
+        if match:
+            migrations.append((match.group(1), importlib.import_module(f"{__name__}.{info.name}")))
+    return sorted(migrations, key=lambda migration: migration[0])
+
+def applied_versions(engine):
+    metadata.create_all(engine, tables=[schema_migrations])
+    with engine.connect() as connection:
+        return set(connection.execute(select(schema_migrations.c.version)).scalars())
+
+def pending(engine):
+    applied = applied_versions(engine)
+    return [(version, module) for version, module in discover() if version not in applied]
+
+def upgrade(engine, logger=None):
+    """
+    Apply every pending migration. Returns the versions applied.
+
+    Safe to run from several workers at once: a migration that fails because
+    another process applied it first is skipped.
+    """
+    applied = []
+    for version, module in pending(engine):
+        try:
+            with engine.begin() as connection:
+                module.upgrade(connection)
+                connection.execute(schema_migrations.insert().values(version=version, applied_at=datetime.utcnow()))
+        except SQLAlchemyError:
+            if version in applied_versions(engine):
+                continue
+            raise
+        if logger:
+            logger.info(f"Applied migration {version}: {module.description}")
+        applied.append(version)
+    return applied
+
+def add_column(connection, table_name, column):
+    """
+    ALTER TABLE ... ADD COLUMN unless the column already exists.
+    """
+    existing = {c['name'] for c in inspect(connection).get_columns(table_name)}
+    if column.name in existing:
+        return
+    column_type = column.type.compile(dialect=connection.dialect)
+    connection.execute(text(f'ALTER TABLE {table_name} ADD COLUMN {column.name} {column_type}'))
+
+def create_index(connection, name, table_name, *columns):
+    # IF NOT EXISTS is supported by both SQLite and PostgreSQL
+    connection.execute(text(f'CREATE INDEX IF NOT EXISTS {name} ON {table_name} ({", ".join(columns)})'))
@@ -1,29 +1,51 @@
 from .db import db
+from .types import CompressedText
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import aliased
 from datetime import datetime
 import uuid
 
 class ChatHistory(db.Model):
+    __table_args__ = (
+        db.Index('ix_chat_history_user_created', 'user_id', 'created_at'),
+        db.Index('ix_chat_history_user_message', 'user_message_id'),
+    )
+    
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     user_id = db.Column(db.String(36), db.ForeignKey('user.id'), nullable=False)
-    query = db.Column(db.Text, nullable=False)
-    response = db.Column(db.Text, nullable=False)
+    # Empty when the turn's text lives in the ChatMessage pair referenced below;
+    # only rows whose session was deleted (or never linked) keep their own copy
+    query = db.Column(CompressedText, nullable=False, default='')
+    response = db.Column(CompressedText, nullable=False, default='')
+    user_message_id = db.Column(db.String(36), db.ForeignKey('chat_message.id'), nullable=True)
+    assistant_message_id = db.Column(db.String(36), db.ForeignKey('chat_message.id'), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    user_message = db.relationship('ChatMessage', foreign_keys=[user_message_id], lazy='joined')
+    assistant_message = db.relationship('ChatMessage', foreign_keys=[assistant_message_id], lazy='joined')
 
     def to_dict(self):
         return {
             'id': self.id,
             'user_id': self.user_id,
-            'query': self.query,
-            'response': self.response,
+            'query': self.user_message.content if self.user_message is not None else self.query,
+            'response': self.assistant_message.content if self.assistant_message is not None else self.response,
             'created_at': self.created_at.isoformat()
         }
 
 class ChatSession(db.Model):
+    __table_args__ = (
+        db.Index('ix_chat_session_user_updated', 'user_id', 'updated_at'),
+    )
+    
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     user_id = db.Column(db.String(36), db.ForeignKey('user.id'), nullable=False)
     title = db.Column(db.String(100), nullable=False, default="New Chat")
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Rolling summary of the turns that no longer fit the context window
+    summary = db.Column(db.Text, nullable=True)
+    summary_until = db.Column(db.DateTime, nullable=True)  # created_at of the last summarized message
     
     # One-to-many relationship with ChatHistory
     messages = db.relationship('ChatMessage', backref='session', lazy=True, cascade="all, delete-orphan")
@@ -38,10 +60,14 @@ class ChatSession(db.Model):
         }
 
 class ChatMessage(db.Model):
+    __table_args__ = (
+        db.Index('ix_chat_message_session_created', 'session_id', 'created_at'),
+    )
+    
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     session_id = db.Column(db.String(36), db.ForeignKey('chat_session.id'), nullable=False)
     role = db.Column(db.String(10), nullable=False)  # 'user' or 'assistant'
-    content = db.Column(db.Text, nullable=False)
+    content = db.Column(CompressedText, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     def to_dict(self):
@@ -51,4 +77,43 @@ class ChatMessage(db.Model):
             'role': self.role,
             'content': self.content,
             'created_at': self.created_at.isoformat()
-        }
\ No newline at end of file
+        }
+
+# The columns behind to_dict(), for list endpoints that return rows as dicts
+# instead of loading and converting ORM objects (dates are left to the JSON provider)
+SESSION_COLUMNS = (ChatSession.id, ChatSession.user_id, ChatSession.title, ChatSession.created_at,
+                   ChatSession.updated_at)
+MESSAGE_COLUMNS = (ChatMessage.id, ChatMessage.session_id, ChatMessage.role, ChatMessage.content,
+                   ChatMessage.created_at)
+
+def select_history_rows():
+    """
+    SELECT of the to_dict() fields of history rows, with the text of linked
+    entries taken from their message pair in the same query.
+    """
+    user_message, assistant_message = aliased(ChatMessage), aliased(ChatMessage)
+    return (select(ChatHistory.id, ChatHistory.user_id,
+                   func.coalesce(user_message.content, ChatHistory.query).label('query'),
+                   func.coalesce(assistant_message.content, ChatHistory.response).label('response'),
+                   ChatHistory.created_at)
+            .outerjoin(user_message, user_message.id == ChatHistory.user_message_id)
+            .outerjoin(assistant_message, assistant_message.id == ChatHistory.assistant_message_id))
+
+def detach_history(session_id):
+    """
+    UPDATE statement that copies the text of a session's messages back into
+    the history rows referencing them. Run it before deleting the messages,
+    so history outlives its session as it always has.
+    """
+    history = ChatHistory.__table__
+    messages = ChatMessage.__table__
+    
+    def content_of(column):
+        return select(messages.c.content).where(messages.c.id == column).scalar_subquery()
+    
+    return (update(history)
+            .where(history.c.user_message_id.in_(select(messages.c.id).where(messages.c.session_id == session_id)))
+            .values(query=content_of(history.c.user_message_id),
+                    response=content_of(history.c.assistant_message_id),
+                    user_message_id=None,
+                    assistant_message_id=None))
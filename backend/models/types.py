@@ -0,0 +1,22 @@
+from sqlalchemy.types import TypeDecorator, Text
+
+from services.compression import codec
+
+class CompressedText(TypeDecorator):
+    """
+    Text column whose long values are stored compressed (see
+    services.compression). Reads always return the original string, so
+    models and their to_dict() are unaffected, and the column stays a
+    plain TEXT column that can hold compressed and uncompressed rows side by side.
+
+    Values are opaque to SQL: don't filter or compare on these columns in queries.
+    """
+
+    impl = Text
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return codec.encode(value)
+
+    def process_result_value(self, value, dialect):
+        return codec.decode(value)
@@ -0,0 +1,116 @@
+import hmac
+from functools import wraps
+
+from flask import Blueprint, Response, request, jsonify, current_app
+
+from services.profiler import ProfilerBusy
+
+admin_bp = Blueprint('admin', __name__)
+
+def profiler_token_required(f):
+    """
+    Only for callers sending the configured PROFILING_TOKEN as
+    X-Profiler-Token; the profiling routes do not exist while profiling is disabled.
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        profiler = current_app.profiler
+        if not profiler.enabled:
+            return jsonify({'message': 'Not found!'}), 404
+        if not profiler.authorized(request.headers):
+            return jsonify({'message': 'Invalid profiler token!'}), 403
+        return f(*args, **kwargs)
+    
+    return decorated
+
+def admin_token_required(f):
+    """
+    Only for callers sending the configured ADMIN_TOKEN as X-Admin-Token;
+    the stats route does not exist unless ADMIN_STATS_ENABLED is set too.
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        token = current_app.config.get('ADMIN_TOKEN')
+        if not current_app.config.get('ADMIN_STATS_ENABLED') or not token:
+            return jsonify({'message': 'Not found!'}), 404
+        supplied = request.headers.get('X-Admin-Token', '')
+        if not supplied or not hmac.compare_digest(supplied, token):
+            return jsonify({'message': 'Invalid admin token!'}), 403
+        return f(*args, **kwargs)
+    
+    return decorated
+
+@admin_bp.route('/stats', methods=['GET'])
+@admin_token_required
+def service_stats():
+    """
+    Counters of the caches, the upstream governor, the rate limiter,
+    single-flight, the write-behind queue and the LLM connection pool in
+    the worker that answers. Kept off the unauthenticated /health.
+    """
+    return jsonify({
+        'cache': current_app.response_cache.stats(),
+        'llm': current_app.llm.describe(),
+        'llm_pool': current_app.llm.pool_stats(),
+        'upstream': current_app.governor.stats(),
+        'rate_limits': current_app.rate_limiter.stats(),
+        'singleflight': current_app.singleflight.stats(),
+        'write_behind': current_app.write_behind.stats() if current_app.write_behind else None,
+    }), 200
+
+@admin_bp.route('/profile', methods=['GET'])
+@profiler_token_required
+def profile_status():
+    """
+    Whether a worker-wide profile is running in the worker that answers.
+    """
+    return jsonify(current_app.profiler.status()), 200
+
+@admin_bp.route('/profile', methods=['POST'])
+@profiler_token_required
+def start_profile():
+    """
+    Sample every thread of the worker that answers for `seconds`, or for
+    its next `requests` requests. Download the result from
+    /api/admin/profile/<profile_id> once it is done.
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        seconds = float(data['seconds']) if data.get('seconds') else None
+        requests = int(data['requests']) if data.get('requests') else None
+    except (TypeError, ValueError):
+        return jsonify({'message': 'seconds and requests must be numbers!'}), 400
+    if (seconds is not None and seconds <= 0) or (requests is not None and requests <= 0):
+        return jsonify({'message': 'seconds and requests must be positive!'}), 400
+    
+    try:
+        status = current_app.profiler.start(seconds=seconds, requests=requests)
+    except ProfilerBusy as e:
+        return jsonify({'message': str(e), **current_app.profiler.status()}), 409
+    return jsonify(status), 202
+
+@admin_bp.route('/profile', methods=['DELETE'])
+@profiler_token_required
+def stop_profile():
+    """
+    Stop the worker-wide profile running in the worker that answers.
+    """
+    profile_id = current_app.profiler.stop()
+    if profile_id is None:
+        return jsonify({'message': 'No profile is running in this worker!'}), 404
+    return jsonify({'profile_id': profile_id}), 200
+
+@admin_bp.route('/profile/<profile_id>', methods=['GET'])
+@profiler_token_required
+def download_profile(profile_id):
+    """
+    A finished profile as collapsed stacks, ready for flamegraph.pl or speedscope.
+    """
+    path = current_app.profiler.path(profile_id)
+    if path is None:
+        return jsonify({'message': 'Profile not found!'}), 404
+    with open(path, encoding='utf-8') as f:
+        body = f.read()
+    return Response(body, mimetype='text/plain', headers={
+        'Content-Disposition': f'attachment; filename="{profile_id}.collapsed"'
+    })
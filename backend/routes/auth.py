@@ -1,12 +1,16 @@
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, Response, request, jsonify, current_app, after_this_request
 from models import User, db
 import jwt
 from datetime import datetime, timedelta
 import uuid
 from functools import wraps
+from services.versions import etag_matches
 
 auth_bp = Blueprint('auth', __name__)
 
+def load_user(user_id):
+    return User.query.filter_by(id=user_id).first()
+
 # JWT token required decorator
 def token_required(f):
     @wraps(f)
@@ -22,9 +26,13 @@ def token_required(f):
             return jsonify({'message': 'Token is missing!'}), 401
         
         try:
-            # Decode the token
-            data = jwt.decode(token, current_app.config['JWT_SECRET_KEY'], algorithms=["HS256"])
-            current_user = User.query.filter_by(id=data['user_id']).first()
+            with current_app.metrics.stage('auth'):
+                # Decode the token, reusing the claims if it was verified before
+                data = current_app.auth_cache.get_claims(token)
+                if data is None:
+                    data = jwt.decode(token, current_app.config['JWT_SECRET_KEY'], algorithms=["HS256"])
+                    current_app.auth_cache.set_claims(token, data)
+                current_user = current_app.auth_cache.get_principal(data['user_id'], load_user)
             
             if not current_user:
                 return jsonify({'message': 'User not found!'}), 401
@@ -38,6 +46,88 @@ def token_required(f):
     
     return decorated
 
+def rate_limited(endpoint):
+    """
+    Limit how often the current user and client IP may call the route, with
+    the limits configured for `endpoint` in RATE_LIMITS. Goes below
+    token_required, which passes in the current user.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated(current_user, *args, **kwargs):
+            limiter = current_app.rate_limiter
+            client_ip = limiter.client_ip(request.remote_addr, request.headers.get('X-Forwarded-For'))
+            result = limiter.check(endpoint, current_user.id, client_ip)
+            if result is None:
+                return f(current_user, *args, **kwargs)
+            
+            headers = result.headers()
+            if not result.allowed:
+                response = jsonify({'message': 'Too many requests!', 'retry_after': int(headers['Retry-After'])})
+                response.status_code = 429
+                response.headers.update(headers)
+                return response
+            
+            @after_this_request
+            def add_rate_limit_headers(response):
+                response.headers.update(headers)
+                return response
+            
+            return f(current_user, *args, **kwargs)
+        
+        return decorated
+    
+    return decorator
+
+def versioned(skip=None):
+    """
+    Serve a GET of the current user's sessions or history from their change
+    version (see services/versions.py): 304 when the client's If-None-Match
+    is current, else the body cached at this version, and only then the
+    route, whose body is cached for the next call. Requests for which
+    `skip(request.args)` is true always reach the route. Goes below
+    token_required.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated(current_user, *args, **kwargs):
+            versions = current_app.versions
+            version = None if skip is not None and skip(request.args) else versions.current(current_user.id)
+            if version is None:
+                return f(current_user, *args, **kwargs)
+            
+            metrics = current_app.metrics
+            resource = request.full_path
+            etag = versions.etag(current_user.id, version, resource)
+            if_none_match = request.headers.get('If-None-Match')
+            if if_none_match:
+                matched = etag_matches(if_none_match, etag)
+                metrics.cache_lookup('etag', matched)
+                if matched:
+                    return versioned_headers(Response(status=304), etag)
+            
+            body = versions.get_projection(current_user.id, version, resource)
+            metrics.cache_lookup('projection', body is not None)
+            if body is not None:
+                return versioned_headers(Response(body, mimetype='application/json'), etag)
+            
+            response = current_app.make_response(f(current_user, *args, **kwargs))
+            if response.status_code != 200:
+                return response
+            versions.set_projection(current_user.id, version, resource, response.get_data(as_text=True))
+            return versioned_headers(response, etag)
+        
+        return decorated
+    
+    return decorator
+
+def versioned_headers(response, etag):
+    response.headers['ETag'] = etag
+    # Browsers may keep the body but must revalidate it, and never share it
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Authorization')
+    return response
+
 @auth_bp.route('/register', methods=['POST'])
 def register():
     data = request.get_json()
@@ -1,79 +1,29 @@
+import os
+import re
+import hmac
 import openai
 import json
-import hashlib
 import traceback
-import random
-import re
-from flask import Blueprint, request, jsonify, current_app
-from models.chat import ChatSession, ChatMessage, ChatHistory
-from models.db import db
-from routes.auth import token_required
-
-# Fallback responses for when OpenAI API is unavailable
-def generate_fallback_response(user_message):
-    """
-    Generate a simple fallback response when the OpenAI API is unavailable
-    due to rate limiting or other issues.
-    """
-    # Common health-related questions patterns
-    patterns = {
-        r"(?i)headache|migraine": [
-            "Headaches can have many causes including stress, dehydration, or lack of sleep. If severe or persistent, please consult a healthcare provider.",
-            "For occasional headaches, rest, hydration, and over-the-counter pain relievers may help. Consult a doctor for severe or recurring headaches."
-        ],
-        r"(?i)fever|temperature": [
-            "Fever is often a sign that your body is fighting an infection. Rest, fluids, and fever-reducing medications may help. Consult a doctor for high or persistent fevers.",
-            "A fever above 103°F (39.4°C) in adults or any fever in infants may require medical attention. Please consult a healthcare provider."
-        ],
-        r"(?i)cold|flu|cough": [
-            "Rest, fluids, and over-the-counter medications may help with cold symptoms. If symptoms are severe or last more than 10 days, consult a healthcare provider.",
-            "Flu symptoms can include fever, body aches, fatigue, and respiratory symptoms. Rest and fluids are important. Antiviral medications may be prescribed if diagnosed early."
-        ],
-        r"(?i)diet|nutrition|eat": [
-            "A balanced diet rich in fruits, vegetables, whole grains, lean proteins, and healthy fats is generally recommended for good health.",
-            "Nutritional needs vary by individual. Consider consulting a registered dietitian for personalized advice."
-        ],
-        r"(?i)exercise|workout|fitness": [
-            "Regular physical activity is important for health. Aim for at least 150 minutes of moderate activity per week, along with strength training.",
-            "Start slowly with any new exercise routine and listen to your body. Consult a healthcare provider before beginning if you have health concerns."
-        ],
-        r"(?i)sleep|insomnia|tired": [
-            "Most adults need 7-9 hours of sleep per night. Consistent sleep schedules and good sleep hygiene can help improve sleep quality.",
-            "Persistent sleep problems may benefit from professional evaluation. Consider discussing with a healthcare provider."
-        ],
-        r"(?i)stress|anxiety|depression": [
-            "Stress management techniques include regular exercise, mindfulness, deep breathing, and maintaining social connections.",
-            "Mental health is as important as physical health. If you're struggling, please consider reaching out to a mental health professional."
-        ]
-    }
-    
-    # Check if the user message matches any patterns
-    for pattern, responses in patterns.items():
-        if re.search(pattern, user_message):
-            return random.choice(responses)
-    
-    # Default responses if no pattern matches
-    default_responses = [
-        "I'm currently experiencing connectivity issues with my knowledge base. For medical concerns, please consult a healthcare provider.",
-        "I apologize, but I'm unable to provide a detailed response at the moment. For health-related questions, it's best to consult with a qualified healthcare professional.",
-        "I'm sorry, but I can't access my full capabilities right now. For any health concerns, please speak with your doctor or healthcare provider.",
-        "Due to technical limitations, I can only provide basic information at the moment. For medical advice, please consult a healthcare professional.",
-        "I'm experiencing some limitations right now. Remember that for any health concerns, it's important to consult with a qualified healthcare provider."
-    ]
-    
-    return random.choice(default_responses)
+from functools import wraps
+from flask import Blueprint, Response, request, jsonify, current_app, stream_with_context
+from models.chat import ChatSession, ChatMessage, SESSION_COLUMNS, MESSAGE_COLUMNS, detach_history
 from models.db import db
-from routes.auth import token_required
+from routes.auth import token_required, rate_limited, versioned
+from services.semantic_cache import SemanticCache
+from services.persistence import new_session, is_new_session, build_turn, save_turn
+from services.pagination import InvalidCursor, keyset_query, keyset_result, page_params, wants_page, count_query
+from services.governor import UpstreamUnavailable
+from services.batch import BatchRunner, prune_checkpoints
+from sqlalchemy import select
 
 chat_bp = Blueprint('chat', __name__)
 
-# Set up the OpenAI client
-def get_openai_client():
-    api_key = current_app.config.get('OPENAI_API_KEY')
-    if not api_key:
+# Get the shared client of the configured LLM provider
+def get_llm_client():
+    if not current_app.llm.configured:
         current_app.logger.error("OpenAI API key is not configured")
         raise ValueError("OpenAI API key is not configured")
-    return openai.OpenAI(api_key=api_key)
+    return current_app.llm.client
 
 # Medical chatbot system prompt
 SYSTEM_PROMPT = """
@@ -96,9 +46,301 @@ Important limitations:
 For any serious or emergency symptoms, ALWAYS advise seeking immediate medical attention.
 """
 
+# Sampling parameters shared by every completion request
+COMPLETION_PARAMS = {
+    'temperature': 0.7,
+    'max_tokens': 800,
+    'top_p': 1.0,
+    'frequency_penalty': 0.0,
+    'presence_penalty': 0.0,
+}
+
+SUMMARY_PREFIX = "Summary of the earlier conversation:"
+FALLBACK_NOTE = "\n\n*Note: This is a fallback response due to AI service limitations.*"
+EMPTY_RESPONSE = "I'm sorry, I couldn't generate a response. Please try again."
+
+def resolve_session(current_user, session_id):
+    """
+    Return the chat session for this turn, starting a new one when no
+    session_id is given. Returns None if the session does not belong to the user.
+    A new session is saved together with its first turn.
+    """
+    if not session_id:
+        return new_session(current_user.id)
+    if current_app.write_behind is not None:
+        # Make sure the session's earlier turns have been written
+        current_app.write_behind.wait_for_session(session_id)
+    return ChatSession.query.filter_by(id=session_id, user_id=current_user.id).first()
+
+def build_chat_messages(previous_messages, user_message, summary=None):
+    """
+    Format the system prompt, the summary of older turns, the recent session
+    context and the new user message for the OpenAI API.
+    """
+    messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+    
+    if summary:
+        messages.append({"role": "system", "content": f"{SUMMARY_PREFIX}\n{summary}"})
+    
+    for msg in previous_messages:
+        messages.append({"role": msg.role, "content": msg.content})
+    
+    messages.append({"role": "user", "content": user_message})
+    return messages
+
+def load_context(session, user_message):
+    """
+    Load the recent messages that fit the prompt token budget, oldest first.
+    Turns that fell out of the window are folded into the session summary,
+    which is saved with the rest of the turn.
+    """
+    if is_new_session(session):
+        return []
+    
+    builder = current_app.context_builder
+    tail = db.session.execute(builder.tail_query(session.id)).scalars().all()
+    previous_messages, dropped = builder.fit(tail, SYSTEM_PROMPT, session.summary, user_message)
+    
+    if builder.needs_fold(session, tail, dropped):
+        window_start = previous_messages[0] if previous_messages else None
+        builder.fold(session, db.session.execute(builder.fold_query(session, window_start)).scalars().all())
+    return previous_messages
+
+def build_completion_payload(messages):
+    """
+    The exact request sent to OpenAI. The response cache keys on this payload,
+    so anything that changes the answer must be part of it.
+    """
+    return {
+        'model': current_app.llm.model,
+        'messages': messages,
+        **COMPLETION_PARAMS
+    }
+
+def get_cached_response(payload, user_message, previous_messages):
+    """
+    Look for a reusable answer: first an exact payload match, then, for the
+    first turn of a session, a near-duplicate question in the semantic cache.
+    """
+    assistant_response = current_app.response_cache.get(payload)
+    if current_app.response_cache.enabled:
+        current_app.metrics.cache_lookup('response', bool(assistant_response))
+    if assistant_response:
+        current_app.logger.debug("Cache hit for chat response")
+        return assistant_response
+    
+    if current_app.semantic_cache is not None and not previous_messages:
+        try:
+            scope = SemanticCache.scope_for(payload['model'], SYSTEM_PROMPT)
+            assistant_response = current_app.semantic_cache.lookup(user_message, scope)
+            current_app.metrics.cache_lookup('semantic', bool(assistant_response))
+            return assistant_response
+        except Exception as e:
+            current_app.logger.warning(f"Semantic cache error: {str(e)}")
+    return None
+
+def cache_response(payload, user_message, previous_messages, assistant_response):
+    current_app.response_cache.set(payload, assistant_response)
+    
+    if current_app.semantic_cache is not None and not previous_messages:
+        try:
+            scope = SemanticCache.scope_for(payload['model'], SYSTEM_PROMPT)
+            current_app.semantic_cache.add(user_message, assistant_response, scope)
+        except Exception as e:
+            current_app.logger.warning(f"Semantic cache error: {str(e)}")
+
+def estimate_tokens(payload):
+    """
+    Tokens a completion for this payload may use: the prompt plus the whole
+    completion budget. Reserved from the upstream governor's token bucket.
+    """
+    builder = current_app.context_builder
+    return sum(builder.count_message(message['content']) for message in payload['messages']) + payload.get('max_tokens', 0)
+
+def request_completion(client, payload, user_message, previous_messages):
+    """
+    Call OpenAI for this payload, extract the answer and cache it.
+    """
+    current_app.logger.debug(f"Calling OpenAI API with model: {payload['model']}")
+    governor = current_app.governor
+    with governor.slot(estimate_tokens(payload)) as slot:
+        with current_app.metrics.upstream_call(payload['model']) as call:
+            raw = client.chat.completions.with_raw_response.create(**payload)
+            response = raw.parse()
+            call.usage = getattr(response, 'usage', None)
+        governor.observe(raw.headers)
+        slot.used(getattr(call.usage, 'total_tokens', None))
+    
+    # Extract the response content with error handling
+    try:
+        assistant_response = normalize_response(response.choices[0].message.content)
+    except (AttributeError, IndexError) as e:
+        current_app.logger.error(f"Error extracting response: {str(e)}")
+        assistant_response = EMPTY_RESPONSE
+    
+    cache_response(payload, user_message, previous_messages, assistant_response)
+    return assistant_response
+
+def normalize_response(content):
+    """
+    The answer as it is cached and saved, whether it arrived whole or as
+    streamed deltas.
+    """
+    content = (content or '').strip()
+    if not content:
+        current_app.logger.warning("Empty response received from OpenAI")
+        return EMPTY_RESPONSE
+    return content
+
+def request_completion_once(client, payload, user_message, previous_messages):
+    """
+    request_completion, coalesced with identical in-flight requests so a burst
+    of the same uncached question makes a single upstream call.
+    """
+    return current_app.singleflight.do(
+        current_app.response_cache.make_key(payload),
+        lambda: request_completion(client, payload, user_message, previous_messages),
+        lookup=lambda: current_app.response_cache.get(payload)
+    )
+
+def build_fallback_response(user_message, rate_error):
+    """
+    Build the fallback answer used when OpenAI rate limits us, or when the
+    upstream governor holds the call back to avoid being rate limited.
+    Returns the response text, the error type reported to the frontend and
+    the fallback topics the message matched.
+    """
+    error_message = str(rate_error)
+    if isinstance(rate_error, UpstreamUnavailable):
+        current_app.logger.warning(f"Upstream call not made ({rate_error.reason}): {error_message}")
+    else:
+        current_app.logger.warning(f"OpenAI rate limit error: {error_message}")
+    
+    fallback_response, topics = current_app.fallback.match(user_message)
+    assistant_response = fallback_response + FALLBACK_NOTE
+    current_app.logger.info(f"Fallback topics: {', '.join(topics) or 'none'}")
+    
+    # Determine error type for the frontend
+    error_type = "quota_exceeded" if "insufficient_quota" in error_message else "rate_limited"
+    current_app.metrics.fallback(rate_error.reason if isinstance(rate_error, UpstreamUnavailable) else error_type)
+    
+    if error_type == "quota_exceeded":
+        current_app.logger.warning("OpenAI API quota exceeded, using fallback response")
+    else:
+        current_app.logger.warning("OpenAI API rate limited, using fallback response")
+    
+    return assistant_response, error_type, topics
+
+def save_chat_turn(session, user_id, user_message, assistant_response, previous_messages):
+    """
+    Persist the user message, the assistant response and the history entry
+    for one chat turn in a single transaction, or queue them for the
+    write-behind worker when it is enabled.
+    """
+    # Update the session title if it's the first message
+    set_title = len(previous_messages) < 2
+    
+    write_behind = current_app.write_behind
+    if write_behind is not None:
+        turn = build_turn(session, user_id, user_message, assistant_response, set_title)
+        if write_behind.enqueue(turn):
+            # The queued turn carries the session changes; drop them from this request
+            db.session.rollback()
+            return
+    
+    save_turn(db.session, session, user_id, user_message, assistant_response, set_title)
+    current_app.versions.bump(user_id)
+
+def sse_event(event, data):
+    """
+    Format a single Server-Sent Events frame with a JSON payload.
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def chat_turn(current_user, user_message, session_id=None):
+    """
+    Answer one message and persist the turn: the whole of send_message
+    after request parsing, shared with the batch runner. Returns the
+    response body and HTTP status.
+    """
+    metrics = current_app.metrics
+    
+    # Check if it's a new session or existing one
+    with metrics.stage('session'):
+        session = resolve_session(current_user, session_id)
+    if not session:
+        return {'message': 'Invalid session ID!'}, 404
+    session_id = session.id
+    
+    # Get previous messages in this session for context
+    with metrics.stage('context'):
+        previous_messages = load_context(session, user_message)
+    messages = build_chat_messages(previous_messages, user_message, session.summary)
+    payload = build_completion_payload(messages)
+    
+    # Try to get from cache first
+    with metrics.stage('cache'):
+        assistant_response = get_cached_response(payload, user_message, previous_messages)
+    
+    if not assistant_response:
+        try:
+            # Verify OpenAI API key is configured
+            if not current_app.llm.configured:
+                return {'message': 'OpenAI API key is not configured!', 'error': 'Missing API key'}, 500
+            
+            # Call OpenAI API
+            client = get_llm_client()
+            try:
+                with metrics.stage('upstream'):
+                    assistant_response = request_completion_once(client, payload, user_message, previous_messages)
+            
+            except openai.AuthenticationError as auth_error:
+                return {'message': 'Invalid OpenAI API key!', 'error': str(auth_error)}, 401
+            except (openai.RateLimitError, UpstreamUnavailable) as rate_error:
+                # Generate a fallback response so it gets saved to the database
+                assistant_response, error_type, fallback_topics = build_fallback_response(user_message, rate_error)
+                with metrics.stage('persist'):
+                    save_chat_turn(session, current_user.id, user_message, assistant_response, previous_messages)
+                
+                # Return the response with a flag indicating it's a fallback
+                return {
+                    'message': 'Message sent successfully with fallback response!',
+                    'response': assistant_response,
+                    'session_id': session_id,
+                    'is_fallback': True,
+                    'error_type': error_type,
+                    'fallback_topics': fallback_topics
+                }, 200
+            except openai.APIError as api_error:
+                return {'message': 'OpenAI API error!', 'error': str(api_error)}, 500
+            except Exception as e:
+                # Catch any other OpenAI-related errors
+                current_app.logger.error(f"OpenAI error: {str(e)}\n{traceback.format_exc()}")
+                return {'message': 'Error with OpenAI service!', 'error': str(e)}, 500
+        
+        except Exception as e:
+            current_app.logger.error(f"Error getting response from OpenAI: {str(e)}\n{traceback.format_exc()}")
+            return {'message': 'Error getting response from OpenAI!', 'error': str(e)}, 500
+    
+    if not assistant_response:
+        return {'message': 'Failed to get a response!'}, 500
+    
+    with metrics.stage('persist'):
+        save_chat_turn(session, current_user.id, user_message, assistant_response, previous_messages)
+    
+    return {
+        'message': 'Message sent successfully!',
+        'response': assistant_response,
+        'session_id': session_id
+    }, 200
+
 @chat_bp.route('/send', methods=['POST'])
 @token_required
+@rate_limited('chat.send')
 def send_message(current_user):
+    if request.args.get('stream') in ('1', 'true'):
+        return stream_message(current_user)
+    
     try:
         data = request.get_json()
         
@@ -106,216 +348,9 @@ def send_message(current_user):
             return jsonify({'message': 'No message provided!'}), 400
         
         user_message = data.get('message')
-        session_id = data.get('session_id')
         
-        # Check if it's a new session or existing one
-        if not session_id:
-            # Create a new chat session
-            session = ChatSession(user_id=current_user.id)
-            db.session.add(session)
-            db.session.commit()
-            session_id = session.id
-        else:
-            # Verify the session belongs to the user
-            session = ChatSession.query.filter_by(id=session_id, user_id=current_user.id).first()
-            if not session:
-                return jsonify({'message': 'Invalid session ID!'}), 404
-        
-        # Initialize variables
-        cached_response = None
-        assistant_response = None
-        previous_messages = []
-        
-        # Try to get from cache first
-        try:
-            cache_key = f"chat:{hashlib.md5(user_message.encode()).hexdigest()}"
-            
-            if hasattr(current_app, 'redis') and current_app.redis:
-                cached_response = current_app.redis.get(cache_key)
-                
-                if cached_response:
-                    # Use cached response if available
-                    assistant_response = json.loads(cached_response)
-                    current_app.logger.info(f"Cache hit for message: {user_message[:20]}...")
-        except Exception as cache_error:
-            # Log the error but continue processing
-            current_app.logger.warning(f"Cache error: {str(cache_error)}")
-            cached_response = None
-            
-        if not assistant_response:
-            # Get previous messages in this session for context
-            previous_messages = ChatMessage.query.filter_by(session_id=session_id).order_by(ChatMessage.created_at).all()
-            
-            # Format messages for OpenAI API
-            messages = [{"role": "system", "content": SYSTEM_PROMPT}]
-            
-            # Add previous context (limit to last 10 messages to keep context manageable)
-            for msg in previous_messages[-10:]:
-                messages.append({"role": msg.role, "content": msg.content})
-            
-            # Add the new user message
-            messages.append({"role": "user", "content": user_message})
-            
-            try:
-                # Verify OpenAI API key is configured
-                api_key = current_app.config.get('OPENAI_API_KEY')
-                if not api_key:
-                    return jsonify({'message': 'OpenAI API key is not configured!', 'error': 'Missing API key'}), 500
-
-                # Call OpenAI API
-                client = get_openai_client()
-                try:
-                    current_app.logger.debug(f"Calling OpenAI API with model: {current_app.config.get('OPENAI_MODEL', 'gpt-3.5-turbo')}")
-                    response = client.chat.completions.create(
-                        model=current_app.config.get('OPENAI_MODEL', 'gpt-3.5-turbo'),
-                        messages=messages,
-                        temperature=0.7,
-                        max_tokens=800,
-                        top_p=1.0,
-                        frequency_penalty=0.0,
-                        presence_penalty=0.0,
-                    )
-                    
-                    # Extract the response content with error handling
-                    try:
-                        assistant_response = response.choices[0].message.content
-                        if not assistant_response:
-                            assistant_response = "I'm sorry, I couldn't generate a response. Please try again."
-                            current_app.logger.warning("Empty response received from OpenAI")
-                    except (AttributeError, IndexError) as e:
-                        current_app.logger.error(f"Error extracting response: {str(e)}")
-                        assistant_response = "I'm sorry, I couldn't generate a response. Please try again."
-                    
-                    # Cache the response
-                    try:
-                        if hasattr(current_app, 'redis') and current_app.redis:
-                            current_app.redis.setex(
-                                cache_key,
-                                3600,  # Cache for 1 hour
-                                json.dumps(assistant_response)
-                            )
-                    except Exception as redis_error:
-                        # Log Redis error but continue processing
-                        current_app.logger.warning(f"Redis caching error: {str(redis_error)}")
-                        
-                except openai.AuthenticationError as auth_error:
-                    return jsonify({'message': 'Invalid OpenAI API key!', 'error': str(auth_error)}), 401
-                except openai.RateLimitError as rate_error:
-                    error_message = str(rate_error)
-                    current_app.logger.warning(f"OpenAI rate limit error: {error_message}")
-                    
-                    # Generate a fallback response
-                    fallback_response = generate_fallback_response(user_message)
-                    current_app.logger.info(f"Using fallback response mechanism due to rate limiting")
-                    
-                    # Set assistant_response to the fallback response so it gets saved to the database
-                    assistant_response = fallback_response
-                    
-                    # Add a note to the response that this is a fallback
-                    assistant_response += "\n\n*Note: This is a fallback response due to AI service limitations.*"
-                    
-                    # Determine error type for the frontend
-                    error_type = "quota_exceeded" if "insufficient_quota" in error_message else "rate_limited"
-                    
-                    # Log appropriate message
-                    if error_type == "quota_exceeded":
-                        current_app.logger.warning("OpenAI API quota exceeded, using fallback response")
-                    else:
-                        current_app.logger.warning("OpenAI API rate limited, using fallback response")
-                    
-                    # Save the user message
-                    user_msg = ChatMessage(
-                        session_id=session_id,
-                        role="user",
-                        content=user_message
-                    )
-                    db.session.add(user_msg)
-                    
-                    # Save the assistant response
-                    assistant_msg = ChatMessage(
-                        session_id=session_id,
-                        role="assistant",
-                        content=assistant_response
-                    )
-                    db.session.add(assistant_msg)
-                    
-                    # Update the session title if it's the first message
-                    if len(previous_messages) < 2:  # Just the first user message
-                        # Use the first ~30 chars of user message as title
-                        title = user_message[:30] + '...' if len(user_message) > 30 else user_message
-                        session.title = title
-                    
-                    db.session.commit()
-                    
-                    # Also save to the general chat history
-                    chat_history = ChatHistory(
-                        user_id=current_user.id,
-                        query=user_message,
-                        response=assistant_response
-                    )
-                    db.session.add(chat_history)
-                    db.session.commit()
-                    
-                    # Return the response with a flag indicating it's a fallback
-                    return jsonify({
-                        'message': 'Message sent successfully with fallback response!',
-                        'response': assistant_response,
-                        'session_id': session_id,
-                        'is_fallback': True,
-                        'error_type': error_type
-                    }), 200
-                except openai.APIError as api_error:
-                    return jsonify({'message': 'OpenAI API error!', 'error': str(api_error)}), 500
-                except Exception as e:
-                    # Catch any other OpenAI-related errors
-                    current_app.logger.error(f"OpenAI error: {str(e)}\n{traceback.format_exc()}")
-                    return jsonify({'message': 'Error with OpenAI service!', 'error': str(e)}), 500
-                    
-            except Exception as e:
-                current_app.logger.error(f"Error getting response from OpenAI: {str(e)}\n{traceback.format_exc()}")
-                return jsonify({'message': 'Error getting response from OpenAI!', 'error': str(e)}), 500
-        
-        if not assistant_response:
-            return jsonify({'message': 'Failed to get a response!'}), 500
-        
-        # Save the user message
-        user_msg = ChatMessage(
-            session_id=session_id,
-            role="user",
-            content=user_message
-        )
-        db.session.add(user_msg)
-        
-        # Save the assistant response
-        assistant_msg = ChatMessage(
-            session_id=session_id,
-            role="assistant",
-            content=assistant_response
-        )
-        db.session.add(assistant_msg)
-        
-        # Update the session title if it's the first message
-        if len(previous_messages) < 2:  # Just the first user message
-            # Use the first ~30 chars of user message as title
-            title = user_message[:30] + '...' if len(user_message) > 30 else user_message
-            session.title = title
-        
-        db.session.commit()
-        
-        # Also save to the general chat history
-        chat_history = ChatHistory(
-            user_id=current_user.id,
-            query=user_message,
-            response=assistant_response
-        )
-        db.session.add(chat_history)
-        db.session.commit()
-        
-        return jsonify({
-            'message': 'Message sent successfully!',
-            'response': assistant_response,
-            'session_id': session_id
-        }), 200
+        body, status = chat_turn(current_user, user_message, data.get('session_id'))
+        return jsonify(body), status
     
     except Exception as e:
         # Log the full exception with traceback
@@ -329,39 +364,309 @@ def send_message(current_user):
             'error': str(e)
         }), 500
 
+@chat_bp.route('/send/stream', methods=['POST'])
+@token_required
+@rate_limited('chat.send')
+def send_message_stream(current_user):
+    return stream_message(current_user)
+
+def stream_message(current_user):
+    """
+    Streaming variant of send_message. Completion deltas are relayed to the
+    client as Server-Sent Events while they arrive; the turn is persisted and
+    cached once the upstream stream closes. Identical requests in flight are
+    coalesced like send_message's: only the leader streams from OpenAI, the
+    others get its answer as a single delta.
+    
+    Events: `session` (session_id), `delta` (content), `done` (full response,
+    is_fallback, error_type) and `error` (message).
+    """
+    data = request.get_json(silent=True)
+    
+    if not data or not data.get('message'):
+        return jsonify({'message': 'No message provided!'}), 400
+    
+    if not current_app.llm.configured:
+        return jsonify({'message': 'OpenAI API key is not configured!', 'error': 'Missing API key'}), 500
+    
+    user_message = data.get('message')
+    
+    try:
+        session = resolve_session(current_user, data.get('session_id'))
+    except Exception as e:
+        current_app.logger.error(f"Unexpected error in stream_message: {str(e)}\n{traceback.format_exc()}")
+        db.session.rollback()
+        return jsonify({'message': 'An unexpected error occurred!', 'error': str(e)}), 500
+    if not session:
+        return jsonify({'message': 'Invalid session ID!'}), 404
+    
+    # The request's ORM session is torn down before the body streams, so only
+    # plain ids (and a not yet saved new session) are carried into the generator
+    session_id = session.id
+    unsaved_session = session if is_new_session(session) else None
+    user_id = current_user.id
+    
+    def generate():
+        yield sse_event('session', {'session_id': session_id})
+        session = unsaved_session or db.session.get(ChatSession, session_id)
+        metrics = current_app.metrics
+        
+        def persist(assistant_response):
+            # The stream has already started with a 200, so a failed save becomes an error event
+            try:
+                with metrics.stage('persist'):
+                    save_chat_turn(session, user_id, user_message, assistant_response, previous_messages)
+            except Exception as e:
+                current_app.logger.error(f"Error saving streamed response: {str(e)}\n{traceback.format_exc()}")
+                db.session.rollback()
+                return sse_event('error', {'message': 'Failed to save the response!', 'error': str(e)})
+            return None
+        
+        with metrics.stage('context'):
+            previous_messages = load_context(session, user_message)
+        payload = build_completion_payload(build_chat_messages(previous_messages, user_message, session.summary))
+        
+        with metrics.stage('cache'):
+            cached = get_cached_response(payload, user_message, previous_messages)
+        if cached:
+            error = persist(cached)
+            if error:
+                yield error
+                return
+            yield sse_event('delta', {'content': cached})
+            yield sse_event('done', {'response': cached, 'session_id': session_id, 'is_fallback': False})
+            return
+        
+        chunks = []
+        upstream = None
+        try:
+            client = get_llm_client()
+            with current_app.singleflight.lead(
+                current_app.response_cache.make_key(payload),
+                lookup=lambda: current_app.response_cache.get(payload)
+            ) as flight:
+                if flight.leader:
+                    governor = current_app.governor
+                    with governor.slot(estimate_tokens(payload)) as slot, metrics.upstream_call(payload['model']) as call:
+                        raw = client.chat.completions.with_raw_response.create(
+                            stream=True, stream_options={'include_usage': True}, **payload
+                        )
+                        governor.observe(raw.headers)
+                        upstream = raw.parse()
+                        for chunk in upstream:
+                            # The usage of the whole completion comes in a last chunk without choices
+                            if getattr(chunk, 'usage', None):
+                                call.usage = chunk.usage
+                            delta = chunk.choices[0].delta.content if chunk.choices else None
+                            if delta:
+                                chunks.append(delta)
+                                yield sse_event('delta', {'content': delta})
+                        slot.used(getattr(call.usage, 'total_tokens', None))
+                    flight.result = normalize_response(''.join(chunks))
+                    if flight.result != EMPTY_RESPONSE:
+                        cache_response(payload, user_message, previous_messages, flight.result)
+            assistant_response = flight.result
+            if not flight.leader:
+                yield sse_event('delta', {'content': assistant_response})
+        except GeneratorExit:
+            # The client went away; stop paying for tokens nobody will read
+            current_app.logger.info(f"Client disconnected mid-stream for session {session_id}")
+            if upstream is not None:
+                upstream.close()
+            if chunks:
+                # Keep what the user already saw, but never cache a partial answer
+                try:
+                    save_chat_turn(session, user_id, user_message, normalize_response(''.join(chunks)), previous_messages)
+                except Exception as e:
+                    current_app.logger.error(f"Error saving partial streamed response: {str(e)}")
+                    db.session.rollback()
+            raise
+        except (openai.RateLimitError, UpstreamUnavailable) as rate_error:
+            assistant_response, error_type, fallback_topics = build_fallback_response(user_message, rate_error)
+            error = persist(assistant_response)
+            if error:
+                yield error
+                return
+            yield sse_event('delta', {'content': assistant_response})
+            yield sse_event('done', {
+                'response': assistant_response,
+                'session_id': session_id,
+                'is_fallback': True,
+                'error_type': error_type,
+                'fallback_topics': fallback_topics
+            })
+            return
+        except Exception as e:
+            current_app.logger.error(f"OpenAI streaming error: {str(e)}\n{traceback.format_exc()}")
+            yield sse_event('error', {'message': 'Error with OpenAI service!', 'error': str(e)})
+            return
+        
+        error = persist(assistant_response)
+        if error:
+            yield error
+            return
+        yield sse_event('done', {'response': assistant_response, 'session_id': session_id, 'is_fallback': False})
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # Stop nginx from buffering the stream
+    })
+
+BATCH_ID_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+def batch_token_required(f):
+    """
+    Only for callers sending the configured BATCH_API_TOKEN as X-Batch-Token:
+    a batch runs up to BATCH_MAX_ITEMS prompts through the paid upstream on
+    one request, past the per-user chat.send limit. The endpoint does not
+    exist while no token is configured.
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        token = current_app.config.get('BATCH_API_TOKEN')
+        if not token:
+            return jsonify({'message': 'Not found!'}), 404
+        supplied = request.headers.get('X-Batch-Token', '')
+        if not supplied or not hmac.compare_digest(supplied, token):
+            return jsonify({'message': 'Invalid batch token!'}), 403
+        return f(*args, **kwargs)
+    
+    return decorated
+
+@chat_bp.route('/batch', methods=['POST'])
+@batch_token_required
+@token_required
+@rate_limited('chat.batch')
+def send_batch(current_user):
+    """
+    Answer a JSONL body of prompts ({"message", "id"?, "session_id"?} per
+    line) and stream one JSONL result per prompt as it finishes, followed
+    by a {"summary": ...} line.
+    
+    Query parameters: `concurrency` (prompts in flight) and `batch_id`.
+    With a batch_id, answered prompts are checkpointed on the server and
+    sending the same batch again resumes it instead of starting over, for
+    BATCH_CHECKPOINT_TTL seconds or until every prompt has been answered.
+    """
+    lines = request.get_data(as_text=True).splitlines()
+    prompt_count = sum(1 for line in lines if line.strip())
+    if not prompt_count:
+        return jsonify({'message': 'No prompts provided!'}), 400
+    
+    max_items = current_app.config['BATCH_MAX_ITEMS']
+    if prompt_count > max_items:
+        return jsonify({'message': f'Too many prompts, at most {max_items} per batch!'}), 413
+    
+    batch_id = request.args.get('batch_id')
+    if batch_id is not None and not BATCH_ID_RE.match(batch_id):
+        return jsonify({'message': 'Invalid batch ID!', 'error': 'Use up to 64 letters, digits, - and _'}), 400
+    
+    try:
+        concurrency = int(request.args.get('concurrency', current_app.config['BATCH_CONCURRENCY']))
+    except ValueError:
+        return jsonify({'message': 'Invalid concurrency!'}), 400
+    concurrency = max(1, min(concurrency, current_app.config['BATCH_MAX_CONCURRENCY']))
+    
+    checkpoint_path = None
+    if batch_id:
+        checkpoint_dir = os.path.join(current_app.config['BATCH_CHECKPOINT_DIR'], str(current_user.id))
+        prune_checkpoints(checkpoint_dir, current_app.config['BATCH_CHECKPOINT_TTL'])
+        checkpoint_path = os.path.join(checkpoint_dir, f"{batch_id}.jsonl")
+    runner = BatchRunner(current_app._get_current_object(), chat_turn, concurrency=concurrency,
+                         checkpoint_path=checkpoint_path, total=prompt_count)
+    
+    def generate():
+        for result in runner.run(current_user, lines):
+            yield json.dumps(result) + '\n'
+        summary = runner.summary()
+        current_app.logger.info(f"Batch {batch_id or '(no checkpoint)'} for user {current_user.id} finished: {summary}")
+        yield json.dumps({'summary': summary}) + '\n'
+    
+    headers = {'X-Accel-Buffering': 'no'}
+    if batch_id:
+        headers['X-Batch-Id'] = batch_id
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson', headers=headers)
+
 @chat_bp.route('/sessions', methods=['GET'])
 @token_required
+@rate_limited('chat.sessions')
+@versioned()
 def get_sessions(current_user):
     try:
-        sessions = ChatSession.query.filter_by(user_id=current_user.id).order_by(ChatSession.updated_at.desc()).all()
-        return jsonify({
-            'sessions': [session.to_dict() for session in sessions]
-        }), 200
+        query = select(*SESSION_COLUMNS).where(ChatSession.user_id == current_user.id)
+        if not wants_page(request.args):
+            sessions = db.session.execute(query.order_by(ChatSession.updated_at.desc())).all()
+            return jsonify({
+                'sessions': [session._asdict() for session in sessions]
+            }), 200
+
+        cursor, limit, include_total = page_params(request.args)
+        rows = db.session.execute(
+            keyset_query(query, ChatSession.updated_at, ChatSession.id, cursor, limit)
+        ).all()
+        sessions, next_cursor = keyset_result(rows, 'updated_at', limit)
+
+        response = {
+            'sessions': [session._asdict() for session in sessions],
+            'next_cursor': next_cursor,
+            'has_more': next_cursor is not None
+        }
+        if include_total:
+            response['total'] = db.session.execute(count_query(query)).scalar()
+        return jsonify(response), 200
+    except InvalidCursor as e:
+        return jsonify({'message': 'Invalid cursor!', 'error': str(e)}), 400
     except Exception as e:
         current_app.logger.error(f"Error in get_sessions: {str(e)}")
         return jsonify({'message': 'Failed to get sessions!', 'error': str(e)}), 500
 
 @chat_bp.route('/sessions/<session_id>', methods=['GET'])
 @token_required
+@rate_limited('chat.sessions')
 def get_session(current_user, session_id):
     try:
+        if current_app.write_behind is not None:
+            current_app.write_behind.wait_for_session(session_id)
+        
         session = ChatSession.query.filter_by(id=session_id, user_id=current_user.id).first()
         
         if not session:
             return jsonify({'message': 'Session not found!'}), 404
         
-        messages = ChatMessage.query.filter_by(session_id=session_id).order_by(ChatMessage.created_at).all()
-        
-        return jsonify({
+        query = select(*MESSAGE_COLUMNS).where(ChatMessage.session_id == session_id)
+        if not wants_page(request.args):
+            messages = db.session.execute(query.order_by(ChatMessage.created_at)).all()
+
+            return jsonify({
+                'session': session.to_dict(),
+                'messages': [message._asdict() for message in messages]
+            }), 200
+
+        # Pages walk back from the newest message; each page is returned oldest first
+        cursor, limit, include_total = page_params(request.args, default_limit=50)
+        rows = db.session.execute(
+            keyset_query(query, ChatMessage.created_at, ChatMessage.id, cursor, limit)
+        ).all()
+        messages, next_cursor = keyset_result(rows, 'created_at', limit)
+
+        response = {
             'session': session.to_dict(),
-            'messages': [message.to_dict() for message in messages]
-        }), 200
+            'messages': [message._asdict() for message in reversed(messages)],
+            'next_cursor': next_cursor,
+            'has_more': next_cursor is not None
+        }
+        if include_total:
+            response['total'] = db.session.execute(count_query(query)).scalar()
+        return jsonify(response), 200
+    except InvalidCursor as e:
+        return jsonify({'message': 'Invalid cursor!', 'error': str(e)}), 400
     except Exception as e:
         current_app.logger.error(f"Error in get_session: {str(e)}")
         return jsonify({'message': 'Failed to get session!', 'error': str(e)}), 500
 
 @chat_bp.route('/sessions/<session_id>', methods=['DELETE'])
 @token_required
+@rate_limited('chat.sessions')
 def delete_session(current_user, session_id):
     try:
         session = ChatSession.query.filter_by(id=session_id, user_id=current_user.id).first()
@@ -369,8 +674,11 @@ def delete_session(current_user, session_id):
         if not session:
             return jsonify({'message': 'Session not found!'}), 404
         
+        # Keep the session's turns in the history
+        db.session.execute(detach_history(session_id))
         db.session.delete(session)
         db.session.commit()
+        current_app.versions.bump(current_user.id)
         
         return jsonify({
             'message': 'Session deleted successfully!'
@@ -0,0 +1,447 @@
+"""
+Asyncio-native chat endpoints served by asgi.py.
+
+These mirror the synchronous handlers in routes/chat.py but await the OpenAI
+call, the database and Redis, so one process can hold many upstream calls in
+flight. Handlers run inside the Flask app context, which gives them the same
+config, logger and prompt-building helpers as the WSGI routes.
+"""
+
+import time
+import asyncio
+import traceback
+from functools import wraps
+
+import jwt
+import openai
+from sqlalchemy import select, delete
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+from flask import current_app, g
+
+from models.chat import ChatSession, ChatMessage, SESSION_COLUMNS, MESSAGE_COLUMNS, detach_history
+from models.user import User
+from routes.chat import (
+    SYSTEM_PROMPT, EMPTY_RESPONSE, build_chat_messages, build_completion_payload, build_fallback_response,
+    estimate_tokens, normalize_response
+)
+from services.governor import UpstreamUnavailable
+from services.semantic_cache import SemanticCache
+from services.persistence import new_session, is_new_session, build_turn, save_turn_async
+from services.pagination import InvalidCursor, keyset_query, keyset_result, page_params, wants_page, count_query
+from services.versions import etag_matches
+from services.json_provider import json_bytes
+
+class AppJSONResponse(JSONResponse):
+    """
+    JSONResponse through the Flask app's JSON provider (orjson when
+    configured), which also writes the dates of projected rows.
+    """
+
+    def render(self, content):
+        return json_bytes(content)
+
+def async_token_required(f):
+    """
+    Async counterpart of routes.auth.token_required. Opens a database session
+    for the request and passes it to the handler along with the current user.
+    """
+    @wraps(f)
+    async def decorated(request):
+        state = request.app.state
+        with state.flask_app.app_context():
+            # These requests never reach Flask's request hooks, so time them here
+            g.metrics_endpoint = f"async.{f.__name__}"
+            g.metrics_queries = 0
+            started = time.perf_counter()
+            response = await authenticate(request, state)
+            # A handler may hand the request to the WSGI app, which records it
+            if hasattr(response, 'status_code'):
+                current_app.metrics.observe_request(request.method, g.metrics_endpoint, response.status_code,
+                                                    time.perf_counter() - started, g.metrics_queries)
+            return response
+
+    async def authenticate(request, state):
+        token = None
+        auth_header = request.headers.get('Authorization')
+        if auth_header:
+            token = auth_header.split(" ")[1] if len(auth_header.split(" ")) > 1 else None
+
+        if not token:
+            return JSONResponse({'message': 'Token is missing!'}, status_code=401)
+
+        async with state.db_sessionmaker() as db_session:
+            try:
+                with current_app.metrics.stage('auth'):
+                    data = current_app.auth_cache.get_claims(token)
+                    if data is None:
+                        data = jwt.decode(token, current_app.config['JWT_SECRET_KEY'], algorithms=["HS256"])
+                        current_app.auth_cache.set_claims(token, data)
+                    current_user = await current_app.auth_cache.get_principal_async(
+                        data['user_id'], lambda user_id: db_session.get(User, user_id)
+                    )
+
+                if not current_user:
+                    return JSONResponse({'message': 'User not found!'}, status_code=401)
+            except jwt.ExpiredSignatureError:
+                return JSONResponse({'message': 'Token has expired!'}, status_code=401)
+            except Exception as e:
+                return JSONResponse({'message': 'Token is invalid!', 'error': str(e)}, status_code=401)
+
+            return await f(request, db_session, current_user)
+
+    return decorated
+
+def async_rate_limited(endpoint, skip=None):
+    """
+    Async counterpart of routes.auth.rate_limited, for handlers wrapped by
+    async_token_required. Requests for which `skip(request)` is true are
+    left to the WSGI route they are handed to, which counts them itself.
+    """
+    def decorator(f):
+        @wraps(f)
+        async def decorated(request, db_session, current_user):
+            if skip is not None and skip(request):
+                return await f(request, db_session, current_user)
+
+            limiter = request.app.state.rate_limiter
+            client_ip = limiter.client_ip(request.client.host if request.client else None,
+                                          request.headers.get('x-forwarded-for'))
+            result = await limiter.check(endpoint, current_user.id, client_ip)
+            if result is None:
+                return await f(request, db_session, current_user)
+
+            headers = result.headers()
+            if not result.allowed:
+                return JSONResponse({'message': 'Too many requests!', 'retry_after': int(headers['Retry-After'])},
+                                    status_code=429, headers=headers)
+
+            response = await f(request, db_session, current_user)
+            response.headers.update(headers)
+            return response
+
+        return decorated
+
+    return decorator
+
+def async_versioned(f):
+    """
+    Async counterpart of routes.auth.versioned. The change versions use the
+    synchronous Redis client, so their calls run in a thread.
+    """
+    @wraps(f)
+    async def decorated(request, db_session, current_user):
+        versions = current_app.versions
+        version = await asyncio.to_thread(versions.current, current_user.id) if versions.enabled else None
+        if version is None:
+            return await f(request, db_session, current_user)
+
+        metrics = current_app.metrics
+        resource = f"{request.url.path}?{request.url.query}"
+        etag = versions.etag(current_user.id, version, resource)
+        headers = {'ETag': etag, 'Cache-Control': 'private, no-cache', 'Vary': 'Authorization'}
+        if_none_match = request.headers.get('if-none-match')
+        if if_none_match:
+            matched = etag_matches(if_none_match, etag)
+            metrics.cache_lookup('etag', matched)
+            if matched:
+                return Response(status_code=304, headers=headers)
+
+        body = await asyncio.to_thread(versions.get_projection, current_user.id, version, resource)
+        metrics.cache_lookup('projection', body is not None)
+        if body is not None:
+            return Response(body, media_type='application/json', headers=headers)
+
+        response = await f(request, db_session, current_user)
+        if response.status_code != 200:
+            return response
+        await asyncio.to_thread(versions.set_projection, current_user.id, version, resource, response.body.decode())
+        response.headers.update(headers)
+        return response
+
+    return decorated
+
+def is_stream_request(request):
+    return request.query_params.get('stream') in ('1', 'true')
+
+async def load_context(db_session, session, user_message):
+    if is_new_session(session):
+        return []
+
+    builder = current_app.context_builder
+    tail = (await db_session.execute(builder.tail_query(session.id))).scalars().all()
+    previous_messages, dropped = builder.fit(tail, SYSTEM_PROMPT, session.summary, user_message)
+
+    if builder.needs_fold(session, tail, dropped):
+        window_start = previous_messages[0] if previous_messages else None
+        builder.fold(session, (await db_session.execute(builder.fold_query(session, window_start))).scalars().all())
+    return previous_messages
+
+async def get_cached_response(state, payload, user_message, previous_messages):
+    assistant_response = await state.response_cache.get(payload)
+    if state.response_cache.enabled:
+        current_app.metrics.cache_lookup('response', bool(assistant_response))
+    if assistant_response:
+        current_app.logger.debug("Cache hit for chat response")
+        return assistant_response
+
+    if current_app.semantic_cache is not None and not previous_messages:
+        try:
+            scope = SemanticCache.scope_for(payload['model'], SYSTEM_PROMPT)
+            # Embedding the question and scanning the index are CPU work, keep them off the event loop
+            assistant_response = await asyncio.to_thread(current_app.semantic_cache.lookup, user_message, scope)
+            current_app.metrics.cache_lookup('semantic', bool(assistant_response))
+            return assistant_response
+        except Exception as e:
+            current_app.logger.warning(f"Semantic cache error: {str(e)}")
+    return None
+
+async def cache_response(state, payload, user_message, previous_messages, assistant_response):
+    await state.response_cache.set(payload, assistant_response)
+
+    if current_app.semantic_cache is not None and not previous_messages:
+        try:
+            scope = SemanticCache.scope_for(payload['model'], SYSTEM_PROMPT)
+            # Index writes touch the disk, keep them off the event loop
+            await asyncio.to_thread(current_app.semantic_cache.add, user_message, assistant_response, scope)
+        except Exception as e:
+            current_app.logger.warning(f"Semantic cache error: {str(e)}")
+
+async def request_completion(state, payload, user_message, previous_messages):
+    current_app.logger.debug(f"Calling OpenAI API with model: {payload['model']}")
+    governor = state.governor
+    async with governor.slot(estimate_tokens(payload)) as slot:
+        with current_app.metrics.upstream_call(payload['model']) as call:
+            raw = await state.openai_client.chat.completions.with_raw_response.create(**payload)
+            response = raw.parse()
+            call.usage = getattr(response, 'usage', None)
+        await governor.observe(raw.headers)
+        slot.used(getattr(call.usage, 'total_tokens', None))
+
+    try:
+        assistant_response = normalize_response(response.choices[0].message.content)
+    except (AttributeError, IndexError) as e:
+        current_app.logger.error(f"Error extracting response: {str(e)}")
+        assistant_response = EMPTY_RESPONSE
+
+    await cache_response(state, payload, user_message, previous_messages, assistant_response)
+    return assistant_response
+
+async def request_completion_once(state, payload, user_message, previous_messages):
+    return await state.singleflight.do(
+        state.response_cache.make_key(payload),
+        lambda: request_completion(state, payload, user_message, previous_messages),
+        lookup=lambda: state.response_cache.get(payload)
+    )
+
+async def save_chat_turn(db_session, session, user_id, user_message, assistant_response, previous_messages):
+    # Update the session title if it's the first message
+    set_title = len(previous_messages) < 2
+
+    write_behind = current_app.write_behind
+    if write_behind is not None:
+        turn = build_turn(session, user_id, user_message, assistant_response, set_title)
+        # Queue appends may fsync, keep them off the event loop
+        if await asyncio.to_thread(write_behind.enqueue, turn):
+            await db_session.rollback()
+            return
+
+    await save_turn_async(db_session, session, user_id, user_message, assistant_response, set_title)
+    if current_app.versions.enabled:
+        await asyncio.to_thread(current_app.versions.bump, user_id)
+
+@async_token_required
+@async_rate_limited('chat.send', skip=is_stream_request)
+async def send_message(request, db_session, current_user):
+    state = request.app.state
+    if is_stream_request(request):
+        # Streaming stays on the WSGI implementation
+        return state.wsgi_app
+
+    try:
+        try:
+            data = await request.json()
+        except ValueError:
+            data = None
+
+        if not data or not data.get('message'):
+            return JSONResponse({'message': 'No message provided!'}, status_code=400)
+
+        user_message = data.get('message')
+        session_id = data.get('session_id')
+        metrics = current_app.metrics
+
+        with metrics.stage('session'):
+            if not session_id:
+                # Saved together with its first turn
+                session = new_session(current_user.id)
+            else:
+                if current_app.write_behind is not None:
+                    # Make sure the session's earlier turns have been written
+                    await asyncio.to_thread(current_app.write_behind.wait_for_session, session_id)
+                session = (await db_session.execute(
+                    select(ChatSession).filter_by(id=session_id, user_id=current_user.id)
+                )).scalars().first()
+        if not session:
+            return JSONResponse({'message': 'Invalid session ID!'}, status_code=404)
+        session_id = session.id
+
+        with metrics.stage('context'):
+            previous_messages = await load_context(db_session, session, user_message)
+            # End the read transaction so no pooled connection is held during the OpenAI call
+            await db_session.commit()
+
+        payload = build_completion_payload(build_chat_messages(previous_messages, user_message, session.summary))
+        with metrics.stage('cache'):
+            assistant_response = await get_cached_response(state, payload, user_message, previous_messages)
+
+        if not assistant_response:
+            if not current_app.llm.configured:
+                return JSONResponse({'message': 'OpenAI API key is not configured!', 'error': 'Missing API key'}, status_code=500)
+
+            try:
+                with metrics.stage('upstream'):
+                    assistant_response = await request_completion_once(state, payload, user_message, previous_messages)
+            except openai.AuthenticationError as auth_error:
+                return JSONResponse({'message': 'Invalid OpenAI API key!', 'error': str(auth_error)}, status_code=401)
+            except (openai.RateLimitError, UpstreamUnavailable) as rate_error:
+                assistant_response, error_type, fallback_topics = build_fallback_response(user_message, rate_error)
+                with metrics.stage('persist'):
+                    await save_chat_turn(db_session, session, current_user.id, user_message, assistant_response, previous_messages)
+                return JSONResponse({
+                    'message': 'Message sent successfully with fallback response!',
+                    'response': assistant_response,
+                    'session_id': session_id,
+                    'is_fallback': True,
+                    'error_type': error_type,
+                    'fallback_topics': fallback_topics
+                })
+            except openai.APIError as api_error:
+                return JSONResponse({'message': 'OpenAI API error!', 'error': str(api_error)}, status_code=500)
+            except Exception as e:
+                current_app.logger.error(f"OpenAI error: {str(e)}\n{traceback.format_exc()}")
+                return JSONResponse({'message': 'Error with OpenAI service!', 'error': str(e)}, status_code=500)
+
+        with metrics.stage('persist'):
+            await save_chat_turn(db_session, session, current_user.id, user_message, assistant_response, previous_messages)
+
+        return JSONResponse({
+            'message': 'Message sent successfully!',
+            'response': assistant_response,
+            'session_id': session_id
+        })
+
+    except Exception as e:
+        current_app.logger.error(f"Unexpected error in send_message: {str(e)}\n{traceback.format_exc()}")
+        await db_session.rollback()
+        return JSONResponse({'message': 'An unexpected error occurred!', 'error': str(e)}, status_code=500)
+
+@async_token_required
+@async_rate_limited('chat.sessions')
+@async_versioned
+async def get_sessions(request, db_session, current_user):
+    try:
+        query = select(*SESSION_COLUMNS).where(ChatSession.user_id == current_user.id)
+        if not wants_page(request.query_params):
+            sessions = (await db_session.execute(query.order_by(ChatSession.updated_at.desc()))).all()
+            return AppJSONResponse({'sessions': [session._asdict() for session in sessions]})
+
+        cursor, limit, include_total = page_params(request.query_params)
+        rows = (await db_session.execute(
+            keyset_query(query, ChatSession.updated_at, ChatSession.id, cursor, limit)
+        )).all()
+        sessions, next_cursor = keyset_result(rows, 'updated_at', limit)
+
+        response = {
+            'sessions': [session._asdict() for session in sessions],
+            'next_cursor': next_cursor,
+            'has_more': next_cursor is not None
+        }
+        if include_total:
+            response['total'] = (await db_session.execute(count_query(query))).scalar()
+        return AppJSONResponse(response)
+    except InvalidCursor as e:
+        return JSONResponse({'message': 'Invalid cursor!', 'error': str(e)}, status_code=400)
+    except Exception as e:
+        current_app.logger.error(f"Error in get_sessions: {str(e)}")
+        return JSONResponse({'message': 'Failed to get sessions!', 'error': str(e)}, status_code=500)
+
+@async_token_required
+@async_rate_limited('chat.sessions')
+async def get_session(request, db_session, current_user):
+    session_id = request.path_params['session_id']
+    try:
+        if current_app.write_behind is not None:
+            await asyncio.to_thread(current_app.write_behind.wait_for_session, session_id)
+
+        session = (await db_session.execute(
+            select(ChatSession).filter_by(id=session_id, user_id=current_user.id)
+        )).scalars().first()
+
+        if not session:
+            return JSONResponse({'message': 'Session not found!'}, status_code=404)
+
+        query = select(*MESSAGE_COLUMNS).where(ChatMessage.session_id == session_id)
+        if not wants_page(request.query_params):
+            messages = (await db_session.execute(query.order_by(ChatMessage.created_at))).all()
+
+            return AppJSONResponse({
+                'session': session.to_dict(),
+                'messages': [message._asdict() for message in messages]
+            })
+
+        # Pages walk back from the newest message; each page is returned oldest first
+        cursor, limit, include_total = page_params(request.query_params, default_limit=50)
+        rows = (await db_session.execute(
+            keyset_query(query, ChatMessage.created_at, ChatMessage.id, cursor, limit)
+        )).all()
+        messages, next_cursor = keyset_result(rows, 'created_at', limit)
+
+        response = {
+            'session': session.to_dict(),
+            'messages': [message._asdict() for message in reversed(messages)],
+            'next_cursor': next_cursor,
+            'has_more': next_cursor is not None
+        }
+        if include_total:
+            response['total'] = (await db_session.execute(count_query(query))).scalar()
+        return AppJSONResponse(response)
+    except InvalidCursor as e:
+        return JSONResponse({'message': 'Invalid cursor!', 'error': str(e)}, status_code=400)
+    except Exception as e:
+        current_app.logger.error(f"Error in get_session: {str(e)}")
+        return JSONResponse({'message': 'Failed to get session!', 'error': str(e)}, status_code=500)
+
+@async_token_required
+@async_rate_limited('chat.sessions')
+async def delete_session(request, db_session, current_user):
+    session_id = request.path_params['session_id']
+    try:
+        session = (await db_session.execute(
+            select(ChatSession).filter_by(id=session_id, user_id=current_user.id)
+        )).scalars().first()
+
+        if not session:
+            return JSONResponse({'message': 'Session not found!'}, status_code=404)
+
+        # Keep the session's turns in the history
+        await db_session.execute(detach_history(session_id))
+        # Bulk deletes: the ORM cascade would lazy-load the messages, which async sessions can't do
+        await db_session.execute(delete(ChatMessage).where(ChatMessage.session_id == session_id))
+        await db_session.execute(delete(ChatSession).where(ChatSession.id == session_id))
+        await db_session.commit()
+        if current_app.versions.enabled:
+            await asyncio.to_thread(current_app.versions.bump, current_user.id)
+
+        return JSONResponse({'message': 'Session deleted successfully!'})
+    except Exception as e:
+        current_app.logger.error(f"Error in delete_session: {str(e)}")
+        await db_session.rollback()
+        return JSONResponse({'message': 'Failed to delete session!', 'error': str(e)}, status_code=500)
+
+chat_routes = [
+    Route('/api/chat/send', send_message, methods=['POST']),
+    Route('/api/chat/sessions', get_sessions, methods=['GET']),
+    Route('/api/chat/sessions/{session_id}', get_session, methods=['GET']),
+    Route('/api/chat/sessions/{session_id}', delete_session, methods=['DELETE']),
+]
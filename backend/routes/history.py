@@ -1,59 +1,98 @@
 from flask import Blueprint, request, jsonify, current_app
 from models import ChatHistory, db
-from routes.auth import token_required
+from models.chat import select_history_rows
+from routes.auth import token_required, versioned
+from services.pagination import InvalidCursor, keyset_query, keyset_result, page_params, wants_page, count_query
 from datetime import datetime, timedelta
 from sqlalchemy import desc
 
 history_bp = Blueprint('history', __name__)
 
+# ChatHistory.query is the `query` column, not Flask-SQLAlchemy's query property,
+# so history rows are always loaded through select() or db.session.query().
+
 @history_bp.route('/', methods=['GET'])
 @token_required
+# A `days` window moves with the clock, not with the change version
+@versioned(skip=lambda args: 'days' in args)
 def get_history(current_user):
+    # Page-number pagination and its {total, pages, current_page} shape by
+    # default; cursor pagination when a cursor or limit is given
+    if not wants_page(request.args):
+        return get_history_by_page(current_user)
+
+    # Maximum limit of 50 to prevent excessive data requests
+    cursor, limit, include_total = page_params(
+        request.args, default_limit=request.args.get('per_page', 10, type=int), max_limit=50
+    )
+
+    query = history_query(current_user)
+    try:
+        rows = db.session.execute(keyset_query(
+            query, ChatHistory.created_at, ChatHistory.id, cursor, limit
+        )).all()
+    except InvalidCursor as e:
+        return jsonify({'message': 'Invalid cursor!', 'error': str(e)}), 400
+    items, next_cursor = keyset_result(rows, 'created_at', limit)
+
+    response = {
+        'history': [item._asdict() for item in items],
+        'next_cursor': next_cursor,
+        'has_more': next_cursor is not None
+    }
+
+    # Counting every row is the expensive part, so it is opt-in
+    if include_total:
+        response['total'] = db.session.execute(count_query(query)).scalar()
+
+    return jsonify(response), 200
+
+def history_query(current_user):
+    query = select_history_rows().where(ChatHistory.user_id == current_user.id)
+
+    # Optional date filtering
+    days = request.args.get('days', None, type=int)
+    if days:
+        query = query.where(ChatHistory.created_at >= datetime.utcnow() - timedelta(days=days))
+    return query
+
+def get_history_by_page(current_user):
     # Optional query parameters for pagination
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 10, type=int)
-    
+
     # Maximum limit to prevent excessive data requests
     if per_page > 50:
         per_page = 50
-    
-    # Optional date filtering
-    days = request.args.get('days', None, type=int)
-    date_filter = None
-    
-    if days:
-        date_filter = datetime.utcnow() - timedelta(days=days)
-    
-    # Query with pagination
-    query = ChatHistory.query.filter_by(user_id=current_user.id)
-    
-    if date_filter:
-        query = query.filter(ChatHistory.created_at >= date_filter)
-    
+
     # Order by most recent first
-    query = query.order_by(desc(ChatHistory.created_at))
-    
-    # Get paginated results
-    paginated_history = query.paginate(page=page, per_page=per_page, error_out=False)
-    
+    query = history_query(current_user).order_by(desc(ChatHistory.created_at))
+
+    # Get paginated results (db.paginate only returns the first column of a projection)
+    page = max(page, 1)
+    if per_page < 1:
+        per_page = 20
+    rows = db.session.execute(query.limit(per_page).offset((page - 1) * per_page)).all()
+    total = db.session.execute(count_query(query)).scalar()
+
     # Prepare response
-    history_items = [item.to_dict() for item in paginated_history.items]
-    
+    history_items = [item._asdict() for item in rows]
+
     return jsonify({
         'history': history_items,
-        'total': paginated_history.total,
-        'pages': paginated_history.pages,
+        'total': total,
+        'pages': -(-total // per_page),
         'current_page': page
     }), 200
 
 @history_bp.route('/<history_id>', methods=['GET'])
 @token_required
 def get_history_item(current_user, history_id):
-    history_item = ChatHistory.query.filter_by(id=history_id, user_id=current_user.id).first()
-    
+    history_item = db.session.query(ChatHistory).filter_by(id=history_id, user_id=current_user.id).first()
+
     if not history_item:
         return jsonify({'message': 'History item not found!'}), 404
-    
+
     return jsonify({
         'history_item': history_item.to_dict()
     }), 200
@@ -61,14 +100,15 @@ def get_history_item(current_user, history_id):
 @history_bp.route('/<history_id>', methods=['DELETE'])
 @token_required
 def delete_history_item(current_user, history_id):
-    history_item = ChatHistory.query.filter_by(id=history_id, user_id=current_user.id).first()
-    
+    history_item = db.session.query(ChatHistory).filter_by(id=history_id, user_id=current_user.id).first()
+
     if not history_item:
         return jsonify({'message': 'History item not found!'}), 404
-    
+
     db.session.delete(history_item)
     db.session.commit()
-    
+    current_app.versions.bump(current_user.id)
+
     return jsonify({
         'message': 'History item deleted successfully!'
     }), 200
@@ -79,20 +119,21 @@ def clear_history(current_user):
     # Optional date filtering
     days = request.args.get('days', None, type=int)
     date_filter = None
-    
+
     if days:
         date_filter = datetime.utcnow() - timedelta(days=days)
-        
+
         # Delete filtered history
-        query = ChatHistory.query.filter_by(user_id=current_user.id)
+        query = db.session.query(ChatHistory).filter_by(user_id=current_user.id)
         query = query.filter(ChatHistory.created_at >= date_filter)
         deleted_count = query.delete()
     else:
         # Delete all history for the user
-        deleted_count = ChatHistory.query.filter_by(user_id=current_user.id).delete()
-    
+        deleted_count = db.session.query(ChatHistory).filter_by(user_id=current_user.id).delete()
+
     db.session.commit()
-    
+    current_app.versions.bump(current_user.id)
+
     return jsonify({
         'message': f'{deleted_count} history items deleted successfully!'
-    }), 200
\ No newline at end of file
+    }), 200
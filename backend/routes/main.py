@@ -1,4 +1,4 @@
-from flask import Blueprint, jsonify, current_app
+from flask import Blueprint, Response, jsonify, current_app
 
 main_bp = Blueprint('main', __name__)
 
@@ -50,21 +50,32 @@ def health_check():
         'environment': current_app.config.get('ENV', 'development')
     }), 200
 
+@main_bp.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Prometheus scrape endpoint
+    """
+    if not current_app.metrics.enabled:
+        return jsonify({'message': 'Metrics are disabled!'}), 404
+    body, content_type = current_app.metrics.render()
+    return Response(body, content_type=content_type)
+
 @main_bp.route('/test-openai', methods=['GET'])
 def test_openai():
     """Test endpoint for OpenAI integration"""
     try:
-        from routes.chat import get_openai_client
-        client = get_openai_client()
+        from routes.chat import get_llm_client
+        client = get_llm_client()
         response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
+            model=current_app.llm.model,
             messages=[{"role": "user", "content": "Hello!"}],
             max_tokens=10
         )
         return jsonify({
             "success": True,
             "response": response.choices[0].message.content,
-            "model": current_app.config.get('OPENAI_MODEL')
+            "model": response.model,
+            "provider": current_app.llm.name
         })
     except Exception as e:
         current_app.logger.error(f"OpenAI test error: {str(e)}", exc_info=True)
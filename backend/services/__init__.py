@@ -0,0 +1,5 @@
+"""
+Shared services used by the API routes of the Medical Chatbot application.
+"""
+
+from .cache import ResponseCache, AsyncResponseCache
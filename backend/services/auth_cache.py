@@ -0,0 +1,207 @@
+import json
+import time
+import threading
+from collections import OrderedDict
+
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+class Principal:
+    """
+    The authenticated user as seen by the routes: enough to authorize a
+    request and render /api/auth/me without loading the User row.
+    """
+
+    __slots__ = ('id', 'username', 'email', 'created_at', 'updated_at')
+
+    def __init__(self, id, username, email, created_at, updated_at):
+        self.id = id
+        self.username = username
+        self.email = email
+        self.created_at = created_at
+        self.updated_at = updated_at
+
+    @classmethod
+    def from_user(cls, user):
+        data = user.to_dict()
+        return cls(data['id'], data['username'], data['email'], data['created_at'], data['updated_at'])
+
+    def to_dict(self):
+        # Same shape as User.to_dict()
+        return {
+            'id': self.id,
+            'username': self.username,
+            'email': self.email,
+            'created_at': self.created_at,
+            'updated_at': self.updated_at
+        }
+
+class _TTLCache:
+    """
+    Small thread-safe LRU cache whose entries carry their own expiry time.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at <= time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, expires_at):
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+class AuthCache:
+    """
+    Caches the work token_required does on every request.
+
+    Verified JWT claims are memoized in-process until the token expires.
+    User principals are cached in-process for `local_ttl` seconds and in Redis
+    for `redis_ttl` seconds so workers share them. A committed update or
+    delete of a User row drops its principal (see register_invalidation);
+    other workers pick the change up once their short local TTL runs out.
+    """
+
+    def __init__(self, redis_client=None, local_ttl=30, redis_ttl=300, max_entries=10000, enabled=True, logger=None):
+        self.redis = redis_client
+        self.local_ttl = local_ttl
+        self.redis_ttl = redis_ttl
+        self.enabled = enabled
+        self.logger = logger
+        self._claims = _TTLCache(max_entries)
+        self._principals = _TTLCache(max_entries)
+
+    def get_claims(self, token):
+        if not self.enabled:
+            return None
+        return self._claims.get(token)
+
+    def set_claims(self, token, claims):
+        # Tokens without an expiry are never memoized
+        if self.enabled and 'exp' in claims:
+            self._claims.set(token, claims, claims['exp'])
+
+    def get_principal(self, user_id, loader):
+        """
+        Return the cached principal for user_id, calling loader(user_id) on a
+        miss. The loader returns a User or None.
+        """
+        if not self.enabled:
+            user = loader(user_id)
+            return Principal.from_user(user) if user else None
+
+        principal = self._principals.get(user_id)
+        if principal is not None:
+            return principal
+
+        principal = self._get_shared(user_id)
+        if principal is None:
+            user = loader(user_id)
+            if user is None:
+                return None
+            principal = Principal.from_user(user)
+            self._set_shared(principal)
+        self._principals.set(user_id, principal, time.time() + self.local_ttl)
+        return principal
+
+    async def get_principal_async(self, user_id, loader):
+        """
+        get_principal for the ASGI path: `loader` is a coroutine function and
+        only the in-process layer is used, since the shared layer's Redis
+        client is synchronous.
+        """
+        principal = self._principals.get(user_id) if self.enabled else None
+        if principal is not None:
+            return principal
+
+        user = await loader(user_id)
+        if user is None:
+            return None
+        principal = Principal.from_user(user)
+        if self.enabled:
+            self._principals.set(user_id, principal, time.time() + self.local_ttl)
+        return principal
+
+    def invalidate_user(self, user_id):
+        self._principals.pop(user_id)
+        if self.redis is not None:
+            try:
+                self.redis.delete(self._redis_key(user_id))
+            except Exception as e:
+                self._warn(f"Auth cache invalidation error: {str(e)}")
+
+    def _get_shared(self, user_id):
+        if self.redis is None:
+            return None
+        try:
+            raw = self.redis.get(self._redis_key(user_id))
+        except Exception as e:
+            self._warn(f"Auth cache error: {str(e)}")
+            return None
+        return Principal(**json.loads(raw)) if raw else None
+
+    def _set_shared(self, principal):
+        if self.redis is None:
+            return
+        try:
+            self.redis.setex(self._redis_key(principal.id), self.redis_ttl, json.dumps(principal.to_dict()))
+        except Exception as e:
+            self._warn(f"Auth cache error: {str(e)}")
+
+    @staticmethod
+    def _redis_key(user_id):
+        return f"auth:user:{user_id}"
+
+    def _warn(self, message):
+        if self.logger:
+            self.logger.warning(message)
+
+PENDING_KEY = 'auth_cache_invalidate'
+
+def _mark_user_changed(mapper, connection, target):
+    # Flushed, not committed: a reader may still load the old row until the
+    # commit. Ids left by a rollback only cost an extra invalidation later.
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault(PENDING_KEY, set()).add(target.id)
+
+def _invalidate_committed_users(session):
+    user_ids = session.info.pop(PENDING_KEY, None)
+    if user_ids and has_app_context() and getattr(current_app, 'auth_cache', None) is not None:
+        for user_id in user_ids:
+            current_app.auth_cache.invalidate_user(user_id)
+
+def register_invalidation(user_model):
+    """
+    Drop a user's cached principal once an update or delete of the row
+    commits, whichever code path changes it. Invalidating at flush time
+    would let a request that reads the row before the commit cache the old
+    values again.
+    """
+    listeners = [
+        (user_model, 'after_update', _mark_user_changed),
+        (user_model, 'after_delete', _mark_user_changed),
+        (Session, 'after_commit', _invalidate_committed_users),
+    ]
+    for target, identifier, listener in listeners:
+        if not event.contains(target, identifier, listener):
+            event.listen(target, identifier, listener)
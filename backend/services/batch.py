@@ -0,0 +1,206 @@
+import os
+import json
+import time
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from models.db import db
+
+# Keys of a prompt line other than these are returned untouched under 'metadata'
+ITEM_KEYS = ('id', 'message', 'session_id')
+
+def parse_items(lines):
+    """
+    Yield (item_id, item, error) for each non-blank JSONL prompt line. An
+    item is {"message": ..., "id": optional, "session_id": optional}; lines
+    without an id are named after their line number.
+    """
+    for number, line in enumerate(lines, 1):
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError as e:
+            yield f"line-{number}", None, f"Invalid JSON: {str(e)}"
+            continue
+        if not isinstance(item, dict):
+            yield f"line-{number}", None, "Each line must be a JSON object"
+            continue
+        item_id = str(item.get('id', f"line-{number}"))
+        message = item.get('message')
+        if not isinstance(message, str) or not message.strip():
+            yield item_id, None, "Each line needs a non-empty 'message'"
+            continue
+        yield item_id, item, None
+
+class Checkpoint:
+    """
+    Append-only JSONL log of the results a batch has finished. Reopening it
+    tells a resumed run which items to skip, and gives it their results.
+    A line cut short by a crash is ignored and its item runs again.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.done = {}
+        self._lock = threading.Lock()
+        self._file = None
+        if not path:
+            return
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        result = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.done[result['id']] = result
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def record(self, result):
+        if self._file is None:
+            return
+        with self._lock:
+            self._file.write(json.dumps(result) + '\n')
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def discard(self):
+        """
+        Close and delete the log, once nothing is left to resume.
+        """
+        self.close()
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+def prune_checkpoints(directory, max_age):
+    """
+    Delete the checkpoints in `directory` not written to for `max_age`
+    seconds. Returns how many were deleted.
+    """
+    if not os.path.isdir(directory):
+        return 0
+    cutoff = time.time() - max_age
+    pruned = 0
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        try:
+            if name.endswith('.jsonl') and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                pruned += 1
+        except FileNotFoundError:
+            # Pruned by a concurrent request
+            continue
+    return pruned
+
+class BatchRunner:
+    """
+    Runs a JSONL file of prompts through `turn` (routes.chat.chat_turn),
+    `concurrency` at a time, so every prompt takes the same cache, upstream
+    governor and persistence path as POST /api/chat/send.
+
+    run() yields one result per prompt as it finishes, so completion order,
+    not input order. Answered prompts are written to the checkpoint as they
+    finish; running again with the same checkpoint re-emits those and only
+    runs what is left, including prompts that failed or only got a fallback
+    answer. A run that answers every prompt deletes the checkpoint.
+    """
+
+    def __init__(self, app, turn, concurrency=8, checkpoint_path=None, total=None):
+        self.app = app
+        self.turn = turn
+        self.concurrency = max(1, concurrency)
+        self.checkpoint_path = checkpoint_path
+        self._lock = threading.Lock()
+        self.progress = {'total': total, 'done': 0, 'resumed': 0, 'failed': 0, 'fallbacks': 0, 'started': time.time()}
+
+    def run(self, user, lines):
+        checkpoint = Checkpoint(self.checkpoint_path)
+        executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='batch')
+        pending = set()
+        seen = set()
+        try:
+            for item_id, item, error in parse_items(lines):
+                if error or item_id in seen:
+                    yield self._count({'id': item_id, 'status': 400, 'error': error or 'Duplicate id'})
+                    continue
+                seen.add(item_id)
+                if item_id in checkpoint.done:
+                    yield self._count(checkpoint.done[item_id], resumed=True)
+                    continue
+
+                while len(pending) >= self.concurrency:
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        yield self._count(future.result())
+                pending.add(executor.submit(self._run_item, user, item_id, item, checkpoint))
+
+            while pending:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    yield self._count(future.result())
+
+            with self._lock:
+                complete = not self.progress['failed'] and not self.progress['fallbacks']
+            if complete:
+                checkpoint.discard()
+        finally:
+            # A consumer that stops early (client gone, Ctrl+C) leaves queued
+            # prompts for the next run; the ones already running still finish
+            # and reach the checkpoint
+            executor.shutdown(wait=True, cancel_futures=True)
+            checkpoint.close()
+
+    def summary(self):
+        with self._lock:
+            progress = dict(self.progress)
+        elapsed = time.time() - progress.pop('started')
+        progress['elapsed_seconds'] = round(elapsed, 1)
+        ran = progress['done'] - progress['resumed']
+        progress['per_second'] = round(ran / elapsed, 2) if elapsed > 0 else None
+        return progress
+
+    def _run_item(self, user, item_id, item, checkpoint):
+        started = time.perf_counter()
+        with self.app.app_context():
+            try:
+                body, status = self.turn(user, item['message'], item.get('session_id'))
+            except Exception as e:
+                self.app.logger.error(f"Unexpected error in batch item {item_id}: {str(e)}\n{traceback.format_exc()}")
+                db.session.rollback()
+                body, status = {'message': 'An unexpected error occurred!', 'error': str(e)}, 500
+
+        result = {'id': item_id, 'status': status, 'message': item['message']}
+        if status == 200:
+            for key in ('response', 'session_id', 'is_fallback', 'error_type', 'fallback_topics'):
+                if key in body:
+                    result[key] = body[key]
+        else:
+            result['error'] = body.get('error') or body.get('message')
+        metadata = {key: value for key, value in item.items() if key not in ITEM_KEYS}
+        if metadata:
+            result['metadata'] = metadata
+        result['latency_ms'] = round((time.perf_counter() - started) * 1000, 1)
+
+        if status == 200 and not result.get('is_fallback'):
+            checkpoint.record(result)
+        return result
+
+    def _count(self, result, resumed=False):
+        with self._lock:
+            self.progress['done'] += 1
+            if resumed:
+                self.progress['resumed'] += 1
+            if result['status'] != 200:
+                self.progress['failed'] += 1
+            elif result.get('is_fallback'):
+                self.progress['fallbacks'] += 1
+        return result
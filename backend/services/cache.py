@@ -0,0 +1,188 @@
+import json
+import hashlib
+import threading
+
+class ResponseCache:
+    """
+    Redis cache for assistant responses.
+
+    Keys are a canonical hash of the full completion payload sent to OpenAI
+    (model, system prompt, conversation window and sampling parameters), so a
+    cached answer is only reused for an identical request. Keys are namespaced
+    by cache version and model: `chat:v{version}:{model}:{sha256}`.
+
+    Values are JSON, compressed by `codec` (a services.compression.TextCodec)
+    when given. The cache is a no-op when Redis is unavailable.
+    """
+
+    def __init__(self, redis_client, version=1, default_ttl=3600, model_ttls=None, prefix='chat', codec=None, logger=None):
+        self.redis = redis_client
+        self.codec = codec
+        self.version = version
+        self.default_ttl = default_ttl
+        self.model_ttls = model_ttls or {}
+        self.prefix = prefix
+        self.logger = logger
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'errors': 0, 'bytes_read': 0, 'bytes_written': 0}
+
+    @property
+    def enabled(self):
+        return self.redis is not None
+
+    @staticmethod
+    def canonical_payload(payload):
+        # Sorted keys and fixed separators so equal payloads always hash equally
+        return json.dumps(payload, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+
+    def namespace(self, model):
+        return f"{self.prefix}:v{self.version}:{model}"
+
+    def make_key(self, payload):
+        digest = hashlib.sha256(self.canonical_payload(payload).encode()).hexdigest()
+        return f"{self.namespace(payload.get('model'))}:{digest}"
+
+    def ttl_for(self, model):
+        return self.model_ttls.get(model, self.default_ttl)
+
+    def get(self, payload):
+        """
+        Return the cached response for this payload, or None on a miss or error.
+        """
+        if not self.enabled:
+            return None
+        try:
+            raw = self.redis.get(self.make_key(payload))
+        except Exception as e:
+            self._record('errors')
+            self._warn(f"Cache error: {str(e)}")
+            return None
+        if raw is None:
+            self._record('misses')
+            return None
+        self._record('hits', bytes_read=len(raw))
+        return self._load(raw)
+
+    def set(self, payload, response):
+        if not self.enabled:
+            return
+        raw = self._dump(response)
+        try:
+            self.redis.setex(self.make_key(payload), self.ttl_for(payload.get('model')), raw)
+            self._record(bytes_written=len(raw))
+        except Exception as e:
+            self._record('errors')
+            self._warn(f"Redis caching error: {str(e)}")
+
+    def invalidate(self, payload):
+        """
+        Drop the cached response for one payload. Returns the number of keys removed.
+        """
+        if not self.enabled:
+            return 0
+        return self.redis.delete(self.make_key(payload))
+
+    def invalidate_model(self, model):
+        """
+        Drop every cached response for a model in the current cache version.
+        """
+        return self._delete_matching(f"{self.namespace(model)}:*")
+
+    def invalidate_all(self):
+        """
+        Drop every cached response in the current cache version.
+        """
+        return self._delete_matching(f"{self.prefix}:v{self.version}:*")
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+    def _delete_matching(self, pattern):
+        if not self.enabled:
+            return 0
+        deleted = 0
+        batch = []
+        for key in self.redis.scan_iter(match=pattern, count=500):
+            batch.append(key)
+            if len(batch) >= 500:
+                deleted += self.redis.delete(*batch)
+                batch = []
+        if batch:
+            deleted += self.redis.delete(*batch)
+        return deleted
+
+    def _dump(self, response):
+        raw = json.dumps(response)
+        return self.codec.encode(raw) if self.codec is not None else raw
+
+    def _load(self, raw):
+        if self.codec is not None:
+            raw = self.codec.decode(raw)
+        return json.loads(raw)
+
+    def _record(self, counter=None, bytes_read=0, bytes_written=0):
+        with self._lock:
+            if counter:
+                self._stats[counter] += 1
+            self._stats['bytes_read'] += bytes_read
+            self._stats['bytes_written'] += bytes_written
+
+    def _warn(self, message):
+        if self.logger:
+            self.logger.warning(message)
+
+class AsyncResponseCache(ResponseCache):
+    """
+    ResponseCache for the ASGI path, backed by a `redis.asyncio` client.
+    Keys, TTLs and counters are identical to the synchronous cache.
+    """
+
+    async def get(self, payload):
+        if not self.enabled:
+            return None
+        try:
+            raw = await self.redis.get(self.make_key(payload))
+        except Exception as e:
+            self._record('errors')
+            self._warn(f"Cache error: {str(e)}")
+            return None
+        if raw is None:
+            self._record('misses')
+            return None
+        self._record('hits', bytes_read=len(raw))
+        return self._load(raw)
+
+    async def set(self, payload, response):
+        if not self.enabled:
+            return
+        raw = self._dump(response)
+        try:
+            await self.redis.setex(self.make_key(payload), self.ttl_for(payload.get('model')), raw)
+            self._record(bytes_written=len(raw))
+        except Exception as e:
+            self._record('errors')
+            self._warn(f"Redis caching error: {str(e)}")
+
+    async def invalidate(self, payload):
+        if not self.enabled:
+            return 0
+        return await self.redis.delete(self.make_key(payload))
+
+    async def _delete_matching(self, pattern):
+        # invalidate_model() and invalidate_all() return this coroutine unchanged
+        if not self.enabled:
+            return 0
+        deleted = 0
+        batch = []
+        async for key in self.redis.scan_iter(match=pattern, count=500):
+            batch.append(key)
+            if len(batch) >= 500:
+                deleted += await self.redis.delete(*batch)
+                batch = []
+        if batch:
+            deleted += await self.redis.delete(*batch)
+        return deleted
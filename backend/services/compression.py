@@ -0,0 +1,171 @@
+import os
+import re
+import zlib
+import base64
+import hashlib
+import threading
+from collections import Counter
+
+# Encoded values start with a control character plain text never begins with:
+#   \x1f z <dictionary id, 8 hex chars or 00000000> : <base85 raw deflate>
+MARKER = '\x1f'
+NO_DICTIONARY = '00000000'
+DICTIONARY_SUFFIX = '.zdict'
+CURRENT_FILE = 'current'
+
+# zlib only looks back 32 KiB, so a larger preset dictionary is wasted
+MAX_DICTIONARY_SIZE = 32 * 1024
+
+WORD_RE = re.compile(r"\S+\s*")
+
+class TextCodec:
+    """
+    Transparent compression for long text values stored in the database and
+    in Redis.
+
+    Values shorter than `min_size` characters, or that would not shrink, are
+    stored unchanged. Longer ones are deflated with a preset dictionary of
+    phrases common in past answers (see train_dictionary), which is what
+    makes answers of a few hundred tokens compress well, and stored as text
+    so existing Text columns and string Redis values can hold them.
+
+    Decoding works whatever `enabled` is set to, so compression can be turned
+    off without losing access to values written while it was on. Every
+    dictionary ever used must stay in `dictionary_dir`; values name theirs by id.
+    """
+
+    def __init__(self, enabled=True, min_size=512, level=6, dictionary_dir=None):
+        self._lock = threading.Lock()
+        self.configure(enabled, min_size, level, dictionary_dir)
+
+    def configure(self, enabled=True, min_size=512, level=6, dictionary_dir=None):
+        self.enabled = enabled
+        self.min_size = min_size
+        self.level = level
+        self.dictionary_dir = dictionary_dir
+        self._dictionaries = {NO_DICTIONARY: b''}
+        self._current = NO_DICTIONARY
+        self.load_dictionaries()
+
+    @property
+    def dictionary_id(self):
+        return self._current
+
+    def encode(self, text):
+        if not self.enabled or text is None or (len(text) < self.min_size and not text.startswith(MARKER)):
+            return text
+
+        dictionary_id = self._current
+        dictionary = self._dictionaries[dictionary_id]
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15, zdict=dictionary) if dictionary \
+            else zlib.compressobj(self.level, zlib.DEFLATED, -15)
+        data = compressor.compress(text.encode()) + compressor.flush()
+        encoded = f"{MARKER}z{dictionary_id}:{base64.b85encode(data).decode()}"
+
+        # Plain text that happens to start with the marker must always be encoded
+        if len(encoded) >= len(text) and not text.startswith(MARKER):
+            return text
+        return encoded
+
+    def decode(self, value):
+        if not value or value[0] != MARKER:
+            return value
+        if len(value) < 11 or value[1] != 'z' or value[10] != ':':
+            raise ValueError("Unknown compressed value format")
+
+        dictionary = self._dictionary(value[2:10])
+        decompressor = zlib.decompressobj(-15, zdict=dictionary) if dictionary else zlib.decompressobj(-15)
+        data = decompressor.decompress(base64.b85decode(value[11:])) + decompressor.flush()
+        return data.decode()
+
+    def load_dictionaries(self):
+        """
+        (Re)load every dictionary in dictionary_dir and the one marked current.
+        """
+        if not self.dictionary_dir or not os.path.isdir(self.dictionary_dir):
+            return
+        with self._lock:
+            for name in os.listdir(self.dictionary_dir):
+                if name.endswith(DICTIONARY_SUFFIX):
+                    with open(os.path.join(self.dictionary_dir, name), 'rb') as f:
+                        self._dictionaries[name[:-len(DICTIONARY_SUFFIX)]] = f.read()
+            current_path = os.path.join(self.dictionary_dir, CURRENT_FILE)
+            if os.path.exists(current_path):
+                with open(current_path) as f:
+                    current = f.read().strip()
+                if current in self._dictionaries:
+                    self._current = current
+
+    def save_dictionary(self, dictionary, make_current=True):
+        """
+        Store a trained dictionary in dictionary_dir and return its id.
+        """
+        dictionary_id = hashlib.sha1(dictionary).hexdigest()[:8]
+        os.makedirs(self.dictionary_dir, exist_ok=True)
+        with open(os.path.join(self.dictionary_dir, dictionary_id + DICTIONARY_SUFFIX), 'wb') as f:
+            f.write(dictionary)
+        if make_current:
+            tmp_path = os.path.join(self.dictionary_dir, CURRENT_FILE + '.tmp')
+            with open(tmp_path, 'w') as f:
+                f.write(dictionary_id)
+            os.replace(tmp_path, os.path.join(self.dictionary_dir, CURRENT_FILE))
+        self.load_dictionaries()
+        return dictionary_id
+
+    def _dictionary(self, dictionary_id):
+        if dictionary_id not in self._dictionaries:
+            # Another process may have trained it since this one started
+            self.load_dictionaries()
+        try:
+            return self._dictionaries[dictionary_id]
+        except KeyError:
+            raise ValueError(f"Compression dictionary {dictionary_id} is missing")
+
+def train_dictionary(samples, size=MAX_DICTIONARY_SIZE, max_phrase_words=8):
+    """
+    Build a zlib preset dictionary from sample texts: the phrases (runs of
+    words) that save the most bytes across the samples, most valuable last,
+    where deflate finds them at the shortest distance.
+    """
+    counts = Counter()
+    for text in samples:
+        words = WORD_RE.findall(text)
+        seen = set()
+        for n in (max_phrase_words, max_phrase_words // 2, 2):
+            for i in range(len(words) - n + 1):
+                phrase = ''.join(words[i:i + n])
+                # Count each phrase once per sample: it must recur across answers to be worth storing
+                if phrase not in seen:
+                    seen.add(phrase)
+                    counts[phrase] += 1
+
+    candidates = sorted(
+        (phrase for phrase, count in counts.items() if count > 1),
+        key=lambda phrase: counts[phrase] * len(phrase),
+        reverse=True
+    )
+    chosen = []
+    used = 0
+    for phrase in candidates:
+        if used >= size:
+            break
+        # Skip phrases already covered by a longer one
+        if any(phrase in other for other in chosen[-200:]):
+            continue
+        chosen.append(phrase)
+        used += len(phrase.encode())
+
+    return ''.join(reversed(chosen)).encode()[-size:]
+
+# Shared by the CompressedText column type and the response caches;
+# create_app configures it
+codec = TextCodec()
+
+def configure_codec(config):
+    codec.configure(
+        enabled=config['COMPRESSION_ENABLED'],
+        min_size=config['COMPRESSION_MIN_SIZE'],
+        level=config['COMPRESSION_LEVEL'],
+        dictionary_dir=config['COMPRESSION_DICT_DIR']
+    )
+    return codec
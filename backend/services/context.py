@@ -0,0 +1,172 @@
+import re
+
+from sqlalchemy import select
+
+from models.chat import ChatMessage
+
+try:
+    import tiktoken
+except ImportError:  # pragma: no cover - tiktoken is in requirements
+    tiktoken = None
+
+# Approximate per-message overhead of the chat format, in tokens
+MESSAGE_OVERHEAD = 4
+
+SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s")
+
+class Tokenizer:
+    """
+    Counts tokens locally with tiktoken's encoding for the model (o200k_base
+    for models tiktoken doesn't know). Only if tiktoken or its encoding
+    files are unavailable does it estimate about four characters per token,
+    which can be off by a third for non-English text.
+    """
+
+    DEFAULT_ENCODING = 'o200k_base'
+
+    def __init__(self, model=None):
+        self.encoding = None
+        if tiktoken is not None:
+            try:
+                self.encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                self.encoding = self._get_encoding(self.DEFAULT_ENCODING)
+            except Exception:
+                self.encoding = None
+
+    @staticmethod
+    def _get_encoding(name):
+        try:
+            return tiktoken.get_encoding(name)
+        except Exception:
+            # Encoding files are downloaded on first use; offline we estimate
+            return None
+
+    def count(self, text):
+        if not text:
+            return 0
+        if self.encoding is not None:
+            return len(self.encoding.encode(text))
+        return len(text) // 4 + 1
+
+class ExtractiveSummarizer:
+    """
+    Folds old turns into a running summary without calling the LLM: each
+    question is kept (shortened) along with the first sentence of each answer.
+    When the summary grows past its budget the oldest lines are dropped.
+    """
+
+    def __init__(self, tokenizer, max_tokens=300):
+        self.tokenizer = tokenizer
+        self.max_tokens = max_tokens
+
+    def summarize(self, summary, messages):
+        lines = summary.splitlines() if summary else []
+        for message in messages:
+            if message.role == 'user':
+                lines.append(f"- User asked: {self._shorten(message.content, 150)}")
+            else:
+                first_sentence = SENTENCE_END_RE.split(message.content.strip(), 1)[0]
+                lines.append(f"- Assistant answered: {self._shorten(first_sentence, 200)}")
+
+        while len(lines) > 1 and self.tokenizer.count("\n".join(lines)) > self.max_tokens:
+            lines.pop(0)
+        return "\n".join(lines)
+
+    @staticmethod
+    def _shorten(text, limit):
+        text = " ".join(text.split())
+        return text if len(text) <= limit else text[:limit - 3].rstrip() + '...'
+
+class ContextBuilder:
+    """
+    Builds the conversation window sent to OpenAI for a chat turn.
+
+    Only the newest `max_messages` rows of a session are read (LIMIT query),
+    then trimmed from the oldest end until the whole prompt fits in
+    `token_budget`. Turns that leave the window, whether trimmed for the
+    budget or aged out of `max_messages`, are folded (oldest first,
+    `fold_batch` at a time) into a rolling summary stored on the
+    ChatSession, which is sent as context in their place.
+
+    Sessions shorter than the window cost no query beyond the tail.
+
+    Queries are returned as SQLAlchemy statements so the sync and async
+    routes can execute them with their own sessions.
+    """
+
+    def __init__(self, tokenizer, summarizer, token_budget=3000, max_messages=20, fold_batch=50):
+        self.tokenizer = tokenizer
+        self.summarizer = summarizer
+        self.token_budget = token_budget
+        self.max_messages = max_messages
+        self.fold_batch = fold_batch
+
+    @classmethod
+    def from_config(cls, config):
+        tokenizer = Tokenizer(config.get('OPENAI_MODEL'))
+        return cls(
+            tokenizer,
+            ExtractiveSummarizer(tokenizer, max_tokens=config['CONTEXT_SUMMARY_MAX_TOKENS']),
+            token_budget=config['CONTEXT_TOKEN_BUDGET'],
+            max_messages=config['CONTEXT_MAX_MESSAGES']
+        )
+
+    def tail_query(self, session_id):
+        """
+        Newest messages of the session, newest first.
+        """
+        return (select(ChatMessage)
+                .filter_by(session_id=session_id)
+                .order_by(ChatMessage.created_at.desc())
+                .limit(self.max_messages))
+
+    def fit(self, tail, system_prompt, summary, user_message):
+        """
+        Split the tail (newest first) into the messages that fit the token
+        budget, returned oldest first, and the older ones that don't.
+        """
+        used = (self.count_message(system_prompt) + self.count_message(user_message)
+                + (self.count_message(summary) if summary else 0))
+        kept = []
+        for index, message in enumerate(tail):
+            used += self.count_message(message.content)
+            if used > self.token_budget:
+                return kept[::-1], tail[index:]
+            kept.append(message)
+        return kept[::-1], []
+
+    def needs_fold(self, session, tail, dropped):
+        """
+        Whether messages older than the window may be missing from the
+        summary: some were trimmed for the budget, or the tail is full, so
+        older rows exist, and the summary stops short of the window.
+        """
+        if dropped:
+            return True
+        if len(tail) < self.max_messages:
+            return False
+        return session.summary_until is None or session.summary_until < tail[-1].created_at
+
+    def fold_query(self, session, window_start):
+        """
+        Messages older than the window that the summary doesn't cover yet, oldest first.
+        """
+        query = select(ChatMessage).filter_by(session_id=session.id)
+        if window_start is not None:
+            query = query.filter(ChatMessage.created_at < window_start.created_at)
+        if session.summary_until is not None:
+            query = query.filter(ChatMessage.created_at > session.summary_until)
+        return query.order_by(ChatMessage.created_at).limit(self.fold_batch)
+
+    def fold(self, session, messages):
+        """
+        Fold messages into the session's rolling summary. The caller commits.
+        """
+        if not messages:
+            return
+        session.summary = self.summarizer.summarize(session.summary, messages)
+        session.summary_until = messages[-1].created_at
+
+    def count_message(self, text):
+        return self.tokenizer.count(text) + MESSAGE_OVERHEAD
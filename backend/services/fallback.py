@@ -0,0 +1,110 @@
+import os
+import re
+import json
+import random
+
+DEFAULT_CORPUS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'fallback_responses.json')
+
+# A runner-up topic whose score is at least this share of the best one is
+# answered too, so "headache and fever" gets both answers
+SECONDARY_SHARE = 0.5
+MAX_TOPICS = 2
+
+def keyword_pattern(keywords):
+    """
+    A regular expression matching any of the keywords, with shared prefixes
+    factored out: "fever", "fitness" and "flu" become f(?:ever|itness|lu).
+    The regex engine then rejects a position after one character instead of
+    trying every keyword in turn. Spaces inside a keyword match any run of
+    whitespace, and a longer keyword wins over its own prefix.
+    """
+    trie = {}
+    for keyword in keywords:
+        node = trie
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    def build(node):
+        branches = [(r'\s+' if char == ' ' else re.escape(char)) + build(child)
+                    for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        optional = '' in node
+        if len(branches) == 1 and not optional:
+            return branches[0]
+        # Greedy '?' tries the longer keyword first
+        return f"(?:{'|'.join(branches)})" + ('?' if optional else '')
+
+    return build(trie)
+
+class FallbackEngine:
+    """
+    Canned answers for when the LLM is unavailable, picked by keyword.
+
+    Every keyword of every topic is compiled into a single pattern shaped
+    like a prefix tree (see keyword_pattern), so a message is scanned once
+    whatever the size of the corpus. Keywords match at the start of a word
+    ("depress" matches "depression", "eat" does not match "great"), each hit
+    adds the keyword's weight to its topic, and the best scoring topics are
+    answered.
+    """
+
+    def __init__(self, topics, default_responses, rng=None):
+        self.topics = {topic['name']: topic['responses'] for topic in topics}
+        self.default_responses = default_responses
+        self._keywords = {}
+        for topic in topics:
+            for keyword, weight in topic['keywords'].items():
+                self._keywords[self._normalize(keyword)] = (topic['name'], weight)
+        self._random = rng or random.Random()
+
+        # Messages are lowercased before matching: re.IGNORECASE makes the scan several times slower
+        self._pattern = re.compile(rf"\b{keyword_pattern(self._keywords)}") if self._keywords else None
+
+    @classmethod
+    def load(cls, path=DEFAULT_CORPUS_PATH, rng=None):
+        with open(path, encoding='utf-8') as f:
+            corpus = json.load(f)
+        return cls(corpus['topics'], corpus['default'], rng=rng)
+
+    @staticmethod
+    def _normalize(text):
+        return ' '.join(text.lower().split())
+
+    def scores(self, message):
+        """
+        Keyword weight per topic found in the message.
+        """
+        scores = {}
+        if self._pattern is None:
+            return scores
+        for found in self._pattern.findall(message.lower()):
+            topic, weight = self._keywords[self._normalize(found)]
+            scores[topic] = scores.get(topic, 0) + weight
+        return scores
+
+    def match(self, message):
+        """
+        Return (response, topics): the answer for the best matching topics,
+        or a default answer and an empty list when none match.
+        """
+        scores = self.scores(message)
+        if not scores:
+            return self._random.choice(self.default_responses), []
+
+        ranked = sorted(scores, key=scores.get, reverse=True)
+        best = scores[ranked[0]]
+        topics = [topic for topic in ranked[:MAX_TOPICS] if scores[topic] >= best * SECONDARY_SHARE]
+        response = ' '.join(self._random.choice(self.topics[topic]) for topic in topics)
+        return response, topics
+
+# Built once at import; create_app swaps in another corpus if configured
+engine = FallbackEngine.load()
+
+def configure_fallback(config):
+    global engine
+    path = config.get('FALLBACK_CORPUS_PATH') or DEFAULT_CORPUS_PATH
+    if path != DEFAULT_CORPUS_PATH:
+        engine = FallbackEngine.load(path)
+    return engine
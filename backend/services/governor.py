@@ -0,0 +1,595 @@
+import re
+import time
+import uuid
+import random
+import asyncio
+import inspect
+import threading
+import contextlib
+
+import openai
+
+# Shared by the scripts below. Times are milliseconds from the Redis clock, so
+# every worker sees the same buckets whatever its own clock says.
+#   KEYS: 1 requests bucket, 2 tokens bucket, 3 leases, 4 breaker open,
+#         5 breaker tripped, 6 breaker probe, 7 breaker failures
+SCRIPT_PRELUDE = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local function refill(key, default_limit, headroom)
+    local state = redis.call('HMGET', key, 'level', 'ts', 'limit')
+    local capacity = (tonumber(state[3]) or tonumber(default_limit)) * headroom
+    local level = tonumber(state[1]) or capacity
+    local ts = tonumber(state[2]) or now
+    return math.min(capacity, level + math.max(0, now - ts) * capacity / 60000), capacity
+end
+"""
+
+# ARGV: rpm, tpm, tokens, max concurrency, lease id, lease ttl ms, headroom, bucket ttl ms
+# Returns {1, 0, 'probe' or ''} when granted, {0, wait ms, reason} otherwise
+ACQUIRE_SCRIPT = SCRIPT_PRELUDE + """
+local open_ttl = redis.call('PTTL', KEYS[4])
+if open_ttl > 0 then
+    return {0, open_ttl, 'breaker_open'}
+end
+local half_open = redis.call('EXISTS', KEYS[5]) == 1
+if half_open and redis.call('EXISTS', KEYS[6]) == 1 then
+    return {0, 1000, 'breaker_open'}
+end
+
+local max_concurrency = tonumber(ARGV[4])
+if max_concurrency > 0 then
+    redis.call('ZREMRANGEBYSCORE', KEYS[3], '-inf', now)
+    if redis.call('ZCARD', KEYS[3]) >= max_concurrency then
+        return {0, 50, 'concurrency'}
+    end
+end
+
+local headroom = tonumber(ARGV[7])
+local requests, request_capacity = refill(KEYS[1], ARGV[1], headroom)
+local tokens, token_capacity = refill(KEYS[2], ARGV[2], headroom)
+-- A call larger than the whole bucket goes through once the bucket is full
+local needed = math.min(tonumber(ARGV[3]), token_capacity)
+local wait, reason = 0, ''
+if requests < 1 then
+    wait, reason = (1 - requests) * 60000 / request_capacity, 'requests'
+end
+if tokens < needed and (needed - tokens) * 60000 / token_capacity > wait then
+    wait, reason = (needed - tokens) * 60000 / token_capacity, 'tokens'
+end
+if wait > 0 then
+    return {0, math.ceil(wait), reason}
+end
+
+local probe = ''
+if half_open then
+    redis.call('SET', KEYS[6], '1', 'PX', ARGV[6])
+    probe = 'probe'
+end
+redis.call('HSET', KEYS[1], 'level', requests - 1, 'ts', now)
+redis.call('HSET', KEYS[2], 'level', tokens - needed, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], ARGV[8])
+redis.call('PEXPIRE', KEYS[2], ARGV[8])
+if max_concurrency > 0 then
+    redis.call('ZADD', KEYS[3], now + tonumber(ARGV[6]), ARGV[5])
+    redis.call('PEXPIRE', KEYS[3], ARGV[6])
+end
+return {1, 0, probe}
+"""
+
+# ARGV: lease id, unused tokens to refund, outcome (success, failure or neutral),
+#       failure threshold, failure window ms, open cooldown ms
+# Returns 1 when this call opened the breaker
+RELEASE_SCRIPT = SCRIPT_PRELUDE + """
+redis.call('ZREM', KEYS[3], ARGV[1])
+local refund = tonumber(ARGV[2])
+if refund > 0 and redis.call('EXISTS', KEYS[2]) == 1 then
+    redis.call('HINCRBYFLOAT', KEYS[2], 'level', refund)
+end
+if ARGV[3] == 'success' then
+    redis.call('DEL', KEYS[5], KEYS[6], KEYS[7])
+elseif ARGV[3] == 'failure' then
+    local failures = redis.call('INCR', KEYS[7])
+    if failures == 1 then
+        redis.call('PEXPIRE', KEYS[7], ARGV[5])
+    end
+    if redis.call('EXISTS', KEYS[5]) == 1 or failures >= tonumber(ARGV[4]) then
+        redis.call('SET', KEYS[4], '1', 'PX', ARGV[6])
+        redis.call('SET', KEYS[5], '1', 'PX', tonumber(ARGV[6]) * 10)
+        redis.call('DEL', KEYS[6], KEYS[7])
+        return 1
+    end
+elseif ARGV[3] == 'neutral' then
+    redis.call('DEL', KEYS[6])
+end
+return 0
+"""
+
+# ARGV: kind (1 requests, 2 tokens), limit or '', remaining or '', default limit, headroom, bucket ttl ms
+OBSERVE_SCRIPT = SCRIPT_PRELUDE + """
+local key = KEYS[tonumber(ARGV[1])]
+if ARGV[2] ~= '' then
+    redis.call('HSET', key, 'limit', ARGV[2])
+end
+local level, capacity = refill(key, ARGV[4], tonumber(ARGV[5]))
+if ARGV[3] ~= '' then
+    level = math.min(level, tonumber(ARGV[3]) * tonumber(ARGV[5]))
+end
+redis.call('HSET', key, 'level', level, 'ts', now)
+redis.call('PEXPIRE', key, ARGV[6])
+return 0
+"""
+
+KEY_NAMES = ('requests', 'tokens', 'leases', 'breaker:open', 'breaker:tripped', 'breaker:probe', 'breaker:failures')
+
+# Idle buckets are full again after a minute; keep learned limits a while longer
+BUCKET_TTL = 3600
+
+DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+DURATION_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+# Upstream errors that count against the circuit breaker
+BREAKER_ERRORS = (openai.RateLimitError, openai.InternalServerError, openai.APITimeoutError, openai.APIConnectionError)
+
+class UpstreamUnavailable(Exception):
+    """
+    The governor refused an upstream call; the caller should fall back.
+    `retry_after` is the number of seconds after which a retry may succeed.
+    """
+
+    def __init__(self, message, reason, retry_after=None):
+        super().__init__(message)
+        self.reason = reason
+        self.retry_after = retry_after
+
+class UpstreamThrottled(UpstreamUnavailable):
+    """
+    The call would have exceeded a rate or concurrency limit before the
+    queue timeout, so it was shed instead of sent.
+    """
+
+class CircuitOpen(UpstreamUnavailable):
+    """
+    The circuit breaker is open after repeated upstream failures.
+    """
+
+def parse_duration(value):
+    """
+    Seconds in an OpenAI reset header value such as '1s', '6m0s' or '20ms'.
+    """
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = DURATION_RE.findall(value)
+    return sum(float(number) * DURATION_UNITS[unit] for number, unit in parts) if parts else None
+
+def rate_limit_headers(headers):
+    """
+    The request and token limits reported by OpenAI's x-ratelimit-* headers,
+    as {'requests': (limit, remaining), 'tokens': (limit, remaining)}.
+    """
+    limits = {}
+    if not headers:
+        return limits
+    for kind in ('requests', 'tokens'):
+        limit = headers.get(f'x-ratelimit-limit-{kind}')
+        remaining = headers.get(f'x-ratelimit-remaining-{kind}')
+        if limit or remaining:
+            limits[kind] = (limit or '', remaining or '')
+    return limits
+
+def retry_after(error):
+    """
+    Seconds the upstream asked us to wait in a 429 response, if it said.
+    """
+    headers = getattr(getattr(error, 'response', None), 'headers', None)
+    if not headers:
+        return None
+    if headers.get('retry-after-ms'):
+        return parse_duration(headers['retry-after-ms'] + 'ms')
+    return parse_duration(headers.get('retry-after')) or parse_duration(headers.get('x-ratelimit-reset-requests'))
+
+class LocalLimiter:
+    """
+    In-process stand-in for the Redis scripts, used when Redis is not
+    configured (tests, single-process development) or unreachable. Same
+    semantics, but the buckets are per process.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {'requests': {}, 'tokens': {}}
+        self._leases = {}
+        self._breaker = {'open_until': 0, 'tripped_until': 0, 'probe_until': 0, 'failures': 0, 'window_until': 0}
+
+    def acquire(self, rpm, tpm, tokens, max_concurrency, lease_id, lease_ttl, headroom):
+        with self._lock:
+            now = time.monotonic()
+            breaker = self._breaker
+            if breaker['open_until'] > now:
+                return 0, breaker['open_until'] - now, 'breaker_open'
+            half_open = breaker['tripped_until'] > now
+            if half_open and breaker['probe_until'] > now:
+                return 0, 1.0, 'breaker_open'
+
+            if max_concurrency > 0:
+                self._leases = {lease: until for lease, until in self._leases.items() if until > now}
+                if len(self._leases) >= max_concurrency:
+                    return 0, 0.05, 'concurrency'
+
+            requests, request_capacity = self._refill('requests', rpm, headroom, now)
+            available, token_capacity = self._refill('tokens', tpm, headroom, now)
+            needed = min(tokens, token_capacity)
+            wait, reason = 0, ''
+            if requests < 1:
+                wait, reason = (1 - requests) * 60 / request_capacity, 'requests'
+            if available < needed and (needed - available) * 60 / token_capacity > wait:
+                wait, reason = (needed - available) * 60 / token_capacity, 'tokens'
+            if wait > 0:
+                return 0, wait, reason
+
+            probe = ''
+            if half_open:
+                breaker['probe_until'] = now + lease_ttl
+                probe = 'probe'
+            self._buckets['requests'].update(level=requests - 1, ts=now)
+            self._buckets['tokens'].update(level=available - needed, ts=now)
+            if max_concurrency > 0:
+                self._leases[lease_id] = now + lease_ttl
+            return 1, 0, probe
+
+    def release(self, lease_id, refund, outcome, threshold, window, cooldown):
+        with self._lock:
+            now = time.monotonic()
+            self._leases.pop(lease_id, None)
+            if refund > 0 and 'level' in self._buckets['tokens']:
+                self._buckets['tokens']['level'] += refund
+
+            breaker = self._breaker
+            if outcome == 'success':
+                breaker.update(tripped_until=0, probe_until=0, failures=0)
+            elif outcome == 'failure':
+                if breaker['window_until'] <= now:
+                    breaker.update(failures=0, window_until=now + window)
+                breaker['failures'] += 1
+                if breaker['tripped_until'] > now or breaker['failures'] >= threshold:
+                    breaker.update(open_until=now + cooldown, tripped_until=now + cooldown * 10,
+                                   probe_until=0, failures=0)
+                    return 1
+            elif outcome == 'neutral':
+                breaker['probe_until'] = 0
+            return 0
+
+    def observe(self, kind, limit, remaining, default_limit, headroom):
+        with self._lock:
+            now = time.monotonic()
+            bucket = self._buckets[kind]
+            if limit:
+                bucket['limit'] = float(limit)
+            level, capacity = self._refill(kind, default_limit, headroom, now)
+            if remaining:
+                level = min(level, float(remaining) * headroom)
+            bucket.update(level=level, ts=now)
+
+    def _refill(self, kind, default_limit, headroom, now):
+        bucket = self._buckets[kind]
+        capacity = bucket.get('limit', default_limit) * headroom
+        level = bucket.get('level', capacity)
+        elapsed = max(0, now - bucket.get('ts', now))
+        return min(capacity, level + elapsed * capacity / 60), capacity
+
+class RedisLimiter:
+    """
+    Buckets, concurrency leases and breaker state kept in Redis and updated
+    by one script call per acquire and per release, so every worker shares
+    them. Works with both the sync and the asyncio Redis clients; with the
+    latter every method returns an awaitable.
+    """
+
+    def __init__(self, redis_client, prefix):
+        self.keys = [f"{prefix}:{name}" for name in KEY_NAMES]
+        self._acquire = redis_client.register_script(ACQUIRE_SCRIPT)
+        self._release = redis_client.register_script(RELEASE_SCRIPT)
+        self._observe = redis_client.register_script(OBSERVE_SCRIPT)
+
+    def acquire(self, rpm, tpm, tokens, max_concurrency, lease_id, lease_ttl, headroom):
+        return self._acquire(keys=self.keys, args=[
+            rpm, tpm, tokens, max_concurrency, lease_id, int(lease_ttl * 1000), headroom, BUCKET_TTL * 1000
+        ])
+
+    def release(self, lease_id, refund, outcome, threshold, window, cooldown):
+        return self._release(keys=self.keys, args=[
+            lease_id, refund, outcome, threshold, int(window * 1000), int(cooldown * 1000)
+        ])
+
+    def observe(self, kind, limit, remaining, default_limit, headroom):
+        return self._observe(keys=self.keys, args=[
+            KEY_NAMES.index(kind) + 1, limit, remaining, default_limit, headroom, BUCKET_TTL * 1000
+        ])
+
+class Slot:
+    """
+    Permission for one upstream call. Report the tokens the call actually
+    used with `used` so the unused part of the reservation is refunded.
+    """
+
+    __slots__ = ('lease_id', 'tokens', 'probe', 'refund')
+
+    def __init__(self, lease_id, tokens, probe=False):
+        self.lease_id = lease_id
+        self.tokens = tokens
+        self.probe = probe
+        self.refund = 0
+
+    def used(self, tokens):
+        if tokens is not None:
+            self.refund = max(0, self.tokens - tokens)
+
+class UpstreamGovernor:
+    """
+    Paces calls to OpenAI so we stay under its limits instead of finding
+    out from a RateLimitError.
+
+    Each call takes a request and its estimated tokens from token buckets
+    sized to the requests- and tokens-per-minute limits, and a lease that
+    caps concurrent upstream calls. The limits start from config and are
+    corrected from the x-ratelimit-* headers of every response. A call that
+    cannot start within `queue_timeout`, or that finds `max_queued` callers
+    already waiting in this process, is shed with UpstreamThrottled.
+
+    A circuit breaker opens after `breaker_threshold` rate limit or server
+    errors within `breaker_window` seconds. While it is open calls fail fast
+    with CircuitOpen; after the cooldown (or the upstream's Retry-After, if
+    longer) a single probe call is let through and its outcome closes or
+    reopens the breaker.
+
+    State lives in Redis when it is available, so all workers share it, and
+    in a LocalLimiter otherwise.
+    """
+
+    def __init__(self, redis_client=None, rpm=3500, tpm=90000, max_concurrency=32, headroom=0.9,
+                 queue_timeout=5.0, max_queued=64, lease_ttl=120.0, breaker_threshold=5, breaker_window=30.0,
+                 breaker_cooldown=30.0, prefix='upstream', enabled=True, local=None, logger=None):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_concurrency = max_concurrency
+        self.headroom = headroom
+        self.queue_timeout = queue_timeout
+        self.max_queued = max_queued
+        self.lease_ttl = lease_ttl
+        self.breaker_threshold = breaker_threshold
+        self.breaker_window = breaker_window
+        self.breaker_cooldown = breaker_cooldown
+        self.enabled = enabled
+        self.logger = logger
+        # Pass the WSGI app's limiter to an ASGI governor so both share one budget
+        self.local = local or LocalLimiter()
+        self.limiter = RedisLimiter(redis_client, prefix) if redis_client is not None else self.local
+        self._queued = 0
+        self._stats_lock = threading.Lock()
+        self._stats = {'granted': 0, 'queued': 0, 'wait_seconds': 0.0, 'shed': 0, 'breaker_rejected': 0,
+                       'breaker_trips': 0, 'limiter_errors': 0}
+
+    @classmethod
+    def from_config(cls, config, redis_client=None, local=None, logger=None):
+        return cls(
+            redis_client,
+            rpm=config['UPSTREAM_RPM'],
+            tpm=config['UPSTREAM_TPM'],
+            max_concurrency=config['UPSTREAM_MAX_CONCURRENCY'],
+            headroom=config['UPSTREAM_HEADROOM'],
+            queue_timeout=config['UPSTREAM_QUEUE_TIMEOUT'],
+            max_queued=config['UPSTREAM_MAX_QUEUED'],
+            # A lease outlives the longest call the OpenAI client can make, retries included
+            lease_ttl=config['OPENAI_TIMEOUT'] * (config['OPENAI_MAX_RETRIES'] + 1) + 5,
+            breaker_threshold=config['UPSTREAM_BREAKER_THRESHOLD'],
+            breaker_window=config['UPSTREAM_BREAKER_WINDOW'],
+            breaker_cooldown=config['UPSTREAM_BREAKER_COOLDOWN'],
+            enabled=config['UPSTREAM_GOVERNOR_ENABLED'],
+            local=local,
+            logger=logger
+        )
+
+    @contextlib.contextmanager
+    def slot(self, tokens):
+        """
+        Wait for permission to make one upstream call that may use `tokens`
+        tokens, and record its outcome. Raises UpstreamUnavailable when the
+        call should not be made.
+        """
+        if not self.enabled:
+            yield Slot(None, tokens)
+            return
+
+        slot = self._wait(tokens)
+        outcome, cooldown = 'success', self.breaker_cooldown
+        try:
+            yield slot
+        except BREAKER_ERRORS as e:
+            outcome = 'failure'
+            cooldown = max(cooldown, retry_after(e) or 0)
+            if isinstance(e, openai.RateLimitError):
+                self.observe(e.response.headers)
+            raise
+        except BaseException:
+            # Our own errors and disconnected clients say nothing about the upstream
+            outcome = 'neutral'
+            raise
+        finally:
+            self._finish(self._call(self.limiter.release, slot.lease_id, slot.refund, outcome,
+                                    self.breaker_threshold, self.breaker_window, cooldown))
+
+    def observe(self, headers):
+        """
+        Correct the buckets from the x-ratelimit-* headers of a response.
+        """
+        if not self.enabled:
+            return
+        for kind, (limit, remaining) in rate_limit_headers(headers).items():
+            self._call(self.limiter.observe, kind, limit, remaining, self._default_limit(kind), self.headroom)
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['wait_seconds'] = round(stats['wait_seconds'], 3)
+        stats['waiting'] = self._queued
+        stats['backend'] = 'redis' if self.limiter is not self.local else 'local'
+        return stats
+
+    def _wait(self, tokens):
+        deadline = time.monotonic() + self.queue_timeout
+        lease_id = uuid.uuid4().hex
+        queued = False
+        try:
+            while True:
+                granted, wait, reason = self._decode(self._call(
+                    self.limiter.acquire, self.rpm, self.tpm, tokens, self.max_concurrency,
+                    lease_id, self.lease_ttl, self.headroom
+                ))
+                if granted:
+                    return self._granted(lease_id, tokens, reason, deadline, queued)
+                self._refuse(reason, wait, deadline, queued)
+                if not queued:
+                    queued = self._enqueue()
+                time.sleep(self._backoff(wait, deadline))
+        finally:
+            if queued:
+                self._dequeue()
+
+    def _call(self, method, *args):
+        try:
+            return method(*args)
+        except Exception as e:
+            if method.__self__ is self.local:
+                raise
+            # Never fail a chat request because Redis is down: pace this process on its own
+            self._record('limiter_errors')
+            self._warn(f"Upstream governor Redis error: {str(e)}")
+            return getattr(self.local, method.__name__)(*args)
+
+    def _decode(self, result):
+        granted, wait, reason = result
+        if isinstance(reason, bytes):
+            reason = reason.decode()
+        # The Redis scripts answer in integer milliseconds, LocalLimiter in seconds
+        if not isinstance(wait, float):
+            wait = wait / 1000
+        return bool(granted), wait, reason
+
+    def _finish(self, opened):
+        if opened:
+            self._record('breaker_trips')
+            self._warn("Upstream circuit breaker opened")
+
+    def _granted(self, lease_id, tokens, reason, deadline, queued):
+        self._record('granted')
+        if queued:
+            with self._stats_lock:
+                self._stats['wait_seconds'] += self.queue_timeout - (deadline - time.monotonic())
+        return Slot(lease_id, tokens, probe=reason == 'probe')
+
+    def _refuse(self, reason, wait, deadline, queued):
+        """
+        Raise if the call cannot start before the deadline.
+        """
+        if reason == 'breaker_open':
+            self._record('breaker_rejected')
+            raise CircuitOpen("Upstream circuit breaker is open", reason, retry_after=wait)
+        if time.monotonic() + wait > deadline or (not queued and self._queued >= self.max_queued):
+            self._record('shed')
+            raise UpstreamThrottled(f"Upstream {reason} limit reached", reason, retry_after=wait)
+
+    def _enqueue(self):
+        with self._stats_lock:
+            self._queued += 1
+            self._stats['queued'] += 1
+        return True
+
+    def _dequeue(self):
+        with self._stats_lock:
+            self._queued -= 1
+
+    @staticmethod
+    def _backoff(wait, deadline):
+        # Jitter so waiting workers do not retry in lockstep
+        return max(0, min(wait * random.uniform(1.0, 1.2), deadline - time.monotonic()))
+
+    def _default_limit(self, kind):
+        return self.rpm if kind == 'requests' else self.tpm
+
+    def _record(self, counter):
+        with self._stats_lock:
+            self._stats[counter] += 1
+
+    def _warn(self, message):
+        if self.logger:
+            self.logger.warning(message)
+
+class AsyncUpstreamGovernor(UpstreamGovernor):
+    """
+    UpstreamGovernor for the ASGI path: Redis is a `redis.asyncio` client
+    and waiting happens on the event loop.
+    """
+
+    @contextlib.asynccontextmanager
+    async def slot(self, tokens):
+        if not self.enabled:
+            yield Slot(None, tokens)
+            return
+
+        slot = await self._wait(tokens)
+        outcome, cooldown = 'success', self.breaker_cooldown
+        try:
+            yield slot
+        except BREAKER_ERRORS as e:
+            outcome = 'failure'
+            cooldown = max(cooldown, retry_after(e) or 0)
+            if isinstance(e, openai.RateLimitError):
+                await self.observe(e.response.headers)
+            raise
+        except BaseException:
+            outcome = 'neutral'
+            raise
+        finally:
+            self._finish(await self._call(self.limiter.release, slot.lease_id, slot.refund, outcome,
+                                          self.breaker_threshold, self.breaker_window, cooldown))
+
+    async def observe(self, headers):
+        if not self.enabled:
+            return
+        for kind, (limit, remaining) in rate_limit_headers(headers).items():
+            await self._call(self.limiter.observe, kind, limit, remaining, self._default_limit(kind), self.headroom)
+
+    async def _wait(self, tokens):
+        deadline = time.monotonic() + self.queue_timeout
+        lease_id = uuid.uuid4().hex
+        queued = False
+        try:
+            while True:
+                granted, wait, reason = self._decode(await self._call(
+                    self.limiter.acquire, self.rpm, self.tpm, tokens, self.max_concurrency,
+                    lease_id, self.lease_ttl, self.headroom
+                ))
+                if granted:
+                    return self._granted(lease_id, tokens, reason, deadline, queued)
+                self._refuse(reason, wait, deadline, queued)
+                if not queued:
+                    queued = self._enqueue()
+                await asyncio.sleep(self._backoff(wait, deadline))
+        finally:
+            if queued:
+                self._dequeue()
+
+    async def _call(self, method, *args):
+        try:
+            result = method(*args)
+            return await result if inspect.isawaitable(result) else result
+        except Exception as e:
+            if method.__self__ is self.local:
+                raise
+            self._record('limiter_errors')
+            self._warn(f"Upstream governor Redis error: {str(e)}")
+            return getattr(self.local, method.__name__)(*args)
@@ -0,0 +1,196 @@
+import os
+import threading
+
+import httpx
+import openai
+
+from services.llm_stub import StubBehavior, StubLLMServer
+
+class OpenAIProvider:
+    """
+    Process-wide OpenAI clients sharing one keep-alive HTTP connection pool.
+
+    Created once in create_app. Connection pools must not be shared across
+    forked gunicorn workers, so the clients are built lazily and rebuilt when
+    the provider is first used in a new process.
+
+    A provider hands out clients with the `openai` SDK's interface, whatever
+    serves them, so the routes, the upstream governor (which reads the
+    x-ratelimit-* headers) and the fallback on `openai.RateLimitError` work
+    the same with every provider. Providers are picked by LLM_PROVIDER, see
+    create_provider.
+    """
+
+    name = 'openai'
+
+    def __init__(self, api_key, model, base_url=None, max_connections=20, max_keepalive_connections=10,
+                 keepalive_expiry=60.0, timeout=60.0, connect_timeout=5.0, max_retries=2):
+        self.api_key = api_key
+        self.model = model
+        self.base_url = base_url
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout, pool=timeout)
+        self.max_retries = max_retries
+        self._lock = threading.Lock()
+        self._pid = None
+        self._client = None
+        self._http_client = None
+
+    @classmethod
+    def from_config(cls, config, **kwargs):
+        return cls(
+            api_key=config.get('OPENAI_API_KEY'),
+            model=config['OPENAI_MODEL'],
+            base_url=config.get('OPENAI_BASE_URL'),
+            max_connections=config['OPENAI_MAX_CONNECTIONS'],
+            max_keepalive_connections=config['OPENAI_MAX_KEEPALIVE_CONNECTIONS'],
+            keepalive_expiry=config['OPENAI_KEEPALIVE_EXPIRY'],
+            timeout=config['OPENAI_TIMEOUT'],
+            connect_timeout=config['OPENAI_CONNECT_TIMEOUT'],
+            max_retries=config['OPENAI_MAX_RETRIES'],
+            **kwargs
+        )
+
+    @property
+    def configured(self):
+        """
+        Whether completions can be requested at all (an API key is set).
+        """
+        return bool(self.api_key)
+
+    def describe(self):
+        return {'provider': self.name, 'model': self.model, 'base_url': self.base_url}
+
+    @property
+    def client(self):
+        """
+        The shared `openai.OpenAI` client for this process.
+        """
+        if self._client is None or self._pid != os.getpid():
+            with self._lock:
+                if self._client is None or self._pid != os.getpid():
+                    self._build()
+        return self._client
+
+    def create_async_client(self):
+        """
+        Build an `openai.AsyncOpenAI` client with the same pool settings.
+        It belongs to the caller's event loop, so the caller must close it.
+        """
+        http_client = httpx.AsyncClient(limits=self.limits, timeout=self.timeout)
+        return openai.AsyncOpenAI(
+            api_key=self.api_key,
+            base_url=self.endpoint(),
+            max_retries=self.max_retries,
+            http_client=http_client
+        )
+
+    def pool_stats(self):
+        """
+        Connection pool metrics for this process.
+        """
+        stats = {
+            'max_connections': self.limits.max_connections,
+            'connections_open': 0,
+            'connections_idle': 0,
+            'requests_waiting': 0,
+        }
+        # httpx does not expose its pool, so read httpcore's state defensively
+        pool = getattr(getattr(self._http_client, '_transport', None), '_pool', None)
+        if pool is None or self._pid != os.getpid():
+            return stats
+        connections = pool.connections
+        stats['connections_open'] = len(connections)
+        stats['connections_idle'] = sum(1 for connection in connections if connection.is_idle())
+        stats['requests_waiting'] = sum(
+            1 for pool_request in getattr(pool, '_requests', []) if getattr(pool_request, 'connection', None) is None
+        )
+        return stats
+
+    def endpoint(self):
+        """
+        Base URL the clients send requests to; None for OpenAI's own.
+        """
+        return self.base_url
+
+    def close(self):
+        with self._lock:
+            if self._client is not None and self._pid == os.getpid():
+                self._client.close()
+            self._client = None
+            self._http_client = None
+
+    def _build(self):
+        # A client inherited from the parent process is dropped, not closed,
+        # since its sockets are shared with the parent
+        self._http_client = httpx.Client(limits=self.limits, timeout=self.timeout)
+        self._client = openai.OpenAI(
+            api_key=self.api_key,
+            base_url=self.endpoint(),
+            max_retries=self.max_retries,
+            http_client=self._http_client
+        )
+        self._pid = os.getpid()
+
+class StubProvider(OpenAIProvider):
+    """
+    OpenAI clients pointed at a local stub server (services.llm_stub)
+    instead of OpenAI, for load tests and benchmarks that must not spend
+    money or meet OpenAI's rate limits. Requests still go through the SDK,
+    the connection pool and real HTTP, so errors, retries and headers are
+    handled exactly as in production.
+
+    With LLM_STUB_URL the clients use that server (start one with
+    benchmarks/stub_llm.py to share it, and its per-minute limits, across
+    workers); otherwise each process starts its own on a free port.
+    """
+
+    name = 'stub'
+
+    def __init__(self, behavior=None, stub_url=None, **kwargs):
+        super().__init__(**kwargs)
+        # The stub accepts any key
+        self.api_key = self.api_key or 'stub'
+        self.behavior = behavior or StubBehavior()
+        self.stub_url = stub_url
+        self._server = None
+        self._server_pid = None
+        self._server_lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config, **kwargs):
+        return super().from_config(
+            config, behavior=StubBehavior.from_config(config), stub_url=config.get('LLM_STUB_URL'), **kwargs
+        )
+
+    def describe(self):
+        return {'provider': self.name, 'model': self.model, 'base_url': self.stub_url, 'stub': self.behavior.describe()}
+
+    def endpoint(self):
+        if self.stub_url:
+            return self.stub_url
+        # Like the clients, a server thread does not survive a fork
+        if self._server is None or self._server_pid != os.getpid():
+            with self._server_lock:
+                if self._server is None or self._server_pid != os.getpid():
+                    self._server = StubLLMServer(('127.0.0.1', 0), self.behavior).start()
+                    self._server_pid = os.getpid()
+        return self._server.base_url
+
+PROVIDERS = {
+    OpenAIProvider.name: OpenAIProvider,
+    StubProvider.name: StubProvider,
+}
+
+def create_provider(config):
+    """
+    The LLM provider named by LLM_PROVIDER.
+    """
+    name = config['LLM_PROVIDER']
+    if name not in PROVIDERS:
+        raise ValueError(f"Unknown LLM_PROVIDER {name!r}, expected one of: {', '.join(PROVIDERS)}")
+    return PROVIDERS[name].from_config(config)
@@ -0,0 +1,305 @@
+import json
+import math
+import time
+import random
+import threading
+import itertools
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPLIES = [
+    "Most adults need 7-9 hours of sleep per night. Keep a consistent schedule, "
+    "limit caffeine late in the day and talk to a healthcare provider if problems persist.",
+    "Mild headaches often respond to rest, fluids and over-the-counter pain relief. "
+    "See a doctor if a headache is sudden and severe, or comes with fever, a stiff neck or confusion.",
+    "A fever is usually the body fighting an infection. Rest, drink plenty of fluids and seek "
+    "medical attention if it goes above 39.4°C (103°F) or lasts more than three days.",
+    "Aim for at least 150 minutes of moderate activity a week, spread over several days, "
+    "and check with your doctor before starting if you have a heart condition.",
+]
+
+def parse_distribution(spec):
+    """
+    Parse a latency spec into a function drawing seconds from a
+    random.Random: '0.5' (fixed), 'uniform:0.2,0.8', 'normal:0.5,0.1'
+    (mean, stdev), 'lognormal:0.5,0.6' (median, sigma) or
+    'exponential:0.5' (mean). Draws are never negative.
+    """
+    kind, _, args = str(spec).partition(':')
+    kind = kind.strip().lower()
+    if not args:
+        try:
+            value = float(kind)
+        except ValueError:
+            raise ValueError(f"Invalid latency distribution: {spec!r}")
+        return lambda rng: value
+    params = [float(arg) for arg in args.split(',')]
+    if kind == 'uniform':
+        low, high = params
+        return lambda rng: rng.uniform(low, high)
+    if kind == 'normal':
+        mean, stdev = params
+        return lambda rng: max(0.0, rng.gauss(mean, stdev))
+    if kind == 'lognormal':
+        median, sigma = params
+        return lambda rng: rng.lognormvariate(math.log(median), sigma)
+    if kind == 'exponential':
+        mean, = params
+        return lambda rng: rng.expovariate(1 / mean) if mean > 0 else 0.0
+    raise ValueError(f"Invalid latency distribution: {spec!r}")
+
+def count_tokens(text):
+    # Close enough to OpenAI's tokenizer for English prose
+    return max(1, len(text) // 4)
+
+class StubPlan:
+    """
+    What the stub does with one request: the HTTP status, how long to wait
+    before the first byte, the reply words and the delay between them,
+    and the headers to send.
+    """
+
+    __slots__ = ('status', 'delay', 'words', 'token_delay', 'headers', 'error')
+
+    def __init__(self, status, delay, words=(), token_delay=0.0, headers=None, error=None):
+        self.status = status
+        self.delay = delay
+        self.words = list(words)
+        self.token_delay = token_delay
+        self.headers = headers or {}
+        self.error = error
+
+class StubBehavior:
+    """
+    How a stub LLM answers: time to first token drawn from a latency
+    distribution, replies streamed at `token_rate` tokens per second (0 for
+    all at once), random 500s and 429s at the given rates, and optional
+    requests- and tokens-per-minute limits enforced like OpenAI's, with the
+    same x-ratelimit-* headers and 429s once a limit is used up.
+
+    Every random choice comes from a generator seeded with `seed` and the
+    request's sequence number, so a run with the same seed and the same
+    request order gets the same latencies, replies and errors.
+    """
+
+    def __init__(self, latency='0.5', token_rate=0.0, reply_tokens=0, error_rate=0.0, rate_limit_rate=0.0,
+                 rpm=0, tpm=0, seed=0):
+        self.latency_spec = str(latency)
+        self.latency = parse_distribution(latency)
+        self.token_rate = token_rate
+        self.reply_tokens = reply_tokens
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.rpm = rpm
+        self.tpm = tpm
+        self.seed = seed
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._window = (None, 0, 0)  # (minute, requests, tokens)
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            latency=config['LLM_STUB_LATENCY'],
+            token_rate=config['LLM_STUB_TOKEN_RATE'],
+            reply_tokens=config['LLM_STUB_REPLY_TOKENS'],
+            error_rate=config['LLM_STUB_ERROR_RATE'],
+            rate_limit_rate=config['LLM_STUB_RATE_LIMIT_RATE'],
+            rpm=config['LLM_STUB_RPM'],
+            tpm=config['LLM_STUB_TPM'],
+            seed=config['LLM_STUB_SEED']
+        )
+
+    def describe(self):
+        return {
+            'latency': self.latency_spec,
+            'token_rate': self.token_rate,
+            'reply_tokens': self.reply_tokens,
+            'error_rate': self.error_rate,
+            'rate_limit_rate': self.rate_limit_rate,
+            'rpm': self.rpm,
+            'tpm': self.tpm,
+            'seed': self.seed,
+        }
+
+    def plan(self, body):
+        rng = random.Random(f"{self.seed}:{next(self._sequence)}")
+        delay = self.latency(rng)
+
+        prompt_tokens = sum(count_tokens(str(message.get('content') or '')) for message in body.get('messages', []))
+        allowed, headers = self._count(prompt_tokens + int(body.get('max_tokens') or 0))
+        if not allowed:
+            return StubPlan(429, 0.0, headers=headers, error=(
+                'rate_limit_exceeded', 'requests', 'Rate limit reached for requests (stub). Please try again later.'
+            ))
+
+        draw = rng.random()
+        if draw < self.rate_limit_rate:
+            headers['retry-after'] = '1'
+            return StubPlan(429, delay, headers=headers, error=(
+                'rate_limit_exceeded', 'requests', 'Rate limit reached (stub, injected). Please try again later.'
+            ))
+        if draw < self.rate_limit_rate + self.error_rate:
+            return StubPlan(500, delay, headers=headers, error=(
+                None, 'server_error', 'The server had an error while processing your request (stub, injected).'
+            ))
+
+        words = rng.choice(REPLIES).split(' ')
+        if self.reply_tokens:
+            words = list(itertools.islice(itertools.cycle(words), self.reply_tokens))
+        token_delay = 1 / self.token_rate if self.token_rate else 0.0
+        return StubPlan(200, delay, words, token_delay, headers)
+
+    def _count(self, tokens):
+        """
+        Count one request against the per-minute limits. Returns whether it
+        is allowed and the x-ratelimit-* headers to send.
+        """
+        if not self.rpm and not self.tpm:
+            return True, {}
+        with self._lock:
+            now = time.time()
+            minute = int(now // 60)
+            current, requests, used = self._window
+            if current != minute:
+                requests, used = 0, 0
+            allowed = (not self.rpm or requests < self.rpm) and (not self.tpm or used + tokens <= self.tpm)
+            if allowed:
+                requests += 1
+                used += tokens
+            self._window = (minute, requests, used)
+
+        reset = f"{math.ceil((minute + 1) * 60 - now)}s"
+        headers = {}
+        if self.rpm:
+            headers.update({
+                'x-ratelimit-limit-requests': str(self.rpm),
+                'x-ratelimit-remaining-requests': str(max(0, self.rpm - requests)),
+                'x-ratelimit-reset-requests': reset,
+            })
+        if self.tpm:
+            headers.update({
+                'x-ratelimit-limit-tokens': str(self.tpm),
+                'x-ratelimit-remaining-tokens': str(max(0, self.tpm - used)),
+                'x-ratelimit-reset-tokens': reset,
+            })
+        return allowed, headers
+
+class StubLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        if not self.path.endswith('/chat/completions'):
+            self.send_error(404)
+            return
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        plan = self.server.behavior.plan(body)
+        time.sleep(plan.delay)
+
+        if plan.status != 200:
+            code, kind, message = plan.error
+            self._send_json({'error': {'message': message, 'type': kind, 'param': None, 'code': code}},
+                            plan.status, plan.headers)
+            return
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        model = body.get('model', 'stub')
+        if body.get('stream'):
+            self._stream(completion_id, model, plan, body)
+            return
+
+        time.sleep(plan.token_delay * len(plan.words))
+        reply = ' '.join(plan.words)
+        prompt_tokens = sum(count_tokens(str(message.get('content') or '')) for message in body.get('messages', []))
+        self._send_json({
+            'id': completion_id,
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': model,
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': reply},
+                'finish_reason': 'stop'
+            }],
+            'usage': {
+                'prompt_tokens': prompt_tokens,
+                'completion_tokens': len(plan.words),
+                'total_tokens': prompt_tokens + len(plan.words)
+            }
+        }, 200, plan.headers)
+
+    def _send_json(self, data, status, headers):
+        raw = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(raw)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def _stream(self, completion_id, model, plan, body):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        for name, value in plan.headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        for i, word in enumerate(plan.words):
+            if i and plan.token_delay:
+                time.sleep(plan.token_delay)
+            chunk = {
+                'id': completion_id,
+                'object': 'chat.completion.chunk',
+                'created': int(time.time()),
+                'model': model,
+                # Deltas join up to the non-streamed reply
+                'choices': [{'index': 0, 'delta': {'content': (' ' if i else '') + word}, 'finish_reason': None}]
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.wfile.flush()
+        if (body.get('stream_options') or {}).get('include_usage'):
+            prompt_tokens = sum(count_tokens(str(message.get('content') or '')) for message in body.get('messages', []))
+            chunk = {
+                'id': completion_id,
+                'object': 'chat.completion.chunk',
+                'created': int(time.time()),
+                'model': model,
+                'choices': [],
+                'usage': {
+                    'prompt_tokens': prompt_tokens,
+                    'completion_tokens': len(plan.words),
+                    'total_tokens': prompt_tokens + len(plan.words)
+                }
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+class StubLLMServer(ThreadingHTTPServer):
+    """
+    OpenAI-compatible chat completions server answering according to a
+    StubBehavior. `latency` is a shorthand for StubBehavior(latency=...).
+    """
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, address, behavior=None, latency=None):
+        super().__init__(address, StubLLMHandler)
+        self.behavior = behavior or StubBehavior(latency=0.5 if latency is None else latency)
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        """
+        Serve from a daemon thread and return self.
+        """
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
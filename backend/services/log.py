@@ -0,0 +1,238 @@
+import os
+import re
+import sys
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from flask import has_request_context, request
+
+# Attributes every LogRecord has; anything else was passed through `extra`
+RECORD_ATTRS = frozenset(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per record: time, level, logger, message, process and
+    thread, the request it was logged from, the traceback, and any fields
+    passed with `extra`.
+    """
+
+    def format(self, record):
+        data = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'pid': record.process,
+            'thread': record.threadName,
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRS and not key.startswith('_'):
+                data[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exc_info'] = record.exc_text
+        return json.dumps(data, default=str)
+
+class TextFormatter(logging.Formatter):
+    """
+    The classic one-line format, noting how many similar records were
+    suppressed before this one.
+    """
+
+    def format(self, record):
+        line = super().format(record)
+        suppressed = getattr(record, 'suppressed', 0)
+        return f"{line} ({suppressed} similar suppressed)" if suppressed else line
+
+class RequestContextFilter(logging.Filter):
+    """
+    Tag records logged while handling a request with its method and path.
+    Runs in the thread that logs, before the record is queued.
+    """
+
+    def filter(self, record):
+        if has_request_context():
+            record.method = request.method
+            record.path = request.path
+        return True
+
+class RepeatFilter(logging.Filter):
+    """
+    Let through at most `burst` similar warnings or errors per `window`
+    seconds; the next one let through after that carries how many were
+    dropped as `suppressed`. Records are similar when they come from the
+    same logger at the same level and differ only in their numbers, so a
+    retry loop or an unreachable Redis logs a few lines per window instead
+    of one per request. CRITICAL records always pass.
+    """
+
+    DIGITS_RE = re.compile(r'\d+')
+    # Start over rather than grow without bound on ever-changing messages
+    MAX_KEYS = 10000
+
+    def __init__(self, window=60.0, burst=5):
+        super().__init__()
+        self.window = window
+        self.burst = burst
+        self._lock = threading.Lock()
+        self._seen = {}
+
+    def filter(self, record):
+        if self.burst <= 0 or not logging.WARNING <= record.levelno < logging.CRITICAL:
+            return True
+        message = record.msg if isinstance(record.msg, str) else str(record.msg)
+        key = (record.name, record.levelno, self.DIGITS_RE.sub('#', message)[:200])
+        now = time.monotonic()
+        with self._lock:
+            started, count, suppressed = self._seen.get(key, (now, 0, 0))
+            if now - started >= self.window:
+                started, count = now, 0
+            if count >= self.burst:
+                self._seen[key] = (started, count, suppressed + 1)
+                return False
+            if len(self._seen) >= self.MAX_KEYS:
+                self._seen.clear()
+            self._seen[key] = (started, count + 1, 0)
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    Hands records to the listener thread without blocking. Only the message
+    is rendered here (it may reference objects that change later); the
+    formatting and the write happen in the listener. When the queue is full
+    the record is dropped and counted rather than stalling the request.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class LogPipeline:
+    """
+    The process's log handling: loggers write to a bounded in-memory queue
+    and a single listener thread formats the records (JSON or text) and
+    writes them to stdout, so request threads never wait on log I/O.
+    """
+
+    def __init__(self, level='INFO', fmt='json', sql=False, use_queue=True, queue_size=10000,
+                 repeat_window=60.0, repeat_burst=5, stream=None):
+        self.level = level
+        self.sql = sql
+        self.output = logging.StreamHandler(stream or sys.stdout)
+        self.output.setFormatter(JsonFormatter() if fmt == 'json' else TextFormatter(TEXT_FORMAT))
+        self.listener = None
+        self._pid = os.getpid()
+        if use_queue:
+            self.handler = NonBlockingQueueHandler(queue.Queue(queue_size))
+            self.listener = QueueListener(self.handler.queue, self.output, respect_handler_level=True)
+        else:
+            self.handler = self.output
+        self.handler.addFilter(RequestContextFilter())
+        self.handler.addFilter(RepeatFilter(repeat_window, repeat_burst))
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            level=config['LOG_LEVEL'],
+            fmt=config['LOG_FORMAT'],
+            sql=config['LOG_SQL'],
+            use_queue=config['LOG_QUEUE'],
+            queue_size=config['LOG_QUEUE_SIZE'],
+            repeat_window=config['LOG_REPEAT_WINDOW'],
+            repeat_burst=config['LOG_REPEAT_BURST']
+        )
+
+    def install(self, app):
+        """
+        Route the root logger (and through it the app's and the libraries'
+        loggers) into this pipeline, replacing one installed by an earlier
+        create_app in this process.
+        """
+        global _installed
+        from flask.logging import default_handler
+
+        root = logging.getLogger()
+        if _installed is not None:
+            _installed.uninstall()
+        root.addHandler(self.handler)
+        root.setLevel(self.level)
+
+        app.logger.removeHandler(default_handler)
+        app.logger.setLevel(self.level)
+        # Engine logs go through this pipeline; SQLALCHEMY_ECHO would add a handler of its own
+        logging.getLogger('sqlalchemy.engine').setLevel(logging.INFO if self.sql else logging.WARNING)
+
+        self.start()
+        _installed = self
+        return self
+
+    def start(self):
+        if self.listener is not None:
+            self.listener.start()
+
+    def uninstall(self):
+        logging.getLogger().removeHandler(self.handler)
+        self.stop()
+
+    def stop(self):
+        """
+        Write out what is still queued and stop the listener thread.
+        """
+        if self.listener is not None and self.listener._thread is not None and self._pid == os.getpid():
+            self.listener.stop()
+
+    def _after_fork(self):
+        # The listener thread does not survive a fork (gunicorn --preload), and
+        # the inherited queue's lock may have been held by it; start afresh.
+        # Records still queued at the fork are written by the parent.
+        self._pid = os.getpid()
+        if self.listener is not None:
+            self.handler.queue = self.listener.queue = queue.Queue(self.handler.queue.maxsize)
+            self.listener._thread = None
+            self.listener.start()
+
+_installed = None
+
+def _stop_installed():
+    if _installed is not None:
+        _installed.stop()
+
+def _restart_installed():
+    if _installed is not None:
+        _installed._after_fork()
+
+atexit.register(_stop_installed)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_installed)
+
+def configure_logging(app):
+    """
+    Install the log pipeline described by the app's config.
+    """
+    return LogPipeline.from_config(app.config).install(app)
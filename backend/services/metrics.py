@@ -0,0 +1,193 @@
+import os
+import time
+from contextlib import contextmanager
+
+import openai
+from flask import g, has_app_context, has_request_context, request
+from sqlalchemy import event
+
+try:
+    from prometheus_client import CollectorRegistry, Counter, Histogram, generate_latest, multiprocess, CONTENT_TYPE_LATEST
+except ImportError:  # pragma: no cover - metrics are disabled without prometheus_client
+    CollectorRegistry = None
+    CONTENT_TYPE_LATEST = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+QUERY_BUCKETS = (0, 1, 2, 3, 4, 5, 7, 10, 15, 20, 30, 50)
+
+class Metrics:
+    """
+    Prometheus metrics for the request hot path: request latency, the time
+    spent in each stage of a request (auth, session, context, cache,
+    upstream, persist), cache hits and misses, fallback answers, upstream
+    latency and tokens, and the number of database queries per request.
+
+    Under gunicorn, set PROMETHEUS_MULTIPROC_DIR (see gunicorn.conf.py) so
+    every worker writes its samples there and /metrics reports the sum
+    over all workers; otherwise /metrics reports this process only.
+
+    Every method is a no-op when metrics are disabled or prometheus_client
+    is not installed.
+    """
+
+    def __init__(self, enabled=True, multiprocess_dir=None, prefix='chatbot', logger=None):
+        self.enabled = enabled and CollectorRegistry is not None
+        self.multiprocess_dir = multiprocess_dir
+        if enabled and CollectorRegistry is None and logger:
+            logger.warning("prometheus_client is not installed. Metrics will be disabled.")
+        if not self.enabled:
+            return
+
+        # A registry per app, so creating several apps in one process does not
+        # register the metrics twice; in multiprocess mode the samples go to
+        # files whatever the registry
+        self.registry = CollectorRegistry()
+        metric = lambda cls, name, doc, labels, **kwargs: cls(
+            f"{prefix}_{name}", doc, labels, registry=self.registry, **kwargs
+        )
+        self.requests = metric(Counter, 'http_requests', 'HTTP requests handled.', ['method', 'endpoint', 'status'])
+        self.request_seconds = metric(Histogram, 'http_request_duration_seconds', 'Time to build the response.',
+                                      ['method', 'endpoint'], buckets=LATENCY_BUCKETS)
+        self.stage_seconds = metric(Histogram, 'request_stage_duration_seconds', 'Time spent in each request stage.',
+                                    ['endpoint', 'stage'], buckets=LATENCY_BUCKETS)
+        self.db_queries = metric(Histogram, 'db_queries_per_request', 'Database queries issued per request.',
+                                 ['endpoint'], buckets=QUERY_BUCKETS)
+        self.cache_lookups = metric(Counter, 'cache_lookups', 'Response cache lookups.', ['cache', 'result'])
+        self.fallbacks = metric(Counter, 'fallback_responses', 'Answers from the fallback responder.', ['reason'])
+        self.upstream_seconds = metric(Histogram, 'upstream_request_duration_seconds', 'Latency of LLM calls.',
+                                       ['model', 'outcome'], buckets=LATENCY_BUCKETS)
+        self.upstream_tokens = metric(Histogram, 'upstream_tokens', 'Tokens per LLM call.', ['model', 'kind'],
+                                      buckets=TOKEN_BUCKETS)
+
+    @classmethod
+    def from_config(cls, config, logger=None):
+        return cls(
+            enabled=config['METRICS_ENABLED'],
+            multiprocess_dir=os.environ.get('PROMETHEUS_MULTIPROC_DIR'),
+            logger=logger
+        )
+
+    def init_app(self, app):
+        """
+        Time every Flask request and count the queries it sends to the database.
+        """
+        if not self.enabled:
+            return
+
+        @app.before_request
+        def start_request_metrics():
+            g.metrics_started = time.perf_counter()
+            g.metrics_queries = 0
+
+        @app.after_request
+        def record_request_metrics(response):
+            # Streamed bodies are timed up to their first byte
+            if 'metrics_started' in g:
+                self.observe_request(request.method, request.endpoint or 'unmatched', response.status_code,
+                                     time.perf_counter() - g.metrics_started, g.metrics_queries)
+            return response
+
+        with app.app_context():
+            from models.db import db
+            self.instrument_engine(db.engine)
+
+    def instrument_engine(self, engine):
+        """
+        Count the queries `engine` runs for the current request. For an
+        AsyncEngine pass its sync_engine.
+        """
+        if not self.enabled:
+            return
+        event.listen(engine, 'before_cursor_execute', self._count_query)
+
+    @staticmethod
+    def _count_query(*args):
+        if has_app_context() and 'metrics_queries' in g:
+            g.metrics_queries += 1
+
+    def endpoint(self):
+        if has_app_context() and 'metrics_endpoint' in g:
+            return g.metrics_endpoint
+        if has_request_context():
+            return request.endpoint or 'unmatched'
+        return 'background'
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Time the block as stage `name` of the current request.
+        """
+        if not self.enabled:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage_seconds.labels(self.endpoint(), name).observe(time.perf_counter() - started)
+
+    def observe_request(self, method, endpoint, status, seconds, queries=None):
+        if not self.enabled:
+            return
+        self.requests.labels(method, endpoint, str(status)).inc()
+        self.request_seconds.labels(method, endpoint).observe(seconds)
+        if queries is not None:
+            self.db_queries.labels(endpoint).observe(queries)
+
+    def cache_lookup(self, cache, hit):
+        if self.enabled:
+            self.cache_lookups.labels(cache, 'hit' if hit else 'miss').inc()
+
+    def fallback(self, reason):
+        if self.enabled:
+            self.fallbacks.labels(reason).inc()
+
+    def upstream(self, model, seconds, outcome, usage=None):
+        """
+        Record one LLM call: its latency, how it ended ('ok', 'rate_limited'
+        or 'error') and, when the response reported usage, its tokens.
+        """
+        if not self.enabled:
+            return
+        self.upstream_seconds.labels(model, outcome).observe(seconds)
+        for kind in ('prompt_tokens', 'completion_tokens'):
+            tokens = getattr(usage, kind, None)
+            if tokens is not None:
+                self.upstream_tokens.labels(model, kind.split('_')[0]).observe(tokens)
+
+    @contextmanager
+    def upstream_call(self, model):
+        """
+        Time an LLM call in the block; set `.usage` on the yielded object
+        to record the response's token usage.
+        """
+        call = UpstreamCall()
+        started = time.perf_counter()
+        try:
+            yield call
+        except openai.RateLimitError:
+            self.upstream(model, time.perf_counter() - started, 'rate_limited')
+            raise
+        except Exception:
+            self.upstream(model, time.perf_counter() - started, 'error')
+            raise
+        self.upstream(model, time.perf_counter() - started, 'ok', call.usage)
+
+    def render(self):
+        """
+        The exposition text for /metrics and its content type.
+        """
+        if not self.enabled:
+            return b'', CONTENT_TYPE_LATEST
+        if self.multiprocess_dir:
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+            return generate_latest(registry), CONTENT_TYPE_LATEST
+        return generate_latest(self.registry), CONTENT_TYPE_LATEST
+
+class UpstreamCall:
+    __slots__ = ('usage',)
+
+    def __init__(self):
+        self.usage = None
@@ -0,0 +1,76 @@
+import json
+import base64
+from datetime import datetime
+
+from sqlalchemy import and_, or_, func, select
+
+class InvalidCursor(ValueError):
+    pass
+
+def encode_cursor(sort_value, row_id):
+    """
+    Opaque token pointing just past the row with this sort value and id.
+    """
+    raw = json.dumps([sort_value.isoformat(), row_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        sort_value, row_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(sort_value), str(row_id)
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor(f"Invalid cursor: {str(e)}")
+
+def keyset_query(query, sort_column, id_column, cursor=None, limit=20, descending=True):
+    """
+    Restrict a select() to the page after `cursor`, ordered by (sort_column, id).
+
+    Unlike OFFSET, the database seeks straight to the cursor position through
+    the index, so deep pages cost the same as the first one, and rows inserted
+    ahead of the cursor never shift later pages. One extra row is fetched to
+    tell whether another page exists; pass the rows to keyset_result.
+    """
+    if cursor:
+        sort_value, row_id = decode_cursor(cursor)
+        if descending:
+            query = query.where(or_(sort_column < sort_value, and_(sort_column == sort_value, id_column < row_id)))
+        else:
+            query = query.where(or_(sort_column > sort_value, and_(sort_column == sort_value, id_column > row_id)))
+
+    if descending:
+        query = query.order_by(sort_column.desc(), id_column.desc())
+    else:
+        query = query.order_by(sort_column.asc(), id_column.asc())
+    return query.limit(limit + 1)
+
+def keyset_result(rows, sort_attribute, limit):
+    """
+    Trim the look-ahead row and build the cursor for the next page.
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    """
+    rows = list(rows)
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(getattr(last, sort_attribute), last.id)
+
+def page_params(args, default_limit=20, max_limit=100):
+    """
+    Read cursor, limit and include_total from a Flask or Starlette query string.
+    Returns (cursor, limit, include_total).
+    """
+    try:
+        limit = int(args.get('limit', default_limit))
+    except (TypeError, ValueError):
+        limit = default_limit
+    include_total = args.get('include_total', 'false').lower() in ('1', 'true')
+    return args.get('cursor'), max(1, min(limit, max_limit)), include_total
+
+def wants_page(args):
+    # Endpoints that used to return every row only paginate when asked to
+    return 'cursor' in args or 'limit' in args
+
+def count_query(query):
+    return select(func.count()).select_from(query.order_by(None).subquery())
@@ -0,0 +1,148 @@
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert, inspect, select, update, or_
+
+from models.chat import ChatSession, ChatMessage, ChatHistory
+
+TITLE_LENGTH = 30
+
+def new_session(user_id):
+    """
+    A chat session that only exists in memory until its first turn is saved,
+    so starting a conversation costs no commit of its own.
+    """
+    now = datetime.utcnow()
+    return ChatSession(id=str(uuid.uuid4()), user_id=user_id, created_at=now, updated_at=now)
+
+def is_new_session(session):
+    return inspect(session).transient
+
+def session_title(user_message):
+    # Use the first ~30 chars of user message as title
+    return user_message[:TITLE_LENGTH] + '...' if len(user_message) > TITLE_LENGTH else user_message
+
+def build_turn(session, user_id, user_message, assistant_response, set_title):
+    """
+    Everything one chat turn writes, as plain rows with their ids and
+    timestamps already assigned: the session state, both messages and the
+    history entry.
+    """
+    now = datetime.utcnow()
+    turn = {
+        'session': {
+            'id': session.id,
+            'user_id': session.user_id,
+            'title': session_title(user_message) if set_title else None,
+            'created_at': session.created_at or now,
+            'updated_at': now,
+            # Carries the rolling summary the context builder folded this turn
+            'summary': session.summary,
+            'summary_until': session.summary_until,
+        },
+        # The assistant row is stamped a microsecond later so the pair keeps its order
+        'messages': [
+            {'id': str(uuid.uuid4()), 'session_id': session.id, 'role': 'user',
+             'content': user_message, 'created_at': now},
+            {'id': str(uuid.uuid4()), 'session_id': session.id, 'role': 'assistant',
+             'content': assistant_response, 'created_at': now + timedelta(microseconds=1)},
+        ],
+    }
+    # History points at the message pair instead of storing the text again
+    turn['history'] = [
+        {'id': str(uuid.uuid4()), 'user_id': user_id, 'query': '', 'response': '',
+         'user_message_id': turn['messages'][0]['id'], 'assistant_message_id': turn['messages'][1]['id'],
+         'created_at': now},
+    ]
+    return turn
+
+def prepare_turn(db_session, session, user_id, user_message, assistant_response, set_title):
+    """
+    Stage the session changes of one chat turn on the ORM session and return
+    the bulk inserts for its rows as (statement, rows) pairs.
+
+    The session row goes through the ORM so a new session, the title, the
+    rolling summary folded by the context builder and the updated_at bump are
+    all written by a single flush.
+    """
+    turn = build_turn(session, user_id, user_message, assistant_response, set_title)
+    if is_new_session(session):
+        db_session.add(session)
+    if turn['session']['title']:
+        session.title = turn['session']['title']
+    session.updated_at = turn['session']['updated_at']
+    return [(insert(ChatMessage), turn['messages']), (insert(ChatHistory), turn['history'])]
+
+def save_turn(db_session, session, user_id, user_message, assistant_response, set_title):
+    """
+    Write the whole turn (session, both messages and the history entry) in
+    one transaction with a single commit.
+    """
+    try:
+        inserts = prepare_turn(db_session, session, user_id, user_message, assistant_response, set_title)
+        # The session row must exist before the messages that reference it
+        db_session.flush()
+        for statement, rows in inserts:
+            db_session.execute(statement, rows)
+        db_session.commit()
+    except Exception:
+        db_session.rollback()
+        raise
+
+async def save_turn_async(db_session, session, user_id, user_message, assistant_response, set_title):
+    """
+    save_turn for an AsyncSession.
+    """
+    try:
+        inserts = prepare_turn(db_session, session, user_id, user_message, assistant_response, set_title)
+        await db_session.flush()
+        for statement, rows in inserts:
+            await db_session.execute(statement, rows)
+        await db_session.commit()
+    except Exception:
+        await db_session.rollback()
+        raise
+
+def apply_turns(db_session, turns):
+    """
+    Write a batch of turns built by build_turn, in order, without committing.
+
+    Replaying a batch is harmless: rows whose id already exists are skipped,
+    and a session is only updated by a turn newer than its stored updated_at.
+    This is what lets the write-behind worker deliver at least once.
+    """
+    sessions = {}
+    for turn in turns:
+        state = turn['session']
+        merged = sessions.setdefault(state['id'], dict(state))
+        merged['updated_at'] = max(merged['updated_at'], state['updated_at'])
+        for key in ('title', 'summary', 'summary_until'):
+            if state[key] is not None:
+                merged[key] = state[key]
+
+    existing = set(db_session.execute(
+        select(ChatSession.id).where(ChatSession.id.in_(list(sessions)))
+    ).scalars())
+    new_sessions = []
+    for session_id, state in sessions.items():
+        if session_id not in existing:
+            new_sessions.append(dict(state, title=state['title'] or 'New Chat'))
+            continue
+        values = {key: state[key] for key in ('title', 'summary', 'summary_until') if state[key] is not None}
+        db_session.execute(
+            update(ChatSession)
+            .where(ChatSession.id == session_id)
+            .where(or_(ChatSession.updated_at.is_(None), ChatSession.updated_at < state['updated_at']))
+            .values(updated_at=state['updated_at'], **values)
+        )
+    if new_sessions:
+        db_session.execute(insert(ChatSession), new_sessions)
+
+    for model, key in ((ChatMessage, 'messages'), (ChatHistory, 'history')):
+        rows = [row for turn in turns for row in turn[key]]
+        written = set(db_session.execute(
+            select(model.id).where(model.id.in_([row['id'] for row in rows]))
+        ).scalars())
+        rows = [row for row in rows if row['id'] not in written]
+        if rows:
+            db_session.execute(insert(model), rows)
@@ -0,0 +1,225 @@
+import os
+import sys
+import hmac
+import time
+import uuid
+import threading
+from collections import Counter
+
+from flask import g, request
+
+HEX_DIGITS = set('0123456789abcdef')
+
+class ProfilerBusy(Exception):
+    """
+    A worker-wide profile is already running in this process.
+    """
+
+def frame_name(code):
+    # Collapsed stacks separate frames with ';'
+    path = os.path.join(*code.co_filename.split(os.sep)[-2:]) if code.co_filename else '?'
+    return f"{code.co_name} ({path}:{code.co_firstlineno})".replace(';', ':')
+
+def collapse(frame):
+    """
+    The stack of `frame`, outermost call first, in collapsed-stack form.
+    """
+    names = []
+    while frame is not None:
+        names.append(frame_name(frame.f_code))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+class StackSampler(threading.Thread):
+    """
+    Statistical profiler: every `interval` seconds, record the current
+    stack of the sampled threads (`thread_ids`, or every thread but this
+    one). Costs one sys._current_frames() call per tick and nothing in the
+    sampled threads themselves. Stops after `seconds`, when stop() is
+    called, and then calls on_done(self).
+    """
+
+    def __init__(self, interval=0.005, thread_ids=None, seconds=None, on_done=None):
+        super().__init__(daemon=True, name='stack-sampler')
+        self.interval = interval
+        self.thread_ids = thread_ids
+        self.deadline = time.monotonic() + seconds if seconds else None
+        self.on_done = on_done
+        self.stacks = Counter()
+        self.samples = 0
+        self.started_at = time.time()
+        self.stopped_at = None
+        self._stop_event = threading.Event()
+
+    def run(self):
+        own_id = threading.get_ident()
+        while not self._stop_event.wait(self.interval):
+            if self.deadline and time.monotonic() >= self.deadline:
+                break
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id or (self.thread_ids is not None and thread_id not in self.thread_ids):
+                    continue
+                self.stacks[collapse(frame)] += 1
+            self.samples += 1
+        self.stopped_at = time.time()
+        if self.on_done is not None:
+            self.on_done(self)
+
+    def stop(self):
+        self._stop_event.set()
+        if threading.current_thread() is not self:
+            self.join()
+
+    def collapsed(self):
+        """
+        The samples as collapsed stacks ("frame;frame;frame count" per
+        line), the input format of flamegraph.pl, speedscope and inferno.
+        """
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+class Profiler:
+    """
+    Opt-in sampling profiler for live workers, for callers presenting
+    PROFILING_TOKEN in the X-Profiler-Token header:
+
+    - a worker-wide profile of every thread of the process that receives
+      the start request, for a number of seconds or of requests;
+    - a profile of a single request, sent with `X-Profile: 1`.
+
+    Profiles are written as collapsed stacks to `directory`, so any worker
+    on the host can serve them for download. Off unless PROFILING_ENABLED
+    is set and a token is configured.
+    """
+
+    def __init__(self, enabled=False, token=None, directory='profiles', interval=0.005, max_seconds=300,
+                 logger=None):
+        self.enabled = bool(enabled and token)
+        self.token = token
+        self.directory = directory
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.logger = logger
+        self._lock = threading.Lock()
+        self._session = None
+        self._requests_left = None
+        if enabled and not token and logger:
+            logger.warning("PROFILING_ENABLED is set without PROFILING_TOKEN. Profiling will be disabled.")
+
+    @classmethod
+    def from_config(cls, config, logger=None):
+        return cls(
+            enabled=config['PROFILING_ENABLED'],
+            token=config.get('PROFILING_TOKEN'),
+            directory=config['PROFILING_DIR'],
+            interval=config['PROFILING_INTERVAL'],
+            max_seconds=config['PROFILING_MAX_SECONDS'],
+            logger=logger
+        )
+
+    def init_app(self, app):
+        """
+        Profile single requests that ask for it, and count requests for a
+        worker-wide profile limited to a number of requests.
+        """
+        if not self.enabled:
+            return
+
+        @app.before_request
+        def start_request_profile():
+            if request.headers.get('X-Profile') in ('1', 'true') and self.authorized(request.headers):
+                g.profile_sampler = StackSampler(self.interval, thread_ids={threading.get_ident()},
+                                                 seconds=self.max_seconds)
+                g.profile_sampler.start()
+
+        @app.after_request
+        def finish_request_profile(response):
+            sampler = g.pop('profile_sampler', None)
+            if sampler is not None:
+                # Streamed bodies are profiled up to their first byte
+                sampler.stop()
+                response.headers['X-Profile-Id'] = self._save(sampler)
+                response.headers['X-Profile-Samples'] = str(sampler.samples)
+            if request.blueprint != 'admin':
+                self._count_request()
+            return response
+
+    def authorized(self, headers):
+        supplied = headers.get('X-Profiler-Token', '')
+        return self.enabled and bool(supplied) and hmac.compare_digest(supplied, self.token)
+
+    def start(self, seconds=None, requests=None):
+        """
+        Start a worker-wide profile for `seconds`, or until `requests`
+        more requests have been handled (capped at max_seconds either way).
+        Returns its status.
+        """
+        seconds = min(seconds or self.max_seconds, self.max_seconds)
+        with self._lock:
+            if self._session is not None:
+                raise ProfilerBusy("A profile is already running in this worker")
+            profile_id = uuid.uuid4().hex
+            sampler = StackSampler(self.interval, seconds=seconds,
+                                   on_done=lambda done: self._finish(done, profile_id))
+            sampler.profile_id = profile_id
+            self._session = sampler
+            self._requests_left = requests
+            sampler.start()
+        if self.logger:
+            self.logger.warning(f"Profiling worker {os.getpid()} for {requests or seconds} "
+                                f"{'requests' if requests else 'seconds'} (profile {profile_id})")
+        return self.status()
+
+    def stop(self):
+        """
+        Stop the running worker-wide profile and return its id, or None.
+        """
+        with self._lock:
+            sampler = self._session
+        if sampler is None:
+            return None
+        sampler.stop()
+        return sampler.profile_id
+
+    def status(self):
+        with self._lock:
+            sampler = self._session
+            requests_left = self._requests_left
+        status = {'pid': os.getpid(), 'running': sampler is not None}
+        if sampler is not None:
+            status.update(profile_id=sampler.profile_id, samples=sampler.samples, requests_left=requests_left,
+                          elapsed_seconds=round(time.time() - sampler.started_at, 1))
+        return status
+
+    def path(self, profile_id):
+        if not profile_id or set(profile_id) - HEX_DIGITS or len(profile_id) != 32:
+            return None
+        path = os.path.join(self.directory, f"{profile_id}.collapsed")
+        return path if os.path.exists(path) else None
+
+    def _count_request(self):
+        with self._lock:
+            if self._session is None or self._requests_left is None:
+                return
+            self._requests_left -= 1
+            sampler = self._session if self._requests_left <= 0 else None
+        if sampler is not None:
+            # Stopping joins the sampler thread, which takes the lock in _finish
+            sampler.stop()
+
+    def _finish(self, sampler, profile_id):
+        self._save(sampler, profile_id)
+        if self.logger:
+            self.logger.warning(f"Profile {profile_id} of worker {os.getpid()} done: {sampler.samples} samples")
+        with self._lock:
+            if self._session is sampler:
+                self._session = None
+                self._requests_left = None
+
+    def _save(self, sampler, profile_id=None):
+        profile_id = profile_id or uuid.uuid4().hex
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = os.path.join(self.directory, f".{profile_id}.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(sampler.collapsed())
+        os.replace(tmp_path, os.path.join(self.directory, f"{profile_id}.collapsed"))
+        return profile_id
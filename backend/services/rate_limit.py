@@ -0,0 +1,291 @@
+import math
+import time
+import inspect
+import threading
+
+# Sliding window counter over every scope of one check (user, IP), atomically:
+# the request is counted in all of them or in none. Each scope keeps a counter
+# per fixed window; the previous window's count is weighted by how much of it
+# still overlaps the sliding window.
+#   KEYS: one counter prefix per scope
+#   ARGV: limit and window ms for each scope, in KEYS order
+# Returns {allowed, limit, remaining, reset ms, retry ms} for each scope
+SLIDING_WINDOW_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local allowed = 1
+local scopes = {}
+for i, key in ipairs(KEYS) do
+    local limit = tonumber(ARGV[i * 2 - 1])
+    local window = tonumber(ARGV[i * 2])
+    local index = math.floor(now / window)
+    local elapsed = now - index * window
+    local current = tonumber(redis.call('GET', key .. ':' .. index) or '0')
+    local previous = tonumber(redis.call('GET', key .. ':' .. (index - 1)) or '0')
+    local used = previous * (window - elapsed) / window + current
+    local retry = 0
+    if used + 1 > limit then
+        allowed = 0
+        if current + 1 > limit then
+            -- Wait for this window to end and then for its weight to fall enough
+            retry = window - elapsed + window * (1 - (limit - 1) / current)
+        else
+            retry = window * (1 - (limit - 1 - current) / previous) - elapsed
+        end
+    end
+    scopes[i] = {key .. ':' .. index, limit, used, window - elapsed, retry, window}
+end
+local result = {}
+for i, scope in ipairs(scopes) do
+    local remaining = scope[2] - scope[3]
+    if allowed == 1 then
+        redis.call('INCR', scope[1])
+        redis.call('PEXPIRE', scope[1], scope[6] * 2)
+        remaining = remaining - 1
+    end
+    for _, value in ipairs({allowed, scope[2], math.max(0, math.floor(remaining)), scope[4], math.ceil(scope[5])}) do
+        table.insert(result, value)
+    end
+end
+return result
+"""
+
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+
+def parse_limit(value):
+    """
+    Parse a limit such as '20/minute', '100/hour' or '20/60' (seconds)
+    into (count, window seconds). Returns None for an empty value.
+    """
+    if not value:
+        return None
+    count, _, period = str(value).partition('/')
+    period = period.strip().lower()
+    window = PERIODS.get(period.rstrip('s')) or float(period or 60)
+    return int(count), window
+
+class RateLimitResult:
+    """
+    Outcome of one check, for the scope closest to its limit.
+    """
+
+    __slots__ = ('allowed', 'limit', 'remaining', 'reset', 'retry_after', 'policy')
+
+    def __init__(self, allowed, limit, remaining, reset, retry_after, policy):
+        self.allowed = allowed
+        self.limit = limit
+        self.remaining = remaining
+        self.reset = reset
+        self.retry_after = retry_after
+        self.policy = policy
+
+    @classmethod
+    def from_scopes(cls, scopes, policy):
+        """
+        Pick the scope to report from (allowed, limit, remaining, reset, retry)
+        rows: the one that refused the request for longest, or the one with
+        the fewest requests left.
+        """
+        allowed = all(scope[0] for scope in scopes)
+        if allowed:
+            scope = min(scopes, key=lambda scope: scope[2])
+        else:
+            scope = max(scopes, key=lambda scope: scope[4])
+        return cls(allowed, scope[1], scope[2], scope[3], scope[4], policy)
+
+    def headers(self):
+        """
+        RateLimit-* headers (IETF httpapi draft) plus Retry-After when refused.
+        """
+        headers = {
+            'RateLimit-Limit': str(self.limit),
+            'RateLimit-Remaining': str(self.remaining),
+            'RateLimit-Reset': str(math.ceil(self.reset)),
+            'RateLimit-Policy': self.policy,
+        }
+        if not self.allowed:
+            headers['Retry-After'] = str(max(1, math.ceil(self.retry_after)))
+        return headers
+
+class LocalWindowCounter:
+    """
+    In-process stand-in for SLIDING_WINDOW_SCRIPT when Redis is not
+    configured or unreachable. Limits are then enforced per worker.
+    """
+
+    # Drop expired windows every this many checks
+    PRUNE_EVERY = 1000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {}
+        self._checks = 0
+
+    def check(self, keys, args):
+        with self._lock:
+            now = time.time()
+            self._checks += 1
+            if self._checks % self.PRUNE_EVERY == 0:
+                self._prune(now)
+
+            allowed = True
+            scopes = []
+            for i, key in enumerate(keys):
+                limit, window = args[i * 2], args[i * 2 + 1] / 1000
+                index = int(now // window)
+                elapsed = now - index * window
+                current = self._counts.get((key, index), (0, 0))[0]
+                previous = self._counts.get((key, index - 1), (0, 0))[0]
+                used = previous * (window - elapsed) / window + current
+                retry = 0
+                if used + 1 > limit:
+                    allowed = False
+                    if current + 1 > limit:
+                        retry = window - elapsed + window * (1 - (limit - 1) / current)
+                    else:
+                        retry = window * (1 - (limit - 1 - current) / previous) - elapsed
+                scopes.append(((key, index), limit, used, window - elapsed, retry, now + window * 2))
+
+            result = []
+            for counter, limit, used, reset, retry, expires in scopes:
+                remaining = limit - used
+                if allowed:
+                    self._counts[counter] = (self._counts.get(counter, (0, 0))[0] + 1, expires)
+                    remaining -= 1
+                result.append((allowed, limit, max(0, int(remaining)), reset, retry))
+            return result
+
+    def _prune(self, now):
+        self._counts = {counter: value for counter, value in self._counts.items() if value[1] > now}
+
+class RateLimiter:
+    """
+    Sliding window request limits per endpoint, for each authenticated user
+    and each client IP. `limits` maps an endpoint name to
+    {'user': '20/minute', 'ip': '60/minute'}; a missing or empty scope is
+    not limited.
+
+    Counters live in Redis, so the limits hold across workers, with one
+    script call per check; without Redis, or when it fails, each worker
+    counts on its own.
+    """
+
+    def __init__(self, redis_client=None, limits=None, enabled=True, proxy_count=0, prefix='ratelimit', local=None,
+                 logger=None):
+        self.redis = redis_client
+        self.enabled = enabled
+        self.proxy_count = proxy_count
+        self.prefix = prefix
+        self.logger = logger
+        # Pass the WSGI app's counter to an ASGI limiter so both count against the same limits
+        self.local = local or LocalWindowCounter()
+        self._script = redis_client.register_script(SLIDING_WINDOW_SCRIPT) if redis_client is not None else None
+        self.limits = {}
+        for endpoint, scopes in (limits or {}).items():
+            parsed = {scope: parse_limit(value) for scope, value in scopes.items()}
+            parsed = {scope: limit for scope, limit in parsed.items() if limit and limit[0] > 0}
+            if parsed:
+                self.limits[endpoint] = parsed
+        self._stats_lock = threading.Lock()
+        self._stats = {'allowed': 0, 'limited': 0, 'redis_errors': 0}
+
+    @classmethod
+    def from_config(cls, config, redis_client=None, local=None, logger=None):
+        return cls(
+            redis_client,
+            limits=config['RATE_LIMITS'],
+            enabled=config['RATE_LIMIT_ENABLED'],
+            proxy_count=config['RATE_LIMIT_PROXY_COUNT'],
+            local=local,
+            logger=logger
+        )
+
+    def client_ip(self, remote_addr, forwarded_for=None):
+        """
+        The client address, taken from X-Forwarded-For when we sit behind
+        `proxy_count` trusted proxies (each appends the address it saw).
+        """
+        if self.proxy_count and forwarded_for:
+            hops = [hop.strip() for hop in forwarded_for.split(',') if hop.strip()]
+            if len(hops) >= self.proxy_count:
+                return hops[-self.proxy_count]
+        return remote_addr or 'unknown'
+
+    def check(self, endpoint, user_id=None, ip=None):
+        """
+        Count one request to `endpoint`. Returns a RateLimitResult, or None
+        when the endpoint has no limits.
+        """
+        prepared = self._prepare(endpoint, user_id, ip)
+        if prepared is None:
+            return None
+        keys, args, policy = prepared
+        if self._script is not None:
+            try:
+                return self._result(self._rows(self._script(keys=keys, args=args)), policy)
+            except Exception as e:
+                self._redis_error(e)
+        return self._result(self.local.check(keys, args), policy)
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['backend'] = 'redis' if self._script is not None else 'local'
+        return stats
+
+    def _prepare(self, endpoint, user_id, ip):
+        scopes = self.limits.get(endpoint) if self.enabled else None
+        if not scopes:
+            return None
+        keys, args, policy = [], [], []
+        for scope, identity in (('user', user_id), ('ip', ip)):
+            if scope in scopes and identity:
+                count, window = scopes[scope]
+                keys.append(f"{self.prefix}:{endpoint}:{scope}:{identity}")
+                args += [count, int(window * 1000)]
+                policy.append(f"{count};w={int(window)}")
+        if not keys:
+            return None
+        return keys, args, ', '.join(policy)
+
+    @staticmethod
+    def _rows(flat):
+        # The script answers in milliseconds
+        return [
+            (bool(flat[i]), flat[i + 1], flat[i + 2], flat[i + 3] / 1000, flat[i + 4] / 1000)
+            for i in range(0, len(flat), 5)
+        ]
+
+    def _result(self, rows, policy):
+        result = RateLimitResult.from_scopes(rows, policy)
+        self._record('allowed' if result.allowed else 'limited')
+        return result
+
+    def _redis_error(self, error):
+        self._record('redis_errors')
+        if self.logger:
+            self.logger.warning(f"Rate limit Redis error: {str(error)}. Counting in this process.")
+
+    def _record(self, counter):
+        with self._stats_lock:
+            self._stats[counter] += 1
+
+class AsyncRateLimiter(RateLimiter):
+    """
+    RateLimiter for the ASGI path, with a `redis.asyncio` client.
+    """
+
+    async def check(self, endpoint, user_id=None, ip=None):
+        prepared = self._prepare(endpoint, user_id, ip)
+        if prepared is None:
+            return None
+        keys, args, policy = prepared
+        if self._script is not None:
+            try:
+                flat = self._script(keys=keys, args=args)
+                if inspect.isawaitable(flat):
+                    flat = await flat
+                return self._result(self._rows(flat), policy)
+            except Exception as e:
+                self._redis_error(e)
+        return self._result(self.local.check(keys, args), policy)
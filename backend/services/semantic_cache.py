@@ -0,0 +1,307 @@
+import os
+import re
+import time
+import zlib
+import sqlite3
+import hashlib
+import inspect
+import threading
+import importlib
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - numpy is only needed when the semantic cache is enabled
+    np = None
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to an in-process lock only
+    fcntl = None
+
+STOP_WORDS = frozenset("""
+a about am an and any are as at be been but by can could do does doing for from get
+had has have how i if in into is it its me my of on or should so than that the their
+them then there these they this to too was we were what when where which who why will
+with would you your
+""".split())
+
+WORD_RE = re.compile(r"[a-z0-9]+")
+
+class HashingEmbedder:
+    """
+    Offline text embedder using the hashing trick over word unigrams, word
+    bigrams and character trigrams. Hashes are stable across processes, so
+    vectors can be persisted and shared between workers.
+
+    It only measures shared wording: "how much sleep do adults need" and
+    "hours of sleep for adults" score 0.60 while "... adults need" and
+    "... children need" score 0.66, so it catches reworded punctuation and
+    filler words rather than paraphrases; same_subject() keeps apart the
+    near-identical questions it scores high. It is the default because it
+    needs no model; see SentenceTransformerEmbedder for paraphrases.
+    """
+
+    DEFAULT_DIM = 1024
+
+    def __init__(self, dim=None):
+        self.dim = dim or self.DEFAULT_DIM
+
+    def tokens(self, text):
+        words = [w.rstrip('s') if len(w) > 3 else w for w in WORD_RE.findall(text.lower()) if w not in STOP_WORDS]
+        features = list(words)
+        features.extend(f"{a} {b}" for a, b in zip(words, words[1:]))
+        for word in words:
+            padded = f"#{word}#"
+            features.extend(f"c:{padded[i:i + 3]}" for i in range(len(padded) - 2))
+        return features
+
+    def embed(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for feature in self.tokens(text):
+            h = zlib.crc32(feature.encode())
+            # The top bit picks the sign so collisions tend to cancel out
+            vector[h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+class SentenceTransformerEmbedder:
+    """
+    Sentence embeddings from a sentence-transformers model (all-MiniLM-L6-v2
+    by default), which places paraphrases close together where the hashing
+    embedder only sees shared words. Needs the packages in
+    requirements-semantic.txt; the model is loaded once per process.
+
+    The vector size is the model's. A `dim` that doesn't match it raises
+    ValueError rather than being ignored.
+    """
+
+    def __init__(self, dim=None, model='sentence-transformers/all-MiniLM-L6-v2'):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model)
+        self.dim = self.model.get_sentence_embedding_dimension()
+        if dim and dim != self.dim:
+            raise ValueError(f"{model} embeds into {self.dim} dimensions, not {dim}; unset SEMANTIC_CACHE_DIM")
+
+    def embed(self, text):
+        return self.model.encode(text, normalize_embeddings=True).astype(np.float32)
+
+def load_embedder(path, dim, model=None):
+    """
+    Instantiate an embedder from a dotted path such as
+    `services.semantic_cache.SentenceTransformerEmbedder`. The class must
+    accept `dim` (None for its default size), and is given `model` if it
+    takes one; it exposes `dim` and `embed(text) -> unit-length numpy vector`.
+    """
+    module_name, _, class_name = path.rpartition('.')
+    embedder_class = getattr(importlib.import_module(module_name), class_name)
+    if model and 'model' in inspect.signature(embedder_class).parameters:
+        return embedder_class(dim=dim, model=model)
+    return embedder_class(dim=dim)
+
+# Words that flip the meaning of a question without moving its embedding much
+NEGATIONS = frozenset("""
+no not without never none nor cannot cant dont doesnt didnt isnt arent wasnt wont
+shouldnt couldnt wouldnt avoid except non
+""".split())
+
+# Who the question is about and what they take: two questions that differ in
+# any of these must not share an answer, however similar they read
+GUARDED_TERMS = frozenset("""
+adult adults child children kid kids infant infants baby babies newborn newborns toddler toddlers
+teen teens teenager teenagers adolescent adolescents elderly senior seniors older
+pregnant pregnancy breastfeeding nursing man men woman women male female boy boys girl girls
+dog dogs cat cats
+acetaminophen paracetamol tylenol ibuprofen advil motrin aspirin naproxen aleve diclofenac
+codeine tramadol morphine oxycodone hydrocodone fentanyl opioid opioids
+amoxicillin penicillin azithromycin doxycycline ciprofloxacin antibiotic antibiotics
+metformin insulin warfarin heparin apixaban clopidogrel statin statins atorvastatin simvastatin
+lisinopril amlodipine losartan metoprolol omeprazole pantoprazole prednisone steroid steroids
+diphenhydramine benadryl loratadine cetirizine antihistamine antihistamines melatonin
+sertraline fluoxetine citalopram escitalopram antidepressant antidepressants lithium
+alcohol caffeine nicotine cannabis marijuana
+mg mcg ml kg lb lbs
+""".split())
+
+DIGIT_RE = re.compile(r"\d")
+
+def guard_terms(text):
+    """
+    Whether `text` is negated, and the guarded terms and numbers (doses,
+    ages) in it.
+    """
+    words = WORD_RE.findall(text.lower().replace("n't", "nt").replace("'", ""))
+    negated = any(word in NEGATIONS for word in words)
+    return negated, frozenset(word for word in words if word in GUARDED_TERMS or DIGIT_RE.search(word))
+
+def same_subject(question, cached_question):
+    """
+    Whether a cached answer may be reused for `question`: both questions must
+    be negated alike and name the same guarded terms and numbers. Embeddings
+    score "with alcohol" and "without alcohol", or "ibuprofen" and "aspirin",
+    as near duplicates; the answers are not.
+    """
+    return guard_terms(question) == guard_terms(cached_question)
+
+class SemanticCache:
+    """
+    Near-duplicate answer cache for first-turn questions.
+
+    Question vectors live in a fixed-size NumPy index persisted as memory-mapped
+    files under `path`, so every worker on the host shares the same pages.
+    When the index is full the least recently used slot is overwritten. A
+    candidate above the similarity threshold is only used if it passes
+    same_subject().
+
+    Files:
+        vectors.f32   capacity x dim float32 embeddings
+        used.f64      last-used timestamp per slot (0 marks an empty slot)
+        entries.db    SQLite table of question, response, scope and vector
+                      digest per slot
+
+    An add writes one row. It unpublishes the slot, writes the row, then the
+    vector, and publishes the slot last; a lookup only returns a row whose
+    digest matches the vector it scored, so a reader racing an eviction in
+    another process misses instead of returning the evicted question's answer.
+    """
+
+    def __init__(self, path, embedder, capacity=10000, threshold=0.85, logger=None):
+        if np is None:
+            raise RuntimeError("numpy is required for the semantic cache")
+        self.path = path
+        self.embedder = embedder
+        self.capacity = capacity
+        self.threshold = threshold
+        self.logger = logger
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+        os.makedirs(path, exist_ok=True)
+        self._lock_path = os.path.join(path, 'lock')
+        self._entries_path = os.path.join(path, 'entries.db')
+        self.vectors = self._open_memmap('vectors.f32', (capacity, embedder.dim), np.float32)
+        self.used = self._open_memmap('used.f64', (capacity,), np.float64)
+        with self._locked():
+            self._db().execute(
+                "CREATE TABLE IF NOT EXISTS entries (slot INTEGER PRIMARY KEY, question TEXT NOT NULL, "
+                "response TEXT NOT NULL, scope TEXT NOT NULL, digest TEXT NOT NULL)"
+            )
+
+    @staticmethod
+    def scope_for(model, system_prompt):
+        """
+        Answers are only shared between requests with the same model and system prompt.
+        """
+        return hashlib.sha256(f"{model}\n{system_prompt}".encode()).hexdigest()[:16]
+
+    def lookup(self, question, scope):
+        """
+        Return the cached response for the closest stored question if its
+        cosine similarity reaches the threshold and it is about the same
+        subject, otherwise None.
+        """
+        occupied = np.flatnonzero(self.used > 0)
+        if not len(occupied):
+            return None
+
+        query = self.embedder.embed(question)
+        # Vectors are unit length, so the dot product is the cosine similarity
+        scores = self.vectors[occupied] @ query
+        for idx in np.argsort(scores)[::-1]:
+            if scores[idx] < self.threshold:
+                break
+            slot = int(occupied[idx])
+            entry = self._entry(slot)
+            if entry is None or entry['scope'] != scope:
+                continue
+            # Re-read the vector: it must still be the one this row was written with
+            vector = np.array(self.vectors[slot])
+            if _digest(vector) != entry['digest'] or float(vector @ query) < self.threshold:
+                continue
+            if not same_subject(question, entry['question']):
+                if self.logger:
+                    self.logger.debug(f"Semantic cache candidate rejected by the subject guard (similarity {scores[idx]:.3f})")
+                continue
+            self.used[slot] = time.time()
+            if self.logger:
+                self.logger.debug(f"Semantic cache hit (similarity {scores[idx]:.3f})")
+            return entry['response']
+        return None
+
+    def add(self, question, response, scope):
+        vector = self.embedder.embed(question).astype(np.float32)
+        with self._locked():
+            empty = np.flatnonzero(self.used == 0)
+            # Reuse an empty slot, otherwise evict the least recently used one
+            slot = int(empty[0]) if len(empty) else int(np.argmin(self.used))
+            self.used[slot] = 0
+            self.used.flush()
+            with self._db() as conn:
+                conn.execute("INSERT OR REPLACE INTO entries (slot, question, response, scope, digest) VALUES (?, ?, ?, ?, ?)",
+                             (slot, question, response, scope, _digest(vector)))
+            self.vectors[slot] = vector
+            self.vectors.flush()
+            self.used[slot] = time.time()
+            self.used.flush()
+
+    def clear(self):
+        with self._locked():
+            self.used[:] = 0
+            self.used.flush()
+            with self._db() as conn:
+                conn.execute("DELETE FROM entries")
+
+    def __len__(self):
+        return int(np.count_nonzero(self.used))
+
+    def _open_memmap(self, name, shape, dtype):
+        filename = os.path.join(self.path, name)
+        expected = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        # Start over if the capacity or embedding size changed
+        if not os.path.exists(filename) or os.path.getsize(filename) != expected:
+            return np.memmap(filename, dtype=dtype, mode='w+', shape=shape)
+        return np.memmap(filename, dtype=dtype, mode='r+', shape=shape)
+
+    def _entry(self, slot):
+        row = self._db().execute("SELECT question, response, scope, digest FROM entries WHERE slot = ?", (slot,)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(('question', 'response', 'scope', 'digest'), row))
+
+    def _db(self):
+        # One connection per thread, and none carried across a fork
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self._entries_path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def _locked(self):
+        return _FileLock(self._lock_path, self._lock)
+
+def _digest(vector):
+    return hashlib.blake2b(vector.tobytes(), digest_size=8).hexdigest()
+
+class _FileLock:
+    """
+    Serializes index writes across threads and, where fcntl exists, across worker processes.
+    """
+
+    def __init__(self, path, thread_lock):
+        self.path = path
+        self.thread_lock = thread_lock
+        self.handle = None
+
+    def __enter__(self):
+        self.thread_lock.acquire()
+        if fcntl:
+            self.handle = open(self.path, 'a')
+            fcntl.flock(self.handle, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if self.handle:
+            fcntl.flock(self.handle, fcntl.LOCK_UN)
+            self.handle.close()
+            self.handle = None
+        self.thread_lock.release()
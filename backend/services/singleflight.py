@@ -0,0 +1,385 @@
+import json
+import time
+import uuid
+import asyncio
+import threading
+from contextlib import contextmanager
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+from services.governor import UpstreamUnavailable
+
+# Delete the lock only if we still own it
+RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+class LeaderFailed(Exception):
+    """
+    The call this request was coalesced with failed in another worker.
+    `error` is the class name of the leader's exception and `status` its
+    HTTP status, if it had one.
+    """
+
+    def __init__(self, message, error, status=None):
+        super().__init__(message)
+        self.error = error
+        self.status = status
+
+def describe_error(error):
+    """
+    What waiters in other workers are told about the leader's exception.
+    """
+    if isinstance(error, UpstreamUnavailable):
+        return {'unavailable': True, 'message': str(error), 'reason': error.reason, 'retry_after': error.retry_after}
+    status = getattr(error, 'status_code', None)
+    if status == 429:
+        return {'unavailable': True, 'message': str(error), 'reason': 'rate_limited', 'retry_after': None}
+    return {'message': str(error), 'error': type(error).__name__, 'status': status}
+
+def leader_error(data):
+    """
+    The exception a waiter raises for the leader's published `data`. Rate
+    limits and governor refusals come back as UpstreamUnavailable, which the
+    routes answer with the fallback responder, like the leader did.
+    """
+    if data.get('unavailable'):
+        return UpstreamUnavailable(data['message'], data['reason'], data.get('retry_after'))
+    return LeaderFailed(data['message'], data.get('error'), data.get('status'))
+
+class Flight:
+    """
+    One caller's part in a coalesced call, as yielded by SingleFlight.lead().
+    """
+
+    def __init__(self, leader=False, result=None):
+        self.leader = leader
+        self.result = result
+
+class _Cancelled(Exception):
+    """
+    Given to local waiters when the leader's caller was cancelled.
+    """
+
+# _wait_for_leader outcomes other than a result
+_RETAKE = object()
+_LEAD = object()
+
+def wait_timed_out(timeout):
+    return UpstreamUnavailable(f"Coalesced call did not finish within {timeout}s", 'singleflight_timeout')
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key into one upstream call.
+
+    Within a worker, the first caller runs the function and later callers wait
+    on its future. Across workers, the caller holding a Redis lock runs the
+    function and publishes the result on a pub/sub channel; callers in other
+    workers wait for that message.
+
+    A failure is shared like a result: the leader publishes the error and
+    waiters raise it (see leader_error()) instead of all calling the failing
+    upstream at once. A leader that disappears without publishing anything
+    releases the lock, and exactly one waiter takes it over. A waiter that
+    outlasts wait_timeout raises UpstreamUnavailable, so the route falls
+    back rather than starting a second call behind a slow one.
+
+    Results must be JSON serializable to be shared across workers.
+    """
+
+    def __init__(self, redis_client=None, lock_ttl=90, wait_timeout=60, prefix='singleflight', enabled=True, logger=None):
+        self.redis = redis_client
+        self.lock_ttl = lock_ttl
+        self.wait_timeout = wait_timeout
+        self.prefix = prefix
+        self.enabled = enabled
+        self.logger = logger
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {'leaders': 0, 'coalesced': 0, 'remote_waits': 0, 'timeouts': 0}
+
+    def do(self, key, fn, lookup=None):
+        """
+        Return fn() for this key, sharing one in-flight call between concurrent
+        callers. `lookup` should return the cached result, if any; it is
+        checked by callers that wait on another worker.
+        """
+        with self.lead(key, lookup) as flight:
+            if flight.leader:
+                flight.result = fn()
+        return flight.result
+
+    @contextmanager
+    def lead(self, key, lookup=None):
+        """
+        do() for callers that make the call themselves, such as a response
+        streamed to the client while it arrives. Yields a Flight: if
+        `flight.leader` is set, make the call and store its result in
+        `flight.result`; otherwise `flight.result` already holds the result
+        of the call this one was coalesced with. An exception raised in the
+        leader's block is shared with the waiters.
+        """
+        if not self.enabled:
+            yield Flight(leader=True)
+            return
+
+        while True:
+            with self._lock:
+                future = self._calls.get(key)
+                leader = future is None
+                if leader:
+                    future = Future()
+                    self._calls[key] = future
+            if leader:
+                break
+
+            self._record('coalesced')
+            try:
+                result = future.result(timeout=self.wait_timeout)
+            except FutureTimeoutError:
+                self._record('timeouts')
+                raise wait_timed_out(self.wait_timeout)
+            except _Cancelled:
+                # The leader's caller went away; the next one through the lock takes over
+                continue
+            yield Flight(result=result)
+            return
+
+        try:
+            with self._across_workers(key, lookup) as flight:
+                yield flight
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        except BaseException:
+            future.set_exception(_Cancelled())
+            raise
+        else:
+            future.set_result(flight.result)
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+    def stats(self):
+        with self._stats_lock:
+            return dict(self._stats)
+
+    @contextmanager
+    def _across_workers(self, key, lookup):
+        if self.redis is None:
+            self._record('leaders')
+            yield Flight(leader=True)
+            return
+
+        lock_key, channel = self._names(key)
+        deadline = time.monotonic() + self.wait_timeout
+        while True:
+            token = uuid.uuid4().hex
+            try:
+                acquired = self.redis.set(lock_key, token, nx=True, px=int(self.lock_ttl * 1000))
+            except Exception as e:
+                self._warn(f"Single-flight lock error: {str(e)}")
+                yield Flight(leader=True)
+                return
+            if acquired:
+                break
+            result = self._wait_for_leader(lock_key, channel, lookup, deadline)
+            if result is _LEAD:
+                yield Flight(leader=True)
+                return
+            if result is not _RETAKE:
+                yield Flight(result=result)
+                return
+            # The lock is free: one waiter wins it and leads, the others wait on it
+
+        self._record('leaders')
+        flight = Flight(leader=True)
+        try:
+            yield flight
+        except Exception as e:
+            self._publish(channel, {'error': describe_error(e)})
+            raise
+        except BaseException:
+            # Cancelled, not failed: let a waiter make the call
+            self._publish(channel, {'retry': True})
+            raise
+        else:
+            self._publish(channel, {'result': flight.result})
+        finally:
+            try:
+                self.redis.eval(RELEASE_LOCK_SCRIPT, 1, lock_key, token)
+            except Exception as e:
+                self._warn(f"Single-flight unlock error: {str(e)}")
+
+    def _wait_for_leader(self, lock_key, channel, lookup, deadline):
+        """
+        The leader's result, _RETAKE once its lock is free without one, or
+        _LEAD if Redis fails and this caller should make the call itself.
+        Raises the leader's error.
+        """
+        self._record('remote_waits')
+        pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        try:
+            pubsub.subscribe(channel)
+            # The leader may have finished before we subscribed
+            cached = lookup() if lookup else None
+            if cached:
+                return cached
+
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._record('timeouts')
+                    raise wait_timed_out(self.wait_timeout)
+                message = pubsub.get_message(timeout=min(remaining, 1.0))
+                if message:
+                    data = json.loads(message['data'])
+                    if 'result' in data:
+                        return data['result']
+                    if 'error' in data:
+                        raise leader_error(data['error'])
+                    return _RETAKE
+                if not self.redis.exists(lock_key):
+                    # Leader finished without us hearing it, or died
+                    cached = lookup() if lookup else None
+                    return cached or _RETAKE
+        except (UpstreamUnavailable, LeaderFailed):
+            raise
+        except Exception as e:
+            self._warn(f"Single-flight wait error: {str(e)}")
+            return _LEAD
+        finally:
+            pubsub.close()
+
+    def _names(self, key):
+        return f"{self.prefix}:lock:{key}", f"{self.prefix}:done:{key}"
+
+    def _publish(self, channel, data):
+        try:
+            self.redis.publish(channel, json.dumps(data))
+        except Exception as e:
+            self._warn(f"Single-flight publish error: {str(e)}")
+
+    def _record(self, counter):
+        with self._stats_lock:
+            self._stats[counter] += 1
+
+    def _warn(self, message):
+        if self.logger:
+            self.logger.warning(message)
+
+class AsyncSingleFlight(SingleFlight):
+    """
+    SingleFlight for the ASGI path: `fn` and `lookup` are coroutine functions
+    and Redis is a `redis.asyncio` client. Callers within the event loop share
+    an asyncio future.
+    """
+
+    async def do(self, key, fn, lookup=None):
+        if not self.enabled:
+            return await fn()
+
+        future = self._calls.get(key)
+        if future is not None:
+            self._record('coalesced')
+            try:
+                return await asyncio.wait_for(asyncio.shield(future), self.wait_timeout)
+            except asyncio.TimeoutError:
+                self._record('timeouts')
+                raise wait_timed_out(self.wait_timeout)
+
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        try:
+            result = await self._call_across_workers(key, fn, lookup)
+        except BaseException as e:
+            future.set_exception(e)
+            # Nobody may be waiting; don't warn about an unretrieved exception
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            self._calls.pop(key, None)
+
+    async def _call_across_workers(self, key, fn, lookup, deadline=None):
+        if self.redis is None:
+            self._record('leaders')
+            return await fn()
+
+        lock_key, channel = self._names(key)
+        token = uuid.uuid4().hex
+        try:
+            acquired = await self.redis.set(lock_key, token, nx=True, px=int(self.lock_ttl * 1000))
+        except Exception as e:
+            self._warn(f"Single-flight lock error: {str(e)}")
+            return await fn()
+
+        if not acquired:
+            return await self._wait_for_leader(key, fn, lookup, deadline)
+
+        self._record('leaders')
+        try:
+            result = await fn()
+        except Exception as e:
+            await self._publish(channel, {'error': describe_error(e)})
+            raise
+        except BaseException:
+            await self._publish(channel, {'retry': True})
+            raise
+        else:
+            await self._publish(channel, {'result': result})
+            return result
+        finally:
+            try:
+                await self.redis.eval(RELEASE_LOCK_SCRIPT, 1, lock_key, token)
+            except Exception as e:
+                self._warn(f"Single-flight unlock error: {str(e)}")
+
+    async def _wait_for_leader(self, key, fn, lookup, deadline):
+        self._record('remote_waits')
+        lock_key, channel = self._names(key)
+        deadline = deadline or time.monotonic() + self.wait_timeout
+        pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        try:
+            await pubsub.subscribe(channel)
+            cached = await lookup() if lookup else None
+            if cached:
+                return cached
+
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._record('timeouts')
+                    raise wait_timed_out(self.wait_timeout)
+                message = await pubsub.get_message(timeout=min(remaining, 1.0))
+                if message:
+                    data = json.loads(message['data'])
+                    if 'result' in data:
+                        return data['result']
+                    if 'error' in data:
+                        raise leader_error(data['error'])
+                    break
+                if not await self.redis.exists(lock_key):
+                    cached = await lookup() if lookup else None
+                    if cached:
+                        return cached
+                    break
+        except (UpstreamUnavailable, LeaderFailed):
+            raise
+        except Exception as e:
+            self._warn(f"Single-flight wait error: {str(e)}")
+            return await fn()
+        finally:
+            await pubsub.aclose()
+        return await self._call_across_workers(key, fn, lookup, deadline)
+
+    async def _publish(self, channel, data):
+        try:
+            await self.redis.publish(channel, json.dumps(data))
+        except Exception as e:
+            self._warn(f"Single-flight publish error: {str(e)}")
@@ -0,0 +1,128 @@
+import uuid
+import hashlib
+
+class ChangeVersions:
+    """
+    A per-user change version in Redis, replaced after every committed
+    write to the user's sessions, messages or history. Reads of those
+    lists use it to answer `If-None-Match` with 304 and to serve a cached,
+    pre-serialized body, neither of which touches the database.
+
+    Versions are random tokens rather than counters, so a version key that
+    expires or is evicted can never come back with a value an old ETag or
+    cached body was made for.
+
+    Ordering is what keeps the cache correct: readers take the version
+    before they query, writers replace it after they commit. A body cached
+    under a version may be newer than the version, never older.
+
+    Without Redis every read returns None and callers serve from the
+    database as before.
+    """
+
+    KEY_PREFIX = 'chat:version'
+
+    def __init__(self, redis_client=None, ttl=7 * 86400, projection_ttl=300, enabled=True, logger=None):
+        self.redis = redis_client if enabled else None
+        self.ttl = ttl
+        self.projection_ttl = projection_ttl
+        self.logger = logger
+
+    @classmethod
+    def from_config(cls, config, redis_client, logger=None):
+        return cls(
+            redis_client,
+            ttl=config['CHANGE_VERSION_TTL'],
+            projection_ttl=config['PROJECTION_CACHE_TTL'],
+            enabled=config['CHANGE_VERSION_ENABLED'],
+            logger=logger
+        )
+
+    @property
+    def enabled(self):
+        return self.redis is not None
+
+    def current(self, user_id):
+        """
+        The user's current version, starting one if there is none yet.
+        Returns None without Redis or when it fails.
+        """
+        if self.redis is None:
+            return None
+        key = self._key(user_id)
+        try:
+            version = self.redis.get(key)
+            if version is None:
+                # Another worker may start it first; either way read back the winner
+                self.redis.set(key, uuid.uuid4().hex, ex=self.ttl, nx=True)
+                version = self.redis.get(key)
+            return version
+        except Exception as e:
+            self._warn(f"Change version error: {str(e)}")
+            return None
+
+    def bump(self, *user_ids):
+        """
+        Record that the users' data changed. Call after the write committed.
+        """
+        if self.redis is None or not user_ids:
+            return
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            for user_id in set(user_ids):
+                pipe.set(self._key(user_id), uuid.uuid4().hex, ex=self.ttl)
+            pipe.execute()
+        except Exception as e:
+            # The old version and the bodies cached under it live on until their TTL
+            self._warn(f"Change version bump error: {str(e)}")
+
+    @staticmethod
+    def etag(user_id, version, resource):
+        """
+        The ETag of `resource` (a path with its query string) for the user
+        at `version`.
+        """
+        digest = hashlib.blake2b(f"{user_id}|{resource}".encode(), digest_size=8).hexdigest()
+        return f'"{version}-{digest}"'
+
+    def get_projection(self, user_id, version, resource):
+        """
+        The body cached for `resource` at `version`, or None.
+        """
+        if self.redis is None or self.projection_ttl <= 0:
+            return None
+        try:
+            return self.redis.get(self._projection_key(user_id, version, resource))
+        except Exception as e:
+            self._warn(f"Projection cache error: {str(e)}")
+            return None
+
+    def set_projection(self, user_id, version, resource, body):
+        if self.redis is None or self.projection_ttl <= 0:
+            return
+        try:
+            self.redis.setex(self._projection_key(user_id, version, resource), self.projection_ttl, body)
+        except Exception as e:
+            self._warn(f"Projection cache error: {str(e)}")
+
+    def _key(self, user_id):
+        return f"{self.KEY_PREFIX}:{user_id}"
+
+    def _projection_key(self, user_id, version, resource):
+        # The version is part of the key, so a bump orphans every cached body at once
+        digest = hashlib.blake2b(resource.encode(), digest_size=8).hexdigest()
+        return f"chat:projection:{user_id}:{version}:{digest}"
+
+    def _warn(self, message):
+        if self.logger:
+            self.logger.warning(message)
+
+def etag_matches(if_none_match, etag):
+    """
+    Whether an If-None-Match header value matches `etag`, comparing weakly
+    as RFC 9110 asks for GET.
+    """
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in candidates or etag in (tag[2:] if tag.startswith('W/') else tag for tag in candidates)
@@ -0,0 +1,535 @@
+import os
+import json
+import time
+import socket
+import threading
+from datetime import datetime
+
+from sqlalchemy.exc import OperationalError, InterfaceError
+
+from models.db import db
+from services.persistence import apply_turns
+
+try:
+    import fcntl
+except ImportError:  # Windows: the file queue needs flock, only the Redis queue is available
+    fcntl = None
+
+DATETIME_FIELDS = ('created_at', 'updated_at', 'summary_until')
+
+def encode_turn(turn):
+    return json.dumps(dict(turn, queued_at=time.time()), default=lambda value: value.isoformat())
+
+def decode_turn(data):
+    turn = json.loads(data)
+    for row in [turn['session']] + turn['messages'] + turn['history']:
+        for key in DATETIME_FIELDS:
+            if row.get(key):
+                row[key] = datetime.fromisoformat(row[key])
+    return turn
+
+class RedisStreamQueue:
+    """
+    Turns queued on a Redis stream and read through a consumer group, so any
+    number of workers can drain it. Entries are deleted once acknowledged,
+    which keeps the stream length equal to the backlog. Entries a crashed
+    worker read but never acknowledged are claimed by another worker after
+    `claim_idle` seconds. Durability is that of the Redis server (use AOF).
+
+    A hash next to the stream counts the queued turns of each session, so the
+    read-your-writes barrier is one HGET instead of a scan of the backlog.
+    The count is raised in the same transaction as the XADD and lowered in
+    the same one as the XACK.
+    """
+
+    name = 'redis'
+
+    # Decrement the sessions' queued counts, dropping those that reach zero
+    RELEASE_SCRIPT = """
+    for _, session_id in ipairs(ARGV) do
+        if redis.call('HINCRBY', KEYS[1], session_id, -1) <= 0 then
+            redis.call('HDEL', KEYS[1], session_id)
+        end
+    end
+    """
+
+    def __init__(self, redis_client, stream='chat:writes', group='chat-writers', claim_idle=60):
+        self.redis = redis_client
+        self.stream = stream
+        self.group = group
+        self.claim_idle = claim_idle
+        self.dead_stream = f"{stream}:dead"
+        self.sessions_key = f"{stream}:sessions"
+        self._release = redis_client.register_script(self.RELEASE_SCRIPT)
+        # Session of each entry read and not yet acknowledged
+        self._entry_sessions = {}
+        self._group_ready = False
+        self._drain_lock = threading.Lock()
+
+    @property
+    def consumer(self):
+        # Evaluated per call: forked workers must not share a consumer name
+        return f"{socket.gethostname()}-{os.getpid()}"
+
+    def put(self, session_id, data):
+        pipe = self.redis.pipeline()
+        pipe.xadd(self.stream, {'session_id': session_id, 'data': data})
+        pipe.hincrby(self.sessions_key, session_id, 1)
+        pipe.execute()
+
+    def read(self, count, block_ms):
+        self._ensure_group()
+        # Retry what this worker read before a failed batch, then take over
+        # entries abandoned by crashed workers, then read new ones
+        entries = self._read_group('0', count, None)
+        if not entries:
+            claimed = self.redis.xautoclaim(self.stream, self.group, self.consumer,
+                                            min_idle_time=self.claim_idle * 1000, start_id='0-0', count=count)
+            entries = claimed[1] if claimed else []
+        if not entries:
+            entries = self._read_group('>', count, block_ms or None)
+
+        # Entries deleted while pending come back without fields
+        stale = [entry_id for entry_id, fields in entries if not fields]
+        if stale:
+            self.ack(stale)
+        entries = [(entry_id, fields) for entry_id, fields in entries if fields]
+        for entry_id, fields in entries:
+            self._entry_sessions[entry_id] = fields.get('session_id')
+        return [(entry_id, fields['data']) for entry_id, fields in entries]
+
+    def _read_group(self, last_id, count, block_ms):
+        response = self.redis.xreadgroup(self.group, self.consumer, {self.stream: last_id}, count=count, block=block_ms)
+        return response[0][1] if response else []
+
+    def ack(self, entry_ids):
+        if entry_ids:
+            session_ids = [self._entry_sessions.pop(entry_id, None) for entry_id in entry_ids]
+            pipe = self.redis.pipeline()
+            pipe.xack(self.stream, self.group, *entry_ids)
+            pipe.xdel(self.stream, *entry_ids)
+            session_ids = [session_id for session_id in session_ids if session_id]
+            if session_ids:
+                self._release(keys=[self.sessions_key], args=session_ids, client=pipe)
+            pipe.execute()
+
+    def dead_letter(self, entry_id, data, error):
+        self.redis.xadd(self.dead_stream, {'data': data, 'error': error})
+        self.ack([entry_id])
+
+    def depth(self):
+        return self.redis.xlen(self.stream)
+
+    def oldest_queued_at(self):
+        entries = self.redis.xrange(self.stream, '-', '+', count=1)
+        if not entries:
+            return None
+        # Stream ids start with the enqueue time in milliseconds
+        return int(entries[0][0].split('-')[0]) / 1000
+
+    def pending_for(self, session_id):
+        return int(self.redis.hget(self.sessions_key, session_id) or 0) > 0
+
+    def lock(self):
+        # The consumer group keeps workers apart; threads of one process share
+        # a consumer name, and with it the pending entries, so they take turns
+        return self._drain_lock.acquire(blocking=False)
+
+    def unlock(self):
+        self._drain_lock.release()
+
+    def _ensure_group(self):
+        if self._group_ready:
+            return
+        try:
+            self.redis.xgroup_create(self.stream, self.group, id='0', mkstream=True)
+        except Exception as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+        self._group_ready = True
+
+class FileQueue:
+    """
+    Turns appended to a JSON-lines log on local disk, for deployments without
+    Redis. Appends hold an exclusive lock and are fsynced, so every worker
+    process on the host can share the log. A single drainer at a time (held
+    by a second lock) reads from the committed byte offset stored next to the
+    log, and the log is truncated once fully drained.
+
+    Needs fcntl, so it is not available on Windows.
+    """
+
+    name = 'file'
+
+    def __init__(self, path, fsync=True):
+        self.path = path
+        self.offset_path = path + '.offset'
+        self.dead_path = path + '.dead'
+        self.fsync = fsync
+        self._thread_lock = threading.Lock()
+        self._drain_lock = None
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def put(self, session_id, data):
+        self._append(self.path, data)
+
+    def read(self, count, block_ms):
+        entries = []
+        with open(self.path, 'ab+') as f:
+            offset = self._start(f)
+            f.seek(offset)
+            while len(entries) < count:
+                line = f.readline()
+                # A line without its newline is still being written
+                if not line.endswith(b'\n'):
+                    break
+                offset += len(line)
+                entries.append((offset, line.decode()))
+        if not entries and block_ms:
+            time.sleep(block_ms / 1000)
+        return entries
+
+    def ack(self, entry_ids):
+        if not entry_ids:
+            return
+        self._write_offset(max(entry_ids))
+        self._compact()
+
+    def dead_letter(self, entry_id, data, error):
+        self._append(self.dead_path, json.dumps({'data': data, 'error': error}))
+        self.ack([entry_id])
+
+    def depth(self):
+        return sum(1 for _ in self._pending_lines())
+
+    def oldest_queued_at(self):
+        for line in self._pending_lines():
+            return json.loads(line).get('queued_at')
+        return None
+
+    def pending_for(self, session_id):
+        return any(session_id in line for line in self._pending_lines())
+
+    def lock(self):
+        if not self._thread_lock.acquire(blocking=False):
+            return False
+        f = open(self.path + '.lock', 'a')
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            self._thread_lock.release()
+            return False
+        self._drain_lock = f
+        return True
+
+    def unlock(self):
+        fcntl.flock(self._drain_lock, fcntl.LOCK_UN)
+        self._drain_lock.close()
+        self._drain_lock = None
+        self._thread_lock.release()
+
+    def _append(self, path, data):
+        with open(path, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.write(data + '\n')
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _offset(self):
+        try:
+            with open(self.offset_path) as f:
+                return int(f.read() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def _start(self, f):
+        """
+        Where reading `f`, the open log, resumes.
+        """
+        offset = self._offset()
+        # An offset past the end was written for a log that has since been
+        # truncated; every line in the log now is unread. Replaying is safe,
+        # skipping is not.
+        if offset > os.fstat(f.fileno()).st_size:
+            return 0
+        return offset
+
+    def _write_offset(self, offset):
+        # Replaced atomically, so a crash leaves the old offset or the new one
+        tmp_path = self.offset_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(str(offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.offset_path)
+
+    def _pending_lines(self):
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(self._start(f))
+                for line in f:
+                    if line.endswith(b'\n'):
+                        yield line.decode()
+        except FileNotFoundError:
+            return
+
+    def _compact(self):
+        # Truncate under the append lock so no append lands between the check and the truncate
+        with open(self.path, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                if os.path.getsize(self.path) == self._offset():
+                    # Offset first: a crash before the truncate replays the
+                    # drained lines, which the idempotent inserts skip
+                    self._write_offset(0)
+                    f.truncate(0)
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+class WriteBehind:
+    """
+    Takes chat turn persistence off the request path.
+
+    Routes enqueue a finished turn (built by persistence.build_turn) and
+    respond right away; a worker thread in each process drains the queue in
+    batches with persistence.apply_turns, acknowledging entries only after
+    their transaction commits. Delivery is at least once and the inserts are
+    idempotent, so a crash between commit and acknowledgement only replays
+    rows that are then skipped.
+
+    While the database is unavailable the worker backs off and the backlog
+    waits in the queue. A turn that keeps failing on its own (e.g. its user
+    was deleted) is moved to a dead-letter queue instead of blocking the rest.
+    """
+
+    def __init__(self, app, queue, batch_size=100, interval=0.5, read_timeout=5, run_worker=True, logger=None):
+        self.app = app
+        self.queue = queue
+        self.batch_size = batch_size
+        self.interval = interval
+        self.read_timeout = read_timeout
+        self.run_worker = run_worker
+        self.logger = logger
+        self.enqueued = 0
+        self.applied = 0
+        self.failed = 0
+        self.dead_lettered = 0
+        self._lock = threading.Lock()
+        self._pid = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    @classmethod
+    def from_config(cls, app, redis_client):
+        """
+        The configured write-behind queue, or None (chat turns are written
+        on the request path) when neither Redis nor the file queue can be used.
+        """
+        config = app.config
+        if config['WRITE_BEHIND_BACKEND'] == 'redis' and redis_client is not None:
+            queue = RedisStreamQueue(redis_client, stream=config['WRITE_BEHIND_STREAM'],
+                                     claim_idle=config['WRITE_BEHIND_CLAIM_IDLE'])
+        elif fcntl is None:
+            app.logger.warning("Write-behind needs Redis on this platform, writing chat turns synchronously")
+            return None
+        else:
+            if config['WRITE_BEHIND_BACKEND'] == 'redis':
+                app.logger.warning("Redis is not available, queueing chat writes to the local log instead")
+            queue = FileQueue(config['WRITE_BEHIND_LOG_PATH'], fsync=config['WRITE_BEHIND_FSYNC'])
+        return cls(
+            app,
+            queue,
+            batch_size=config['WRITE_BEHIND_BATCH_SIZE'],
+            interval=config['WRITE_BEHIND_INTERVAL'],
+            read_timeout=config['WRITE_BEHIND_READ_TIMEOUT'],
+            run_worker=config['WRITE_BEHIND_WORKER'],
+            logger=app.logger
+        )
+
+    def enqueue(self, turn):
+        """
+        Queue a turn for writing. Returns False if the queue is unavailable,
+        in which case the caller should write the turn itself.
+        """
+        try:
+            self.queue.put(turn['session']['id'], encode_turn(turn))
+        except Exception as e:
+            self._log('warning', f"Write-behind enqueue failed: {str(e)}")
+            return False
+        self.enqueued += 1
+        if self.run_worker:
+            self.start()
+        return True
+
+    def wait_for_session(self, session_id):
+        """
+        Read-your-writes barrier: block until no queued turn of this session
+        is waiting, so the next turn sees the previous ones. Drains the queue
+        inline if the worker hasn't caught up within read_timeout, and gives
+        up after twice that.
+        """
+        deadline = time.monotonic() + self.read_timeout
+        try:
+            while self.queue.pending_for(session_id):
+                now = time.monotonic()
+                if now >= deadline:
+                    self._log('warning', f"Write-behind queue is behind, draining inline for session {session_id}")
+                    # Returns 0 without waiting while the worker holds the queue;
+                    # it is then writing the batch this session waits for
+                    if self.drain():
+                        continue
+                    if now >= deadline + self.read_timeout:
+                        self._log('warning', f"Write-behind barrier timed out for session {session_id}")
+                        return
+                time.sleep(0.05)
+        except Exception as e:
+            self._log('warning', f"Write-behind barrier error: {str(e)}")
+
+    def drain(self, max_batches=None, block_ms=0):
+        """
+        Apply queued turns until the queue is empty (or max_batches batches
+        were read). Returns the number of turns written.
+        """
+        if not self.queue.lock():
+            return 0
+        written = 0
+        batches = 0
+        try:
+            while max_batches is None or batches < max_batches:
+                entries = self.queue.read(self.batch_size, block_ms)
+                if not entries:
+                    break
+                batches += 1
+                written += self._apply(entries)
+        finally:
+            self.queue.unlock()
+        return written
+
+    def _apply(self, entries):
+        turns = []
+        for _, data in entries:
+            try:
+                turns.append(decode_turn(data))
+            except Exception as e:
+                # Truncated or foreign data can never be written; set it aside below
+                turns.append(e)
+
+        if not any(isinstance(turn, Exception) for turn in turns):
+            try:
+                self._commit(turns)
+            except Exception as e:
+                self.failed += 1
+                self._log('warning', f"Write-behind batch of {len(entries)} failed: {str(e)}")
+                if _is_outage(e):
+                    raise
+            else:
+                self.queue.ack([entry_id for entry_id, _ in entries])
+                self.applied += len(entries)
+                return len(entries)
+
+        # Some turn in the batch is bad: write them one by one, in queue order,
+        # and set the bad ones aside
+        written = 0
+        for (entry_id, data), turn in zip(entries, turns):
+            if isinstance(turn, Exception):
+                self._dead_letter(entry_id, data, f"Undecodable turn: {str(turn)}")
+                continue
+            try:
+                self._commit([turn])
+            except Exception as turn_error:
+                if _is_outage(turn_error):
+                    raise
+                self._dead_letter(entry_id, data, str(turn_error))
+            else:
+                self.queue.ack([entry_id])
+                self.applied += 1
+                written += 1
+        return written
+
+    def _dead_letter(self, entry_id, data, error):
+        self.queue.dead_letter(entry_id, data, error)
+        self.dead_lettered += 1
+        self._log('error', f"Write-behind turn dead-lettered: {error}")
+
+    def _commit(self, turns):
+        with self.app.app_context():
+            try:
+                apply_turns(db.session, turns)
+                db.session.commit()
+                self.app.versions.bump(*{turn['session']['user_id'] for turn in turns})
+            except Exception:
+                db.session.rollback()
+                raise
+            finally:
+                db.session.remove()
+
+    def start(self):
+        """
+        Start this process's worker thread. Threads do not survive a fork, so
+        a worker started before gunicorn forks is restarted in each child.
+        """
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self.run, name='write-behind', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def run(self):
+        """
+        Worker loop: drain, then wait for new turns. Backs off exponentially
+        while the database is unreachable.
+
+        The wait happens outside the queue lock, so a request draining inline
+        in wait_for_session never finds the queue held by an idle worker.
+        """
+        backoff = self.interval
+        while not self._stop.is_set():
+            try:
+                if not self.drain():
+                    self._stop.wait(self.interval)
+                backoff = self.interval
+            except Exception as e:
+                self._log('warning', f"Write-behind worker error, retrying in {backoff:.1f}s: {str(e)}")
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, 30)
+
+    def stats(self):
+        """
+        Queue depth and lag (age of the oldest queued turn, in seconds), plus
+        this process's counters.
+        """
+        stats = {
+            'backend': self.queue.name,
+            'enqueued': self.enqueued,
+            'applied': self.applied,
+            'failed_batches': self.failed,
+            'dead_lettered': self.dead_lettered,
+            'worker_running': self._thread is not None and self._pid == os.getpid() and self._thread.is_alive(),
+        }
+        try:
+            oldest = self.queue.oldest_queued_at()
+            stats['depth'] = self.queue.depth()
+            stats['lag_seconds'] = round(time.time() - oldest, 3) if oldest else 0.0
+        except Exception as e:
+            stats['error'] = str(e)
+        return stats
+
+    def _log(self, level, message):
+        if self.logger:
+            getattr(self.logger, level)(message)
+
+def _is_outage(error):
+    # Connection-level failures affect every turn alike; retry the batch later
+    return isinstance(error, (OperationalError, InterfaceError))
@@ -0,0 +1,58 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from config import TestingConfig
+from models import User, db
+
+PASSWORD = 'test-password'
+
+@pytest.fixture
+def make_config(tmp_path):
+    """
+    TestingConfig on a fresh SQLite file, with `overrides` applied as
+    config attributes.
+    """
+    def make(**overrides):
+        return type('Config', (TestingConfig,), {
+            'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'test.db'}",
+            'LOG_LEVEL': 'WARNING',
+            'LLM_PROVIDER': 'stub',
+            'LLM_STUB_LATENCY': '0',
+            **overrides,
+        })
+    return make
+
+@pytest.fixture
+def make_app(make_config):
+    """
+    create_app with make_config(**overrides).
+    """
+    def make(**overrides):
+        return create_app(make_config(**overrides))
+    return make
+
+@pytest.fixture
+def app(make_app):
+    return make_app()
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+@pytest.fixture
+def user_id(app):
+    with app.app_context():
+        user = User('tester', 'tester@example.com', PASSWORD)
+        db.session.add(user)
+        db.session.commit()
+        return user.id
+
+@pytest.fixture
+def auth_headers(client, user_id):
+    response = client.post('/api/auth/login', json={'username': 'tester', 'password': PASSWORD})
+    return {'Authorization': f"Bearer {response.get_json()['access_token']}"}
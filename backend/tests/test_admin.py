@@ -0,0 +1,23 @@
+TOKEN = 'admin-token'
+
+def test_health_keeps_internals_private(client):
+    response = client.get('/health')
+    assert response.status_code == 200
+    assert set(response.get_json()) == {'status', 'database', 'redis', 'environment'}
+
+def test_stats_are_off_by_default(client):
+    assert client.get('/api/admin/stats', headers={'X-Admin-Token': TOKEN}).status_code == 404
+
+def test_stats_need_the_admin_token(make_app):
+    client = make_app(ADMIN_STATS_ENABLED=True, ADMIN_TOKEN=TOKEN).test_client()
+    assert client.get('/api/admin/stats').status_code == 403
+    assert client.get('/api/admin/stats', headers={'X-Admin-Token': 'wrong'}).status_code == 403
+
+    response = client.get('/api/admin/stats', headers={'X-Admin-Token': TOKEN})
+    assert response.status_code == 200
+    assert {'cache', 'upstream', 'rate_limits', 'singleflight'} <= set(response.get_json())
+
+def test_stats_do_not_depend_on_the_profiler(make_app):
+    client = make_app(ADMIN_STATS_ENABLED=True, ADMIN_TOKEN=TOKEN, PROFILING_ENABLED=False).test_client()
+    assert client.get('/api/admin/stats', headers={'X-Admin-Token': TOKEN}).status_code == 200
+    assert client.get('/api/admin/profile', headers={'X-Profiler-Token': TOKEN}).status_code == 404
@@ -0,0 +1,45 @@
+import pytest
+
+from conftest import PASSWORD
+
+testclient = pytest.importorskip('starlette.testclient')
+asgi = pytest.importorskip('asgi')
+
+@pytest.fixture
+def asgi_client(make_config, user_id):
+    with testclient.TestClient(asgi.create_asgi_app(make_config())) as client:
+        yield client
+
+@pytest.fixture
+def asgi_headers(asgi_client):
+    # Login is not an async route: this goes through the mounted Flask app
+    response = asgi_client.post('/api/auth/login', json={'username': 'tester', 'password': PASSWORD})
+    assert response.status_code == 200
+    return {'Authorization': f"Bearer {response.json()['access_token']}"}
+
+def test_send_and_read_back_through_the_async_routes(asgi_client, asgi_headers):
+    first = asgi_client.post('/api/chat/send', json={'message': 'What helps with a headache?'}, headers=asgi_headers)
+    assert first.status_code == 200
+    session_id = first.json()['session_id']
+    second = asgi_client.post('/api/chat/send', json={'message': 'And for a fever?', 'session_id': session_id},
+                              headers=asgi_headers)
+    assert second.status_code == 200 and second.json()['session_id'] == session_id
+
+    sessions = asgi_client.get('/api/chat/sessions', headers=asgi_headers).json()['sessions']
+    assert [session['id'] for session in sessions] == [session_id]
+    messages = asgi_client.get(f'/api/chat/sessions/{session_id}', headers=asgi_headers).json()['messages']
+    assert [message['role'] for message in messages] == ['user', 'assistant', 'user', 'assistant']
+    assert messages[1]['content'] == first.json()['response']
+
+def test_async_routes_check_the_token(asgi_client):
+    assert asgi_client.post('/api/chat/send', json={'message': 'hi'}).status_code == 401
+    assert asgi_client.get('/api/chat/sessions', headers={'Authorization': 'Bearer nonsense'}).status_code == 401
+
+def test_other_routes_fall_through_to_flask(asgi_client):
+    response = asgi_client.get('/health')
+    assert response.status_code == 200 and response.json()['status'] == 'healthy'
+
+def test_delete_session(asgi_client, asgi_headers):
+    session_id = asgi_client.post('/api/chat/send', json={'message': 'Hello'}, headers=asgi_headers).json()['session_id']
+    assert asgi_client.delete(f'/api/chat/sessions/{session_id}', headers=asgi_headers).status_code == 200
+    assert asgi_client.get(f'/api/chat/sessions/{session_id}', headers=asgi_headers).status_code == 404
@@ -0,0 +1,40 @@
+from models import User, db
+
+def test_user_update_invalidates_after_commit(app, user_id):
+    cache = app.auth_cache
+    loads = []
+
+    def loader(uid):
+        loads.append(uid)
+        return db.session.get(User, uid)
+
+    with app.app_context():
+        assert cache.get_principal(user_id, loader).username == 'tester'
+        user = db.session.get(User, user_id)
+        user.username = 'renamed'
+        db.session.flush()
+        # Flushed only: another request still sees the committed row, and the cache keeps it
+        assert cache.get_principal(user_id, loader).username == 'tester'
+        assert len(loads) == 1
+
+        db.session.commit()
+        assert cache.get_principal(user_id, loader).username == 'renamed'
+        assert len(loads) == 2
+
+def test_rolled_back_update_keeps_the_principal(app, user_id):
+    cache = app.auth_cache
+    with app.app_context():
+        cache.get_principal(user_id, lambda uid: db.session.get(User, uid))
+        user = db.session.get(User, user_id)
+        user.username = 'renamed'
+        db.session.flush()
+        db.session.rollback()
+        assert cache.get_principal(user_id, lambda uid: None).username == 'tester'
+
+def test_user_delete_invalidates_after_commit(app, user_id):
+    cache = app.auth_cache
+    with app.app_context():
+        cache.get_principal(user_id, lambda uid: db.session.get(User, uid))
+        db.session.delete(db.session.get(User, user_id))
+        db.session.commit()
+        assert cache.get_principal(user_id, lambda uid: db.session.get(User, uid)) is None
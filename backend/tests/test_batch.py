@@ -0,0 +1,82 @@
+import json
+import os
+import time
+
+import pytest
+
+from services.batch import prune_checkpoints
+
+TOKEN = 'batch-token'
+
+@pytest.fixture
+def app(make_app, tmp_path):
+    return make_app(BATCH_API_TOKEN=TOKEN, BATCH_CHECKPOINT_DIR=str(tmp_path / 'batches'))
+
+def post_batch(client, headers, lines, batch_id=None, token=TOKEN):
+    url = '/api/chat/batch' + (f'?batch_id={batch_id}' if batch_id else '')
+    return client.post(url, data='\n'.join(lines), headers={**headers, 'X-Batch-Token': token})
+
+def results(response):
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+def checkpoint_path(app, user_id, batch_id):
+    return os.path.join(app.config['BATCH_CHECKPOINT_DIR'], user_id, f'{batch_id}.jsonl')
+
+def test_batch_needs_a_configured_token(make_app):
+    client = make_app().test_client()
+    assert client.post('/api/chat/batch', data='{"message": "hi"}').status_code == 404
+
+def test_batch_rejects_a_wrong_token(client, auth_headers):
+    response = post_batch(client, auth_headers, ['{"message": "hi"}'], token='wrong')
+    assert response.status_code == 403
+
+def test_batch_size_is_capped(app, client, auth_headers):
+    lines = ['{"message": "hi"}'] * (app.config['BATCH_MAX_ITEMS'] + 1)
+    assert post_batch(client, auth_headers, lines).status_code == 413
+
+def test_finished_batch_deletes_its_checkpoint(app, client, user_id, auth_headers):
+    response = post_batch(client, auth_headers, ['{"id": "a", "message": "headache"}',
+                                                 '{"id": "b", "message": "fever"}'], batch_id='done')
+    assert response.status_code == 200
+    lines = results(response)
+    assert sorted(line['id'] for line in lines[:-1]) == ['a', 'b']
+    assert lines[-1]['summary']['failed'] == 0
+    assert not os.path.exists(checkpoint_path(app, user_id, 'done'))
+
+def test_batch_with_failures_keeps_its_checkpoint_to_resume(app, client, user_id, auth_headers):
+    lines = ['{"id": "a", "message": "headache"}', 'not json']
+    first = results(post_batch(client, auth_headers, lines, batch_id='partial'))
+    assert first[-1]['summary']['failed'] == 1
+    assert os.path.exists(checkpoint_path(app, user_id, 'partial'))
+
+    second = results(post_batch(client, auth_headers, lines, batch_id='partial'))
+    assert second[-1]['summary']['resumed'] == 1
+
+def test_prune_checkpoints_deletes_only_stale_files(tmp_path):
+    stale, fresh = tmp_path / 'stale.jsonl', tmp_path / 'fresh.jsonl'
+    stale.write_text('')
+    fresh.write_text('')
+    old = time.time() - 3600
+    os.utime(stale, (old, old))
+    assert prune_checkpoints(str(tmp_path), 60) == 1
+    assert not stale.exists() and fresh.exists()
+    assert prune_checkpoints(str(tmp_path / 'missing'), 60) == 0
+
+def test_cli_batch_resumes_from_its_checkpoint(app, user_id, tmp_path):
+    prompts = tmp_path / 'prompts.jsonl'
+    prompts.write_text('{"id": "a", "message": "headache"}\n{"id": "b", "message": ""}\n')
+    output = tmp_path / 'results.jsonl'
+    runner = app.test_cli_runner()
+
+    result = runner.invoke(args=['chat', 'batch', str(prompts), '--user', 'tester', '--output', str(output)])
+    assert result.exit_code == 0, result.output
+    first = {line['id']: line for line in map(json.loads, output.read_text().splitlines())}
+    assert first['a']['status'] == 200 and first['b']['status'] == 400
+    # The empty message failed, so the checkpoint is kept for a resume
+    assert os.path.exists(f'{prompts}.checkpoint.jsonl')
+
+    result = runner.invoke(args=['chat', 'batch', str(prompts), '--user', 'tester', '--output', str(output)])
+    assert result.exit_code == 0, result.output
+    second = {line['id']: line for line in map(json.loads, output.read_text().splitlines())}
+    assert second['a'] == first['a']
+    assert '2/2 done (1 resumed, 1 failed' in result.output
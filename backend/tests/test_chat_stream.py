@@ -0,0 +1,52 @@
+import json
+
+from sqlalchemy import select
+
+import routes.chat
+from models import ChatMessage, db
+
+def events(response):
+    """
+    (event, data) pairs of an SSE response body.
+    """
+    parsed = []
+    for frame in response.get_data(as_text=True).strip().split('\n\n'):
+        lines = dict(line.split(': ', 1) for line in frame.splitlines())
+        parsed.append((lines['event'], json.loads(lines['data'])))
+    return parsed
+
+def stream(client, auth_headers, message='What helps with a headache?'):
+    return client.post('/api/chat/send/stream', json={'message': message}, headers=auth_headers)
+
+def test_streamed_answer_is_the_saved_answer(app, client, auth_headers):
+    response = stream(client, auth_headers)
+    assert response.status_code == 200
+    parsed = events(response)
+    assert parsed[0][0] == 'session' and parsed[-1][0] == 'done'
+    streamed = ''.join(data['content'] for event, data in parsed if event == 'delta')
+    done = parsed[-1][1]
+    assert streamed == done['response'] == streamed.strip()
+    assert not done['is_fallback']
+
+    with app.app_context():
+        saved = db.session.execute(
+            select(ChatMessage.content).filter_by(session_id=done['session_id'], role='assistant')
+        ).scalar()
+    assert saved == done['response']
+
+def test_cache_hit_that_cannot_be_saved_sends_an_error_event(client, auth_headers, monkeypatch):
+    monkeypatch.setattr(routes.chat, 'get_cached_response', lambda *args: 'A cached answer.')
+
+    def fail(*args):
+        raise RuntimeError('database is locked')
+    monkeypatch.setattr(routes.chat, 'save_chat_turn', fail)
+
+    parsed = events(stream(client, auth_headers))
+    assert [event for event, data in parsed] == ['session', 'error']
+    assert parsed[-1][1]['error'] == 'database is locked'
+
+def test_cache_hit_streams_the_cached_answer(client, auth_headers, monkeypatch):
+    monkeypatch.setattr(routes.chat, 'get_cached_response', lambda *args: 'A cached answer.')
+    parsed = events(stream(client, auth_headers))
+    assert [event for event, data in parsed] == ['session', 'delta', 'done']
+    assert parsed[-1][1]['response'] == 'A cached answer.'
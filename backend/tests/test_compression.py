@@ -0,0 +1,59 @@
+import pytest
+from sqlalchemy import select, text
+
+from models import ChatMessage, db
+from services.compression import MARKER, TextCodec, train_dictionary
+
+ANSWERS = [
+    f"A fever of {n} days is usually the body fighting an infection. Rest, drink plenty of fluids and "
+    f"seek medical attention if it goes above 39.4°C or lasts more than three days. Always consult a "
+    f"healthcare professional if you are worried about your symptoms." * 3
+    for n in range(40)
+]
+
+def test_short_values_are_stored_unchanged():
+    codec = TextCodec(min_size=512)
+    assert codec.encode('Short answer.') == 'Short answer.'
+    assert codec.decode('Short answer.') == 'Short answer.'
+
+def test_long_values_round_trip_smaller():
+    codec = TextCodec(min_size=64)
+    encoded = codec.encode(ANSWERS[0])
+    assert encoded.startswith(MARKER) and len(encoded) < len(ANSWERS[0])
+    assert codec.decode(encoded) == ANSWERS[0]
+
+def test_text_starting_with_the_marker_is_always_encoded():
+    codec = TextCodec(min_size=512)
+    tricky = MARKER + 'z not really compressed'
+    assert codec.encode(tricky) != tricky
+    assert codec.decode(codec.encode(tricky)) == tricky
+
+def test_disabled_codec_still_decodes():
+    encoded = TextCodec(min_size=64).encode(ANSWERS[0])
+    disabled = TextCodec(enabled=False)
+    assert disabled.encode(ANSWERS[0]) == ANSWERS[0]
+    assert disabled.decode(encoded) == ANSWERS[0]
+
+def test_trained_dictionary_compresses_better(tmp_path):
+    plain = TextCodec(min_size=64)
+    trained = TextCodec(min_size=64, dictionary_dir=str(tmp_path))
+    dictionary_id = trained.save_dictionary(train_dictionary(ANSWERS[:30]))
+    assert trained.dictionary_id == dictionary_id
+
+    sample = ANSWERS[35]
+    assert len(trained.encode(sample)) < len(plain.encode(sample))
+    # Another process finds the dictionary by the id in the value
+    assert TextCodec(dictionary_dir=str(tmp_path)).decode(trained.encode(sample)) == sample
+    with pytest.raises(ValueError):
+        TextCodec().decode(trained.encode(sample))
+
+def test_message_column_is_compressed_at_rest(app, client, auth_headers, monkeypatch):
+    monkeypatch.setattr('routes.chat.get_cached_response', lambda *args: ANSWERS[0])
+    response = client.post('/api/chat/send', json={'message': 'Fever?'}, headers=auth_headers)
+    session_id = response.get_json()['session_id']
+    with app.app_context():
+        raw = db.session.execute(
+            text("SELECT content FROM chat_message WHERE session_id = :id AND role = 'assistant'"), {'id': session_id}
+        ).scalar()
+        assert raw.startswith(MARKER) and len(raw) < len(ANSWERS[0])
+        assert db.session.execute(select(ChatMessage.content).filter_by(role='assistant')).scalar() == ANSWERS[0]
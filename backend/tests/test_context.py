@@ -0,0 +1,69 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from sqlalchemy import select
+
+from conftest import PASSWORD
+from models import ChatSession, ChatMessage, db
+from services.context import ContextBuilder, ExtractiveSummarizer, Tokenizer
+
+def make_builder(**options):
+    tokenizer = Tokenizer()
+    return ContextBuilder(tokenizer, ExtractiveSummarizer(tokenizer), **options)
+
+def make_tail(count, words=10):
+    start = datetime(2024, 1, 1)
+    messages = [SimpleNamespace(role='user' if n % 2 == 0 else 'assistant', content=' '.join(['word'] * words),
+                                created_at=start + timedelta(seconds=n)) for n in range(count)]
+    return messages[::-1]
+
+def test_short_session_within_budget_does_not_fold():
+    builder = make_builder(token_budget=3000, max_messages=20)
+    tail = make_tail(12)
+    kept, dropped = builder.fit(tail, 'system', None, 'question')
+    assert len(kept) == 12 and dropped == []
+    assert not builder.needs_fold(SimpleNamespace(summary_until=None), tail, dropped)
+
+def test_full_window_folds_until_the_summary_reaches_it():
+    builder = make_builder(token_budget=3000, max_messages=20)
+    tail = make_tail(20)
+    kept, dropped = builder.fit(tail, 'system', None, 'question')
+    assert dropped == []
+    # Older rows may have aged out of the window without being summarized
+    assert builder.needs_fold(SimpleNamespace(summary_until=None), tail, dropped)
+    behind = tail[-1].created_at - timedelta(seconds=1)
+    assert builder.needs_fold(SimpleNamespace(summary_until=behind), tail, dropped)
+    assert not builder.needs_fold(SimpleNamespace(summary_until=tail[-1].created_at), tail, dropped)
+
+def test_over_budget_folds_the_dropped_turns():
+    builder = make_builder(token_budget=200, max_messages=20)
+    tail = make_tail(20, words=40)
+    kept, dropped = builder.fit(tail, 'system', None, 'question')
+    assert dropped and kept[0].created_at > dropped[0].created_at
+    assert builder.needs_fold(SimpleNamespace(summary_until=None), tail, dropped)
+
+    session = SimpleNamespace(summary=None, summary_until=None)
+    builder.fold(session, dropped[::-1])
+    assert session.summary.startswith('- ')
+    assert session.summary_until == dropped[0].created_at
+
+def test_turns_aging_out_of_the_window_are_summarized(make_app, user_id):
+    # The budget is never reached: only the message window pushes turns out
+    app = make_app(CONTEXT_MAX_MESSAGES=4)
+    client = app.test_client()
+    token = client.post('/api/auth/login', json={'username': 'tester', 'password': PASSWORD}).get_json()['access_token']
+    session_id = None
+    for turn in range(8):
+        response = client.post('/api/chat/send', json={'message': f'Short question {turn}?', 'session_id': session_id},
+                               headers={'Authorization': f'Bearer {token}'})
+        assert response.status_code == 200
+        session_id = response.get_json()['session_id']
+
+    with app.app_context():
+        session = db.session.get(ChatSession, session_id)
+        messages = db.session.execute(
+            select(ChatMessage).filter_by(session_id=session_id).order_by(ChatMessage.created_at)
+        ).scalars().all()
+        assert 'Short question 0?' in session.summary
+        # The last turn read 14 messages and sent the newest 4; the 10 before them are summarized
+        assert session.summary_until == messages[9].created_at
@@ -0,0 +1,49 @@
+import json
+import random
+import re
+
+import pytest
+
+from services.fallback import DEFAULT_CORPUS_PATH, FallbackEngine, keyword_pattern
+
+@pytest.fixture
+def engine():
+    return FallbackEngine.load(rng=random.Random(0))
+
+def test_keyword_pattern_factors_shared_prefixes():
+    pattern = keyword_pattern(['fever', 'fitness', 'flu'])
+    assert pattern == 'f(?:ever|itness|lu)'
+    assert re.fullmatch(pattern, 'flu') and not re.fullmatch(pattern, 'f')
+
+def test_longer_keyword_wins_over_its_prefix():
+    pattern = re.compile(keyword_pattern(['head', 'head pain']))
+    assert pattern.match('head  pain').group() == 'head  pain'
+    assert pattern.match('head cold').group() == 'head'
+
+@pytest.mark.parametrize('message, topics', [
+    ('I have a terrible HEADACHE', ['headache']),
+    ('My head hurts and I have chills', ['headache', 'fever']),
+    ('Feeling depressed lately', ['mental_health']),
+    # Keywords match at the start of a word only
+    ('That was a great meal', []),
+])
+def test_topics(engine, message, topics):
+    response, matched = engine.match(message)
+    assert sorted(matched) == sorted(topics)
+    assert response
+
+def test_unmatched_message_gets_a_default_answer(engine):
+    with open(DEFAULT_CORPUS_PATH, encoding='utf-8') as f:
+        defaults = json.load(f)['default']
+    assert engine.match('Tell me about quantum physics')[0] in defaults
+
+def test_weak_runner_up_is_not_answered():
+    engine = FallbackEngine([
+        {'name': 'a', 'keywords': {'alpha': 4}, 'responses': ['A.']},
+        {'name': 'b', 'keywords': {'beta': 1}, 'responses': ['B.']},
+    ], ['Default.'])
+    assert engine.match('alpha and beta') == ('A.', ['a'])
+    assert engine.match('beta alpha alpha')[1] == ['a']
+
+def test_empty_corpus_always_defaults():
+    assert FallbackEngine([], ['Default.']).match('headache') == ('Default.', [])
@@ -0,0 +1,97 @@
+import httpx
+import openai
+import pytest
+
+from services.governor import CircuitOpen, Slot, UpstreamGovernor, UpstreamThrottled
+
+def make_governor(redis_client=None):
+    # A 1000 token budget that barely refills while the test runs, and no queueing
+    return UpstreamGovernor(redis_client, rpm=1000, tpm=1000, headroom=1.0, queue_timeout=0.01, max_queued=0)
+
+def test_slot_refunds_only_unused_tokens():
+    slot = Slot('lease', 800)
+    slot.used(None)
+    assert slot.refund == 0
+    slot.used(300)
+    assert slot.refund == 500
+    slot.used(900)
+    assert slot.refund == 0
+
+def test_refund_returns_tokens_to_the_bucket():
+    governor = make_governor()
+    with governor.slot(800) as slot:
+        slot.used(100)
+    # 200 left plus the 700 refunded
+    with governor.slot(800):
+        pass
+    assert governor.stats()['granted'] == 2
+
+def test_unreported_usage_keeps_the_reservation():
+    governor = make_governor()
+    with governor.slot(800):
+        pass
+    with pytest.raises(UpstreamThrottled) as raised:
+        with governor.slot(800):
+            pass
+    assert raised.value.reason == 'tokens'
+
+def test_refund_survives_a_failed_call():
+    governor = make_governor()
+    with pytest.raises(RuntimeError):
+        with governor.slot(800) as slot:
+            slot.used(100)
+            raise RuntimeError('client went away')
+    with governor.slot(800):
+        pass
+
+def test_redis_refund_matches_local():
+    fakeredis = pytest.importorskip('fakeredis')
+    redis_client = fakeredis.FakeRedis()
+    governor = make_governor(redis_client)
+    with governor.slot(800) as slot:
+        slot.used(100)
+    level = float(redis_client.hget('upstream:tokens', 'level'))
+    assert 900 <= level < 1000
+    with governor.slot(800):
+        pass
+    stats = governor.stats()
+    assert (stats['backend'], stats['granted'], stats['limiter_errors']) == ('redis', 2, 0)
+
+def connection_error():
+    return openai.APIConnectionError(request=httpx.Request('POST', 'https://api.openai.com/v1/chat/completions'))
+
+def test_breaker_opens_after_repeated_failures():
+    governor = UpstreamGovernor(breaker_threshold=2, breaker_cooldown=30.0)
+    for _ in range(2):
+        with pytest.raises(openai.APIConnectionError):
+            with governor.slot(10):
+                raise connection_error()
+    with pytest.raises(CircuitOpen):
+        with governor.slot(10):
+            pass
+    stats = governor.stats()
+    assert (stats['breaker_trips'], stats['breaker_rejected']) == (1, 1)
+
+def test_our_own_errors_do_not_trip_the_breaker():
+    governor = UpstreamGovernor(breaker_threshold=1)
+    with pytest.raises(ValueError):
+        with governor.slot(10):
+            raise ValueError('bad payload')
+    with governor.slot(10):
+        pass
+
+def test_concurrency_cap_sheds_callers_that_cannot_wait():
+    governor = UpstreamGovernor(max_concurrency=1, queue_timeout=0.05)
+    with governor.slot(10):
+        with pytest.raises(UpstreamThrottled) as raised:
+            with governor.slot(10):
+                pass
+    assert raised.value.reason == 'concurrency'
+    with governor.slot(10):
+        pass
+
+def test_disabled_governor_lets_everything_through():
+    governor = UpstreamGovernor(tpm=1, enabled=False)
+    with governor.slot(1000) as slot:
+        slot.used(10)
+    assert governor.stats()['granted'] == 0
@@ -0,0 +1,35 @@
+from sqlalchemy import select
+
+from models import ChatHistory, db
+
+def send(client, auth_headers, message, session_id=None):
+    response = client.post('/api/chat/send', json={'message': message, 'session_id': session_id}, headers=auth_headers)
+    assert response.status_code == 200
+    return response.get_json()
+
+def test_history_reads_the_text_from_the_message_pair(app, client, auth_headers):
+    turn = send(client, auth_headers, 'What helps with a headache?')
+    with app.app_context():
+        stored = db.session.execute(select(ChatHistory)).scalar_one()
+        # The text is stored once, in the messages
+        assert stored.query == stored.response == ''
+
+    history = client.get('/api/history/', headers=auth_headers).get_json()['history']
+    assert [(h['query'], h['response']) for h in history] == [('What helps with a headache?', turn['response'])]
+
+def test_history_outlives_its_session(client, auth_headers):
+    turn = send(client, auth_headers, 'What helps with a fever?')
+    assert client.delete(f"/api/chat/sessions/{turn['session_id']}", headers=auth_headers).status_code == 200
+
+    history = client.get('/api/history/', headers=auth_headers).get_json()['history']
+    assert [(h['query'], h['response']) for h in history] == [('What helps with a fever?', turn['response'])]
+
+def test_long_answers_survive_detaching(app, client, auth_headers, monkeypatch):
+    # Long enough to be stored compressed, which the copy must keep decodable
+    answer = ' '.join(['Drink plenty of fluids and rest.'] * 100)
+    monkeypatch.setattr('routes.chat.get_cached_response', lambda *args: answer)
+    turn = send(client, auth_headers, 'What helps with a cold?')
+    client.delete(f"/api/chat/sessions/{turn['session_id']}", headers=auth_headers)
+
+    history = client.get('/api/history/', headers=auth_headers).get_json()['history']
+    assert history[0]['response'] == answer
@@ -0,0 +1,43 @@
+import json
+from datetime import date, datetime
+
+import pytest
+from flask import jsonify
+
+from services.json_provider import OrjsonProvider, StdlibJSONProvider, configure_json
+
+ROW = {'updated_at': datetime(2024, 5, 1, 12, 30), 'day': date(2024, 5, 1), 'b': 2, 'a': [1, 'x']}
+
+@pytest.fixture(params=['default', 'orjson'])
+def json_app(request, make_app):
+    if request.param == 'orjson':
+        pytest.importorskip('orjson')
+    return make_app(JSON_PROVIDER=request.param)
+
+def test_configured_provider(make_app):
+    pytest.importorskip('orjson')
+    assert isinstance(make_app().json, OrjsonProvider)
+    assert isinstance(make_app(JSON_PROVIDER='default').json, StdlibJSONProvider)
+
+def test_unknown_provider_is_rejected(app):
+    app.config['JSON_PROVIDER'] = 'simplejson'
+    with pytest.raises(ValueError, match='simplejson'):
+        configure_json(app)
+
+def test_providers_write_the_same_bytes(make_app):
+    pytest.importorskip('orjson')
+    stdlib = make_app(JSON_PROVIDER='default').json.dumps_bytes(ROW)
+    assert make_app(JSON_PROVIDER='orjson').json.dumps_bytes(ROW) == stdlib
+
+def test_compact_sorted_output_with_iso_dates(json_app):
+    body = json_app.json.dumps_bytes(ROW)
+    assert body.startswith(b'{"a":[1,"x"],"b":2,"day":"2024-05-01"')
+    assert json.loads(body)['updated_at'] == '2024-05-01T12:30:00'
+    assert json_app.json.loads(body)['b'] == 2
+
+def test_jsonify_uses_the_provider(json_app):
+    with json_app.app_context():
+        response = jsonify(ROW)
+    assert response.mimetype == 'application/json'
+    assert response.get_json()['day'] == '2024-05-01'
+    assert list(response.get_json()) == ['a', 'b', 'day', 'updated_at']
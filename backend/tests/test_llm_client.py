@@ -0,0 +1,47 @@
+import os
+
+import openai
+
+from services.llm import OpenAIProvider, StubProvider
+from services.llm_stub import StubBehavior
+
+def make_provider(**options):
+    return StubProvider(behavior=StubBehavior(latency='0'), api_key=None, model='gpt-4o', max_retries=0, **options)
+
+def complete(client):
+    return client.chat.completions.create(model='gpt-4o', messages=[{'role': 'user', 'content': 'Hello'}])
+
+def test_one_client_per_process():
+    provider = OpenAIProvider(api_key='sk-test', model='gpt-4o')
+    assert isinstance(provider.client, openai.OpenAI)
+    assert provider.client is provider.client
+
+def test_client_is_rebuilt_after_a_fork(monkeypatch):
+    provider = OpenAIProvider(api_key='sk-test', model='gpt-4o')
+    parent = provider.client
+    monkeypatch.setattr(os, 'getpid', lambda: -1)
+    child = provider.client
+    assert child is not parent
+    assert child is provider.client
+
+def test_requests_reuse_pooled_connections():
+    provider = make_provider(max_connections=4)
+    try:
+        for _ in range(3):
+            assert complete(provider.client).choices[0].message.content
+        stats = provider.pool_stats()
+        assert stats['max_connections'] == 4
+        assert stats['connections_open'] == 1 and stats['connections_idle'] == 1
+    finally:
+        provider.close()
+
+def test_close_drops_the_client():
+    provider = make_provider()
+    client = provider.client
+    provider.close()
+    assert provider.client is not client
+    provider.close()
+
+def test_not_configured_without_an_api_key():
+    assert not OpenAIProvider(api_key=None, model='gpt-4o').configured
+    assert OpenAIProvider(api_key='sk-test', model='gpt-4o').configured
@@ -0,0 +1,108 @@
+import random
+
+import openai
+import pytest
+
+from services.llm import OpenAIProvider, StubProvider, create_provider
+from services import llm_stub
+from services.llm_stub import REPLIES, StubBehavior, parse_distribution
+
+BODY = {'messages': [{'role': 'user', 'content': 'How much sleep do adults need?'}]}
+
+def make_client(behavior):
+    return StubProvider(behavior=behavior, api_key=None, model='gpt-4o', max_retries=0)
+
+def complete(provider, **options):
+    return provider.client.chat.completions.create(
+        model='gpt-4o', messages=BODY['messages'], **options
+    )
+
+def test_create_provider_picks_by_name(app):
+    provider = create_provider(app.config)
+    assert isinstance(provider, StubProvider)
+    assert provider.describe()['provider'] == 'stub'
+
+def test_create_provider_rejects_unknown_names(app):
+    config = dict(app.config, LLM_PROVIDER='mystery')
+    with pytest.raises(ValueError, match='mystery'):
+        create_provider(config)
+    assert type(create_provider(dict(app.config, LLM_PROVIDER='openai'))) is OpenAIProvider
+
+@pytest.mark.parametrize('spec, low, high', [
+    ('0.25', 0.25, 0.25),
+    ('uniform:0.2,0.8', 0.2, 0.8),
+    ('normal:0.5,0.1', 0.0, 2.0),
+    ('lognormal:0.5,0.6', 0.0, 100.0),
+    ('exponential:0.5', 0.0, 100.0),
+])
+def test_parse_distribution(spec, low, high):
+    draw = parse_distribution(spec)
+    rng = random.Random(0)
+    for _ in range(50):
+        assert low <= draw(rng) <= high
+
+@pytest.mark.parametrize('spec', ['fast', 'gamma:1,2'])
+def test_parse_distribution_rejects_unknown_specs(spec):
+    with pytest.raises(ValueError):
+        parse_distribution(spec)
+
+def test_plans_repeat_with_the_same_seed():
+    first, second = StubBehavior(latency='uniform:0,1', seed=7), StubBehavior(latency='uniform:0,1', seed=7)
+    for _ in range(5):
+        a, b = first.plan(BODY), second.plan(BODY)
+        assert (a.status, a.delay, a.words) == (b.status, b.delay, b.words)
+
+def test_reply_tokens_sets_the_reply_length():
+    plan = StubBehavior(latency='0', reply_tokens=100).plan(BODY)
+    assert plan.status == 200 and len(plan.words) == 100
+    assert ' '.join(StubBehavior(latency='0').plan(BODY).words) in REPLIES
+
+def test_injected_server_errors_reach_the_sdk():
+    provider = make_client(StubBehavior(latency='0', error_rate=1.0))
+    try:
+        with pytest.raises(openai.InternalServerError):
+            complete(provider)
+    finally:
+        provider.close()
+
+def test_injected_rate_limits_reach_the_sdk():
+    provider = make_client(StubBehavior(latency='0', rate_limit_rate=1.0))
+    try:
+        with pytest.raises(openai.RateLimitError) as raised:
+            complete(provider)
+        assert raised.value.response.headers['retry-after'] == '1'
+    finally:
+        provider.close()
+
+@pytest.fixture
+def frozen_minute(monkeypatch):
+    # Keep every request in the same rate limit window
+    monkeypatch.setattr(llm_stub.time, 'time', lambda: 600.0)
+
+def test_requests_per_minute_limit(frozen_minute):
+    behavior = StubBehavior(latency='0', rpm=2)
+    plans = [behavior.plan(BODY) for _ in range(3)]
+    assert [plan.status for plan in plans] == [200, 200, 429]
+    assert plans[0].headers['x-ratelimit-limit-requests'] == '2'
+    assert plans[0].headers['x-ratelimit-remaining-requests'] == '1'
+    assert plans[2].headers['x-ratelimit-remaining-requests'] == '0'
+
+def test_tokens_per_minute_limit(frozen_minute):
+    # The prompt counts 7 tokens
+    behavior = StubBehavior(latency='0', tpm=20)
+    assert behavior.plan(dict(BODY, max_tokens=5)).status == 200
+    assert behavior.plan(dict(BODY, max_tokens=5)).status == 429
+    plan = behavior.plan(dict(BODY, max_tokens=1))
+    assert plan.status == 200 and plan.headers['x-ratelimit-remaining-tokens'] == '0'
+
+def test_streamed_deltas_join_up_to_the_reply():
+    provider = make_client(StubBehavior(latency='0', seed=3))
+    try:
+        expected = ' '.join(StubBehavior(latency='0', seed=3).plan(BODY).words)
+        stream = complete(provider, stream=True, stream_options={'include_usage': True})
+        chunks = list(stream)
+        text = ''.join(chunk.choices[0].delta.content or '' for chunk in chunks if chunk.choices)
+        assert text == expected
+        assert chunks[-1].usage.completion_tokens == len(expected.split(' '))
+    finally:
+        provider.close()
@@ -0,0 +1,113 @@
+import io
+import json
+import logging
+import queue
+import sys
+
+import pytest
+from flask import Flask
+
+from services.log import JsonFormatter, LogPipeline, NonBlockingQueueHandler, RepeatFilter, TextFormatter
+
+def make_record(msg, *args, level=logging.WARNING, name='app', **extra):
+    record = logging.LogRecord(name, level, __file__, 1, msg, args, None)
+    for key, value in extra.items():
+        setattr(record, key, value)
+    return record
+
+@pytest.fixture
+def logger():
+    logger = logging.getLogger('tests.log_pipeline')
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    yield logger
+    logger.handlers.clear()
+
+def attach(logger, pipeline):
+    logger.addHandler(pipeline.handler)
+    pipeline.start()
+    return pipeline
+
+def test_json_records_carry_extra_fields():
+    line = JsonFormatter().format(make_record('Saved %d messages', 3, session_id='abc'))
+    data = json.loads(line)
+    assert data['message'] == 'Saved 3 messages'
+    assert data['level'] == 'WARNING' and data['logger'] == 'app'
+    assert data['session_id'] == 'abc'
+    assert 'args' not in data and 'msg' not in data
+
+def test_json_records_carry_the_traceback():
+    try:
+        raise ValueError('bad input')
+    except ValueError:
+        record = logging.LogRecord('app', logging.ERROR, __file__, 1, 'Failed', None, sys.exc_info())
+    assert 'ValueError: bad input' in json.loads(JsonFormatter().format(record))['exc_info']
+
+def test_text_records_note_suppressed_repeats():
+    formatter = TextFormatter('%(levelname)s %(message)s')
+    assert formatter.format(make_record('Redis down')) == 'WARNING Redis down'
+    assert formatter.format(make_record('Redis down', suppressed=4)) == 'WARNING Redis down (4 similar suppressed)'
+
+def test_repeats_are_suppressed_within_the_window(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr('services.log.time.monotonic', lambda: now[0])
+    repeats = RepeatFilter(window=60, burst=2)
+    passed = [repeats.filter(make_record(f'Retry {n} failed')) for n in range(5)]
+    assert passed == [True, True, False, False, False]
+
+    now[0] += 60
+    record = make_record('Retry 6 failed')
+    assert repeats.filter(record)
+    assert record.suppressed == 3
+
+def test_info_critical_and_different_messages_always_pass():
+    repeats = RepeatFilter(window=60, burst=1)
+    assert all(repeats.filter(make_record('Request handled', level=logging.INFO)) for _ in range(3))
+    assert all(repeats.filter(make_record('Out of disk', level=logging.CRITICAL)) for _ in range(3))
+    assert repeats.filter(make_record('Redis down'))
+    assert repeats.filter(make_record('Database down'))
+    assert repeats.filter(make_record('Redis down', name='other'))
+    assert not repeats.filter(make_record('Redis down'))
+
+def test_full_queue_drops_records_instead_of_blocking():
+    handler = NonBlockingQueueHandler(queue.Queue(2))
+    for n in range(5):
+        handler.emit(make_record(f'Record {n}', level=logging.INFO))
+    assert handler.queue.qsize() == 2
+    assert handler.dropped == 3
+
+def test_queued_records_are_rendered_when_logged():
+    handler = NonBlockingQueueHandler(queue.Queue())
+    state = {'count': 1}
+    handler.emit(make_record('State %s', state))
+    state['count'] = 2
+    queued = handler.queue.get_nowait()
+    assert queued.getMessage() == "State {'count': 1}"
+
+def test_pipeline_writes_from_the_listener_thread(logger):
+    stream = io.StringIO()
+    pipeline = attach(logger, LogPipeline(level='DEBUG', stream=stream))
+    logger.info('Saved %d messages', 2, extra={'session_id': 'abc'})
+    pipeline.stop()
+    data = json.loads(stream.getvalue())
+    assert data['message'] == 'Saved 2 messages' and data['session_id'] == 'abc'
+
+def test_pipeline_tags_records_with_the_request(logger):
+    stream = io.StringIO()
+    pipeline = attach(logger, LogPipeline(fmt='json', use_queue=False, stream=stream))
+    with Flask(__name__).test_request_context('/api/chat/send', method='POST'):
+        logger.warning('Slow upstream')
+    data = json.loads(stream.getvalue())
+    assert (data['method'], data['path']) == ('POST', '/api/chat/send')
+    pipeline.stop()
+
+def test_app_logs_through_the_pipeline(make_app):
+    app = make_app(LOG_FORMAT='text')
+    root = logging.getLogger()
+    pipelines = [handler for handler in root.handlers if isinstance(handler, NonBlockingQueueHandler)]
+    assert len(pipelines) == 1
+    # A second app replaces the first one's pipeline
+    make_app()
+    assert pipelines[0] not in root.handlers
+    assert sum(isinstance(handler, NonBlockingQueueHandler) for handler in root.handlers) == 1
+    assert app.logger.level == logging.WARNING
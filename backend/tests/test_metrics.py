@@ -0,0 +1,74 @@
+import pytest
+
+pytest.importorskip('prometheus_client')
+
+import httpx
+import openai
+
+from services.metrics import Metrics
+
+def sample(app, name, **labels):
+    return app.metrics.registry.get_sample_value(f"chatbot_{name}", labels) or 0
+
+def test_metrics_endpoint_exposes_the_registry(client):
+    client.get('/health')
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain')
+    assert b'chatbot_http_requests_total' in response.data
+
+def test_metrics_can_be_disabled(make_app):
+    app = make_app(METRICS_ENABLED=False)
+    assert not app.metrics.enabled
+    assert app.test_client().get('/metrics').status_code == 404
+
+def test_chat_request_times_every_stage(app, client, auth_headers):
+    response = client.post('/api/chat/send', json={'message': 'What helps with a headache?'}, headers=auth_headers)
+    assert response.status_code == 200
+
+    for stage in ('auth', 'session', 'context', 'cache', 'upstream', 'persist'):
+        assert sample(app, 'request_stage_duration_seconds_count', endpoint='chat.send_message', stage=stage) == 1
+    assert sample(app, 'http_requests_total', method='POST', endpoint='chat.send_message', status='200') == 1
+    assert sample(app, 'db_queries_per_request_count', endpoint='chat.send_message') == 1
+    assert sample(app, 'db_queries_per_request_sum', endpoint='chat.send_message') > 0
+    assert sample(app, 'upstream_request_duration_seconds_count', model=app.llm.model, outcome='ok') == 1
+
+def test_upstream_call_records_its_outcome():
+    metrics = Metrics()
+    with metrics.upstream_call('gpt-4o') as call:
+        call.usage = type('Usage', (), {'prompt_tokens': 40, 'completion_tokens': 12})()
+    with pytest.raises(RuntimeError):
+        with metrics.upstream_call('gpt-4o'):
+            raise RuntimeError('connection reset')
+
+    get = metrics.registry.get_sample_value
+    assert get('chatbot_upstream_request_duration_seconds_count', {'model': 'gpt-4o', 'outcome': 'ok'}) == 1
+    assert get('chatbot_upstream_request_duration_seconds_count', {'model': 'gpt-4o', 'outcome': 'error'}) == 1
+    assert get('chatbot_upstream_tokens_sum', {'model': 'gpt-4o', 'kind': 'prompt'}) == 40
+    assert get('chatbot_upstream_tokens_sum', {'model': 'gpt-4o', 'kind': 'completion'}) == 12
+
+def test_rate_limited_upstream_call():
+    metrics = Metrics()
+    response = httpx.Response(429, request=httpx.Request('POST', 'http://llm.test/v1/chat/completions'))
+    error = openai.RateLimitError('Rate limit reached', response=response, body=None)
+    with pytest.raises(openai.RateLimitError):
+        with metrics.upstream_call('gpt-4o'):
+            raise error
+    assert metrics.registry.get_sample_value(
+        'chatbot_upstream_request_duration_seconds_count', {'model': 'gpt-4o', 'outcome': 'rate_limited'}
+    ) == 1
+
+def test_stage_outside_a_request_is_labelled_background():
+    metrics = Metrics()
+    with metrics.stage('persist'):
+        pass
+    assert metrics.registry.get_sample_value(
+        'chatbot_request_stage_duration_seconds_count', {'endpoint': 'background', 'stage': 'persist'}
+    ) == 1
+
+def test_disabled_metrics_are_no_ops():
+    metrics = Metrics(enabled=False)
+    with metrics.stage('cache'), metrics.upstream_call('gpt-4o'):
+        metrics.cache_lookup('response', True)
+        metrics.fallback('rate_limited')
+    assert metrics.render()[0] == b''
@@ -0,0 +1,87 @@
+import sqlite3
+from datetime import datetime
+
+from sqlalchemy import inspect, select, text
+
+import migrations
+from models import ChatHistory, db
+from models.chat import select_history_rows
+
+# The tables as they were before any migration
+BASELINE_SCHEMA = """
+CREATE TABLE user (id VARCHAR(36) PRIMARY KEY, username VARCHAR(80) NOT NULL UNIQUE, email VARCHAR(120) NOT NULL UNIQUE,
+                   password_hash VARCHAR(256) NOT NULL, created_at DATETIME, updated_at DATETIME);
+CREATE TABLE chat_history (id VARCHAR(36) PRIMARY KEY, user_id VARCHAR(36) NOT NULL REFERENCES user (id),
+                           query TEXT NOT NULL, response TEXT NOT NULL, created_at DATETIME);
+CREATE TABLE chat_session (id VARCHAR(36) PRIMARY KEY, user_id VARCHAR(36) NOT NULL REFERENCES user (id),
+                           title VARCHAR(100) NOT NULL, created_at DATETIME, updated_at DATETIME);
+CREATE TABLE chat_message (id VARCHAR(36) PRIMARY KEY, session_id VARCHAR(36) NOT NULL REFERENCES chat_session (id),
+                           role VARCHAR(10) NOT NULL, content TEXT NOT NULL, created_at DATETIME);
+"""
+
+def make_baseline_database(path, rows=()):
+    """
+    A database with the pre-migration schema, one user 'u1' and `rows` as
+    (table, values) pairs.
+    """
+    connection = sqlite3.connect(path)
+    connection.executescript(BASELINE_SCHEMA)
+    connection.execute("INSERT INTO user VALUES ('u1', 'old', 'old@example.com', 'x', NULL, NULL)")
+    for table, values in rows:
+        connection.execute(f"INSERT INTO {table} VALUES ({', '.join('?' * len(values))})", values)
+    connection.commit()
+    connection.close()
+
+def test_existing_database_is_brought_up_to_date(make_app, tmp_path):
+    make_baseline_database(tmp_path / 'test.db')
+    app = make_app()
+    with app.app_context():
+        inspector = inspect(db.engine)
+        assert {'summary', 'summary_until'} <= {c['name'] for c in inspector.get_columns('chat_session')}
+        assert {'ix_chat_message_session_created'} <= {i['name'] for i in inspector.get_indexes('chat_message')}
+        assert {'ix_chat_session_user_updated'} <= {i['name'] for i in inspector.get_indexes('chat_session')}
+        assert {'ix_chat_history_user_created'} <= {i['name'] for i in inspector.get_indexes('chat_history')}
+        assert migrations.applied_versions(db.engine) == {version for version, module in migrations.discover()}
+        # Running again is a no-op
+        assert migrations.upgrade(db.engine) == []
+
+def test_fresh_database_needs_no_migration(app):
+    with app.app_context():
+        assert migrations.pending(db.engine) == []
+        assert migrations.upgrade(db.engine) == []
+
+def test_migrations_are_idempotent(app):
+    # A fresh database already has everything create_all makes; every upgrade must tolerate that
+    with app.app_context(), db.engine.begin() as connection:
+        for version, module in migrations.discover():
+            module.upgrade(connection)
+
+def test_history_page_uses_the_composite_index(app, user_id):
+    with app.app_context():
+        query = (select(ChatHistory.id).where(ChatHistory.user_id == user_id)
+                 .order_by(ChatHistory.created_at.desc()).limit(20))
+        compiled = query.compile(db.engine, compile_kwargs={'literal_binds': True})
+        plan = ' '.join(row[-1] for row in db.session.execute(text(f'EXPLAIN QUERY PLAN {compiled}')))
+    assert 'ix_chat_history_user_created' in plan
+    assert 'TEMP B-TREE' not in plan
+
+def test_history_copies_are_linked_to_their_message_pair(make_app, tmp_path):
+    at = datetime(2024, 1, 1)
+    make_baseline_database(tmp_path / 'test.db', [
+        ('chat_session', ('s1', 'u1', 'Sleep', at, at)),
+        ('chat_message', ('m1', 's1', 'user', 'How much sleep?', at)),
+        ('chat_message', ('m2', 's1', 'assistant', '7-9 hours.', at)),
+        ('chat_history', ('h1', 'u1', 'How much sleep?', '7-9 hours.', at)),
+        # Its session was deleted: the history row keeps its own text
+        ('chat_history', ('h2', 'u1', 'Orphaned question', 'Orphaned answer', at)),
+    ])
+    app = make_app()
+    with app.app_context():
+        rows = {row.id: row for row in db.session.execute(select(ChatHistory)).scalars()}
+        assert (rows['h1'].user_message_id, rows['h1'].assistant_message_id) == ('m1', 'm2')
+        assert rows['h1'].query == rows['h1'].response == ''
+        assert rows['h2'].user_message_id is None and rows['h2'].query == 'Orphaned question'
+
+        listed = {row.id: row for row in db.session.execute(select_history_rows())}
+        assert (listed['h1'].query, listed['h1'].response) == ('How much sleep?', '7-9 hours.')
+        assert (listed['h2'].query, listed['h2'].response) == ('Orphaned question', 'Orphaned answer')
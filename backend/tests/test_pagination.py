@@ -0,0 +1,88 @@
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import insert
+
+from models import ChatSession, ChatMessage, ChatHistory, db
+from services.pagination import InvalidCursor, decode_cursor, encode_cursor, page_params
+
+def seed_history(app, user_id, count, same_time=False):
+    """
+    `count` history entries, newest last; with `same_time` they all share
+    one created_at so only the id orders them.
+    """
+    start = datetime(2024, 1, 1)
+    with app.app_context():
+        session_id = str(uuid.uuid4())
+        db.session.execute(insert(ChatSession), [{'id': session_id, 'user_id': user_id, 'title': 'Test',
+                                                  'created_at': start, 'updated_at': start}])
+        messages, history = [], []
+        for turn in range(count):
+            created_at = start if same_time else start + timedelta(seconds=turn)
+            question, reply = str(uuid.uuid4()), str(uuid.uuid4())
+            messages += [
+                {'id': question, 'session_id': session_id, 'role': 'user', 'content': f'Question {turn}',
+                 'created_at': created_at},
+                {'id': reply, 'session_id': session_id, 'role': 'assistant', 'content': f'Answer {turn}',
+                 'created_at': created_at + timedelta(microseconds=1)},
+            ]
+            history.append({'id': str(uuid.uuid4()), 'user_id': user_id, 'query': '', 'response': '',
+                            'user_message_id': question, 'assistant_message_id': reply, 'created_at': created_at})
+        if history:
+            db.session.execute(insert(ChatMessage), messages)
+            db.session.execute(insert(ChatHistory), history)
+        db.session.commit()
+        return [entry['id'] for entry in history]
+
+def walk(client, auth_headers, limit):
+    ids, pages, cursor = [], 0, None
+    while True:
+        url = f'/api/history/?limit={limit}' + (f'&cursor={cursor}' if cursor else '')
+        response = client.get(url, headers=auth_headers)
+        assert response.status_code == 200
+        data = response.get_json()
+        pages += 1
+        ids += [item['id'] for item in data['history']]
+        assert data['has_more'] == (data['next_cursor'] is not None)
+        if not data['has_more']:
+            return ids, pages
+        cursor = data['next_cursor']
+
+@pytest.mark.parametrize('count, limit, pages', [(6, 3, 2), (7, 3, 3), (3, 3, 1), (2, 3, 1), (0, 3, 1)])
+def test_pages_end_exactly_at_the_last_row(app, client, user_id, auth_headers, count, limit, pages):
+    ids = seed_history(app, user_id, count)
+    seen, walked = walk(client, auth_headers, limit)
+    assert seen == ids[::-1]
+    assert walked == pages
+
+def test_rows_sharing_a_timestamp_are_neither_skipped_nor_repeated(app, client, user_id, auth_headers):
+    ids = seed_history(app, user_id, 7, same_time=True)
+    seen, _ = walk(client, auth_headers, 2)
+    assert seen == sorted(ids, reverse=True)
+
+def test_rows_added_ahead_of_the_cursor_do_not_shift_later_pages(app, client, user_id, auth_headers):
+    ids = seed_history(app, user_id, 4)
+    first = client.get('/api/history/?limit=2', headers=auth_headers).get_json()
+    with app.app_context():
+        db.session.execute(insert(ChatHistory), [{'id': str(uuid.uuid4()), 'user_id': user_id, 'query': 'new',
+                                                  'response': 'new', 'created_at': datetime(2025, 1, 1)}])
+        db.session.commit()
+    second = client.get(f"/api/history/?limit=2&cursor={first['next_cursor']}", headers=auth_headers).get_json()
+    assert [item['id'] for item in second['history']] == ids[1::-1]
+    assert second['has_more'] is False
+
+def test_invalid_cursor_is_rejected(client, auth_headers):
+    response = client.get('/api/history/?limit=2&cursor=not-a-cursor', headers=auth_headers)
+    assert response.status_code == 400
+    with pytest.raises(InvalidCursor):
+        decode_cursor('bm90IGpzb24')
+
+def test_cursor_round_trip():
+    created_at = datetime(2024, 5, 6, 7, 8, 9, 123456)
+    assert decode_cursor(encode_cursor(created_at, 'abc')) == (created_at, 'abc')
+
+def test_page_params_clamp_the_limit():
+    assert page_params({'limit': '500'}, max_limit=50) == (None, 50, False)
+    assert page_params({'limit': '0'}) == (None, 1, False)
+    assert page_params({'limit': 'x', 'cursor': 'c', 'include_total': 'true'}) == ('c', 20, True)
@@ -0,0 +1,61 @@
+import pytest
+from sqlalchemy import event, func, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+import services.persistence as persistence
+from models import ChatSession, ChatMessage, ChatHistory, db
+
+def count(model):
+    return db.session.execute(select(func.count()).select_from(model)).scalar()
+
+def send(client, auth_headers, message, session_id=None):
+    response = client.post('/api/chat/send', json={'message': message, 'session_id': session_id}, headers=auth_headers)
+    assert response.status_code == 200
+    return response.get_json()['session_id']
+
+def test_a_turn_is_one_commit(client, auth_headers):
+    commits = []
+    listener = lambda session: commits.append(session)
+    event.listen(Session, 'after_commit', listener)
+    try:
+        send(client, auth_headers, 'What helps with a headache?')
+    finally:
+        event.remove(Session, 'after_commit', listener)
+    assert len(commits) == 1
+
+def test_turn_writes_session_messages_and_linked_history(app, client, auth_headers):
+    session_id = send(client, auth_headers, 'What helps with a headache that will not go away?')
+    send(client, auth_headers, 'And a fever?', session_id)
+    with app.app_context():
+        session = db.session.get(ChatSession, session_id)
+        # Titled from the first message only
+        assert session.title == 'What helps with a headache tha...'
+        messages = db.session.execute(
+            select(ChatMessage).filter_by(session_id=session_id).order_by(ChatMessage.created_at)
+        ).scalars().all()
+        assert [m.role for m in messages] == ['user', 'assistant', 'user', 'assistant']
+        history = db.session.execute(select(ChatHistory).order_by(ChatHistory.created_at)).scalars().all()
+        assert [(h.user_message_id, h.assistant_message_id) for h in history] == [
+            (messages[0].id, messages[1].id), (messages[2].id, messages[3].id)
+        ]
+        assert session.updated_at == messages[2].created_at
+
+def test_failed_turn_leaves_nothing_behind(app, user_id, monkeypatch):
+    with app.app_context():
+        first = persistence.new_session(user_id)
+        persistence.save_turn(db.session, first, user_id, 'Question', 'Answer', True)
+        taken = db.session.execute(select(ChatHistory.id)).scalar()
+
+        build_turn = persistence.build_turn
+        def clashing_turn(*args):
+            turn = build_turn(*args)
+            turn['history'][0]['id'] = taken
+            return turn
+        monkeypatch.setattr(persistence, 'build_turn', clashing_turn)
+
+        second = persistence.new_session(user_id)
+        with pytest.raises(IntegrityError):
+            persistence.save_turn(db.session, second, user_id, 'Another question', 'Another answer', True)
+        assert db.session.get(ChatSession, second.id) is None
+        assert (count(ChatSession), count(ChatMessage), count(ChatHistory)) == (1, 2, 1)
@@ -0,0 +1,107 @@
+import sys
+import threading
+import time
+
+import pytest
+
+from services.profiler import Profiler, StackSampler, collapse
+
+TOKEN = 'profiler-token'
+HEADERS = {'X-Profiler-Token': TOKEN}
+
+@pytest.fixture
+def profiled_app(make_app, tmp_path):
+    return make_app(PROFILING_ENABLED=True, PROFILING_TOKEN=TOKEN, PROFILING_DIR=str(tmp_path / 'profiles'),
+                    PROFILING_INTERVAL=0.001)
+
+def wait_until_stopped(client, timeout=5):
+    deadline = time.monotonic() + timeout
+    while client.get('/api/admin/profile', headers=HEADERS).get_json()['running']:
+        assert time.monotonic() < deadline, 'profile did not stop'
+        time.sleep(0.01)
+
+def busy_wait(seconds):
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        pass
+
+def test_collapsed_stacks_put_the_outermost_call_first():
+    def inner():
+        return collapse(sys._getframe())
+    frames = inner().split(';')
+    assert frames[-1].startswith('inner (tests/test_profiler.py:')
+    assert frames[-2].startswith('test_collapsed_stacks_put_the_outermost_call_first (')
+
+def test_sampler_records_the_sampled_thread():
+    worker = threading.Thread(target=busy_wait, args=(0.2,))
+    worker.start()
+    sampler = StackSampler(interval=0.001, thread_ids={worker.ident})
+    sampler.start()
+    worker.join()
+    sampler.stop()
+    assert sampler.samples > 0
+    assert any('busy_wait' in stack for stack in sampler.stacks)
+    assert all(line.rsplit(' ', 1)[1].isdigit() for line in sampler.collapsed().splitlines())
+
+def test_profiling_needs_a_token(tmp_path):
+    assert not Profiler(enabled=True, token=None, directory=str(tmp_path)).enabled
+    profiler = Profiler(enabled=True, token=TOKEN, directory=str(tmp_path))
+    assert profiler.authorized(HEADERS)
+    assert not profiler.authorized({'X-Profiler-Token': 'wrong'})
+    assert not profiler.authorized({})
+
+def test_profile_routes_are_hidden_while_disabled(client):
+    assert client.get('/api/admin/profile', headers=HEADERS).status_code == 404
+    response = client.get('/health', headers={'X-Profile': '1', **HEADERS})
+    assert 'X-Profile-Id' not in response.headers
+
+def test_profile_routes_need_the_token(profiled_app):
+    client = profiled_app.test_client()
+    assert client.get('/api/admin/profile').status_code == 403
+    assert client.post('/api/admin/profile', headers={'X-Profiler-Token': 'wrong'}).status_code == 403
+
+def test_single_request_profile(profiled_app):
+    client = profiled_app.test_client()
+    assert 'X-Profile-Id' not in client.get('/health', headers={'X-Profile': '1'}).headers
+
+    response = client.get('/health', headers={'X-Profile': '1', **HEADERS})
+    profile_id = response.headers['X-Profile-Id']
+    assert int(response.headers['X-Profile-Samples']) >= 0
+    download = client.get(f'/api/admin/profile/{profile_id}', headers=HEADERS)
+    assert download.status_code == 200
+    assert download.headers['Content-Disposition'] == f'attachment; filename="{profile_id}.collapsed"'
+
+def test_worker_profile_for_a_number_of_requests(profiled_app):
+    client = profiled_app.test_client()
+    started = client.post('/api/admin/profile', json={'requests': 2}, headers=HEADERS)
+    assert started.status_code == 202
+    status = started.get_json()
+    assert status['running'] and status['requests_left'] == 2
+    assert client.post('/api/admin/profile', json={'seconds': 1}, headers=HEADERS).status_code == 409
+
+    # Admin requests do not count
+    client.get('/api/admin/profile', headers=HEADERS)
+    client.get('/health')
+    assert client.get('/api/admin/profile', headers=HEADERS).get_json()['requests_left'] == 1
+    client.get('/health')
+    wait_until_stopped(client)
+    assert client.get(f"/api/admin/profile/{status['profile_id']}", headers=HEADERS).status_code == 200
+
+def test_worker_profile_can_be_stopped(profiled_app):
+    client = profiled_app.test_client()
+    assert client.delete('/api/admin/profile', headers=HEADERS).status_code == 404
+    profile_id = client.post('/api/admin/profile', json={'seconds': 60}, headers=HEADERS).get_json()['profile_id']
+    response = client.delete('/api/admin/profile', headers=HEADERS)
+    assert response.get_json() == {'profile_id': profile_id}
+    wait_until_stopped(client)
+    assert client.get(f'/api/admin/profile/{profile_id}', headers=HEADERS).status_code == 200
+
+@pytest.mark.parametrize('body', [{'seconds': 'soon'}, {'seconds': -1}, {'requests': 0.5}])
+def test_start_rejects_bad_limits(profiled_app, body):
+    response = profiled_app.test_client().post('/api/admin/profile', json=body, headers=HEADERS)
+    assert response.status_code == 400
+
+@pytest.mark.parametrize('profile_id', ['../../etc/passwd', 'f' * 31, 'A' * 32, 'f' * 32])
+def test_download_only_serves_profile_files(profiled_app, profile_id):
+    response = profiled_app.test_client().get(f'/api/admin/profile/{profile_id}', headers=HEADERS)
+    assert response.status_code == 404
@@ -0,0 +1,58 @@
+import pytest
+
+from conftest import PASSWORD
+from services.rate_limit import RateLimiter, parse_limit
+
+LIMITS = {'chat.send': {'user': '3/minute', 'ip': '5/minute'}}
+
+@pytest.mark.parametrize('value, parsed', [
+    ('20/minute', (20, 60)), ('100/hours', (100, 3600)), ('20/30', (20, 30.0)), ('', None), (None, None),
+])
+def test_parse_limit(value, parsed):
+    assert parse_limit(value) == parsed
+
+def limiter(redis_client=None, **options):
+    return RateLimiter(redis_client, limits=LIMITS, **options)
+
+def check_limits(limiter):
+    results = [limiter.check('chat.send', 'alice', '10.0.0.1') for _ in range(4)]
+    assert [result.allowed for result in results] == [True, True, True, False]
+    assert [result.remaining for result in results[:3]] == [2, 1, 0]
+    assert int(results[-1].headers()['Retry-After']) >= 1
+    # A refused request counts against no scope, so the address has used 3 of its 5
+    assert limiter.check('chat.send', 'bob', '10.0.0.1').allowed
+    assert limiter.check('chat.send', 'carol', '10.0.0.1').allowed
+    assert not limiter.check('chat.send', 'dave', '10.0.0.1').allowed
+    assert limiter.check('chat.send', 'dave', '10.0.0.2').allowed
+
+def test_local_limits():
+    check_limits(limiter())
+
+def test_redis_limits():
+    fakeredis = pytest.importorskip('fakeredis')
+    redis_limiter = limiter(fakeredis.FakeRedis())
+    check_limits(redis_limiter)
+    assert redis_limiter.stats()['backend'] == 'redis' and redis_limiter.stats()['redis_errors'] == 0
+
+def test_unlimited_endpoints_and_disabled_limiter():
+    assert limiter().check('chat.sessions', 'alice', '10.0.0.1') is None
+    assert limiter(enabled=False).check('chat.send', 'alice', '10.0.0.1') is None
+
+def test_client_ip_trusts_only_the_configured_proxies():
+    assert limiter().client_ip('10.0.0.9', '1.2.3.4') == '10.0.0.9'
+    assert limiter(proxy_count=1).client_ip('10.0.0.9', 'spoofed, 1.2.3.4') == '1.2.3.4'
+    assert limiter(proxy_count=2).client_ip('10.0.0.9', 'spoofed, 1.2.3.4, 10.0.0.8') == '1.2.3.4'
+
+def test_send_answers_429_with_retry_after(make_app, user_id):
+    app = make_app(RATE_LIMITS={'chat.send': {'user': '2/minute'}})
+    client = app.test_client()
+    token = client.post('/api/auth/login', json={'username': 'tester', 'password': PASSWORD}).get_json()['access_token']
+    headers = {'Authorization': f'Bearer {token}'}
+
+    first = client.post('/api/chat/send', json={'message': 'Hi'}, headers=headers)
+    assert first.status_code == 200 and first.headers['RateLimit-Remaining'] == '1'
+    client.post('/api/chat/send', json={'message': 'Hi'}, headers=headers)
+    limited = client.post('/api/chat/send', json={'message': 'Hi'}, headers=headers)
+    assert limited.status_code == 429
+    assert int(limited.headers['Retry-After']) >= 1
+    assert limited.get_json()['retry_after'] == int(limited.headers['Retry-After'])
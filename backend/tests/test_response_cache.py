@@ -0,0 +1,55 @@
+import pytest
+
+from services.cache import ResponseCache
+
+fakeredis = pytest.importorskip('fakeredis')
+
+def payload(model='gpt-4o', messages=None, **params):
+    return {'model': model, 'messages': messages or [{'role': 'system', 'content': 'Be brief.'},
+                                                     {'role': 'user', 'content': 'What is a fever?'}],
+            'temperature': 0.7, **params}
+
+@pytest.fixture
+def cache():
+    return ResponseCache(fakeredis.FakeRedis(), model_ttls={'gpt-4o-mini': 60})
+
+def test_key_ignores_dict_order(cache):
+    reordered = dict(reversed(list(payload().items())))
+    assert cache.make_key(payload()) == cache.make_key(reordered)
+    assert cache.make_key(payload()).startswith('chat:v1:gpt-4o:')
+
+@pytest.mark.parametrize('changed', [
+    payload(model='gpt-4o-mini'),
+    payload(temperature=0.2),
+    payload(messages=[{'role': 'system', 'content': 'Be detailed.'}, {'role': 'user', 'content': 'What is a fever?'}]),
+    payload(messages=[{'role': 'system', 'content': 'Be brief.'}, {'role': 'user', 'content': 'I am 3.'},
+                      {'role': 'assistant', 'content': 'Noted.'}, {'role': 'user', 'content': 'What is a fever?'}]),
+])
+def test_anything_that_changes_the_answer_changes_the_key(cache, changed):
+    cache.set(payload(), 'cached answer')
+    assert cache.get(changed) is None
+    assert cache.get(payload()) == 'cached answer'
+
+def test_ttl_per_model(cache):
+    cache.set(payload(), 'a')
+    cache.set(payload(model='gpt-4o-mini'), 'b')
+    assert 3590 < cache.redis.ttl(cache.make_key(payload())) <= 3600
+    assert 50 < cache.redis.ttl(cache.make_key(payload(model='gpt-4o-mini'))) <= 60
+
+def test_invalidate_model_keeps_other_models(cache):
+    cache.set(payload(), 'a')
+    cache.set(payload(model='gpt-4o-mini'), 'b')
+    assert cache.invalidate_model('gpt-4o') == 1
+    assert cache.get(payload()) is None
+    assert cache.get(payload(model='gpt-4o-mini')) == 'b'
+
+def test_version_bump_misses_old_entries(cache):
+    cache.set(payload(), 'a')
+    bumped = ResponseCache(cache.redis, version=2)
+    assert bumped.get(payload()) is None
+    assert bumped.stats()['misses'] == 1
+
+def test_disabled_without_redis():
+    cache = ResponseCache(None)
+    cache.set(payload(), 'a')
+    assert cache.get(payload()) is None
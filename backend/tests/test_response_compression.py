@@ -0,0 +1,105 @@
+import gzip
+
+import pytest
+from flask import Flask, Response, jsonify
+
+from services.response_compression import ResponseCompressor, parse_accept_encoding
+
+BODY = {'messages': [{'role': 'assistant', 'content': 'Rest, fluids and sleep.'}] * 100}
+
+def make_flask_app(**options):
+    app = Flask(__name__)
+    ResponseCompressor(**options).init_app(app)
+
+    @app.route('/list')
+    def listing():
+        response = jsonify(BODY)
+        response.headers['ETag'] = '"v1-abc"'
+        return response
+
+    @app.route('/small')
+    def small():
+        return jsonify({'ok': True})
+
+    @app.route('/stream')
+    def stream():
+        return Response((b'x' * 2048 for _ in range(2)), mimetype='text/plain')
+
+    return app
+
+def gzip_only(compressor):
+    compressor.encodings = ('gzip',)
+    return compressor
+
+@pytest.mark.parametrize('header, parsed', [
+    ('gzip, br;q=0.8', {'gzip': 1.0, 'br': 0.8}),
+    ('gzip;q=bad, *;q=0.1', {'gzip': 0.0, '*': 0.1}),
+    ('', {}),
+    (None, {}),
+])
+def test_parse_accept_encoding(header, parsed):
+    assert parse_accept_encoding(header) == parsed
+
+@pytest.mark.parametrize('header, encoding', [
+    ('gzip', 'gzip'), ('*', 'gzip'), ('gzip;q=0', None), ('identity', None), ('', None), ('br', None),
+])
+def test_negotiate_gzip(header, encoding):
+    assert gzip_only(ResponseCompressor()).negotiate(header) == encoding
+
+def test_brotli_is_preferred_on_a_tie():
+    compressor = ResponseCompressor()
+    compressor.encodings = ('br', 'gzip')
+    assert compressor.negotiate('gzip, br') == 'br'
+    assert compressor.negotiate('gzip, br;q=0.5') == 'gzip'
+
+def test_large_json_is_compressed():
+    client = make_flask_app().test_client()
+    response = client.get('/list', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert response.headers['ETag'] == 'W/"v1-abc"'
+    assert gzip.decompress(response.data) == client.get('/list').data
+
+def test_small_streamed_and_unaccepted_bodies_are_not():
+    client = make_flask_app().test_client()
+    small = client.get('/small', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in small.headers and 'Accept-Encoding' in small.headers['Vary']
+    assert 'Content-Encoding' not in client.get('/stream', headers={'Accept-Encoding': 'gzip'}).headers
+    plain = client.get('/list')
+    assert 'Content-Encoding' not in plain.headers and plain.headers['ETag'] == '"v1-abc"'
+
+def test_disabled_compressor():
+    response = make_flask_app(enabled=False).test_client().get('/list', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+
+def test_gzip_output_is_deterministic():
+    compressor = ResponseCompressor()
+    assert compressor.compress(b'x' * 4096, 'gzip') == compressor.compress(b'x' * 4096, 'gzip')
+
+def test_asgi_middleware_compresses_single_message_bodies():
+    pytest.importorskip('starlette')
+    from starlette.applications import Starlette
+    from starlette.middleware import Middleware
+    from starlette.responses import JSONResponse, StreamingResponse
+    from starlette.routing import Route
+    from starlette.testclient import TestClient
+
+    from services.response_compression import CompressionMiddleware
+
+    async def listing(request):
+        return JSONResponse(BODY)
+
+    async def stream(request):
+        return StreamingResponse(iter([b'x' * 2048, b'y' * 2048]), media_type='text/plain')
+
+    app = Starlette(routes=[Route('/list', listing), Route('/stream', stream)], middleware=[
+        Middleware(CompressionMiddleware, compressor=gzip_only(ResponseCompressor())),
+    ])
+    with TestClient(app) as client:
+        response = client.get('/list', headers={'Accept-Encoding': 'gzip'})
+        assert response.headers['content-encoding'] == 'gzip'
+        assert 'Accept-Encoding' in response.headers['vary']
+        assert response.json() == BODY
+        streamed = client.get('/stream', headers={'Accept-Encoding': 'gzip'})
+        assert 'content-encoding' not in streamed.headers
+        assert len(streamed.content) == 4096
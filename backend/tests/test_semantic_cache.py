@@ -0,0 +1,98 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from services.semantic_cache import HashingEmbedder, SemanticCache, load_embedder, same_subject
+
+SCOPE = SemanticCache.scope_for('gpt-4o-mini', 'system prompt')
+
+PARAPHRASES = [
+    ("How much sleep do adults need?", "Hours of sleep for adults"),
+]
+
+# Close in wording, different answers
+DIFFERENT_SUBJECTS = [
+    ("How much sleep do adults need?", "How much sleep do children need?"),
+    ("Is ibuprofen safe during pregnancy?", "Is aspirin safe during pregnancy?"),
+    ("Can I take ibuprofen with alcohol?", "Can I take ibuprofen without alcohol?"),
+    ("Is 200 mg of ibuprofen safe?", "Is 800 mg of ibuprofen safe?"),
+    ("Should I take my insulin before meals?", "Shouldn't I take my insulin before meals?"),
+]
+
+@pytest.fixture
+def cache(tmp_path):
+    # A threshold low enough that every pair above passes on similarity alone
+    return SemanticCache(str(tmp_path / 'semantic'), HashingEmbedder(dim=256), capacity=4, threshold=0.3)
+
+@pytest.mark.parametrize('question, cached_question', PARAPHRASES)
+def test_paraphrases_share_a_subject(question, cached_question):
+    assert same_subject(question, cached_question)
+
+@pytest.mark.parametrize('question, cached_question', DIFFERENT_SUBJECTS)
+def test_different_subjects_are_rejected(cache, question, cached_question):
+    assert not same_subject(question, cached_question)
+    cache.add(cached_question, 'cached answer', SCOPE)
+    assert cache.lookup(question, SCOPE) is None
+
+def test_hit_miss_and_scope(cache):
+    cache.add("How much sleep do adults need?", 'Seven to nine hours.', SCOPE)
+    assert cache.lookup("how much sleep do adults need", SCOPE) == 'Seven to nine hours.'
+    assert cache.lookup("how much sleep do adults need", 'other-scope') is None
+    assert cache.lookup("What causes migraines?", SCOPE) is None
+
+def test_entries_are_shared_between_instances(cache, tmp_path):
+    cache.add("What causes migraines?", 'Many things.', SCOPE)
+    other = SemanticCache(str(tmp_path / 'semantic'), HashingEmbedder(dim=256), capacity=4, threshold=0.3)
+    assert other.lookup("what causes migraines", SCOPE) == 'Many things.'
+    assert len(other) == 1
+
+def test_evicts_least_recently_used(cache):
+    questions = [f"What are the symptoms of condition {n}?" for n in range(5)]
+    for n, question in enumerate(questions):
+        cache.add(question, f'answer {n}', SCOPE)
+    assert len(cache) == 4
+    assert cache.lookup(questions[0], SCOPE) is None
+    assert cache.lookup(questions[4], SCOPE) == 'answer 4'
+
+def test_vector_without_its_row_is_not_served(cache):
+    cache.add("What causes migraines?", 'Migraine answer.', SCOPE)
+    # Another process is mid-eviction: the new vector is in place, its row not yet
+    cache.vectors[0] = cache.embedder.embed("How do I treat a sprained ankle?")
+    assert cache.lookup("How do I treat a sprained ankle?", SCOPE) is None
+    assert cache.lookup("What causes migraines?", SCOPE) is None
+
+def test_clear(cache):
+    cache.add("What causes migraines?", 'Many things.', SCOPE)
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.lookup("What causes migraines?", SCOPE) is None
+
+def test_sentence_model_matches_paraphrases(tmp_path):
+    pytest.importorskip('sentence_transformers')
+    try:
+        embedder = load_embedder('services.semantic_cache.SentenceTransformerEmbedder', None,
+                                 model='sentence-transformers/all-MiniLM-L6-v2')
+    except Exception as e:  # the model is downloaded on first use
+        pytest.skip(f"Sentence model unavailable: {str(e)}")
+    cache = SemanticCache(str(tmp_path / 'semantic'), embedder, capacity=16, threshold=0.75)
+    for question, cached_question in PARAPHRASES:
+        cache.clear()
+        cache.add(cached_question, 'cached answer', SCOPE)
+        assert cache.lookup(question, SCOPE) == 'cached answer'
+    for question, cached_question in DIFFERENT_SUBJECTS:
+        cache.clear()
+        cache.add(cached_question, 'cached answer', SCOPE)
+        assert cache.lookup(question, SCOPE) is None
+
+def test_hashing_embedder_is_the_default(app):
+    assert app.config['SEMANTIC_CACHE_EMBEDDER'] == 'services.semantic_cache.HashingEmbedder'
+    assert load_embedder(app.config['SEMANTIC_CACHE_EMBEDDER'], None, model='ignored').dim == HashingEmbedder.DEFAULT_DIM
+
+def test_sentence_model_rejects_a_mismatched_dim():
+    pytest.importorskip('sentence_transformers')
+    try:
+        load_embedder('services.semantic_cache.SentenceTransformerEmbedder', None)
+    except Exception as e:
+        pytest.skip(f"Sentence model unavailable: {str(e)}")
+    with pytest.raises(ValueError):
+        load_embedder('services.semantic_cache.SentenceTransformerEmbedder', 7)
@@ -0,0 +1,98 @@
+import threading
+import time
+
+import pytest
+
+from services.governor import UpstreamUnavailable
+from services.singleflight import LeaderFailed, SingleFlight
+
+fakeredis = pytest.importorskip('fakeredis')
+
+class UpstreamError(Exception):
+    status_code = 500
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeServer()
+
+def worker(server, **options):
+    # One SingleFlight per simulated worker process, all on the same Redis
+    return SingleFlight(fakeredis.FakeRedis(server=server, decode_responses=True), **options)
+
+def run_concurrently(calls):
+    results = [None] * len(calls)
+
+    def run(index, call):
+        try:
+            results[index] = call()
+        except Exception as e:
+            results[index] = e
+
+    threads = [threading.Thread(target=run, args=(index, call)) for index, call in enumerate(calls)]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.02)
+    for thread in threads:
+        thread.join(10)
+    return results
+
+def slow(calls, result=None, error=None):
+    def fn():
+        calls.append(1)
+        time.sleep(0.2)
+        if error:
+            raise error
+        return result
+    return fn
+
+def test_local_waiters_share_the_leaders_failure():
+    flight = SingleFlight()
+    calls = []
+    fn = slow(calls, error=UpstreamError('boom'))
+    results = run_concurrently([lambda: flight.do('key', fn) for _ in range(4)])
+    assert len(calls) == 1
+    assert all(isinstance(result, UpstreamError) for result in results)
+
+def test_remote_waiters_raise_the_leaders_error(server):
+    calls = []
+    fn = slow(calls, error=UpstreamError('upstream exploded'))
+    results = run_concurrently([lambda: worker(server).do('key', fn) for _ in range(4)])
+    assert len(calls) == 1
+    assert isinstance(results[0], UpstreamError)
+    for result in results[1:]:
+        assert isinstance(result, LeaderFailed)
+        assert (result.error, result.status, str(result)) == ('UpstreamError', 500, 'upstream exploded')
+
+def test_remote_waiters_fall_back_when_the_leader_is_rate_limited(server):
+    calls = []
+    fn = slow(calls, error=UpstreamUnavailable('slow down', 'throttled', retry_after=3))
+    results = run_concurrently([lambda: worker(server).do('key', fn) for _ in range(3)])
+    assert len(calls) == 1
+    for result in results:
+        assert isinstance(result, UpstreamUnavailable)
+        assert (result.reason, result.retry_after) == ('throttled', 3)
+
+def test_one_waiter_takes_over_from_a_dead_leader(server):
+    flights = [worker(server) for _ in range(4)]
+    # A leader in another worker took the lock and died without publishing
+    lock_key, _ = flights[0]._names('key')
+    flights[0].redis.set(lock_key, 'dead-leader', px=60000)
+    calls = []
+    fn = slow(calls, result='answer')
+    threading.Timer(0.3, lambda: flights[0].redis.delete(lock_key)).start()
+
+    results = run_concurrently([lambda flight=flight: flight.do('key', fn) for flight in flights])
+    assert len(calls) == 1
+    assert results == ['answer'] * 4
+
+def test_waiter_times_out_instead_of_calling_again(server):
+    calls = []
+    leader = worker(server)
+    waiter = worker(server, wait_timeout=0.1)
+    results = run_concurrently([
+        lambda: leader.do('key', slow(calls, result='answer')),
+        lambda: waiter.do('key', slow(calls, result='answer')),
+    ])
+    assert len(calls) == 1
+    assert results[0] == 'answer'
+    assert isinstance(results[1], UpstreamUnavailable) and results[1].reason == 'singleflight_timeout'
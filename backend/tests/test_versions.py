@@ -0,0 +1,100 @@
+import pytest
+
+fakeredis = pytest.importorskip('fakeredis')
+
+from services.versions import ChangeVersions, etag_matches
+
+@pytest.fixture
+def versions():
+    return ChangeVersions(fakeredis.FakeRedis(decode_responses=True))
+
+@pytest.fixture
+def versioned_client(app, client, versions):
+    app.versions = versions
+    return client
+
+def send(client, auth_headers, message='What helps with a headache?'):
+    response = client.post('/api/chat/send', json={'message': message}, headers=auth_headers)
+    assert response.status_code == 200
+
+def test_version_is_stable_until_bumped(versions):
+    first = versions.current('alice')
+    assert first and versions.current('alice') == first
+    assert versions.current('bob') != first
+    versions.bump('alice')
+    assert versions.current('alice') != first
+
+def test_versions_are_off_without_redis():
+    versions = ChangeVersions(None)
+    assert not versions.enabled
+    assert versions.current('alice') is None
+    versions.bump('alice')
+    versions.set_projection('alice', 'v1', '/api/history/?', '[]')
+    assert versions.get_projection('alice', 'v1', '/api/history/?') is None
+    assert not ChangeVersions(fakeredis.FakeRedis(), enabled=False).enabled
+
+def test_etags_differ_by_user_version_and_resource():
+    etag = ChangeVersions.etag('alice', 'v1', '/api/chat/sessions?')
+    assert etag.startswith('"v1-') and etag.endswith('"')
+    assert etag != ChangeVersions.etag('bob', 'v1', '/api/chat/sessions?')
+    assert etag != ChangeVersions.etag('alice', 'v2', '/api/chat/sessions?')
+    assert etag != ChangeVersions.etag('alice', 'v1', '/api/chat/sessions?page=2')
+
+@pytest.mark.parametrize('header, matched', [
+    ('"v1-abc"', True), ('W/"v1-abc"', True), ('"old", "v1-abc"', True), ('*', True),
+    ('"v2-abc"', False), ('', False), (None, False),
+])
+def test_etag_matches(header, matched):
+    assert etag_matches(header, '"v1-abc"') == matched
+
+def test_projection_is_orphaned_by_a_bump(versions):
+    version = versions.current('alice')
+    versions.set_projection('alice', version, '/api/chat/sessions?', '{"sessions": []}')
+    assert versions.get_projection('alice', version, '/api/chat/sessions?') == '{"sessions": []}'
+    versions.bump('alice')
+    assert versions.get_projection('alice', versions.current('alice'), '/api/chat/sessions?') is None
+
+def test_unchanged_sessions_answer_304(versioned_client, auth_headers):
+    send(versioned_client, auth_headers)
+    response = versioned_client.get('/api/chat/sessions', headers=auth_headers)
+    assert response.status_code == 200
+    assert response.headers['Cache-Control'] == 'private, no-cache'
+    assert 'Authorization' in response.headers['Vary']
+    etag = response.headers['ETag']
+
+    revalidated = versioned_client.get('/api/chat/sessions', headers={**auth_headers, 'If-None-Match': etag})
+    assert revalidated.status_code == 304
+    assert revalidated.headers['ETag'] == etag and not revalidated.data
+
+def test_a_write_changes_the_etag(versioned_client, auth_headers):
+    send(versioned_client, auth_headers)
+    etag = versioned_client.get('/api/chat/sessions', headers=auth_headers).headers['ETag']
+    send(versioned_client, auth_headers, 'How much sleep do adults need?')
+
+    response = versioned_client.get('/api/chat/sessions', headers={**auth_headers, 'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert len(response.get_json()['sessions']) == 2
+
+def test_cached_body_is_served_without_the_route(versioned_client, auth_headers, monkeypatch):
+    send(versioned_client, auth_headers)
+    first = versioned_client.get('/api/chat/sessions', headers=auth_headers)
+
+    def fail(*args, **kwargs):
+        raise AssertionError('the route ran')
+    monkeypatch.setattr('routes.chat.select', fail)
+    second = versioned_client.get('/api/chat/sessions', headers=auth_headers)
+    assert second.status_code == 200
+    assert second.get_json() == first.get_json()
+    assert second.headers['ETag'] == first.headers['ETag']
+
+def test_history_days_window_is_not_versioned(versioned_client, auth_headers):
+    send(versioned_client, auth_headers)
+    assert 'ETag' in versioned_client.get('/api/history/', headers=auth_headers).headers
+    assert 'ETag' not in versioned_client.get('/api/history/?days=7', headers=auth_headers).headers
+
+def test_without_redis_reads_are_not_versioned(client, auth_headers):
+    send(client, auth_headers)
+    response = client.get('/api/chat/sessions', headers=auth_headers)
+    assert response.status_code == 200
+    assert 'ETag' not in response.headers
@@ -0,0 +1,145 @@
+import os
+import time
+
+import pytest
+from sqlalchemy import func, select
+
+from models import ChatMessage, ChatSession, db
+from services.persistence import build_turn, new_session
+from services.write_behind import FileQueue, RedisStreamQueue, WriteBehind, encode_turn
+
+def make_turn(user_id, session=None, message='How much sleep do adults need?'):
+    session = session or new_session(user_id)
+    return build_turn(session, user_id, message, 'Seven to nine hours.', set_title=True)
+
+def message_count(app):
+    with app.app_context():
+        return db.session.execute(select(func.count()).select_from(ChatMessage)).scalar()
+
+@pytest.fixture
+def queue(tmp_path):
+    return FileQueue(str(tmp_path / 'writes.log'), fsync=False)
+
+@pytest.fixture
+def write_behind(app, queue):
+    return WriteBehind(app, queue, batch_size=10, run_worker=False)
+
+def test_file_queue_compacts_once_drained(queue):
+    queue.put('s1', 'one')
+    queue.put('s1', 'two')
+    entries = queue.read(10, 0)
+    assert [data for _, data in entries] == ['one\n', 'two\n']
+
+    queue.ack([entries[0][0]])
+    assert queue.depth() == 1 and os.path.getsize(queue.path) > 0
+
+    queue.ack([entries[1][0]])
+    assert os.path.getsize(queue.path) == 0
+    assert queue._offset() == 0
+    queue.put('s2', 'three')
+    assert [data for _, data in queue.read(10, 0)] == ['three\n']
+
+def test_file_queue_rereads_log_after_stale_offset(queue):
+    # An offset left over from a log that has been truncated since
+    queue._write_offset(1000)
+    queue.put('s1', '{"session": "s1"}')
+    assert [data for _, data in queue.read(10, 0)] == ['{"session": "s1"}\n']
+    assert queue.pending_for('s1')
+
+def test_file_queue_skips_partial_line(queue):
+    queue.put('s1', 'one')
+    with open(queue.path, 'a') as f:
+        f.write('tw')
+    assert [data for _, data in queue.read(10, 0)] == ['one\n']
+
+def test_crash_before_truncate_replays_idempotently(app, user_id, queue, write_behind):
+    for _ in range(3):
+        write_behind.enqueue(make_turn(user_id))
+    with open(queue.path) as f:
+        log = f.read()
+    assert write_behind.drain() == 3
+    assert message_count(app) == 6
+
+    # Compaction wrote offset 0 but died before truncating: the drained lines come back
+    with open(queue.path, 'w') as f:
+        f.write(log)
+    assert queue._offset() == 0 and queue.depth() == 3
+    assert write_behind.drain() == 3
+    assert message_count(app) == 6
+    assert queue.depth() == 0
+
+def test_redelivered_turns_are_not_written_twice(app, user_id, queue, write_behind):
+    turn = make_turn(user_id)
+    write_behind.enqueue(turn)
+    write_behind.enqueue(turn)
+    assert write_behind.drain() == 2
+    assert message_count(app) == 2
+
+def test_undecodable_entry_is_dead_lettered(app, user_id, queue, write_behind):
+    write_behind.enqueue(make_turn(user_id))
+    queue.put('broken', '{"session": ')
+    queue.put('foreign', '[1, 2, 3]')
+    write_behind.enqueue(make_turn(user_id))
+
+    assert write_behind.drain() == 2
+    assert write_behind.dead_lettered == 2
+    assert message_count(app) == 4
+    assert queue.depth() == 0
+    with open(queue.dead_path) as f:
+        assert len(f.readlines()) == 2
+
+def test_wait_for_session_drains_inline(app, user_id, queue, write_behind):
+    write_behind.read_timeout = 0
+    turn = make_turn(user_id)
+    write_behind.enqueue(turn)
+    assert queue.pending_for(turn['session']['id'])
+
+    write_behind.wait_for_session(turn['session']['id'])
+    assert not queue.pending_for(turn['session']['id'])
+    with app.app_context():
+        assert db.session.get(ChatSession, turn['session']['id']) is not None
+
+def test_worker_waits_outside_the_queue_lock(app, user_id, queue):
+    write_behind = WriteBehind(app, queue, interval=0.2, run_worker=True)
+    write_behind.start()
+    try:
+        time.sleep(0.05)
+        # The idle worker must not be holding the queue
+        assert queue.lock()
+        queue.unlock()
+    finally:
+        write_behind.stop()
+
+def test_redis_queue_tracks_pending_sessions(app, user_id):
+    fakeredis = pytest.importorskip('fakeredis')
+    redis_client = fakeredis.FakeRedis(decode_responses=True)
+    queue = RedisStreamQueue(redis_client)
+    write_behind = WriteBehind(app, queue, batch_size=10, run_worker=False)
+
+    first, second = make_turn(user_id), make_turn(user_id)
+    follow_up = make_turn(user_id, session=new_session(user_id))
+    follow_up['session']['id'] = first['session']['id']
+    for turn in (first, second, follow_up):
+        write_behind.enqueue(turn)
+    assert redis_client.hget(queue.sessions_key, first['session']['id']) == '2'
+    assert queue.pending_for(second['session']['id'])
+
+    assert write_behind.drain() == 3
+    assert not queue.pending_for(first['session']['id'])
+    assert not queue.pending_for(second['session']['id'])
+    assert redis_client.hlen(queue.sessions_key) == 0
+    assert queue.depth() == 0
+    assert message_count(app) == 6
+
+def test_redis_queue_releases_dead_lettered_sessions(app, user_id):
+    fakeredis = pytest.importorskip('fakeredis')
+    redis_client = fakeredis.FakeRedis(decode_responses=True)
+    queue = RedisStreamQueue(redis_client)
+    write_behind = WriteBehind(app, queue, run_worker=False)
+
+    queue.put('broken', 'not json')
+    assert queue.pending_for('broken')
+    assert write_behind.drain() == 0
+    assert write_behind.dead_lettered == 1
+    assert not queue.pending_for('broken')
+    assert redis_client.xlen(queue.dead_stream) == 1